@@ -1,15 +1,39 @@
 import os
 import logging
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, render_template, request, jsonify, send_file, session, Response, stream_with_context, current_app
 from call_llm import generate_structured_notes, extract_youtube_transcript, download_and_transcribe_youtube
+from download import probe_video
+from probe import probe_file, probe_stream, describe_upload, PartialFile, PROBE_HEAD_BYTES, PROBE_TAIL_BYTES
 from audio import transcribe_audio, process_uploaded_audio
-from youtube import get_youtube_transcript
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from youtube import get_youtube_transcript, extract_video_id
+from metrics import metrics
+from workspace import request_workspace, scratch_file, start_janitor
+from singleflight import single_flight, file_sha256
+from conversion import conversion_pool, ConversionQueueFull
+from memory import MemoryBudgetExceeded, track_request, memory_stage
+from deadline import Deadline, request_deadline, RequestCancelled, REQUEST_DEADLINE_SECONDS
+from fingerprint import fingerprint_index
+from shared_state import SHARED_STATE, init_shared_state, shared_cache
+from jobs import job_queue, JobTimeout
+from speculative import speculative_notes, SPECULATIVE_EDIT_DELAY
+from prefetch import prefetcher, CAPTIONS, METADATA, PAGE
+from http_cache import init_http_cache, pdf_etag, pdf_cache_path, store_pdf
+from pdf_export import stream_pdf, NOTES, TRANSCRIPT
+from scheduler import set_current_owner
+from progress import set_progress_sink
+from tiers import TierChain, BLOCKED
+from timerange import parse_time_range, range_key
+from routing import last_model, reset_last_models
+import history
+import memory
+from history import db, init_history
+import hmac
+import json
+import uuid
+import queue
+import threading
+from datetime import timedelta
+from werkzeug.datastructures import FileStorage
 from dotenv import load_dotenv
 
 
@@ -20,6 +44,32 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key")
 # Increase the maximum file upload size to 100MB (default is 16MB)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
+# Streamed transcriptions send a keep-alive line when nothing has happened for this long
+PROGRESS_KEEPALIVE_SECONDS = float(os.environ.get('PROGRESS_KEEPALIVE_SECONDS', 15))
+# /metrics requires "Authorization: Bearer <token>" when set; without it only
+# direct (unproxied) loopback requests are answered
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Names of downloaded PDFs, by what they contain
+PDF_DOWNLOAD_NAMES = {NOTES: 'structured_notes.pdf', TRANSCRIPT: 'transcript.pdf'}
+# Keep the session (and with it the transcript history) for a year
+app.permanent_session_lifetime = timedelta(days=365)
+
+# Transcript history: Postgres when DATABASE_URL is set, local SQLite otherwise
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///speechscribe.db')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
+db.init_app(app)
+
+# gzip/brotli, ETags and 304s for JSON and text, long-lived caching for versioned static files
+init_http_cache(app)
+
+# Near-duplicate uploads (re-encoded, re-sampled, trimmed) reuse earlier transcripts
+fingerprint_index.init_app(app)
+
+# Several instances behind a load balancer: sessions, transcript caches and the
+# YouTube job queue live in the database instead of this process and the cookie
+if SHARED_STATE:
+    init_shared_state(app)
+    job_queue.init_app(app)
 
 # Configure logging
 logging.basicConfig(
@@ -33,6 +83,125 @@ logging.basicConfig(
 # Logger setup
 logger = logging.getLogger(__name__)
 
+# Keep uploads/, downloads/audio/ and leftover workspaces bounded in size and age
+start_janitor()
+
+with app.app_context():
+    try:
+        init_history()
+        fingerprint_index.upgrade_schema()
+        if job_queue.enabled:
+            job_queue.create_indexes()
+    except Exception as e:
+        logger.error(f"Could not initialize transcript history: {str(e)}")
+
+@app.before_request
+def identify_session():
+    """Tag this thread's Groq work with the user's session for fair scheduling"""
+    session.permanent = True
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    set_current_owner(session['sid'])
+    speculative_notes.touch(session['sid'])
+
+def store_history(owner, transcript, source_type, **metadata):
+    """
+    Store a new transcript in the history; failures never break the request.
+    Doesn't touch the session, so it also works from a streaming worker thread.
+    
+    Returns:
+        int: ID of the new record, or None if it couldn't be stored
+    """
+    transcript_id = None
+    try:
+        transcript_id = history.save_transcript(owner, transcript, source_type, **metadata)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Could not record transcript history: {str(e)}")
+    # Opt-in: start on the notes before the user asks for them; manual edits wait for a quiet period
+    speculative_notes.start(owner, transcript, delay=SPECULATIVE_EDIT_DELAY if source_type == 'manual' else 0)
+    return transcript_id
+
+def record_history(transcript, source_type, **metadata):
+    """Store a new transcript in the history and remember it in the session"""
+    transcript_id = store_history(session['sid'], transcript, source_type, **metadata)
+    if transcript_id is not None:
+        session['transcript_id'] = transcript_id
+
+def wants_progress_stream():
+    """Whether the client asked for NDJSON progress events instead of a single JSON response"""
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
+
+def stream_progress(work):
+    """
+    Run work(owner) on a worker thread and stream its progress reports as NDJSON,
+    one event per line, ending with a "done" or "error" event carrying the result
+    
+    The session cookie is sent before the body, so work must not rely on the
+    session; the client saves the finished transcript with /save-transcript.
+    The work runs under the request's deadline, and is cancelled if the client
+    disconnects (noticed at the next event or keep-alive line) unless another
+    request is sharing it.
+    
+    Args:
+        work (function): Takes the session ID, returns (response body dict, HTTP status)
+        
+    Returns:
+        Response: Streaming application/x-ndjson response
+    """
+    owner = session['sid']
+    events = queue.Queue()
+    flask_app = current_app._get_current_object()
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+    
+    def runner():
+        set_current_owner(owner)
+        set_progress_sink(events.put)
+        try:
+            with flask_app.app_context(), request_deadline(deadline=deadline):
+                body, status = work(owner)
+            final = dict(body, stage='done' if status == 200 else 'error', status=status)
+        except RequestCancelled as cancelled:
+            final = {'stage': 'error', 'status': 504, 'error': _cancelled_message(cancelled)}
+        except ConversionQueueFull as busy:
+            final = {'stage': 'error', 'status': 503, 'retry_after': busy.retry_after,
+                     'error': 'The server is busy processing other uploads. Please try again shortly.'}
+        except MemoryBudgetExceeded as over:
+            final = {'stage': 'error', 'status': 413, 'error': _over_budget_message(over)}
+        except Exception as e:
+            logger.error(f"Error in streamed transcription: {str(e)}")
+            final = {'stage': 'error', 'status': 500, 'error': f"Failed to transcribe: {str(e)}"}
+        finally:
+            set_progress_sink(None)
+        events.put(final)
+        events.put(None)
+    
+    threading.Thread(target=runner, name='progress-stream', daemon=True).start()
+    
+    def generate():
+        finished = False
+        try:
+            yield json.dumps({'stage': 'started'}) + '\n'
+            while True:
+                try:
+                    event = events.get(timeout=PROGRESS_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Keeps proxies from closing a quiet connection during long Groq calls
+                    event = {'stage': 'waiting'}
+                if event is None:
+                    finished = True
+                    break
+                yield json.dumps(event) + '\n'
+        finally:
+            # Closed early: the server couldn't write to the client, so it has gone
+            if not finished:
+                deadline.abandon()
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
 @app.route('/')
 def index():
     """Render the main application page"""
@@ -47,21 +216,25 @@ def transcribe():
         
         audio_file = request.files['audio']
         
-        # Save the audio file temporarily
-        audio_path = 'temp_audio.wav'
-        audio_file.save(audio_path)
-        
-        # Transcribe the audio
-        transcript = transcribe_audio(audio_path)
-        
-        # Remove the temporary file
-        os.remove(audio_path)
+        # Save the audio file in this request's own workspace
+        with request_workspace("recording") as workspace:
+            audio_path = os.path.join(workspace, 'audio.wav')
+            audio_file.save(audio_path)
+            
+            # Transcribe the audio
+            reset_last_models()
+            with request_deadline():
+                transcript = transcribe_audio(audio_path, source="recording")
         
         # Store transcript in session for later use
         session['transcript'] = transcript
+        if not transcript.startswith('Error'):
+            record_history(transcript, 'recording', model=last_model('transcription'))
         
         return jsonify({'transcript': transcript})
     
+    except RequestCancelled as cancelled:
+        return jsonify({'error': _cancelled_message(cancelled)}), 504
     except Exception as e:
         logger.error(f"Error transcribing audio: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -72,15 +245,28 @@ def generate_notes():
     try:
         data = request.json
         transcript = data.get('transcript', session.get('transcript', ''))
+        # Explicit "regenerate" bypasses the completion cache
+        regenerate = bool(data.get('regenerate', False))
         
         if not transcript:
             return jsonify({'error': 'No transcript provided'}), 400
         
-        # Generate structured notes using Groq API
-        structured_notes = generate_structured_notes(transcript)
+        # Use the notes generated in the background if they're ready (or wait for
+        # them if they're in flight); otherwise generate them now
+        structured_notes = None if regenerate else speculative_notes.result(session['sid'], transcript)
+        if structured_notes is None:
+            structured_notes = generate_structured_notes(transcript, regenerate=regenerate)
         
         # Store the structured notes in session
         session['structured_notes'] = structured_notes
+        if not structured_notes.startswith('Error'):
+            try:
+                session['transcript_id'] = history.save_notes(
+                    session['sid'], session.get('transcript_id'), transcript, structured_notes
+                )
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Could not record notes history: {str(e)}")
         
         return jsonify({'notes': structured_notes})
     
@@ -88,188 +274,107 @@ def generate_notes():
         logger.error(f"Error generating notes: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _send_pdf(etag, download_name):
+    """Send a cached PDF; handles If-None-Match (304) and Range (206) requests"""
+    response = send_file(
+        pdf_cache_path(etag),
+        download_name=download_name,
+        as_attachment=True,
+        mimetype='application/pdf',
+        conditional=True,
+        etag=etag,
+        max_age=0
+    )
+    # Notes are per-user; the browser may keep them but must revalidate
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/page-closed', methods=['POST'])
+def page_closed():
+    """Beacon sent when the page is closed: stop background work for this session"""
+    speculative_notes.abandon(session['sid'])
+    return '', 204
+
 @app.route('/download-pdf', methods=['GET', 'POST'])
 def download_pdf():
-    """Generate and download PDF of structured notes"""
+    """
+    Generate and download a PDF of the structured notes, or of the transcript
+    with ?content=transcript; ?id= exports a transcript from the history
+    instead of the current one
+    """
     try:
-        notes = session.get('structured_notes', '')
-        
-        if not notes:
-            return jsonify({'error': 'No notes available to download'}), 400
-        
-        # Create a PDF in memory
-        buffer = io.BytesIO()
-        
-        # Create the PDF document
-        doc = SimpleDocTemplate(
-            buffer, 
-            pagesize=letter,
-            rightMargin=72,
-            leftMargin=72,
-            topMargin=72,
-            bottomMargin=72
-        )
-        
-        # Create custom styles
-        styles = getSampleStyleSheet()
-        
-        # Custom styles for different markdown elements
-        title_style = ParagraphStyle(
-            'Title',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=16,
-            textColor=colors.HexColor('#2c3e50'),
-            alignment=1  # Center alignment
-        )
-        
-        h1_style = ParagraphStyle(
-            'Heading1',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceBefore=16,
-            spaceAfter=8,
-            textColor=colors.HexColor('#3498db'),
-            borderWidth=0,
-            borderColor=colors.HexColor('#3498db'),
-            borderPadding=5,
-            borderRadius=None,
-            allowWidows=0
-        )
-        
-        h2_style = ParagraphStyle(
-            'Heading2',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceBefore=12,
-            spaceAfter=6,
-            textColor=colors.HexColor('#2980b9'),
-            allowWidows=0
-        )
-        
-        h3_style = ParagraphStyle(
-            'Heading3',
-            parent=styles['Heading3'],
-            fontSize=12,
-            spaceBefore=10,
-            spaceAfter=4,
-            textColor=colors.HexColor('#0d6efd'),
-            allowWidows=0
-        )
-        
-        normal_style = ParagraphStyle(
-            'Normal',
-            parent=styles['Normal'],
-            fontSize=10,
-            leading=14,
-            spaceBefore=6,
-            spaceAfter=6,
-            allowWidows=0
-        )
-        
-        bullet_style = ParagraphStyle(
-            'Bullet',
-            parent=normal_style,
-            leftIndent=20,
-            firstLineIndent=-15,
-            spaceBefore=4,
-            spaceAfter=4
-        )
-        
-        blockquote_style = ParagraphStyle(
-            'Blockquote',
-            parent=normal_style,
-            leftIndent=30,
-            rightIndent=30,
-            fontStyle='italic',
-            textColor=colors.HexColor('#6c757d'),
-            spaceBefore=8,
-            spaceAfter=8,
-            borderWidth=1,
-            borderColor=colors.HexColor('#dee2e6'),
-            borderPadding=8,
-            borderRadius=6
-        )
-        
-        elements = []
-        
-        # Add title
-        elements.append(Paragraph("Structured Notes", title_style))
-        elements.append(Spacer(1, 20))
-        
-        # Process the markdown content
-        lines = notes.split('\n')
-        i = 0
-        
-        while i < len(lines):
-            line = lines[i].strip()
-            
-            # Skip empty lines
-            if not line:
-                i += 1
-                continue
-            
-            # Process headings
-            if line.startswith('# '):
-                elements.append(Paragraph(line[2:], h1_style))
-            elif line.startswith('## '):
-                elements.append(Paragraph(line[3:], h2_style))
-            elif line.startswith('### '):
-                elements.append(Paragraph(line[4:], h3_style))
-            
-            # Process blockquotes
-            elif line.startswith('> '):
-                blockquote_text = line[2:]
-                elements.append(Paragraph(blockquote_text, blockquote_style))
-            
-            # Process bullet points
-            elif line.startswith('- ') or line.startswith('* '):
-                bullet_text = f"• {line[2:]}"
-                elements.append(Paragraph(bullet_text, bullet_style))
-            
-            # Process numbered lists
-            elif line.strip() and line[0].isdigit() and '. ' in line:
-                num, text = line.split('. ', 1)
-                num_text = f"{num}. {text}"
-                elements.append(Paragraph(num_text, bullet_style))
-            
-            # Process regular paragraphs
-            else:
-                # Handle bold text with ** or __
-                processed_line = line
-                processed_line = processed_line.replace('**', '<b>', 1)
-                if '**' in processed_line:
-                    processed_line = processed_line.replace('**', '</b>', 1)
-                
-                processed_line = processed_line.replace('__', '<b>', 1)
-                if '__' in processed_line:
-                    processed_line = processed_line.replace('__', '</b>', 1)
-                
-                # Handle italic text with * or _
-                processed_line = processed_line.replace('*', '<i>', 1)
-                if '*' in processed_line:
-                    processed_line = processed_line.replace('*', '</i>', 1)
-                
-                processed_line = processed_line.replace('_', '<i>', 1)
-                if '_' in processed_line:
-                    processed_line = processed_line.replace('_', '</i>', 1)
-                
-                elements.append(Paragraph(processed_line, normal_style))
-            
-            i += 1
-        
-        # Build the PDF
-        doc.build(elements)
-        
-        # Prepare the PDF for download
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            download_name='structured_notes.pdf',
-            as_attachment=True,
-            mimetype='application/pdf'
-        )
+        kind = request.args.get('content', NOTES)
+        if kind not in PDF_DOWNLOAD_NAMES:
+            return jsonify({'error': 'content must be "notes" or "transcript"'}), 400
+        
+        record_id = request.args.get('id', type=int)
+        if record_id is not None:
+            item = history.get_transcript(session['sid'], record_id)
+            if item is None:
+                return jsonify({'error': 'Transcript not found'}), 404
+            text = item['notes'] if kind == NOTES else item['transcript']
+        else:
+            text = session.get('structured_notes' if kind == NOTES else 'transcript', '')
+        
+        if not text:
+            return jsonify({'error': f'No {kind} available to download'}), 400
+        
+        # The same text always renders to the same PDF, so it's cached by its ETag
+        download_name = PDF_DOWNLOAD_NAMES[kind]
+        etag = pdf_etag(text, kind)
+        if os.path.exists(pdf_cache_path(etag)):
+            metrics.increment("pdf.cache_hits")
+            return _send_pdf(etag, download_name)
+        
+        # The ETag comes from the text alone, so the browser's copy is still
+        # current even if ours has been evicted
+        if request.if_none_match.contains(etag):
+            metrics.increment("http.not_modified")
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        # Pages are laid out as the text is read and sent as each one is
+        # finished, so memory stays flat however long the transcript is and the
+        # download starts at once. Once complete, the PDF is cached for repeat
+        # downloads (and Range requests).
+        deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+        
+        def cache_pdf(pdf):
+            try:
+                store_pdf(etag, pdf)
+            except OSError as e:
+                logger.warning(f"Could not cache PDF: {str(e)}")
+        
+        def generate():
+            with request_deadline(deadline=deadline), track_request("pdf"), memory_stage("render"):
+                try:
+                    for chunk in stream_pdf(text, kind, on_complete=cache_pdf):
+                        yield chunk
+                except RequestCancelled as cancelled:
+                    # Headers are already sent; dropping the connection tells the client it's incomplete
+                    logger.warning(f"Stopped streaming a PDF: {_cancelled_message(cancelled)}")
+                    raise
+        
+        # The first page is rendered before any header is sent, so text that
+        # can't be laid out is still an error response rather than a cut-off PDF
+        chunks = generate()
+        try:
+            first_chunk = next(chunks)
+        except RequestCancelled:
+            # Already counted and logged by generate()
+            return jsonify({'error': 'This took longer than the server allows, so the PDF was not made.'}), 504
+        
+        def stream():
+            yield first_chunk
+            yield from chunks
+        
+        # Streamed without a Content-Length (chunked transfer)
+        response = Response(stream(), mimetype='application/pdf')
+        response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.set_etag(etag)
+        return response
     
     except Exception as e:
         logger.error(f"Error generating PDF: {str(e)}")
@@ -283,17 +388,141 @@ def save_transcript():
         transcript = data.get('transcript', '')
         
         if not transcript:
+            speculative_notes.cancel(session['sid'], "transcript cleared")
             return jsonify({'error': 'No transcript provided'}), 400
         
         # Save to session
         session['transcript'] = transcript
         
+        # A streamed transcription stored its record without the session; adopt it
+        streamed_id = data.get('transcript_id')
+        if isinstance(streamed_id, int) and history.get_transcript(session['sid'], streamed_id) is not None:
+            session['transcript_id'] = streamed_id
+        
+        # Keep the history in step with the user's edits
+        try:
+            transcript_id = session.get('transcript_id')
+            if transcript_id is None or not history.update_transcript(session['sid'], transcript_id, transcript):
+                record_history(transcript, 'manual')
+            else:
+                # An edit: cancels notes being generated for the old text
+                speculative_notes.start(session['sid'], transcript, delay=SPECULATIVE_EDIT_DELAY)
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Could not update transcript history: {str(e)}")
+        
         return jsonify({'status': 'success'})
     
     except Exception as e:
         logger.error(f"Error saving transcript: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _conversion_busy(retry_after):
+    """503 response telling the client when to retry an upload"""
+    metrics.increment("conversion.rejected")
+    response = jsonify({'error': 'The server is busy processing other uploads. Please try again shortly.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def _over_budget_message(over):
+    """Error shown when an upload is too long to process within the per-request memory budget"""
+    logger.warning(f"Rejected upload over the memory budget: {str(over)}")
+    return 'This recording is too long to process here. Please upload a shorter file, split it into parts or transcribe part of it with a time range.'
+
+def _cancelled_message(cancelled):
+    """Error shown when a transcription was stopped at its deadline (and counted, whatever the reason)"""
+    metrics.increment(f"deadline.{cancelled.reason}")
+    logger.warning(f"Stopped transcription: {str(cancelled)}")
+    return 'This took longer than the server allows, so it was stopped. Try a shorter recording or transcribe part of it with a time range.'
+
+NOT_AUDIO_MESSAGE = "This file doesn't look like a supported audio file. Allowed formats: MP3, WAV, M4A, OGG and FLAC."
+
+def _reject_by_probe(audio_file, file_ext, time_range):
+    """
+    Probe an upload's header and return the error response if it would be rejected, or None
+    """
+    stream = audio_file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    try:
+        media = probe_stream(stream, size)
+    except ValueError:
+        metrics.increment("probe.rejected.not_audio")
+        return jsonify({'error': NOT_AUDIO_MESSAGE}), 400
+    summary = describe_upload(media, size, file_ext, time_range)
+    logger.info(f"Probed upload: {summary}")
+    if summary['error'] is None:
+        return None
+    metrics.increment(f"probe.rejected.{summary['reason']}")
+    return jsonify({'error': summary['error'], 'probe': summary}), 400 if summary['reason'] == 'range' else 413
+
+@app.route('/probe', methods=['POST'])
+def probe():
+    """
+    Pre-flight check before transcribing: duration, codec, estimated transcoded
+    size, caption availability and estimated processing time.
+    
+    JSON {youtube_url, start, end} probes a video from its metadata only; a form
+    with the first PROBE_HEAD_BYTES of a file as 'head' (and its last
+    PROBE_TAIL_BYTES as 'tail'), 'size', 'filename', 'start' and 'end' probes an
+    upload without sending it. 'error' in the result says why it would be rejected.
+    """
+    try:
+        if request.is_json:
+            data = request.json
+            youtube_url = data.get('youtube_url', '')
+            if not youtube_url.startswith(('https://www.youtube.com/', 'https://youtu.be/', 'https://youtube.com/')):
+                return jsonify({'error': 'Invalid YouTube URL. Please provide a valid YouTube URL starting with https://www.youtube.com/ or https://youtu.be/'}), 400
+            try:
+                time_range = parse_time_range(data.get('start'), data.get('end'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return jsonify(probe_video(youtube_url, time_range))
+        
+        if 'head' not in request.files:
+            return jsonify({'error': 'Send a YouTube URL as JSON, or the start of a file as "head".'}), 400
+        size = request.form.get('size', type=int)
+        if not size or size < 0:
+            return jsonify({'error': 'The size of the file is required.'}), 400
+        try:
+            time_range = parse_time_range(request.form.get('start'), request.form.get('end'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        head = request.files['head'].read(PROBE_HEAD_BYTES)
+        tail = request.files['tail'].read(PROBE_TAIL_BYTES) if 'tail' in request.files else b''
+        file_ext = os.path.splitext(request.form.get('filename', ''))[1].lower()
+        try:
+            media = probe_file(PartialFile(head, size, tail), size)
+        except ValueError:
+            return jsonify({'source': 'upload', 'error': NOT_AUDIO_MESSAGE})
+        return jsonify(describe_upload(media, size, file_ext, time_range))
+    
+    except Exception as e:
+        logger.error(f"Error probing media: {str(e)}")
+        return jsonify({'error': f"Failed to probe media: {str(e)}"}), 500
+
+@app.route('/prefetch', methods=['POST'])
+def prefetch():
+    """
+    Start fetching a YouTube video's captions and metadata in the background
+    as soon as its URL is pasted, so /transcribe-youtube finds them cached.
+    Returns 202 immediately; tiers whose circuit is open are left alone.
+    """
+    data = request.get_json(silent=True) or {}
+    youtube_url = data.get('youtube_url', '')
+    if not youtube_url.startswith(('https://www.youtube.com/', 'https://youtu.be/', 'https://youtube.com/')):
+        return jsonify({'error': 'Invalid YouTube URL. Please provide a valid YouTube URL starting with https://www.youtube.com/ or https://youtu.be/'}), 400
+    video_id = extract_video_id(youtube_url)
+    if not video_id:
+        return jsonify({'error': 'Could not find a video ID in the URL.'}), 400
+    
+    skip = [kind for kind, tier in ((CAPTIONS, 'captions'), (METADATA, 'download'), (PAGE, 'page_context'))
+            if youtube_tiers.is_open(tier)]
+    queued = prefetcher.prefetch(youtube_url, skip=skip)
+    return jsonify({'video_id': video_id, 'queued': queued}), 202
+
 @app.route('/transcribe-audio-file', methods=['POST'])
 def transcribe_audio_file():
     """Process and transcribe an uploaded audio file (MP3, WAV, etc.)"""
@@ -309,6 +538,8 @@ def transcribe_audio_file():
         
         audio_file = request.files['audio_file']
         logger.info(f"Received file: {audio_file.filename}, size: {audio_file.content_length if hasattr(audio_file, 'content_length') else 'unknown'}")
+        # Set when the browser already downsampled the file; the server still checks the header itself
+        logger.info(f"Client-side normalization: {request.form.get('client_normalized', 'none')}")
         
         # Check if file was selected
         if audio_file.filename == '':
@@ -324,32 +555,93 @@ def transcribe_audio_file():
                 'error': f'Unsupported file format. Allowed formats: {", ".join(allowed_extensions)}'
             }), 400
         
-        # Make sure uploads directory exists
-        uploads_dir = os.path.join(os.getcwd(), 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
+        # Optional part of the recording to transcribe; only that part is decoded
+        try:
+            time_range = parse_time_range(request.form.get('start'), request.form.get('end'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Read the container header (a few KB) to turn away files that aren't
+        # audio, or are too long, before any of the upload is processed
+        rejected = _reject_by_probe(audio_file, file_ext, time_range)
+        if rejected is not None:
+            return rejected
+        
+        # Shed load before reading the upload if conversion is already backed up
+        if conversion_pool.is_full():
+            return _conversion_busy(conversion_pool.retry_after())
         
         # Process and transcribe the audio file
         logger.info("Starting audio transcription process...")
         
         try:
-            transcript = process_uploaded_audio(audio_file)
-            logger.info(f"Transcription complete: {transcript[:50]}...")
+            # Identical uploads that arrive together share one transcription
+            audio_hash = file_sha256(audio_file.stream)
+            audio_key = f"audio:{audio_hash}{range_key(time_range)}"
             
-            # Check if there was an error
-            if transcript.startswith('Error'):
-                logger.error(f"Error transcribing audio file: {transcript}")
-                return jsonify({'error': transcript}), 400
+            def transcribe_and_store(owner, upload):
+                def transcribe_upload():
+                    reset_last_models()
+                    return [process_uploaded_audio(upload, time_range), last_model('transcription')]
                 
-            if transcript.startswith('⚠️'):
-                # This is a special case for when online recognition fails but we still want to return a user-friendly message
-                logger.warning("Using fallback message because online services were unavailable")
-                return jsonify({'error': transcript}), 503  # Service Unavailable
+                # Transcripts made by any instance are reused
+                cached = shared_cache.get(f"transcript:{audio_key}")
+                if cached is not None:
+                    transcript, model = cached
+                else:
+                    transcript, model = single_flight.do(
+                        audio_key,
+                        transcribe_upload,
+                        shareable=lambda result: not result[0].startswith(('Error', '⚠️')),
+                    )
+                    if not transcript.startswith(('Error', '⚠️')):
+                        shared_cache.set(f"transcript:{audio_key}", [transcript, model])
+                logger.info(f"Transcription complete: {transcript[:50]}...")
                 
-            # Store transcript in session for later use
-            session['transcript'] = transcript
+                # Check if there was an error
+                if transcript.startswith('Error'):
+                    logger.error(f"Error transcribing audio file: {transcript}")
+                    return {'error': transcript}, 400
+                    
+                if transcript.startswith('⚠️'):
+                    # This is a special case for when online recognition fails but we still want to return a user-friendly message
+                    logger.warning("Using fallback message because online services were unavailable")
+                    return {'error': transcript}, 503  # Service Unavailable
+                
+                transcript_id = store_history(owner, transcript, 'upload', file_hash=audio_hash, model=model)
+                return {'transcript': transcript, 'transcript_id': transcript_id}, 200
+            
+            # Stream stage progress and partial transcripts if the client asked for them
+            if wants_progress_stream():
+                # The request's upload is closed once this view returns, so the worker reads its own copy
+                filename = audio_file.filename
+                upload_path = scratch_file(os.path.splitext(filename)[1].lower())
+                audio_file.save(upload_path)
+                
+                def transcribe_streamed_upload(owner):
+                    try:
+                        with open(upload_path, 'rb') as stream:
+                            return transcribe_and_store(owner, FileStorage(stream, filename=filename))
+                    finally:
+                        os.remove(upload_path)
+                
+                return stream_progress(transcribe_streamed_upload)
             
-            return jsonify({'transcript': transcript})
+            with request_deadline():
+                body, status = transcribe_and_store(session['sid'], audio_file)
+            if status == 200:
+                # Store transcript in session for later use
+                session['transcript'] = body['transcript']
+                if body['transcript_id'] is not None:
+                    session['transcript_id'] = body['transcript_id']
+            return jsonify(body), status
             
+        except ConversionQueueFull as busy:
+            return _conversion_busy(busy.retry_after)
+        except MemoryBudgetExceeded as over:
+            return jsonify({'error': _over_budget_message(over)}), 413
+        except RequestCancelled as cancelled:
+            return jsonify({'error': _cancelled_message(cancelled)}), 504
         except Exception as process_error:
             logger.error(f"Error in process_uploaded_audio: {str(process_error)}")
             import traceback
@@ -365,6 +657,45 @@ def transcribe_audio_file():
         logger.error(traceback.format_exc())  # Log full traceback
         return jsonify({'error': f"Failed to process audio file: {str(e)}"}), 500
 
+# YouTube transcription tiers: captions and download + Whisper are ordered by
+# their observed cost and skipped while their circuit is open; the Groq
+# page-context tier only produces an approximation, so it always comes last
+youtube_tiers = TierChain()
+youtube_tiers.add('captions', get_youtube_transcript, prior_latency=2)
+youtube_tiers.add('download', download_and_transcribe_youtube, prior_latency=60)
+youtube_tiers.add('page_context', extract_youtube_transcript, prior_latency=20, last_resort=True)
+
+def run_youtube_pipeline(youtube_url, time_range=None):
+    """
+    Run the YouTube transcription tiers until one produces a transcript
+    
+    Args:
+        youtube_url (str): The YouTube video URL
+        time_range (tuple, optional): (start, end or None) seconds; tiers only fetch and transcribe that part
+        
+    Returns:
+        list: [transcript, None, tier, model] on success or [error message, HTTP status, None, None] on failure
+    """
+    logger.info(f"Starting YouTube transcription for: {youtube_url}")
+    reset_last_models()
+    transcript, error_class, tier = youtube_tiers.run(youtube_url, time_range=time_range)
+    
+    if error_class is None:
+        logger.info(f"Tier '{tier}' produced the transcript")
+        model = {'download': last_model('transcription'), 'page_context': last_model('chat')}.get(tier)
+        return [transcript, None, tier, model]
+    
+    logger.error(f"All transcription methods failed for: {youtube_url}")
+    # Upstreams blocking us is a temporary condition on our side, not a bad request
+    return [transcript, 503 if error_class == BLOCKED else 400, None, None]
+
+# Any instance's job workers can run a queued YouTube transcription
+job_queue.register('youtube', lambda payload: run_youtube_pipeline(
+    payload['youtube_url'], tuple(payload['time_range']) if payload.get('time_range') else None
+))
+if SHARED_STATE:
+    job_queue.start_workers(sweep=shared_cache.sweep)
+
 @app.route('/transcribe-youtube', methods=['POST'])
 def transcribe_youtube():
     """Get and process transcript from YouTube video"""
@@ -378,57 +709,129 @@ def transcribe_youtube():
         # Validate the URL format
         if not youtube_url.startswith(('https://www.youtube.com/', 'https://youtu.be/', 'https://youtube.com/')):
             return jsonify({'error': 'Invalid YouTube URL. Please provide a valid YouTube URL starting with https://www.youtube.com/ or https://youtu.be/'}), 400
-            
-        # Step 1: First check if we can get a quick response from YouTube API
+        
+        # Optional part of the video to transcribe; only that section is downloaded
         try:
-            logger.info(f"Attempting to fetch transcript via YouTube API for: {youtube_url}")
-            transcript = get_youtube_transcript(youtube_url)
+            time_range = parse_time_range(data.get('start'), data.get('end'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Everyone asking for the same video (and range) at once shares a single pipeline run
+        video_id = extract_video_id(youtube_url)
+        flight_key = f"youtube:{video_id}" if video_id else f"youtube-url:{youtube_url}"
+        flight_key += range_key(time_range)
+        
+        def youtube_pipeline(owner):
+            if not job_queue.enabled:
+                return run_youtube_pipeline(youtube_url, time_range)
+            # A database job, so requests for the same video on other instances wait on this run
+            try:
+                payload = {'youtube_url': youtube_url, 'time_range': time_range}
+                return job_queue.run('youtube', flight_key, payload, owner=owner)
+            except JobTimeout:
+                return ["This video is still being processed. Please try again in a minute.", 503, None, None]
+        
+        def transcribe_and_store(owner):
+            # Transcripts made by any instance are reused
+            cached = shared_cache.get(f"transcript:{flight_key}")
+            if cached is not None:
+                transcript, error_status, tier, model = cached
+            else:
+                transcript, error_status, tier, model = single_flight.do(
+                    flight_key,
+                    lambda: youtube_pipeline(owner),
+                    shareable=lambda result: result[1] is None,
+                )
+                if error_status is None:
+                    shared_cache.set(f"transcript:{flight_key}", [transcript, None, tier, model])
             
-            # If YouTube API worked, use it right away (fastest method)
-            if not transcript.startswith('Error'):
-                logger.info("YouTube API successfully retrieved transcript")
-                session['transcript'] = transcript
-                return jsonify({'transcript': transcript})
-                
-            logger.info(f"YouTube API failed: {transcript}")
-        except Exception as youtube_api_error:
-            logger.info(f"YouTube API error: {str(youtube_api_error)}")
-        
-        # Step 2: Try direct download and transcription
-        logger.info(f"Starting download and transcription process for: {youtube_url}")
-        
-        # Send an initial response to let the user know processing has started
-        # Using an intermediate status helps with longer videos
-        processing_message = "Processing your YouTube video. For longer videos (>10 min), this may take a few moments..."
-        
-        # Return the actual transcript
-        transcript = download_and_transcribe_youtube(youtube_url)
-        
-        # If download and transcribe fails, use Groq API as final fallback
-        if transcript.startswith('Error'):
-            logger.info(f"Download method failed: {transcript}")
-            logger.info(f"Using Groq API as final fallback for: {youtube_url}")
+            if error_status is not None:
+                return {'error': transcript}, error_status
             
-            try:
-                transcript = extract_youtube_transcript(youtube_url)
-            except Exception as groq_error:
-                logger.error(f"Groq API fallback error: {str(groq_error)}")
-                return jsonify({'error': f"Failed to transcribe video. {str(groq_error)}"}), 500
+            transcript_id = store_history(owner, transcript, 'youtube', video_id=video_id, tier=tier, model=model)
+            return {'transcript': transcript, 'transcript_id': transcript_id}, 200
         
-        # Check if we still have an error after all attempts
-        if transcript.startswith('Error'):
-            logger.error(f"All transcription methods failed for: {youtube_url}")
-            return jsonify({'error': transcript}), 400
+        # Stream stage progress and partial transcripts if the client asked for them
+        if wants_progress_stream():
+            return stream_progress(transcribe_and_store)
         
-        # Store transcript in session for later use
-        session['transcript'] = transcript
+        with request_deadline():
+            body, status = transcribe_and_store(session['sid'])
+        if status == 200:
+            # Store transcript in session for later use
+            session['transcript'] = body['transcript']
+            if body['transcript_id'] is not None:
+                session['transcript_id'] = body['transcript_id']
         
-        # Return the successful transcript
-        return jsonify({'transcript': transcript})
+        # Return the transcript, or the error with its status
+        return jsonify(body), status
     
+    except RequestCancelled as cancelled:
+        return jsonify({'error': _cancelled_message(cancelled)}), 504
     except Exception as e:
         logger.error(f"Error getting YouTube transcript: {str(e)}")
         return jsonify({'error': f"Failed to process YouTube video: {str(e)}"}), 500
 
+@app.route('/history', methods=['GET'])
+def list_history():
+    """List this session's transcripts, newest first (?limit=&before=<id> for the next page)"""
+    try:
+        before = request.args.get('before', type=int)
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify(history.list_transcripts(session['sid'], limit=limit, before_id=before))
+    except Exception as e:
+        logger.error(f"Error listing history: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/history/search', methods=['GET'])
+def search_history():
+    """Full-text search over this session's transcripts and notes (?q=&limit=&offset=)"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'No search query provided'}), 400
+        limit = request.args.get('limit', 20, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        results = history.search_transcripts(session['sid'], query, limit=limit, offset=offset)
+        return jsonify({'results': results})
+    except Exception as e:
+        logger.error(f"Error searching history: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/history/<int:record_id>', methods=['GET'])
+def get_history_item(record_id):
+    """Get one stored transcript with its notes"""
+    try:
+        item = history.get_transcript(session['sid'], record_id)
+        if item is None:
+            return jsonify({'error': 'Transcript not found'}), 404
+        return jsonify(item)
+    except Exception as e:
+        logger.error(f"Error loading history item: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def _metrics_allowed():
+    """Whether this request may read /metrics"""
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {METRICS_TOKEN}".encode('utf-8'))
+    # A reverse proxy on this host makes every client look local
+    if request.headers.get('X-Forwarded-For') or request.headers.get('Forwarded'):
+        return False
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Return the in-process metrics (routing decisions, counters, latencies)"""
+    if not _metrics_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    snapshot = metrics.snapshot()
+    snapshot['youtube_tiers'] = youtube_tiers.snapshot()
+    snapshot['conversion_pool'] = conversion_pool.snapshot()
+    snapshot['memory'] = memory.snapshot()
+    if job_queue.enabled:
+        snapshot['jobs'] = job_queue.snapshot()
+    return jsonify(snapshot)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,11 +1,24 @@
 import speech_recognition as sr
 import logging
 import os
-import tempfile
 import groq
-from pydub import AudioSegment
-import uuid
-import time
+import wave
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pydub.utils import mediainfo
+from routing import route_transcription, last_model, remember_model
+from fingerprint import fingerprint_index
+from workspace import request_workspace, scratch_file
+from scheduler import audio_scheduler, current_owner, set_current_owner
+from progress import report, bind
+from conversion import conversion_pool, ConversionQueueFull, is_prenormalized
+from tempo import tempo_factor
+from wavstream import read_wav_header, WAVE_FORMAT_PCM
+from memory import track_request, memory_stage, estimate_request_bytes, check_budget, MemoryBudgetExceeded
+from probe import probe_path, FALLBACK_BITRATE
+from timerange import range_duration
+from metrics import metrics
+from deadline import current_deadline, set_deadline, stage_deadline, RequestCancelled, CONVERT_SHARE
 from dotenv import load_dotenv
 
 
@@ -15,16 +28,57 @@ load_dotenv()
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def transcribe_audio(audio_file_path):
+# Recordings longer than this are transcribed in segments of this length, so
+# partial transcripts can be streamed and no single upload hits Groq's size limit
+TRANSCRIBE_SEGMENT_SECONDS = int(os.environ.get("TRANSCRIBE_SEGMENT_SECONDS", 600))
+TRANSCRIBE_SEGMENT_WORKERS = 2  # Matches the audio scheduler's slots
+GROQ_AUDIO_TIMEOUT = 60.0  # Seconds per Groq call (the SDK's default), less when the request's deadline is closer
+GROQ_MAX_RETRIES = 2  # The SDK's default
+
+def get_audio_duration(audio_file_path):
+    """
+    Get the duration of an audio file without decoding it
+    
+    Args:
+        audio_file_path (str): Path to the audio file
+        
+    Returns:
+        float: Duration in seconds, or None if it can't be determined
+    """
+    # Container headers first (WAV, Ogg, FLAC, MP3, MP4); no subprocess needed
+    probed = probe_path(audio_file_path)
+    if probed and probed['duration']:
+        return probed['duration']
+    
+    try:
+        duration = mediainfo(audio_file_path).get('duration')
+        if duration:
+            return float(duration)
+    except Exception as e:
+        logger.debug(f"Could not probe {audio_file_path}: {str(e)}")
+    
+    try:
+        return os.path.getsize(audio_file_path) * 8.0 / FALLBACK_BITRATE
+    except OSError:
+        return None
+
+def transcribe_audio(audio_file_path, source="upload", model=None):
     """
     Transcribe audio file to text using Groq's Whisper API
     
     Args:
         audio_file_path (str): Path to the audio file
+        source (str): Where the audio came from, recorded with the routing decision
+        model (str, optional): Whisper model already chosen for the whole recording
+            when this file is one segment of it
         
     Returns:
         str: Transcribed text
+        
+    Raises:
+        RequestCancelled: If the request was cancelled before the Groq call
     """
+    current_deadline().check("transcribe")
     try:
         # Check if file exists and has content
         if not os.path.exists(audio_file_path):
@@ -44,22 +98,35 @@ def transcribe_audio(audio_file_path):
             logger.error("GROQ_API_KEY environment variable not found")
             return "Error: Groq API key not configured"
             
-        groq_client = groq.Groq(api_key=groq_api_key)
+        # The SDK retries timeouts and 5xx; only as often as the request's deadline allows
+        groq_client = groq.Groq(
+            api_key=groq_api_key,
+            max_retries=current_deadline().retries(GROQ_MAX_RETRIES, GROQ_AUDIO_TIMEOUT),
+        )
+        
+        # Pick the Whisper model from the audio duration
+        duration = get_audio_duration(audio_file_path)
+        if model is None:
+            model = route_transcription(duration, source).model
         
         # Open the audio file and send to Groq's Whisper API
         try:
             with open(audio_file_path, "rb") as audio_file:
-                logger.info("Sending audio file to Groq's Whisper API...")
+                logger.info(f"Sending audio file to Groq's Whisper API ({model})...")
                 
                 try:
-                    transcription = groq_client.audio.transcriptions.create(
-                        file=audio_file,
-                        model="whisper-large-v3",
-                        prompt="",
-                        response_format="text",
-                        language="en",
-                        temperature=0.0
-                    )
+                    # Short jobs go first; the duration is the job's cost
+                    with audio_scheduler.slot(duration or file_size * 8.0 / FALLBACK_BITRATE):
+                        transcription = groq_client.audio.transcriptions.create(
+                            file=audio_file,
+                            model=model,
+                            prompt="",
+                            response_format="text",
+                            language="en",
+                            temperature=0.0,
+                            # Never outlive the request waiting for a reply nobody will read
+                            timeout=current_deadline().timeout(GROQ_AUDIO_TIMEOUT),
+                        )
                     
                     # The API can return either a string directly or an object with a text attribute
                     # Handle both cases gracefully
@@ -101,6 +168,176 @@ def transcribe_audio(audio_file_path):
         logger.error(f"Error in transcription process: {str(e)}")
         return f"Error processing audio: {str(e)}"
 
+def split_audio(audio_file_path, segment_seconds, output_dir):
+    """
+    Cut an audio file into consecutive segments without re-encoding it
+    
+    Args:
+        audio_file_path (str): The audio file
+        segment_seconds (int): Length of each segment
+        output_dir (str): Where to write the segments (e.g. the request workspace)
+        
+    Returns:
+        list: Paths of the segments in order; just [audio_file_path] if it can't be split
+    """
+    extension = os.path.splitext(audio_file_path)[1].lower()
+    try:
+        if extension == '.wav':
+            paths = []
+            with wave.open(audio_file_path, 'rb') as source:
+                frames_per_segment = int(segment_seconds * source.getframerate())
+                index = 0
+                while True:
+                    frames = source.readframes(frames_per_segment)
+                    if not frames:
+                        break
+                    path = os.path.join(output_dir, f"segment_{index:03d}.wav")
+                    with wave.open(path, 'wb') as segment:
+                        segment.setparams(source.getparams())
+                        segment.writeframes(frames)
+                    paths.append(path)
+                    index += 1
+            return paths or [audio_file_path]
+        
+        # Compressed formats: ffmpeg's segment muxer copies the packets, so this is fast
+        pattern = os.path.join(output_dir, f"segment_%03d{extension}")
+        subprocess.run(
+            ['ffmpeg', '-v', 'error', '-y', '-i', audio_file_path, '-f', 'segment',
+             '-segment_time', str(segment_seconds), '-c', 'copy', pattern],
+            check=True, capture_output=True, timeout=current_deadline().timeout(120)
+        )
+        paths = sorted(
+            os.path.join(output_dir, name) for name in os.listdir(output_dir)
+            if name.startswith('segment_') and name.endswith(extension)
+        )
+        return paths or [audio_file_path]
+    except Exception as e:
+        logger.warning(f"Could not split {audio_file_path} into segments, transcribing it whole: {str(e)}")
+        return [audio_file_path]
+
+def compress_tempo(audio_file_path, output_dir):
+    """
+    Speed up a recording by the configured tempo factor before it is sent to
+    Whisper, so less audio is uploaded and transcribed
+    
+    Only 16-bit PCM mono WAV (what upload conversion produces) is compressed;
+    other files (YouTube's MP3) would grow if re-encoded to WAV first. The
+    compression runs in the conversion pool, and any failure other than a
+    cancellation falls back to the original audio.
+    
+    Args:
+        audio_file_path (str): The audio file
+        output_dir (str): Where to write the compressed copy
+        
+    Returns:
+        tuple: (path to transcribe, TempoMap or None if it wasn't compressed)
+        
+    Raises:
+        RequestCancelled: If the request was cancelled meanwhile
+    """
+    factor = tempo_factor()
+    if factor <= 1.0 or not audio_file_path.lower().endswith('.wav'):
+        return audio_file_path, None
+    try:
+        fmt = read_wav_header(audio_file_path)
+        if fmt.audio_format != WAVE_FORMAT_PCM or fmt.channels != 1 or fmt.bits_per_sample != 16:
+            return audio_file_path, None
+        report("compressing", factor=factor)
+        compressed_path = os.path.join(output_dir, "tempo.wav")
+        with memory_stage("tempo"):
+            tempo_map = conversion_pool.compress_tempo(audio_file_path, compressed_path, factor)
+        metrics.increment("tempo.compressed")
+        return compressed_path, tempo_map
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        metrics.increment("tempo.skipped")
+        logger.warning(f"Could not compress the audio's tempo, transcribing it as-is: {str(e)}")
+        return audio_file_path, None
+
+def original_span(tempo_map, start, end):
+    """
+    Args:
+        tempo_map (TempoMap): From compress_tempo, or None
+        start (float): Seconds into the audio that was transcribed
+        end (float): Seconds into the audio that was transcribed
+        
+    Returns:
+        dict: 'start' and 'end' on the original recording's timeline
+    """
+    if tempo_map is not None:
+        start, end = tempo_map.to_original(start), tempo_map.to_original(end)
+    return {'start': round(start, 3), 'end': round(end, 3)}
+
+def transcribe_in_segments(audio_file_path, transcribe_fn, source, output_dir):
+    """
+    Transcribe a long recording in segments, reporting each segment's text as
+    soon as it and everything before it is done
+    
+    Recordings up to TRANSCRIBE_SEGMENT_SECONDS are sent whole. The Whisper
+    model is routed once on the full duration and used for every segment.
+    With TEMPO_FACTOR set, the recording is sped up first (see compress_tempo);
+    each partial's start and end are still on the original timeline.
+    
+    Args:
+        audio_file_path (str): The audio file
+        transcribe_fn (function): transcribe_audio or transcribe_youtube_audio
+        source (str): Where the audio came from ("upload", "youtube", "recording")
+        output_dir (str): Scratch directory for the segments
+        
+    Returns:
+        str: The full transcript, or the first segment's error message
+    """
+    deadline = current_deadline()
+    audio_file_path, tempo_map = compress_tempo(audio_file_path, output_dir)
+    duration = get_audio_duration(audio_file_path)
+    if not duration or duration <= TRANSCRIBE_SEGMENT_SECONDS:
+        report("transcribing", segment=1, segments=1)
+        transcript = transcribe_fn(audio_file_path)
+        if str(transcript).startswith('Error'):
+            # A call cut short by the deadline is a cancellation, not a bad recording
+            deadline.check("transcribe")
+        else:
+            report("partial", segment=1, segments=1, text=str(transcript), **original_span(tempo_map, 0.0, duration or 0.0))
+        return transcript
+    
+    model = route_transcription(duration, source).model
+    report("splitting", duration=round(duration))
+    segments = split_audio(audio_file_path, TRANSCRIBE_SEGMENT_SECONDS, output_dir)
+    total = len(segments)
+    logger.info(f"Transcribing {duration:.0f}s of audio in {total} segments")
+    
+    owner = current_owner()
+    
+    def transcribe_segment(index, path):
+        set_current_owner(owner)
+        set_deadline(deadline)
+        report("transcribing", segment=index + 1, segments=total)
+        return transcribe_fn(path, model=model)
+    
+    texts = []
+    with ThreadPoolExecutor(max_workers=min(TRANSCRIBE_SEGMENT_WORKERS, total)) as executor:
+        futures = [executor.submit(bind(transcribe_segment), index, path) for index, path in enumerate(segments)]
+        try:
+            # Results are reported in order, so the client can append them as they arrive
+            for index, future in enumerate(futures):
+                text = str(future.result())
+                if text.startswith('Error'):
+                    deadline.check("transcribe")
+                    return text
+                texts.append(text.strip())
+                span = original_span(
+                    tempo_map, index * TRANSCRIBE_SEGMENT_SECONDS, min((index + 1) * TRANSCRIBE_SEGMENT_SECONDS, duration)
+                )
+                report("partial", segment=index + 1, segments=total, text=texts[-1], **span)
+        finally:
+            # Segments not yet sent are dropped on an error or a cancellation
+            skipped = sum(1 for pending in futures if pending.cancel())
+            if skipped and deadline.expired():
+                metrics.increment("cancelled.segments", skipped)
+    
+    return " ".join(texts)
+
 def save_audio_from_blob(audio_blob):
     """
     Save audio blob to a temporary file
@@ -109,12 +346,11 @@ def save_audio_from_blob(audio_blob):
         audio_blob: Audio data blob
         
     Returns:
-        str: Path to the saved audio file
+        str: Path to the saved audio file (the caller removes it when done)
     """
     try:
-        # Create temporary file
-        temp_dir = tempfile.gettempdir()
-        temp_path = os.path.join(temp_dir, "temp_audio.wav")
+        # Create a uniquely named temporary file so concurrent requests never share one
+        temp_path = scratch_file(suffix=".wav")
         
         # Write blob data to file
         with open(temp_path, 'wb') as f:
@@ -126,144 +362,175 @@ def save_audio_from_blob(audio_blob):
         logger.error(f"Error saving audio blob: {str(e)}")
         raise e
 
-def process_uploaded_audio(uploaded_file):
+def check_memory_budget(input_path, time_range=None):
+    """
+    Refuse an upload whose processing would exceed the per-request memory
+    budget, before anything is converted
+    
+    Conversion streams to disk; what grows with the recording is the audio
+    held for Whisper (a whole segment per concurrent upload) and the
+    fingerprint, so the estimate is judged on the probed duration of the
+    range (or, when it can't be probed, the file size).
+    
+    Args:
+        input_path (str): The saved upload
+        time_range (tuple, optional): (start, end or None) seconds to be transcribed
+        
+    Raises:
+        MemoryBudgetExceeded: If it's over budget
+    """
+    duration = range_duration(time_range, get_audio_duration(input_path))
+    if not duration:
+        return
+    if duration > TRANSCRIBE_SEGMENT_SECONDS:
+        held_seconds = TRANSCRIBE_SEGMENT_SECONDS * TRANSCRIBE_SEGMENT_WORKERS
+    else:
+        held_seconds = duration
+    check_budget(estimate_request_bytes(duration, held_seconds))
+
+def process_uploaded_audio(uploaded_file, time_range=None):
     """
     Process and transcribe an uploaded audio file (MP3, WAV, etc.)
     
+    All intermediate files live in a per-request workspace that is removed
+    when processing finishes, whether it succeeded or not.
+    
     Args:
         uploaded_file: The uploaded file object from Flask request.files
+        time_range (tuple, optional): (start, end or None) seconds; only that part is decoded and transcribed
         
     Returns:
         str: Transcribed text from the audio file
     """
-    # Create unique filenames first
-    file_id = str(uuid.uuid4())
-    temp_input_path = None
-    wav_path = None
-    
     try:
-        logger.info(f"Processing uploaded audio file: {uploaded_file.filename}")
-        
-        # Get file metadata
-        original_filename = uploaded_file.filename
-        file_extension = os.path.splitext(original_filename)[1].lower()
-        
-        # Create temp directory if it doesn't exist
-        temp_dir = os.path.join(os.getcwd(), 'uploads')
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Define file paths
-        temp_input_path = os.path.join(temp_dir, f"{file_id}{file_extension}")
-        wav_path = os.path.join(temp_dir, f"{file_id}.wav")
-        
-        # Save the uploaded file directly to disk to avoid memory issues
-        logger.info(f"Saving uploaded file to: {temp_input_path}")
-        uploaded_file.save(temp_input_path)
-        file_size = os.path.getsize(temp_input_path)
-        logger.info(f"File saved successfully. Size: {file_size} bytes")
-        
-        if file_size == 0:
-            logger.error("Uploaded file is empty (0 bytes)")
-            return "Error: The uploaded file is empty. Please try again with a valid audio file."
-        
-        # Convert to WAV if needed
-        if file_extension.lower() != '.wav':
-            logger.info(f"Converting {file_extension} file to WAV format")
-            try:
-                # Load the audio file with pydub
-                logger.debug(f"Loading audio file: {temp_input_path}")
-                if file_extension.lower() == '.mp3':
-                    audio = AudioSegment.from_mp3(temp_input_path)
-                elif file_extension.lower() == '.m4a':
-                    audio = AudioSegment.from_file(temp_input_path, format="m4a")
-                elif file_extension.lower() == '.ogg':
-                    audio = AudioSegment.from_ogg(temp_input_path)
-                else:
-                    # Try generic loading for other formats
-                    audio = AudioSegment.from_file(temp_input_path)
-                
-                logger.debug("Audio file loaded successfully")
-                
-                # Convert to WAV format at 16kHz (good for speech recognition)
-                logger.debug("Converting audio to 16kHz")
-                audio = audio.set_frame_rate(16000)
-                
-                logger.debug(f"Exporting to WAV: {wav_path}")
-                audio.export(wav_path, format="wav")
-                
-                logger.info(f"Audio conversion successful: {wav_path}")
-                
-            except Exception as e:
-                logger.error(f"Error converting audio file: {str(e)}")
-                # Clean up the original temp file
-                if os.path.exists(temp_input_path):
-                    os.remove(temp_input_path)
-                return f"Error: Could not convert audio file. {str(e)}"
-        else:
-            # If already WAV, just rename the original file
-            logger.info("File is already WAV format, using as-is")
-            wav_path = temp_input_path
-        
-        # Add a small delay to ensure file is written to disk completely
-        time.sleep(0.5)
-        
-        # Verify the WAV file exists and has content
-        if not os.path.exists(wav_path):
-            logger.error(f"WAV file does not exist: {wav_path}")
-            return "Error: WAV file was not created successfully."
-            
-        wav_size = os.path.getsize(wav_path)
-        if wav_size == 0:
-            logger.error(f"WAV file is empty: {wav_path}")
-            return "Error: Converted WAV file is empty."
-        
-        logger.info(f"WAV file ready for transcription: {wav_path} (size: {wav_size} bytes)")
-        
-        # Transcribe the WAV file
-        transcript = transcribe_audio(wav_path)
-        logger.info(f"Transcription received: {len(transcript)} characters")
-        
-        # Clean up temporary files after successful transcription
-        try:
-            logger.debug("Cleaning up temporary files")
-            if temp_input_path and os.path.exists(temp_input_path) and temp_input_path != wav_path:
-                os.remove(temp_input_path)
-                logger.debug(f"Removed input file: {temp_input_path}")
-                
-            if wav_path and os.path.exists(wav_path):
-                os.remove(wav_path)
-                logger.debug(f"Removed WAV file: {wav_path}")
-        except Exception as e:
-            logger.warning(f"Error removing temporary files: {str(e)}")
-        
-        return transcript
-        
+        with track_request("upload"), request_workspace("upload") as workspace:
+            return _process_uploaded_audio(uploaded_file, workspace, time_range)
+    except (ConversionQueueFull, MemoryBudgetExceeded, RequestCancelled):
+        # The route turns these into a 503 with Retry-After, a 413 or a 504
+        raise
     except Exception as e:
         logger.error(f"Error processing uploaded audio: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-        
-        # Clean up temporary files in case of error
-        try:
-            if temp_input_path and os.path.exists(temp_input_path):
-                os.remove(temp_input_path)
-            if wav_path and wav_path != temp_input_path and os.path.exists(wav_path):
-                os.remove(wav_path)
-        except Exception as cleanup_error:
-            logger.warning(f"Error during cleanup: {str(cleanup_error)}")
-            
         return f"Error processing audio file: {str(e)}"
 
-def transcribe_youtube_audio(audio_file_path):
+def _process_uploaded_audio(uploaded_file, workspace, time_range=None):
+    """
+    Convert and transcribe an uploaded file inside the given workspace
+    
+    Args:
+        uploaded_file: The uploaded file object from Flask request.files
+        workspace (str): Scratch directory owned by this request
+        time_range (tuple, optional): (start, end or None) seconds to transcribe
+        
+    Returns:
+        str: Transcribed text from the audio file
+    """
+    logger.info(f"Processing uploaded audio file: {uploaded_file.filename}")
+    
+    # Get file metadata
+    original_filename = uploaded_file.filename
+    file_extension = os.path.splitext(original_filename)[1].lower()
+    
+    # Define file paths
+    temp_input_path = os.path.join(workspace, f"input{file_extension}")
+    wav_path = os.path.join(workspace, "converted.wav")
+    
+    # Save the uploaded file directly to disk to avoid memory issues
+    logger.info(f"Saving uploaded file to: {temp_input_path}")
+    with memory_stage("save"):
+        uploaded_file.save(temp_input_path)
+    file_size = os.path.getsize(temp_input_path)
+    logger.info(f"File saved successfully. Size: {file_size} bytes")
+    
+    if file_size == 0:
+        logger.error("Uploaded file is empty (0 bytes)")
+        return "Error: The uploaded file is empty. Please try again with a valid audio file."
+    
+    # Too long to process within the memory budget: refuse it before any work
+    check_memory_budget(temp_input_path, time_range)
+    
+    # Convert in the conversion pool so ffmpeg and resampling never run on a web worker;
+    # 16 kHz mono WAV or Opus (what the browser uploads when it can) is used as-is
+    logger.info(f"Converting {file_extension} file to WAV format")
+    report("converting")
+    deadline = current_deadline()
+    deadline.check("convert")
+    remaining = deadline.remaining()
+    try:
+        # Conversion may use part of the remaining time; transcription needs the rest
+        with memory_stage("convert"), stage_deadline(None if remaining is None else remaining * CONVERT_SHARE):
+            if time_range is None and is_prenormalized(temp_input_path, file_extension):
+                logger.info("File is already 16 kHz mono, skipping conversion")
+                metrics.increment("conversion.skipped_prenormalized")
+                wav_path = temp_input_path
+            elif not conversion_pool.convert(temp_input_path, wav_path, file_extension, time_range=time_range):
+                logger.info("File can be transcribed as-is")
+                wav_path = temp_input_path
+            else:
+                logger.info(f"Audio conversion successful: {wav_path}")
+    except ConversionQueueFull:
+        raise
+    except RequestCancelled:
+        # Out of the conversion's share: the request itself may still have time, but not enough to transcribe
+        if not deadline.expired():
+            return "Error: Converting the audio took too long. Try a shorter recording or a time range."
+        raise
+    except Exception as e:
+        logger.error(f"Error converting audio file: {str(e)}")
+        return f"Error: Could not convert audio file. {str(e)}"
+    
+    # Verify the WAV file exists and has content
+    if not os.path.exists(wav_path):
+        logger.error(f"WAV file does not exist: {wav_path}")
+        return "Error: WAV file was not created successfully."
+        
+    wav_size = os.path.getsize(wav_path)
+    if wav_size == 0:
+        logger.error(f"WAV file is empty: {wav_path}")
+        return "Error: Converted WAV file is empty."
+    
+    logger.info(f"WAV file ready for transcription: {wav_path} (size: {wav_size} bytes)")
+    
+    if time_range is not None and not get_audio_duration(wav_path):
+        return "Error: The requested time range is outside the recording."
+    
+    # A re-encoding of audio we've already transcribed (another bitrate, a WAV of
+    # an MP3, a slightly trimmed copy) reuses that transcript instead of Whisper
+    deadline.check("fingerprint")
+    with memory_stage("fingerprint"):
+        fingerprint = fingerprint_index.fingerprint(wav_path)
+        match = fingerprint_index.match(fingerprint, owner=current_owner())
+    if match is not None:
+        remember_model("transcription", match.model)
+        report("partial", segment=1, segments=1, text=match.transcript)
+        return match.transcript
+    
+    # Transcribe the WAV file
+    with memory_stage("transcribe"):
+        transcript = transcribe_in_segments(wav_path, transcribe_audio, "upload", workspace)
+    logger.info(f"Transcription received: {len(transcript)} characters")
+    if not transcript.startswith('Error'):
+        fingerprint_index.add(fingerprint, transcript, last_model("transcription"), owner=current_owner())
+    
+    return transcript
+
+def transcribe_youtube_audio(audio_file_path, model=None):
     """
     Transcribe YouTube audio file using Groq's Whisper API
     
     Args:
         audio_file_path (str): Path to the downloaded audio file
+        model (str, optional): Whisper model already chosen for the whole video
+            when this file is one segment of it
         
     Returns:
         str: Transcribed text
+        
+    Raises:
+        RequestCancelled: If the request was cancelled before the Groq call
     """
+    current_deadline().check("transcribe")
     try:
         logger.info(f"Transcribing YouTube audio with Groq API from: {audio_file_path}")
         
@@ -286,23 +553,36 @@ def transcribe_youtube_audio(audio_file_path):
             logger.error("GROQ_API_KEY environment variable not found")
             return "Error: Groq API key not configured"
         
-        groq_client = groq.Groq(api_key=groq_api_key)
+        # The SDK retries timeouts and 5xx; only as often as the request's deadline allows
+        groq_client = groq.Groq(
+            api_key=groq_api_key,
+            max_retries=current_deadline().retries(GROQ_MAX_RETRIES, GROQ_AUDIO_TIMEOUT),
+        )
+        
+        # Pick the Whisper model from the audio duration
+        duration = get_audio_duration(audio_file_path)
+        if model is None:
+            model = route_transcription(duration, "youtube").model
         
         # Open the audio file and send to Groq's Whisper API
         try:
             with open(audio_file_path, "rb") as audio_file:
-                logger.info("Sending YouTube audio file to Groq's Whisper API...")
+                logger.info(f"Sending YouTube audio file to Groq's Whisper API ({model})...")
                 
                 try:
                     # For larger files, let the API handle it
-                    transcription = groq_client.audio.transcriptions.create(
-                        file=audio_file,
-                        model="whisper-large-v3",
-                        prompt="",
-                        response_format="text",
-                        language="en",
-                        temperature=0.0
-                    )
+                    # Short jobs go first; the duration is the job's cost
+                    with audio_scheduler.slot(duration or file_size * 8.0 / FALLBACK_BITRATE):
+                        transcription = groq_client.audio.transcriptions.create(
+                            file=audio_file,
+                            model=model,
+                            prompt="",
+                            response_format="text",
+                            language="en",
+                            temperature=0.0,
+                            # Never outlive the request waiting for a reply nobody will read
+                            timeout=current_deadline().timeout(GROQ_AUDIO_TIMEOUT),
+                        )
                     
                     # The API can return either a string directly or an object with a text attribute
                     # Handle both cases gracefully
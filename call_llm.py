@@ -3,8 +3,19 @@ import groq
 import logging
 import trafilatura
 import requests
-from download import download_video_audio, delete_download
-from audio import transcribe_youtube_audio
+from concurrent.futures import ThreadPoolExecutor
+from download import download_video_audio
+from audio import transcribe_youtube_audio, transcribe_in_segments
+from sections import split_into_sections
+from transcript_cleanup import clean_transcript, CLEANUP_VERSION
+from llm_cache import completion_cache, make_cache_key
+from media_cache import page_cache
+from deadline import current_deadline
+from youtube import extract_video_id
+from workspace import request_workspace
+from memory import track_request, memory_stage
+from scheduler import chat_scheduler, current_owner
+from routing import route_chat, completion_budget, estimate_tokens, MAX_COMPLETION_TOKENS
 from dotenv import load_dotenv
 
 
@@ -13,29 +24,7 @@ load_dotenv()
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def generate_structured_notes(transcript):
-    """
-    Generate structured notes from a transcript using Groq API
-    
-    Args:
-        transcript (str): The speech transcript
-        
-    Returns:
-        str: Structured notes
-    """
-    try:
-        # Get Groq API key from environment
-        api_key = os.environ.get("GROQ_API_KEY")
-        
-        if not api_key:
-            logger.error("GROQ_API_KEY not found in environment variables")
-            return "Error: GROQ API key not configured. Please set the GROQ_API_KEY environment variable."
-        
-        # Initialize Groq client
-        client = groq.Client(api_key=api_key)
-        
-        # Prepare the prompt
-        prompt = f"""
+NOTES_PROMPT_TEMPLATE = """
         I need you to organize the following transcript into professionally structured notes.
         
         Rules:
@@ -66,8 +55,75 @@ def generate_structured_notes(transcript):
         
         The result should be highly readable, professional-looking notes that effectively organize the information.
         """
+
+SECTION_PROMPT_TEMPLATE = """
+        I need you to organize the following part of a longer transcript into professionally structured notes.
+        The other parts are handled separately and joined afterwards, under a title and summary written for the whole document.
+        
+        Rules:
+        1. Identify the key topics in this part and give each a main heading (using markdown ## style)
+        2. Use ### subheadings, bullet points (using - ) and numbered lists for details and sequences
+        3. Use **bold text** for important terms and *italic text* for definitions
+        4. Use > blockquotes for direct quotations or important statements
+        5. Correct grammar and remove filler words, but preserve all meaningful information
+        6. Do not write an introduction, overall summary or conclusion for the whole document
+        
+        Here is the transcript part:
+        {transcript}
+        """
+
+MERGE_PROMPT_TEMPLATE = """
+        The following outline lists the headings and key points of structured notes that were written part by part for one long transcript.
+        
+        Write only:
+        1. One title for the whole document (using markdown # style)
+        2. A "## Summary" section: a concise overview of the whole document in one or two short paragraphs
+        
+        Do not repeat the notes; they follow your text unchanged.
+        
+        Here is the outline:
+        {outline}
+        """
+
+# Bump these whenever the corresponding prompt template changes so that
+# cached completions produced by the old prompt are no longer served
+NOTES_PROMPT_VERSION = "notes-1"
+SECTION_PROMPT_VERSION = "section-2"
+MERGE_VERSION = "merge-2"
+
+# The model and max_tokens are chosen per request by the routing layer
+NOTES_PARAMS = {
+    "temperature": 0.1,  # Low temperature for more focused and consistent results
+    "top_p": 0.9,  # Slightly reduced from default for more focused responses
+}
+
+MAX_SECTION_WORKERS = 4  # Parallel section requests when several sections changed
+MERGE_OUTLINE_MAX_CHARS = 12000  # The merge pass sees at most this much of the sections' outline
+MERGE_COMPLETION_TOKENS = 600  # A title and a short summary
+GROQ_CHAT_TIMEOUT = 60.0  # Seconds per Groq chat call (the SDK's default), less when the request's deadline is closer
+
+
+def _complete_notes(client, prompt, model, params, owner, cancelled=None):
+    """
+    Run a single notes completion against the Groq API
+    
+    Args:
+        client: Groq client
+        prompt (str): The full prompt
+        model (str): Model name
+        params (dict): Sampling parameters
+        owner (str): Session the request belongs to, for fair scheduling
+        cancelled (function, optional): Returns True once the result is no longer wanted
         
-        # Call Groq API
+    Returns:
+        str: The generated notes
+    """
+    # Short prompts go first; prompt plus completion tokens is the job's cost
+    cost = estimate_tokens(prompt) + params.get("max_tokens", 0)
+    with chat_scheduler.slot(cost, owner):
+        # Checked after waiting for a slot, which is where a cancelled job spends its time
+        if cancelled is not None and cancelled():
+            raise RuntimeError("Notes generation was cancelled")
         chat_completion = client.chat.completions.create(
             messages=[
                 {
@@ -75,30 +131,231 @@ def generate_structured_notes(transcript):
                     "content": prompt,
                 }
             ],
-            model="llama3-70b-8192",  # Using Llama 3 70B model for its strong capabilities
-            temperature=0.1,  # Low temperature for more focused and consistent results
-            max_tokens=4096,  # Allowing for ample space for structured notes
-            top_p=0.9,  # Slightly reduced from default for more focused responses
+            model=model,
+            **params
+        )
+    return chat_completion.choices[0].message.content
+
+def _demote_titles(notes):
+    """Turn a section's top-level (#) headings into ## so the document keeps a single title"""
+    return "\n".join(f"#{line}" if line.startswith("# ") else line for line in notes.split("\n"))
+
+def _outline(section_notes):
+    """
+    Headings and key points of the section notes, for the merge pass
+    
+    Args:
+        section_notes (list): Notes of each section, in order
+        
+    Returns:
+        str: At most MERGE_OUTLINE_MAX_CHARS of outline
+    """
+    lines = []
+    size = 0
+    for notes in section_notes:
+        for line in notes.split("\n"):
+            line = line.strip()
+            if not (line.startswith("#") or line.startswith("- ") or line.startswith("* ")):
+                continue
+            line = line[:160]
+            if size + len(line) > MERGE_OUTLINE_MAX_CHARS:
+                return "\n".join(lines)
+            lines.append(line)
+            size += len(line) + 1
+    return "\n".join(lines)
+
+def _merge_sections(client, section_notes, owner, regenerate=False, cancelled=None):
+    """
+    Join per-section notes into one document: a title and overall summary
+    written from the sections' outline, then the sections with their own
+    titles demoted to ## headings
+    
+    The merge completion is cached by the outline, so it is only re-run when
+    an edit changed the notes' structure.
+    
+    Args:
+        client: Groq client
+        section_notes (list): Notes of each section, in order
+        owner (str): Session the request belongs to, for fair scheduling
+        regenerate (bool): Ignore a cached merge
+        cancelled (function, optional): Returns True once the result is no longer wanted
+        
+    Returns:
+        tuple: (merged notes, whether the title and summary were written); the
+            notes are left without them if the merge pass fails
+
+    Raises:
+        RuntimeError: If the notes were cancelled
+    """
+    body = "\n\n".join(_demote_titles(notes) for notes in section_notes)
+    outline = _outline(section_notes)
+    outline_tokens = estimate_tokens(outline)
+    model = route_chat(outline_tokens, "notes_merge").model
+    params = dict(
+        NOTES_PARAMS,
+        max_tokens=completion_budget(model, outline_tokens, expected_output_tokens=MERGE_COMPLETION_TOKENS),
+    )
+    key = make_cache_key(outline, MERGE_VERSION, model, params)
+    header = None if regenerate else completion_cache.get(key)
+    if header is None:
+        try:
+            header = _complete_notes(
+                client, MERGE_PROMPT_TEMPLATE.format(outline=outline), model, params, owner, cancelled
+            ).strip()
+        except Exception as e:
+            if cancelled is not None and cancelled():
+                raise
+            logger.warning(f"Could not write a title and summary for the notes: {str(e)}")
+            return body, False
+        completion_cache.set(key, header)
+    return f"{header}\n\n{body}", True
+
+def generate_structured_notes(transcript, regenerate=False, cancelled=None):
+    """
+    Generate structured notes from a transcript using Groq API
+    
+    The transcript is split into content-hashed sections and the notes for each
+    section are cached, so regenerating after a small edit only re-sends the
+    sections that actually changed. Section notes are joined under a title
+    and summary written from their outline. The finished document is cached as well,
+    so repeating a request for the same transcript returns immediately.
+    Non-speech tags, filler words and stutters are removed first, since they
+    only cost prompt tokens.
+    
+    Args:
+        transcript (str): The speech transcript
+        regenerate (bool): Ignore cached completions and ask the model again
+        cancelled (function, optional): Polled before each model call; returning
+            True abandons the sections that haven't been sent yet
+        
+    Returns:
+        str: Structured notes
+    """
+    try:
+        # Get Groq API key from environment
+        api_key = os.environ.get("GROQ_API_KEY")
+        
+        if not api_key:
+            logger.error("GROQ_API_KEY not found in environment variables")
+            return "Error: GROQ API key not configured. Please set the GROQ_API_KEY environment variable."
+        
+        # Drop non-speech tags, fillers and stutters before anything is sent to the model
+        transcript, _ = clean_transcript(transcript)
+        
+        sections = split_into_sections(transcript)
+        if not sections:
+            return "Error generating structured notes: The transcript is empty."
+        
+        total = len(sections)
+        
+        # A single section gets the full document prompt; longer transcripts
+        # get per-section notes that are merged afterwards. Each section is
+        # routed on its own size, so an edit can only change its own model and
+        # cache entry.
+        prompts = []
+        for section in sections:
+            section_tokens = estimate_tokens(section)
+            model = route_chat(section_tokens, "notes").model
+            # Size the completion to the section rather than always asking for 4096 tokens
+            params = dict(NOTES_PARAMS, max_tokens=completion_budget(model, section_tokens))
+            if total == 1:
+                key = make_cache_key(section, NOTES_PROMPT_VERSION, model, params)
+                prompt = NOTES_PROMPT_TEMPLATE.format(transcript=section)
+            else:
+                key = make_cache_key(section, SECTION_PROMPT_VERSION, model, params)
+                prompt = SECTION_PROMPT_TEMPLATE.format(transcript=section)
+            prompts.append((key, prompt, model, params))
+        
+        # Whole-document cache: identical transcripts skip the model entirely
+        document_key = make_cache_key(
+            transcript,
+            f"{NOTES_PROMPT_VERSION}/{SECTION_PROMPT_VERSION}/{MERGE_VERSION}/{CLEANUP_VERSION}",
+            ",".join(model for _, _, model, _ in prompts),
+            NOTES_PARAMS,
         )
+        if not regenerate:
+            cached_notes = completion_cache.get(document_key)
+            if cached_notes is not None:
+                logger.info("Returning structured notes from completion cache")
+                return cached_notes
         
-        # Extract and return the structured notes
-        structured_notes = chat_completion.choices[0].message.content
+        # Initialize Groq client
+        client = groq.Client(api_key=api_key)
+        
+        results = {}
+        missing = {}
+        for key, prompt, model, params in prompts:
+            cached = None if regenerate else completion_cache.get(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                missing[key] = (prompt, model, params)
+        
+        logger.info(f"Notes sections: {total} total, {total - len(missing)} reused, {len(missing)} to generate")
+        
+        # Call Groq API for the sections that changed
+        owner = current_owner()
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(MAX_SECTION_WORKERS, len(missing))) as executor:
+                futures = {
+                    key: executor.submit(_complete_notes, client, prompt, model, params, owner, cancelled)
+                    for key, (prompt, model, params) in missing.items()
+                }
+                for key, future in futures.items():
+                    results[key] = future.result()
+                    completion_cache.set(key, results[key])
+        
+        section_notes = [results[key].strip() for key, _, _, _ in prompts]
+        if total == 1:
+            structured_notes, merged = section_notes[0], True
+        else:
+            structured_notes, merged = _merge_sections(client, section_notes, owner, regenerate, cancelled)
+        # Notes without their title and summary are still returned, but not kept
+        # for the whole document, so the next request tries the merge again
+        if merged:
+            completion_cache.set(document_key, structured_notes)
         return structured_notes
     
     except Exception as e:
         logger.error(f"Error calling Groq API: {str(e)}")
         return f"Error generating structured notes: {str(e)}"
 
-def extract_youtube_transcript(youtube_url):
+def fetch_page_context(youtube_url):
+    """
+    Text of a YouTube video's page (title, description), cached by video ID
+    
+    Args:
+        youtube_url (str): The YouTube video URL
+        
+    Returns:
+        str: The page's main text
+        
+    Raises:
+        Exception: If the page can't be fetched or has no text (not cached)
+    """
+    def load():
+        video_content = trafilatura.extract(trafilatura.fetch_url(youtube_url))
+        if not video_content:
+            raise Exception("The video page has no readable text")
+        return video_content
+    
+    return page_cache.get_or_load(extract_video_id(youtube_url) or youtube_url, load)
+
+def extract_youtube_transcript(youtube_url, time_range=None):
     """
     Extract a transcript from a YouTube video URL using Groq AI
     
     Args:
         youtube_url (str): The YouTube video URL
+        time_range (tuple, optional): Requested section; this tier only sees the
+            page, not the timeline, so it can't produce one
         
     Returns:
         str: The extracted transcript
     """
+    if time_range is not None:
+        return "Error: No transcript for the requested time range could be found in the captions or audio."
+    
     try:
         # Get Groq API key from environment
         api_key = os.environ.get("GROQ_API_KEY")
@@ -107,13 +364,12 @@ def extract_youtube_transcript(youtube_url):
             logger.error("GROQ_API_KEY not found in environment variables")
             return "Error: GROQ API key not configured. Please set the GROQ_API_KEY environment variable."
         
-        # Initialize Groq client
-        client = groq.Client(api_key=api_key)
+        # Initialize Groq client; it retries only as often as the request's deadline allows
+        client = groq.Client(api_key=api_key, max_retries=current_deadline().retries(2, GROQ_CHAT_TIMEOUT))
         
         # First, get the general video content using trafilatura
         try:
-            downloaded = trafilatura.fetch_url(youtube_url)
-            video_content = trafilatura.extract(downloaded)
+            video_content = fetch_page_context(youtube_url)
         except Exception as e:
             logger.error(f"Error fetching YouTube page: {str(e)}")
             video_content = "Could not fetch video content for context."
@@ -139,18 +395,27 @@ def extract_youtube_transcript(youtube_url):
         If you absolutely cannot access the video content, please acknowledge this limitation.
         """
         
+        # Pick the model from the size of the page context; the transcript it
+        # produces can be long, so the completion keeps the full budget
+        page_tokens = estimate_tokens(video_content or "")
+        model = route_chat(page_tokens, "youtube_transcript").model
+        
+        max_tokens = completion_budget(model, page_tokens, expected_output_tokens=MAX_COMPLETION_TOKENS)
+        
         # Call Groq API for transcript extraction
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model="llama3-70b-8192",
-            temperature=0.2,
-            max_tokens=4096,
-        )
+        with chat_scheduler.slot(estimate_tokens(prompt) + max_tokens):
+            chat_completion = client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt,
+                    }
+                ],
+                model=model,
+                temperature=0.2,
+                max_tokens=max_tokens,
+                timeout=current_deadline().timeout(GROQ_CHAT_TIMEOUT),
+            )
         
         # Extract and return the transcript
         transcript = chat_completion.choices[0].message.content
@@ -165,12 +430,16 @@ def extract_youtube_transcript(youtube_url):
         logger.error(f"Error extracting YouTube transcript with Groq: {str(e)}")
         return f"Error extracting YouTube transcript: {str(e)}"
 
-def download_and_transcribe_youtube(youtube_url):
+def download_and_transcribe_youtube(youtube_url, time_range=None):
     """
     Download audio from YouTube video and transcribe it
     
+    The audio is downloaded into a per-request workspace that is removed
+    afterwards, so concurrent requests never collide on file names.
+    
     Args:
         youtube_url (str): The YouTube video URL
+        time_range (tuple, optional): (start, end or None) seconds; only that section is downloaded
         
     Returns:
         str: The extracted transcript
@@ -183,41 +452,49 @@ def download_and_transcribe_youtube(youtube_url):
             logger.error(f"Invalid YouTube URL: {youtube_url}")
             return "Error: Please provide a valid YouTube URL starting with 'https://www.youtube.com/' or 'https://youtu.be/'"
         
-        # Download the audio from YouTube
-        logger.info("Calling download_video_audio function...")
-        audio_file_path = download_video_audio(youtube_url, lambda msg: logger.debug(f"YT-DLP: {msg}"))
-        
-        # Check if download was successful
-        if not audio_file_path or audio_file_path is None:
-            logger.error("Failed to download audio from YouTube")
-            return "Error: Failed to download audio from YouTube. The video might be unavailable or too large."
-        
-        # Verify the file exists
-        if not os.path.exists(audio_file_path):
-            logger.error(f"Downloaded file not found at: {audio_file_path}")
-            return f"Error: Downloaded file not found at: {audio_file_path}"
-        
-        logger.info(f"Successfully downloaded audio to: {audio_file_path}")
-        
-        # Transcribe the downloaded audio
-        logger.info("Starting transcription...")
-        transcript = transcribe_youtube_audio(audio_file_path)
+        with track_request("youtube"), request_workspace("youtube") as workspace:
+            # Download the audio from YouTube, keeping yt-dlp's error lines so
+            # the caller can tell an unavailable video from a blocked request
+            download_errors = []
+            
+            def ytdlp_logger(msg):
+                logger.debug(f"YT-DLP: {msg}")
+                if msg.startswith("ERROR"):
+                    download_errors.append(msg)
+            
+            logger.info("Calling download_video_audio function...")
+            with memory_stage("download"):
+                audio_file_path = download_video_audio(youtube_url, ytdlp_logger, output_dir=workspace, time_range=time_range)
+            
+            # Check if download was successful
+            if not audio_file_path or audio_file_path is None:
+                logger.error("Failed to download audio from YouTube")
+                reason = download_errors[-1] if download_errors else "The video might be unavailable or too large."
+                return f"Error: Failed to download audio from YouTube. {reason}"
+            
+            # Verify the file exists
+            if not os.path.exists(audio_file_path):
+                logger.error(f"Downloaded file not found at: {audio_file_path}")
+                return f"Error: Downloaded file not found at: {audio_file_path}"
+            
+            logger.info(f"Successfully downloaded audio to: {audio_file_path}")
+            
+            # Transcribe the downloaded audio
+            logger.info("Starting transcription...")
+            with memory_stage("transcribe"):
+                transcript = transcribe_in_segments(audio_file_path, transcribe_youtube_audio, "youtube", workspace)
         
         # Check if transcription worked
         if transcript.startswith("Error"):
             logger.error(f"Transcription failed: {transcript}")
-            delete_download(audio_file_path)
             return transcript
         
         # Check if we got an empty transcript
         if not transcript or transcript.strip() == "":
             logger.error("Transcription returned empty result")
-            delete_download(audio_file_path)
             return "Error: Transcription failed. No text was extracted from the video."
         
-        # Clean up - delete the downloaded file
-        delete_download(audio_file_path)
-        logger.info("Deleted downloaded audio file after transcription")
+        logger.info("Removed downloaded audio file after transcription")
         
         return transcript
         
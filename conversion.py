@@ -0,0 +1,318 @@
+import os
+import math
+import time
+import shutil
+import logging
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from metrics import metrics
+from wavstream import read_wav_header, TARGET_RATE
+from oggopus import read_opus_head
+from memory import measure, record_external_stage
+from tempo import compress_wav
+from deadline import current_deadline, POLL_SECONDS
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Conversion pool settings (per web worker process)
+CONVERSION_WORKERS = int(os.environ.get("CONVERSION_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+CONVERSION_QUEUE_SIZE = int(os.environ.get("CONVERSION_QUEUE_SIZE", 8))  # Jobs allowed to wait for a worker
+CONVERSION_TIMEOUT = int(os.environ.get("CONVERSION_TIMEOUT", 240))  # Seconds; below gunicorn's 300 s timeout
+PRIOR_JOB_SECONDS = 10.0  # Assumed conversion time before any job has finished
+CANCEL_WAIT_SECONDS = 30  # How long a cancelled job gets to notice the cancel file and stop
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ConversionQueueFull(Exception):
+    """Raised when the conversion queue is full and the upload should be retried later"""
+
+    def __init__(self, retry_after):
+        super(ConversionQueueFull, self).__init__("Too many uploads are being converted right now")
+        self.retry_after = retry_after
+
+
+def _run_cancellable(command, cancel_path=None, timeout=CONVERSION_TIMEOUT):
+    """
+    subprocess.run(command, check=True) that also kills the process as soon as
+    cancel_path exists (the web worker's way to stop a conversion in a pool process)
+
+    Raises:
+        subprocess.CalledProcessError: If the command failed
+        RuntimeError: If it was cancelled or ran past timeout
+    """
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    started = time.time()
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=POLL_SECONDS)
+            break
+        except subprocess.TimeoutExpired:
+            cancelled = cancel_path is not None and os.path.exists(cancel_path)
+            if cancelled or time.time() - started > timeout:
+                process.kill()
+                process.communicate()
+                raise RuntimeError("Conversion was cancelled" if cancelled else f"Conversion took longer than {timeout} seconds")
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+
+
+def convert_audio(input_path, output_path, file_extension, time_range=None, cancel_path=None):
+    """
+    Convert an uploaded file to 16 kHz mono WAV for transcription (runs in a pool process)
+
+    WAV is resampled in chunks in-process; everything else goes through the
+    ffmpeg CLI, which never holds the decoded audio in memory and is killed as
+    soon as the conversion is cancelled or times out.
+
+    Args:
+        input_path (str): The uploaded file
+        output_path (str): Where to write the WAV file
+        file_extension (str): Extension of the upload, lowercase with the dot
+        time_range (tuple, optional): (start, end or None) seconds; only that
+            part is decoded
+        cancel_path (str, optional): Conversion stops if this file appears
+
+    Returns:
+        bool: True if output_path was written, False if the input can be sent as-is
+
+    Raises:
+        RuntimeError: If ffmpeg is needed but not installed, or the conversion was cancelled
+    """
+    if file_extension == ".wav":
+        from wavstream import convert_wav
+        try:
+            cancelled = (lambda: os.path.exists(cancel_path)) if cancel_path is not None else None
+            return convert_wav(input_path, output_path, time_range, cancelled)
+        except ValueError as e:
+            if time_range is not None:
+                raise
+            logger.info(f"WAV fast path not applicable ({str(e)}), using the file as-is")
+            return False
+
+    if not FFMPEG_AVAILABLE:
+        raise RuntimeError(f"ffmpeg is required to convert {file_extension or 'these'} files")
+
+    # -ss before -i seeks in the input, so nothing before the range is decoded
+    seek = []
+    if time_range is not None:
+        start, end = time_range
+        seek = ["-ss", f"{start:g}"] + (["-t", f"{end - start:g}"] if end is not None else [])
+    _run_cancellable(
+        ["ffmpeg", "-nostdin", "-v", "error", "-y"] + seek + ["-i", input_path,
+         "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le", output_path],
+        cancel_path=cancel_path,
+    )
+    return True
+
+
+def _convert_measured(input_path, output_path, file_extension, time_range, cancel_path):
+    # Pool processes report their own RSS, which the web worker can't see
+    return measure(convert_audio, input_path, output_path, file_extension, time_range, cancel_path)
+
+
+def _compress_measured(input_path, output_path, factor, cancel_path):
+    return measure(compress_wav, input_path, output_path, factor, lambda: os.path.exists(cancel_path))
+
+
+def is_prenormalized(input_path, file_extension):
+    """
+    Whether an upload is already 16 kHz mono (as the browser prepares it when
+    it can) and can be sent for transcription without any conversion.
+    Checked from the file header, so it's cheap enough to run on the web worker.
+
+    Args:
+        input_path (str): The uploaded file
+        file_extension (str): Extension of the upload, lowercase with the dot
+
+    Returns:
+        bool: True if conversion can be skipped
+    """
+    try:
+        if file_extension == ".wav":
+            return read_wav_header(input_path).is_normalized()
+        if file_extension in (".ogg", ".opus"):
+            head = read_opus_head(input_path)
+            return head.channels == 1 and 0 < head.input_sample_rate <= TARGET_RATE
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+class ConversionPool(object):
+    """
+    Process pool for CPU-bound audio conversion with admission control.
+
+    Conversion runs outside the web worker so a burst of uploads can't starve
+    request handling. At most `workers` jobs run and `queue_size` wait; any
+    job beyond that is rejected straight away with ConversionQueueFull.
+    """
+
+    def __init__(self, workers=CONVERSION_WORKERS, queue_size=CONVERSION_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._avg_job_seconds = PRIOR_JOB_SECONDS
+
+    def _get_executor(self):
+        # Created lazily so it's started in the serving process, not before gunicorn forks;
+        # spawn avoids forking a process that has request threads running
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def retry_after(self):
+        """
+        Seconds a rejected client should wait before retrying
+
+        Returns:
+            int: Estimated time for the current backlog to drain one slot
+        """
+        with self._lock:
+            queued = max(0, self._in_flight - self.workers)
+            return max(1, int(math.ceil(self._avg_job_seconds * (queued + 1) / float(self.workers))))
+
+    def is_full(self):
+        with self._lock:
+            return self._in_flight >= self.workers + self.queue_size
+
+    def _update_gauges(self):
+        metrics.set_gauge("conversion.running", min(self._in_flight, self.workers))
+        metrics.set_gauge("conversion.queue_depth", max(0, self._in_flight - self.workers))
+
+    def _admit(self):
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_size:
+                admitted = False
+            else:
+                admitted = True
+                self._in_flight += 1
+                self._update_gauges()
+        if not admitted:
+            raise ConversionQueueFull(self.retry_after())
+
+    def _release(self, elapsed=None):
+        with self._lock:
+            self._in_flight -= 1
+            if elapsed is not None:
+                self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+            self._update_gauges()
+
+    def convert(self, input_path, output_path, file_extension, time_range=None):
+        """
+        Run convert_audio in the pool and wait for it; the pool process's memory
+        use is added to the current request's accounting
+
+        Returns:
+            bool: See convert_audio
+
+        Raises:
+            ConversionQueueFull: If the pool and its queue are both full
+            RequestCancelled: If the request's deadline passes or its client goes
+                away first; a queued job is dropped and a running ffmpeg is killed
+        """
+        return self._run(
+            "convert", _convert_measured, output_path,
+            input_path, output_path, file_extension, time_range,
+        )
+
+    def compress_tempo(self, input_path, output_path, factor):
+        """
+        Run tempo.compress_wav in the pool and wait for it
+
+        Returns:
+            TempoMap: See compress_wav
+
+        Raises:
+            ConversionQueueFull: If the pool and its queue are both full
+            RequestCancelled: If the request is cancelled first
+        """
+        return self._run("tempo", _compress_measured, output_path, input_path, output_path, factor)
+
+    def _run(self, stage, job, output_path, *args):
+        deadline = current_deadline()
+        deadline.check(stage)
+        # The pool process polls for this file, since it can't see the request's deadline
+        cancel_path = f"{output_path}.cancel"
+        self._admit()
+        submitted = time.time()
+        try:
+            with self._lock:
+                executor = self._get_executor()
+            try:
+                future = executor.submit(job, *(args + (cancel_path,)))
+            except BrokenProcessPool:
+                # A pool process died (e.g. OOM-killed); start a fresh pool
+                logger.warning("Conversion pool was broken, restarting it")
+                with self._lock:
+                    executor.shutdown(wait=False)
+                    self._executor = None
+                    executor = self._get_executor()
+                future = executor.submit(job, *(args + (cancel_path,)))
+        except Exception:
+            self._release()
+            raise
+
+        future.add_done_callback(lambda _: self._release(time.time() - submitted))
+        metrics.increment("conversion.accepted")
+        try:
+            while True:
+                try:
+                    result, measured = future.result(timeout=POLL_SECONDS)
+                    break
+                except FutureTimeoutError:
+                    timed_out = time.time() - submitted > CONVERSION_TIMEOUT
+                    if not (timed_out or deadline.expired()):
+                        continue
+                    if not future.cancel():
+                        # Running: ask the process to stop, and don't report the job
+                        # over (and its output free to reuse) until it has
+                        open(cancel_path, "w").close()
+                        if not wait_futures([future], timeout=CANCEL_WAIT_SECONDS).done:
+                            logger.error(f"Cancelled {stage} job is still running after {CANCEL_WAIT_SECONDS} seconds")
+                    if timed_out:
+                        metrics.increment("conversion.timeouts")
+                        raise RuntimeError(f"Audio conversion took longer than {CONVERSION_TIMEOUT} seconds")
+                    metrics.increment("conversion.cancelled")
+                    deadline.check(stage)
+        finally:
+            if future.done():
+                _discard(cancel_path)
+            else:
+                # The process still polls for the file; remove it once it has stopped
+                future.add_done_callback(lambda _: _discard(cancel_path))
+        metrics.observe("conversion.seconds", time.time() - submitted)
+        record_external_stage(f"{stage}_pool", measured)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": min(self._in_flight, self.workers),
+                "queue_depth": max(0, self._in_flight - self.workers),
+                "avg_job_seconds": self._avg_job_seconds,
+            }
+
+
+# One pool per web worker process
+conversion_pool = ConversionPool()
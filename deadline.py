@@ -0,0 +1,268 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from metrics import metrics
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+REQUEST_DEADLINE_SECONDS = int(os.environ.get("REQUEST_DEADLINE_SECONDS", 280))  # Below gunicorn's 300 s timeout
+CONVERT_SHARE = 0.4  # Most of an upload's remaining budget conversion may use; transcription gets the rest
+MIN_CALL_TIMEOUT = 1.0  # Seconds; an HTTP call given less than this would only fail confusingly
+POLL_SECONDS = 0.5  # How often waits re-check for cancellation
+
+EXPIRED = "expired"
+DISCONNECTED = "disconnected"
+
+_local = threading.local()
+
+
+class RequestCancelled(Exception):
+    """Raised inside a request's work once its deadline has passed or its client has gone away"""
+
+    def __init__(self, reason, stage=None):
+        message = "The request ran out of time" if reason == EXPIRED else "The client disconnected"
+        super(RequestCancelled, self).__init__(f"{message} during {stage}" if stage else message)
+        self.reason = reason
+        self.stage = stage
+
+
+class Deadline(object):
+    """
+    Time budget and cancellation flag of one request, carried through its
+    pipeline in a thread-local like the session owner and the progress sink.
+
+    Stages and tiers run under child deadlines holding a slice of the
+    remaining budget; a child expires with its slice or its parent, and is
+    cancelled with its parent. Work checks its deadline before anything
+    expensive (a Groq call, a retry, a conversion) and bounds every HTTP
+    timeout and wait by the time left, so nothing outlives the request.
+
+    Requests coalesced onto the same work attach to the leader's deadline; a
+    disconnect only cancels the work once every attached client is gone.
+    """
+
+    def __init__(self, seconds=None, parent=None):
+        self.parent = parent
+        expires_at = None if seconds is None else time.time() + max(0.0, seconds)
+        if parent is not None and parent.expires_at is not None:
+            expires_at = parent.expires_at if expires_at is None else min(expires_at, parent.expires_at)
+        self.expires_at = expires_at
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._reason = None
+        self._clients = 1
+
+    def child(self, seconds):
+        """
+        A deadline for one stage: at most seconds, and never past this one
+
+        Returns:
+            Deadline: The stage's deadline
+        """
+        return Deadline(seconds, parent=self)
+
+    def remaining(self):
+        """
+        Returns:
+            float: Seconds left, or None if unbounded
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def reason(self):
+        """
+        Why the work should stop, if it should
+
+        Returns:
+            str: DISCONNECTED, EXPIRED or None
+        """
+        if self._cancelled.is_set():
+            return self._reason
+        if self.parent is not None:
+            parent_reason = self.parent.reason()
+            if parent_reason is not None:
+                return parent_reason
+        if self.expires_at is not None and time.time() >= self.expires_at:
+            return EXPIRED
+        return None
+
+    def expired(self):
+        return self.reason() is not None
+
+    def cancel(self, reason=DISCONNECTED):
+        """Stop the work now, e.g. because the client has gone away"""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._reason = reason
+            self._cancelled.set()
+        logger.info(f"Cancelled request work after {time.time() - self.started:.1f}s: {reason}")
+
+    def attach(self):
+        """Another client is now waiting on this work (see SingleFlight)"""
+        with self._lock:
+            self._clients += 1
+
+    def abandon(self):
+        """
+        A client waiting on this work has gone; cancels it once nobody is left
+        """
+        with self._lock:
+            self._clients -= 1
+            orphaned = self._clients <= 0
+        if orphaned:
+            self.cancel(DISCONNECTED)
+
+    def check(self, stage):
+        """
+        Raise if the work should stop
+
+        Args:
+            stage (str): What was about to run, e.g. "transcribe"; counted in
+                the cancelled.<stage> metric
+
+        Raises:
+            RequestCancelled: If the deadline passed or the client went away
+        """
+        reason = self.reason()
+        if reason is not None:
+            metrics.increment(f"cancelled.{stage}")
+            raise RequestCancelled(reason, stage)
+
+    def timeout(self, default):
+        """
+        Timeout for a blocking call: default, or less if the deadline is closer
+
+        Args:
+            default (float): The call's usual timeout
+
+        Returns:
+            float: Seconds, at least MIN_CALL_TIMEOUT
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(MIN_CALL_TIMEOUT, min(default, remaining))
+
+    def retries(self, default, attempt_seconds):
+        """
+        How many retries of a call fit in the time left, if every attempt used its whole timeout
+
+        Args:
+            default (int): The client's usual retry count
+            attempt_seconds (float): Timeout of one attempt
+
+        Returns:
+            int: Between 0 and default
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(0, min(default, int(remaining // max(attempt_seconds, MIN_CALL_TIMEOUT)) - 1))
+
+    def wait(self, seconds, stage):
+        """
+        Sleep (e.g. between retries), waking early to raise if the work is cancelled
+
+        Raises:
+            RequestCancelled: If the deadline passes or the client goes away meanwhile
+        """
+        end = time.time() + seconds
+        while True:
+            self.check(stage)
+            left = end - time.time()
+            if left <= 0:
+                return
+            self._root()._cancelled.wait(min(left, POLL_SECONDS))
+
+    def wait_for(self, event, stage):
+        """
+        Wait for a threading.Event set by other work, or until cancelled
+
+        Raises:
+            RequestCancelled: If the deadline passes or the client goes away first
+        """
+        while not event.wait(POLL_SECONDS):
+            self.check(stage)
+
+    def _root(self):
+        deadline = self
+        while deadline.parent is not None:
+            deadline = deadline.parent
+        return deadline
+
+
+def set_deadline(deadline):
+    """
+    Set the deadline of the work running on this thread
+
+    Args:
+        deadline (Deadline): The request's deadline, or None for unbounded work
+    """
+    _local.deadline = deadline
+
+
+def current_deadline():
+    """
+    Get the deadline of the work running on this thread
+
+    Returns:
+        Deadline: The request's (or stage's) deadline; unbounded for background work
+    """
+    deadline = getattr(_local, "deadline", None)
+    if deadline is None:
+        deadline = _local.deadline = Deadline()
+    return deadline
+
+
+@contextmanager
+def stage_deadline(seconds):
+    """
+    Run a block under a child deadline of at most seconds, restoring the
+    previous deadline afterwards
+
+    Args:
+        seconds (float): The stage's budget, or None for whatever is left
+
+    Yields:
+        Deadline: The stage's deadline
+    """
+    previous = current_deadline()
+    deadline = previous.child(seconds)
+    set_deadline(deadline)
+    try:
+        yield deadline
+    finally:
+        set_deadline(previous)
+
+
+@contextmanager
+def request_deadline(seconds=REQUEST_DEADLINE_SECONDS, deadline=None):
+    """
+    Run a request's work on this thread under its deadline
+
+    Args:
+        seconds (float): The request's budget
+        deadline (Deadline, optional): One created earlier, e.g. on the request
+            thread for work handed to another thread
+
+    Yields:
+        Deadline: The request's deadline
+    """
+    deadline = deadline or Deadline(seconds)
+    previous = getattr(_local, "deadline", None)
+    set_deadline(deadline)
+    try:
+        yield deadline
+    finally:
+        set_deadline(previous)
@@ -1,10 +1,17 @@
 from __future__ import unicode_literals
+import copy
 import yt_dlp as youtube_dl
+from yt_dlp.utils import download_range_func
 import os
-import time
 import shutil
 import logging
 import sys
+from youtube import extract_video_id
+from tiers import classify_error, http_status, TRANSIENT
+from progress import report
+from deadline import current_deadline, RequestCancelled
+from probe import describe_video
+from media_cache import metadata_cache
 from dotenv import load_dotenv
 
 
@@ -29,12 +36,16 @@ logger.addHandler(ch)
 
 # Constants
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500 MB (increased from 100 MB)
-FILE_TOO_LARGE_MESSAGE = "The audio file is too large (over 500 MB). Try a shorter video."
 MAX_RETRIES = 4  # Increased from 3
 RETRY_DELAY = 2
 
+DOWNLOAD_DIR = './downloads/audio'
+
+# Optional stand-in media server (e.g. loadtest/fake_backends.py); unset in production
+YTDLP_BACKEND_URL = os.environ.get("YTDLP_BACKEND_URL")
+
 # Create downloads directory if it doesn't exist
-os.makedirs('./downloads/audio', exist_ok=True)
+os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 class MyLogger(object):
     def __init__(self, external_logger=None):
@@ -52,15 +63,53 @@ class MyLogger(object):
         logger.error(msg)
         self.external_logger(msg)
 
-def progress_hook(d):
-    if d["status"] == "finished":
-        logger.info("Download completed, now converting...")
+def make_progress_hook():
+    """
+    yt-dlp progress hook that reports download progress to the client streaming this
+    request, and aborts the download once the request is cancelled
+    """
+    last_percent = [-1]
+    deadline = current_deadline()
+    
+    def progress_hook(d):
+        deadline.check("download")
+        if d["status"] == "downloading":
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            if total:
+                percent = int(d.get("downloaded_bytes", 0) * 100 / total)
+                # Only whole-percent changes; yt-dlp calls this for every chunk
+                if percent != last_percent[0]:
+                    last_percent[0] = percent
+                    report("downloading", percent=min(percent, 100))
+        elif d["status"] == "finished":
+            logger.info("Download completed, now converting...")
+            report("converting")
+    
+    return progress_hook
 
-def get_ydl_opts(external_logger=None):
+def make_postprocessor_hook():
+    """
+    yt-dlp postprocessor hook that stops before ffmpeg extracts the audio of a cancelled request
+    """
+    deadline = current_deadline()
+    
+    def postprocessor_hook(d):
+        if d["status"] == "started":
+            deadline.check("extract_audio")
+    
+    return postprocessor_hook
+
+def get_ydl_opts(external_logger=None, output_dir=DOWNLOAD_DIR, time_range=None):
     """
     Get options for youtube-dl
+    
+    Args:
+        external_logger (function, optional): External logging function
+        output_dir (str, optional): Directory to download into
+        time_range (tuple, optional): (start, end or None) seconds; only that
+            section is downloaded and converted
     """
-    return {
+    opts = {
         # Prioritize audio-only formats with lower quality for faster downloads
         "format": "worstaudio/worst[filesize<50M]/bestaudio/best",
         "postprocessors": [
@@ -71,45 +120,109 @@ def get_ydl_opts(external_logger=None):
             }
         ],
         "logger": MyLogger(external_logger),
-        "outtmpl": "./downloads/audio/%(title)s.%(ext)s",  # Set output filename
-        "progress_hooks": [progress_hook],
+        "outtmpl": os.path.join(output_dir, "%(title)s.%(ext)s"),  # Set output filename
+        "progress_hooks": [make_progress_hook()],
+        "postprocessor_hooks": [make_postprocessor_hook()],
         "noplaylist": True,  # Only download the video, not the entire playlist
         "quiet": False,
         "no_warnings": False,
         # Adding some timeouts to prevent hanging on large videos
-        "socket_timeout": 30,  # 30 seconds
+        "socket_timeout": current_deadline().timeout(30),  # 30 seconds, less near the request's deadline
     }
+    if time_range is not None:
+        # ffmpeg seeks in the stream, so only the section's bytes are fetched
+        start, end = time_range
+        opts["download_ranges"] = download_range_func(None, [(start, float("inf") if end is None else end)])
+    return opts
+
+def media_url(url):
+    """
+    URL yt-dlp should fetch for a YouTube URL (the stand-in media server's, when one is configured)
+    """
+    if YTDLP_BACKEND_URL:
+        url = f"{YTDLP_BACKEND_URL.rstrip('/')}/media/{extract_video_id(url)}.wav"
+        logger.info(f"Using stand-in media backend: {url}")
+    return url
+
+def video_info(url):
+    """
+    Metadata of a YouTube video (yt-dlp's extract_info without downloading), cached
+    by video ID so the prefetch, the probe and the download share one extraction
+    
+    Args:
+        url (str): YouTube URL
+        
+    Returns:
+        dict: yt-dlp's info dict; callers must not modify it
+    """
+    def load():
+        opts = {
+            "format": get_ydl_opts()["format"],
+            "logger": MyLogger(),
+            "noplaylist": True,
+            "quiet": True,
+            "socket_timeout": 30,
+        }
+        with youtube_dl.YoutubeDL(opts) as ydl:
+            return ydl.extract_info(media_url(url), download=False)
+    
+    return metadata_cache.get_or_load(extract_video_id(url) or url, load)
 
-def download_video_audio(url, external_logger=None):
+def probe_video(url, time_range=None):
+    """
+    Pre-flight probe of a YouTube video from its metadata, without downloading anything
+    
+    Args:
+        url (str): YouTube URL
+        time_range (tuple, optional): (start, end or None) seconds to transcribe
+        
+    Returns:
+        dict: Duration, codec, estimated sizes, caption availability and processing
+            time (see probe.describe_video), or {'error': ...} if the metadata can't be fetched
+    """
+    try:
+        info = video_info(url)
+    except Exception as e:
+        logger.error(f"Could not probe {url}: {str(e)}")
+        return {"source": "youtube", "error": f"Could not read the video's details: {str(e)}"}
+    return describe_video(info, time_range, MAX_FILE_SIZE)
+
+def download_video_audio(url, external_logger=None, output_dir=DOWNLOAD_DIR, time_range=None):
     """
     Download audio from a YouTube video URL
     
     Args:
         url (str): YouTube URL
         external_logger (function, optional): External logging function
+        output_dir (str, optional): Directory to download into, e.g. a request workspace
+        time_range (tuple, optional): (start, end or None) seconds to download instead of the whole video
         
     Returns:
         str: Path to downloaded audio file, or None if download failed
     """
     logger.info(f"Starting download of YouTube audio from: {url}")
     retries = 0
+    deadline = current_deadline()
     
     while retries < MAX_RETRIES:
+        deadline.check("download")
         try:
             # Get youtube-dl options
-            ydl_opts = get_ydl_opts(external_logger)
+            ydl_opts = get_ydl_opts(external_logger, output_dir, time_range)
             
             # Download video and extract audio
             with youtube_dl.YoutubeDL(ydl_opts) as ydl:
                 logger.info(f"Extracting information from URL: {url}")
                 
-                # First extract info without downloading to check size
-                info = ydl.extract_info(url, download=False)
+                # First extract info without downloading to check size (usually
+                # already cached by the prefetch when the URL was pasted)
+                info = video_info(url)
                 
-                # Check if file is too large
-                filesize = info.get("filesize", 0)
-                if filesize > MAX_FILE_SIZE:
-                    logger.error(FILE_TOO_LARGE_MESSAGE)
+                # Reject it before downloading if it's too long or too large; yt-dlp
+                # often has no exact filesize, so the probe estimates one
+                summary = describe_video(info, time_range, MAX_FILE_SIZE)
+                if summary["download_error"]:
+                    ydl_opts["logger"].error(f"ERROR: {summary['download_error']}")
                     return None
                 
                 # Prepare filename
@@ -117,23 +230,41 @@ def download_video_audio(url, external_logger=None):
                 
                 # Download the file
                 logger.info("Starting the actual download...")
-                ydl.download([url])
+                ydl.process_ie_result(copy.deepcopy(info), download=True)
                 
                 # Get the mp3 filename after conversion
                 mp3_filename = os.path.splitext(filename)[0] + '.mp3'
+                if time_range is not None and not os.path.exists(mp3_filename):
+                    # Section downloads can be named after the section; the workspace holds only this download
+                    found = [name for name in os.listdir(output_dir) if name.endswith('.mp3')]
+                    if found:
+                        mp3_filename = os.path.join(output_dir, found[0])
                 logger.info(f"Download complete. MP3 file: {mp3_filename}")
                 
                 return mp3_filename
                 
+        except RequestCancelled:
+            raise
         except Exception as e:
+            # A cancelled request's download was aborted on purpose; don't retry it
+            deadline.check("download")
             retries += 1
             logger.error(f"Error during download (Attempt {retries}/{MAX_RETRIES}): {str(e)}")
+            # The cached stream URLs may have gone stale; extract afresh next time
+            metadata_cache.forget(extract_video_id(url) or url)
+            
+            # Only transient errors are worth retrying; an unavailable video or
+            # a bot check fails the same way every time
+            error_class = classify_error(str(e), http_status(e))
+            if error_class != TRANSIENT:
+                logger.error(f"Not retrying {error_class} error")
+                return None
             
             if retries >= MAX_RETRIES:
                 logger.error(f"Maximum retries ({MAX_RETRIES}) reached. Giving up.")
                 return None
                 
-            time.sleep(RETRY_DELAY)
+            deadline.wait(RETRY_DELAY, "download")
     
     return None
 
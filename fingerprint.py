@@ -0,0 +1,418 @@
+import os
+import time
+import logging
+import subprocess
+from collections import namedtuple
+from datetime import datetime, timezone
+import numpy as np
+from sqlalchemy import and_, inspect, text
+from history import db
+from metrics import metrics
+from wavstream import read_wav_header, pcm_to_float
+from conversion import FFMPEG_AVAILABLE
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+FINGERPRINT_INDEX = os.environ.get("FINGERPRINT_INDEX", "1").lower() in ("1", "true", "yes", "on")
+# Reuse transcripts of audio other sessions uploaded; off, each session only matches its own uploads
+FINGERPRINT_SHARED = os.environ.get("FINGERPRINT_SHARED", "0").lower() in ("1", "true", "yes", "on")
+MIN_CONFIDENCE = float(os.environ.get("FINGERPRINT_MIN_CONFIDENCE", 0.25))  # Share of sampled hashes that must line up
+MIN_MATCHED_HASHES = 20
+DURATION_TOLERANCE = 0.01  # A match may be this much (or MIN_DURATION_SLACK) shorter or longer
+MIN_DURATION_SLACK = 1.0  # Seconds; covers a trimmed click or a re-encoder's padding
+
+# Analysis: peaks of a 64 ms / 32 ms-hop spectrogram of the audio at 8 kHz
+ANALYSIS_RATE = 8000
+FFT_SIZE = 512
+HOP = 256
+FRAMES_PER_SECOND = ANALYSIS_RATE / float(HOP)
+BAND_EDGES = (20, 40, 60, 90, 130, 180, 257)  # FFT bins: six bands from ~300 Hz to 4 kHz
+PEAK_NEIGHBORHOOD = 8  # A band's peak must be the loudest within this many frames either side
+SILENCE_LEVEL = 1e-3  # Spectral magnitude below which a peak is ignored
+BLOCK_SAMPLES = ANALYSIS_RATE * 60  # Audio analysed per block; bounds memory for long recordings
+
+# Hashes: each peak paired with the next FAN_OUT peaks at most MAX_PAIR_FRAMES later
+FAN_OUT = 4
+MAX_PAIR_FRAMES = 63
+MAX_QUERY_HASHES = 1500  # Sampled from the upload for a lookup; the index size doesn't matter
+QUERY_BATCH = 500  # Hashes per IN (...) query
+
+Fingerprint = namedtuple("Fingerprint", ["hashes", "frames", "duration"])
+FingerprintMatch = namedtuple("FingerprintMatch", ["recording_id", "transcript", "model", "confidence"])
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+class FingerprintRecording(db.Model):
+    """Audio whose fingerprint is indexed, and the transcript made from it"""
+
+    __tablename__ = "fingerprint_recordings"
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner = db.Column(db.String(64))  # Session that uploaded it; only that session reuses its transcript
+    duration = db.Column(db.Float, nullable=False, index=True)
+    hash_count = db.Column(db.Integer, nullable=False)
+    transcript = db.Column(db.Text, nullable=False)
+    model = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=_utcnow)
+
+    __table_args__ = (db.Index("ix_fingerprint_recordings_owner_duration", "owner", "duration"),)
+
+
+class FingerprintHash(db.Model):
+    """
+    Inverted index entry: a hash and where it occurs. The primary key is the
+    whole row, so lookups by hash are answered from the index alone.
+    """
+
+    __tablename__ = "fingerprint_hashes"
+
+    hash = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    recording_id = db.Column(
+        db.Integer, db.ForeignKey("fingerprint_recordings.id", ondelete="CASCADE"), primary_key=True, autoincrement=False
+    )
+    frame = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+
+def _analysis_blocks(path):
+    """Yield the WAV's audio as mono float32 blocks at ANALYSIS_RATE"""
+    fmt = read_wav_header(path)
+    step = fmt.sample_rate / float(ANALYSIS_RATE)
+    block_frames = int(BLOCK_SAMPLES * step)
+    remaining = fmt.frames
+    with open(path, "rb") as f:
+        f.seek(fmt.data_offset)
+        while remaining > 0:
+            count = min(remaining, block_frames)
+            raw = np.frombuffer(f.read(count * fmt.block_align), dtype=np.uint8)
+            if not len(raw):
+                break
+            remaining -= count
+            samples = pcm_to_float(raw[:len(raw) - len(raw) % fmt.block_align], fmt).mean(axis=1, dtype=np.float32)
+            if step >= 2:
+                # Box filter against aliasing; crude, but peaks only need to be consistent
+                width = int(step)
+                samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode="same")
+            if step != 1:
+                positions = np.arange(0, len(samples) - 1, step)
+                samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+            yield samples
+
+
+def _decode_command(path):
+    """ffmpeg command writing a file's audio to stdout as mono 16-bit PCM at ANALYSIS_RATE"""
+    return [
+        "ffmpeg", "-v", "error", "-nostdin", "-i", path,
+        "-f", "s16le", "-ac", "1", "-ar", str(ANALYSIS_RATE), "-",
+    ]
+
+
+def _decoded_blocks(path):
+    """
+    Yield any ffmpeg-readable file's audio as mono float32 blocks at ANALYSIS_RATE,
+    decoded through a pipe so only one block is held at a time
+
+    Raises:
+        ValueError: If ffmpeg can't decode it
+    """
+    process = subprocess.Popen(
+        _decode_command(path), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    try:
+        while True:
+            raw = process.stdout.read(BLOCK_SAMPLES * 2)
+            if not raw:
+                break
+            yield np.frombuffer(raw[:len(raw) - len(raw) % 2], dtype="<i2").astype(np.float32) / 32768.0
+        if process.wait() != 0:
+            raise ValueError(f"ffmpeg could not decode it: {process.stderr.read().decode('utf-8', 'replace').strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def _band_peaks(blocks):
+    window = np.hanning(FFT_SIZE).astype(np.float32)
+    carry = np.zeros(0, dtype=np.float32)
+    bins, magnitudes = [], []
+    for block in blocks:
+        samples = np.concatenate((carry, block))
+        if len(samples) < FFT_SIZE:
+            carry = samples
+            continue
+        frames = np.lib.stride_tricks.sliding_window_view(samples, FFT_SIZE)[::HOP]
+        carry = samples[len(frames) * HOP:]
+        spectrum = np.abs(np.fft.rfft(frames * window, axis=1)).astype(np.float32)
+        block_bins = np.stack([
+            spectrum[:, low:high].argmax(axis=1) + low for low, high in zip(BAND_EDGES[:-1], BAND_EDGES[1:])
+        ], axis=1)
+        bins.append(block_bins.astype(np.int32))
+        magnitudes.append(np.take_along_axis(spectrum, block_bins, axis=1))
+    if not bins:
+        bands = len(BAND_EDGES) - 1
+        return np.zeros((0, bands), dtype=np.int32), np.zeros((0, bands), dtype=np.float32)
+    return np.concatenate(bins), np.concatenate(magnitudes)
+
+
+def fingerprint_wav(path):
+    """
+    Fingerprint a PCM WAV file (see fingerprint_blocks)
+
+    Args:
+        path (str): A PCM WAV file (e.g. the converted 16 kHz upload)
+
+    Returns:
+        Fingerprint: See fingerprint_blocks
+
+    Raises:
+        ValueError: If the file isn't a WAV file wavstream can read
+    """
+    return fingerprint_blocks(_analysis_blocks(path))
+
+
+def fingerprint_audio(path):
+    """
+    Fingerprint any audio file ffmpeg can decode (e.g. an Opus upload the
+    browser already made 16 kHz mono, which is never converted to WAV)
+
+    Returns:
+        Fingerprint: See fingerprint_blocks
+
+    Raises:
+        ValueError: If ffmpeg can't decode it
+    """
+    return fingerprint_blocks(_decoded_blocks(path))
+
+
+def fingerprint_blocks(blocks):
+    """
+    Spectral-peak fingerprint of audio: the strongest peaks in each band
+    and time neighbourhood, hashed in pairs as (first bin, second bin, frames
+    apart) with the first peak's frame. Pairs survive re-encoding, gain changes
+    and trimming; their frames say how the copies line up.
+
+    Args:
+        blocks (iterable): The audio as mono float32 arrays at ANALYSIS_RATE
+
+    Returns:
+        Fingerprint: hashes and frames (int32 arrays, sorted by frame) and duration in seconds
+    """
+    bins, magnitudes = _band_peaks(blocks)
+    duration = len(bins) / FRAMES_PER_SECOND
+    if len(bins) == 0:
+        return Fingerprint(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), duration)
+
+    # Keep a band's peak where it is the loudest within PEAK_NEIGHBORHOOD frames
+    padded = np.pad(magnitudes, ((PEAK_NEIGHBORHOOD, PEAK_NEIGHBORHOOD), (0, 0)), constant_values=-1.0)
+    neighbourhood = np.lib.stride_tricks.sliding_window_view(padded, 2 * PEAK_NEIGHBORHOOD + 1, axis=0).max(axis=-1)
+    frame_index, band_index = np.nonzero((magnitudes >= neighbourhood) & (magnitudes > SILENCE_LEVEL))
+    peak_bins = bins[frame_index, band_index]  # np.nonzero is row-major, so peaks are in frame order
+
+    hashes, frames = [], []
+    for ahead in range(1, FAN_OUT + 1):
+        anchor_frames, target_frames = frame_index[:-ahead], frame_index[ahead:]
+        gap = target_frames - anchor_frames
+        keep = gap <= MAX_PAIR_FRAMES
+        hashes.append((peak_bins[:-ahead][keep] << 15) | (peak_bins[ahead:][keep] << 6) | gap[keep])
+        frames.append(anchor_frames[keep])
+    hashes = np.concatenate(hashes).astype(np.int32)
+    frames = np.concatenate(frames).astype(np.int32)
+
+    # One entry per (hash, frame), in frame order
+    unique = np.unique(np.stack((frames, hashes), axis=1), axis=0)
+    return Fingerprint(unique[:, 1].copy(), unique[:, 0].copy(), duration)
+
+
+def _duration_slack(duration):
+    return max(MIN_DURATION_SLACK, duration * DURATION_TOLERANCE)
+
+
+class FingerprintIndex(object):
+    """
+    Inverted index from fingerprint hashes to the recordings they occur in.
+
+    A lookup samples at most MAX_QUERY_HASHES hashes of the new audio and asks
+    the database, in a few batches, where they occur among recordings of about
+    the same length; the primary key index answers each hash in O(log n), so
+    lookups stay fast with millions of entries. Matches are scored by how many
+    sampled hashes agree on one alignment (the frame difference), which random
+    collisions don't. Only near-identical audio of the same length counts: a
+    transcript of a longer or shorter recording would be wrong for this one.
+
+    Recordings belong to the session that uploaded them, and a lookup only
+    sees that session's recordings: a match proves the uploader has audio
+    like it, not that they may read someone else's transcript. Sharing across
+    sessions is opt-in (FINGERPRINT_SHARED).
+    """
+
+    def __init__(self):
+        self.app = None
+
+    @property
+    def enabled(self):
+        return self.app is not None and FINGERPRINT_INDEX
+
+    def init_app(self, app):
+        self.app = app
+
+    def upgrade_schema(self):
+        """
+        Add the owner column to a recordings table created before it existed
+        (call inside an app context, after the tables are created). Recordings
+        indexed before then have no owner, so only shared lookups see them.
+        """
+        columns = [column["name"] for column in inspect(db.engine).get_columns(FingerprintRecording.__tablename__)]
+        if "owner" in columns:
+            return
+        logger.info("Adding an owner column to the fingerprint index")
+        with db.engine.begin() as connection:
+            connection.execute(text("ALTER TABLE fingerprint_recordings ADD COLUMN owner VARCHAR(64)"))
+        for index in FingerprintRecording.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    def fingerprint(self, path):
+        """
+        Fingerprint a converted upload, if the index is enabled. WAV is read
+        directly; anything else (an Opus upload used as-is) is decoded by ffmpeg.
+
+        Returns:
+            Fingerprint: The fingerprint, or None
+        """
+        if not self.enabled:
+            return None
+        is_wav = path.lower().endswith(".wav")
+        if not is_wav and not FFMPEG_AVAILABLE:
+            return None
+        started = time.time()
+        try:
+            fingerprint = fingerprint_wav(path) if is_wav else fingerprint_audio(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not fingerprint {path}: {str(e)}")
+            return None
+        metrics.observe("fingerprint.seconds", time.time() - started)
+        logger.info(f"Fingerprinted {fingerprint.duration:.0f}s of audio into {len(fingerprint.hashes)} hashes")
+        return fingerprint
+
+    def match(self, fingerprint, owner=None):
+        """
+        Find an indexed recording that is near-identical to this audio
+
+        Args:
+            fingerprint (Fingerprint): The new audio's fingerprint, or None
+            owner (str, optional): Session asking; only its recordings are
+                searched unless FINGERPRINT_SHARED is on
+
+        Returns:
+            FingerprintMatch: The best match, or None if none is confident enough
+        """
+        if fingerprint is None or len(fingerprint.hashes) < MIN_MATCHED_HASHES:
+            return None
+        if owner is None and not FINGERPRINT_SHARED:
+            return None
+        started = time.time()
+
+        # An even sample of the hashes, so the lookup costs the same for any length
+        stride = max(1, int(np.ceil(len(fingerprint.hashes) / float(MAX_QUERY_HASHES))))
+        query_hashes = fingerprint.hashes[::stride]
+        query_frames = fingerprint.frames[::stride]
+        slack = _duration_slack(fingerprint.duration)
+
+        conditions = [FingerprintRecording.duration.between(fingerprint.duration - slack, fingerprint.duration + slack)]
+        if not FINGERPRINT_SHARED:
+            conditions.append(FingerprintRecording.owner == owner)
+
+        rows = []
+        try:
+            with self.app.app_context():
+                for batch_start in range(0, len(query_hashes), QUERY_BATCH):
+                    batch = [int(value) for value in np.unique(query_hashes[batch_start:batch_start + QUERY_BATCH])]
+                    rows.extend(
+                        db.session.query(FingerprintHash.hash, FingerprintHash.recording_id, FingerprintHash.frame)
+                        .join(FingerprintRecording, FingerprintRecording.id == FingerprintHash.recording_id)
+                        .filter(and_(FingerprintHash.hash.in_(batch), *conditions))
+                        .all()
+                    )
+        except Exception as e:
+            logger.warning(f"Fingerprint lookup failed: {str(e)}")
+            return None
+        metrics.observe("fingerprint.lookup_seconds", time.time() - started)
+        if not rows:
+            metrics.increment("fingerprint.misses")
+            return None
+
+        # Each occurrence votes for (recording, alignment); votes one frame apart are pooled
+        found = np.array(rows, dtype=np.int64)
+        unique_hashes, first_index = np.unique(query_hashes, return_index=True)
+        query_frame = query_frames[first_index][np.searchsorted(unique_hashes, found[:, 0])]
+        recordings = found[:, 1]
+        offsets = found[:, 2] - query_frame
+
+        keys, counts = np.unique(recordings * (1 << 32) + offsets + (1 << 31), return_counts=True)
+        pooled = counts.copy()
+        for neighbour in (-1, 1):
+            position = np.searchsorted(keys, keys + neighbour)
+            present = (position < len(keys)) & (keys[np.minimum(position, len(keys) - 1)] == keys + neighbour)
+            pooled[present] += counts[position[present]]
+        best = int(pooled.argmax())
+        recording_id = int(keys[best] >> 32)
+        offset = int(keys[best] & 0xFFFFFFFF) - (1 << 31)
+        confidence = pooled[best] / float(len(query_hashes))
+
+        metrics.observe("fingerprint.best_confidence", confidence)
+        if pooled[best] < MIN_MATCHED_HASHES or confidence < MIN_CONFIDENCE or abs(offset) > slack * FRAMES_PER_SECOND:
+            logger.info(f"No confident fingerprint match (best {confidence:.2f} with recording {recording_id})")
+            metrics.increment("fingerprint.misses")
+            return None
+
+        with self.app.app_context():
+            recording = db.session.get(FingerprintRecording, recording_id)
+            if recording is None:
+                return None
+            match = FingerprintMatch(recording.id, recording.transcript, recording.model, round(float(confidence), 3))
+        logger.info(f"Audio matches indexed recording {recording_id} (confidence {confidence:.2f}, offset {offset} frames)")
+        metrics.increment("fingerprint.hits")
+        return match
+
+    def add(self, fingerprint, transcript, model=None, owner=None):
+        """
+        Index a transcribed recording's fingerprint
+
+        Args:
+            fingerprint (Fingerprint): Its fingerprint, or None
+            transcript (str): The transcript to reuse for near-identical audio
+            model (str, optional): The Whisper model that produced it
+            owner (str, optional): Session that uploaded it
+        """
+        if fingerprint is None or len(fingerprint.hashes) < MIN_MATCHED_HASHES:
+            return
+        try:
+            with self.app.app_context():
+                recording = FingerprintRecording(
+                    owner=owner, duration=fingerprint.duration, hash_count=len(fingerprint.hashes), transcript=transcript, model=model
+                )
+                db.session.add(recording)
+                db.session.flush()
+                db.session.execute(FingerprintHash.__table__.insert(), [
+                    {"hash": int(value), "recording_id": recording.id, "frame": int(frame)}
+                    for value, frame in zip(fingerprint.hashes, fingerprint.frames)
+                ])
+                db.session.commit()
+        except Exception as e:
+            logger.warning(f"Could not index fingerprint: {str(e)}")
+            return
+        metrics.increment("fingerprint.indexed")
+        metrics.increment("fingerprint.indexed_hashes", len(fingerprint.hashes))
+
+
+fingerprint_index = FingerprintIndex()
@@ -24,5 +24,7 @@ errorlog = "-"   # stderr
 # Enable auto-reload to detect code changes
 reload = True
 
-# Worker class
-worker_class = "sync"
\ No newline at end of file
+# Worker class - threaded so short requests aren't stuck behind long ones;
+# Groq calls are admitted by the fair scheduler in scheduler.py
+worker_class = "gthread"
+threads = 8
\ No newline at end of file
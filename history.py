@@ -0,0 +1,341 @@
+import re
+import html
+import hashlib
+import logging
+from datetime import datetime, timezone
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.orm import deferred
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+db = SQLAlchemy()
+
+# Constants
+PREVIEW_CHARS = 200
+MAX_PAGE_SIZE = 50
+SNIPPET_WORDS = 16
+# Highlight delimiters used inside the database; the snippet is HTML-escaped
+# before they are turned into <mark> tags
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+class TranscriptRecord(db.Model):
+    """A transcript, its notes and where it came from"""
+
+    __tablename__ = "transcripts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner = db.Column(db.String(64), nullable=False, index=True)
+    source_type = db.Column(db.String(16), nullable=False)  # youtube, upload, recording, manual
+    video_id = db.Column(db.String(32), index=True)
+    file_hash = db.Column(db.String(64), index=True)
+    tier = db.Column(db.String(32))  # Which pipeline tier produced the transcript
+    model = db.Column(db.String(64))  # Model that produced the transcript, if any
+    content_hash = db.Column(db.String(64), nullable=False)
+    # Large columns are deferred so listing never loads them
+    transcript = deferred(db.Column(db.Text, nullable=False))
+    notes = deferred(db.Column(db.Text))
+    has_notes = db.Column(db.Boolean, nullable=False, default=False)
+    preview = db.Column(db.String(PREVIEW_CHARS), nullable=False, default="")
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=_utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=_utcnow, onupdate=_utcnow)
+
+    __table_args__ = (db.Index("ix_transcripts_owner_id", "owner", "id"),)
+
+
+# The owner is an indexed column so a search matches within the owner's
+# records only, instead of matching everyone's and filtering afterwards. It
+# comes last so snippets prefer the transcript and notes columns.
+_SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+        transcript, notes, owner, content='transcripts', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS transcripts_fts_insert AFTER INSERT ON transcripts BEGIN
+        INSERT INTO transcripts_fts(rowid, transcript, notes, owner) VALUES (new.id, new.transcript, new.notes, new.owner);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transcripts_fts_delete AFTER DELETE ON transcripts BEGIN
+        INSERT INTO transcripts_fts(transcripts_fts, rowid, transcript, notes, owner)
+        VALUES ('delete', old.id, old.transcript, old.notes, old.owner);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transcripts_fts_update AFTER UPDATE OF transcript, notes, owner ON transcripts BEGIN
+        INSERT INTO transcripts_fts(transcripts_fts, rowid, transcript, notes, owner)
+        VALUES ('delete', old.id, old.transcript, old.notes, old.owner);
+        INSERT INTO transcripts_fts(rowid, transcript, notes, owner) VALUES (new.id, new.transcript, new.notes, new.owner);
+    END""",
+]
+
+# Indexes created before the owner column was added are dropped and rebuilt
+_SQLITE_FTS_DROP = [
+    "DROP TRIGGER IF EXISTS transcripts_fts_insert",
+    "DROP TRIGGER IF EXISTS transcripts_fts_delete",
+    "DROP TRIGGER IF EXISTS transcripts_fts_update",
+    "DROP TABLE IF EXISTS transcripts_fts",
+]
+
+_POSTGRES_FTS_DDL = [
+    """ALTER TABLE transcripts ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(notes, '')), 'A') ||
+            setweight(to_tsvector('english', transcript), 'B')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_transcripts_search ON transcripts USING GIN (search_vector)",
+]
+
+
+def init_history():
+    """
+    Create the tables and the full-text index (call inside an app context)
+    """
+    db.create_all()
+    sqlite = db.engine.dialect.name == "sqlite"
+    statements = _SQLITE_FTS_DDL if sqlite else _POSTGRES_FTS_DDL
+    with db.engine.begin() as connection:
+        rebuild = False
+        if sqlite:
+            columns = [row[1] for row in connection.execute(text("PRAGMA table_info(transcripts_fts)"))]
+            if columns and "owner" not in columns:
+                logger.info("Rebuilding the transcript search index with an owner column")
+                for statement in _SQLITE_FTS_DROP:
+                    connection.execute(text(statement))
+                rebuild = True
+        for statement in statements:
+            connection.execute(text(statement))
+        if rebuild:
+            connection.execute(text("INSERT INTO transcripts_fts(transcripts_fts) VALUES ('rebuild')"))
+
+
+def content_hash(transcript):
+    return hashlib.sha256(" ".join(transcript.split()).encode("utf-8")).hexdigest()
+
+
+def _preview(transcript):
+    return " ".join(transcript[:PREVIEW_CHARS * 2].split())[:PREVIEW_CHARS]
+
+
+def save_transcript(owner, transcript, source_type, video_id=None, file_hash=None, tier=None, model=None):
+    """
+    Store a new transcript
+
+    Args:
+        owner (str): Session the transcript belongs to
+        transcript (str): Transcript text
+        source_type (str): youtube, upload, recording or manual
+        video_id (str, optional): YouTube video ID
+        file_hash (str, optional): SHA-256 of the uploaded file
+        tier (str, optional): Pipeline tier that produced it
+        model (str, optional): Model that produced it
+
+    Returns:
+        int: ID of the new record
+    """
+    record = TranscriptRecord(
+        owner=owner,
+        source_type=source_type,
+        video_id=video_id,
+        file_hash=file_hash,
+        tier=tier,
+        model=model,
+        content_hash=content_hash(transcript),
+        transcript=transcript,
+        preview=_preview(transcript),
+    )
+    db.session.add(record)
+    db.session.commit()
+    return record.id
+
+
+def update_transcript(owner, record_id, transcript):
+    """
+    Replace the text of an existing transcript after the user edited it
+
+    Returns:
+        bool: False if there is no such record for this owner
+    """
+    record = TranscriptRecord.query.filter_by(id=record_id, owner=owner).first()
+    if record is None:
+        return False
+    new_hash = content_hash(transcript)
+    if record.content_hash != new_hash:
+        record.transcript = transcript
+        record.content_hash = new_hash
+        record.preview = _preview(transcript)
+        db.session.commit()
+    return True
+
+
+def save_notes(owner, record_id, transcript, notes):
+    """
+    Attach notes to the transcript they were generated from, creating a
+    manual record if the session has no matching transcript
+
+    Returns:
+        int: ID of the record holding the notes
+    """
+    record = None
+    if record_id is not None:
+        record = TranscriptRecord.query.filter_by(id=record_id, owner=owner).first()
+    if record is None or record.content_hash != content_hash(transcript):
+        record_id = save_transcript(owner, transcript, "manual")
+        record = db.session.get(TranscriptRecord, record_id)
+    record.notes = notes
+    record.has_notes = True
+    db.session.commit()
+    return record.id
+
+
+def list_transcripts(owner, limit=20, before_id=None):
+    """
+    List an owner's transcripts, newest first, with keyset pagination
+
+    Args:
+        owner (str): Session whose history to list
+        limit (int): Page size
+        before_id (int, optional): Only return records older than this ID (from the previous page)
+
+    Returns:
+        dict: items and the before_id to pass for the next page (None at the end)
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = TranscriptRecord.query.filter_by(owner=owner)
+    if before_id is not None:
+        query = query.filter(TranscriptRecord.id < before_id)
+    records = query.order_by(TranscriptRecord.id.desc()).limit(limit + 1).all()
+
+    items = [_summary(record) for record in records[:limit]]
+    next_before = records[limit - 1].id if len(records) > limit else None
+    return {"items": items, "next_before": next_before}
+
+
+def get_transcript(owner, record_id):
+    """
+    Get one record with its full transcript and notes
+
+    Returns:
+        dict: The record, or None if there is no such record for this owner
+    """
+    record = TranscriptRecord.query.filter_by(id=record_id, owner=owner).first()
+    if record is None:
+        return None
+    item = _summary(record)
+    item.update(transcript=record.transcript, notes=record.notes)
+    return item
+
+
+def _summary(record):
+    return {
+        "id": record.id,
+        "source_type": record.source_type,
+        "video_id": record.video_id,
+        "file_hash": record.file_hash,
+        "tier": record.tier,
+        "model": record.model,
+        "preview": record.preview,
+        "has_notes": record.has_notes,
+        "created_at": record.created_at.isoformat() if record.created_at else None,
+    }
+
+
+def _fts5_query(query, owner):
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return ""
+    owner_phrase = " ".join(re.findall(r"\w+", owner))
+    return f'owner : "{owner_phrase}" AND {{transcript notes}} : (' + " ".join(f'"{term}"' for term in terms) + ")"
+
+
+def _highlight(snippet):
+    """Escape a snippet for HTML, then turn the database's highlight delimiters into <mark> tags"""
+    if snippet is None:
+        return None
+    escaped = html.escape(snippet, quote=False)
+    return escaped.replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+def search_transcripts(owner, query, limit=20, offset=0):
+    """
+    Full-text search over an owner's transcripts and notes
+
+    Args:
+        owner (str): Session whose history to search
+        query (str): Search terms
+        limit (int): Page size
+        offset (int): Number of ranked results to skip
+
+    Returns:
+        list: Ranked results with snippets as HTML: escaped text with <mark> highlights
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    offset = max(0, int(offset))
+
+    if db.engine.dialect.name == "sqlite":
+        match = _fts5_query(query, owner)
+        if not match:
+            return []
+        sql = text(
+            """
+            SELECT t.id, t.source_type, t.video_id, t.preview, t.created_at,
+                   snippet(transcripts_fts, -1, :mark_start, :mark_end, '…', :words) AS snippet,
+                   bm25(transcripts_fts, 1.0, 2.0, 0.0) AS score
+            FROM transcripts_fts
+            JOIN transcripts t ON t.id = transcripts_fts.rowid
+            WHERE transcripts_fts MATCH :match AND t.owner = :owner
+            ORDER BY score
+            LIMIT :limit OFFSET :offset
+            """
+        )
+        params = {
+            "match": match, "owner": owner, "limit": limit, "offset": offset, "words": SNIPPET_WORDS,
+            "mark_start": _MARK_START, "mark_end": _MARK_END,
+        }
+    else:
+        # Rank first, then build headlines only for the page being returned
+        sql = text(
+            """
+            SELECT top.id, top.source_type, top.video_id, top.preview, top.created_at,
+                   ts_headline('english', top.transcript, top.q,
+                               'StartSel=' || :mark_start || ', StopSel=' || :mark_end ||
+                               ', MaxWords=' || :words || ', MinWords=5, MaxFragments=2')
+                       AS snippet,
+                   top.score
+            FROM (
+                SELECT t.id, t.source_type, t.video_id, t.preview, t.created_at, t.transcript, q,
+                       ts_rank(t.search_vector, q) AS score
+                FROM transcripts t, websearch_to_tsquery('english', :query) q
+                WHERE t.owner = :owner AND t.search_vector @@ q
+                ORDER BY score DESC
+                LIMIT :limit OFFSET :offset
+            ) top
+            ORDER BY top.score DESC
+            """
+        )
+        params = {
+            "query": query, "owner": owner, "limit": limit, "offset": offset, "words": SNIPPET_WORDS,
+            "mark_start": _MARK_START, "mark_end": _MARK_END,
+        }
+
+    rows = db.session.execute(sql, params).mappings().all()
+    results = []
+    for row in rows:
+        created_at = row["created_at"]
+        results.append({
+            "id": row["id"],
+            "source_type": row["source_type"],
+            "video_id": row["video_id"],
+            "preview": row["preview"],
+            "snippet": _highlight(row["snippet"]),
+            "score": row["score"],
+            "created_at": created_at.isoformat() if hasattr(created_at, "isoformat") else created_at,
+        })
+    return results
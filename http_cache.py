@@ -0,0 +1,210 @@
+import os
+import gzip
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import request
+from metrics import metrics
+from workspace import manage_directory
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:  # Optional: fall back to gzip only
+    brotli = None
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "text/markdown",
+)
+MIN_COMPRESS_BYTES = 512  # Smaller bodies aren't worth the CPU or the header overhead
+MAX_STATIC_COMPRESS_BYTES = 2 * 1024 * 1024  # Static files above this are sent as-is
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Good ratio at gzip-like speed for dynamic responses
+STATIC_BROTLI_QUALITY = 11  # Static files are compressed once and cached
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", 365 * 24 * 3600))  # Versioned static URLs never change
+STATIC_CACHE_ENTRIES = 64
+
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", "./cache/pdf")
+PDF_CACHE_QUOTA_BYTES = int(os.environ.get("PDF_CACHE_QUOTA_BYTES", 200 * 1024 * 1024))  # 200 MB
+PDF_RENDER_VERSION = "pdf-3"  # Bump when the PDF layout changes so cached PDFs are rebuilt
+
+manage_directory(PDF_CACHE_DIR, quota_bytes=PDF_CACHE_QUOTA_BYTES)
+
+# Compressed static files: (path, etag, encoding) -> bytes
+_static_cache = OrderedDict()
+_static_lock = threading.Lock()
+# Static file path -> (mtime, version hash)
+_static_versions = {}
+
+
+def strong_etag(data):
+    """
+    Strong validator for a response body
+
+    Args:
+        data (bytes): Response body
+
+    Returns:
+        str: ETag value (without quotes)
+    """
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def pdf_etag(text, kind="notes"):
+    """ETag of the PDF rendered from these notes (or this transcript), known before rendering it"""
+    return strong_etag(f"{PDF_RENDER_VERSION}\n{kind}\n{text}".encode("utf-8"))
+
+
+def pdf_cache_path(etag):
+    return os.path.join(PDF_CACHE_DIR, f"{etag}.pdf")
+
+
+def store_pdf(etag, source):
+    """
+    Keep a rendered PDF so repeat downloads are served from disk
+
+    Args:
+        etag (str): From pdf_etag
+        source: Readable binary file object holding the PDF; it is copied from
+            its current position and rewound there afterwards
+
+    Returns:
+        str: Path of the cached PDF
+    """
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    path = pdf_cache_path(etag)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    start = source.tell()
+    with open(temp_path, "wb") as f:
+        shutil.copyfileobj(source, f)
+    source.seek(start)
+    os.replace(temp_path, path)
+    return path
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compress(data, encoding, static=False):
+    if encoding == "br":
+        return brotli.compress(data, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if static else GZIP_LEVEL)
+
+
+def _compress_static(path, etag, data, encoding):
+    key = (path, etag, encoding)
+    with _static_lock:
+        if key in _static_cache:
+            _static_cache.move_to_end(key)
+            return _static_cache[key]
+    compressed = _compress(data, encoding, static=True)
+    with _static_lock:
+        _static_cache[key] = compressed
+        while len(_static_cache) > STATIC_CACHE_ENTRIES:
+            _static_cache.popitem(last=False)
+    return compressed
+
+
+def static_version(app, filename):
+    """
+    Short content hash of a static file, used to version its URL
+
+    Returns:
+        str: Version string, or None if the file doesn't exist
+    """
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _static_versions.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as f:
+        version = hashlib.sha256(f.read()).hexdigest()[:12]
+    _static_versions[path] = (mtime, version)
+    return version
+
+
+def init_http_cache(app):
+    """
+    Install response compression, ETags/conditional requests and static
+    asset caching on the Flask app
+
+    Args:
+        app (Flask): The application
+    """
+
+    @app.url_defaults
+    def version_static_urls(endpoint, values):
+        # url_for('static', ...) gets ?v=<content hash>, so the file can be cached for a year
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            version = static_version(app, values["filename"])
+            if version:
+                values["v"] = version
+
+    @app.after_request
+    def compress_and_tag(response):
+        return _finalize_response(response)
+
+
+def _finalize_response(response):
+    is_static = request.endpoint == "static"
+    if is_static and request.args.get("v"):
+        response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+
+    if response.direct_passthrough:
+        # Only small static files are read into memory to be compressed
+        if not is_static or (response.content_length or 0) > MAX_STATIC_COMPRESS_BYTES:
+            return response
+        response.direct_passthrough = False
+
+    data = response.get_data()
+    response.vary.add("Accept-Encoding")
+    encoding = _choose_encoding() if len(data) >= MIN_COMPRESS_BYTES else None
+
+    # Strong ETags differ per encoding, since the bytes on the wire differ
+    etag = response.get_etag()[0] or strong_etag(data)
+    response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    if request.method in ("GET", "HEAD"):
+        response.make_conditional(request)
+        if response.status_code == 304:
+            metrics.increment("http.not_modified")
+            return response
+
+    if encoding:
+        if is_static:
+            compressed = _compress_static(request.path, etag, data, encoding)
+        else:
+            compressed = _compress(data, encoding)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        metrics.increment(f"http.compressed.{encoding}")
+        metrics.increment("http.bytes_saved", len(data) - len(compressed))
+    return response
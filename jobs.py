@@ -0,0 +1,361 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from history import db
+from metrics import metrics
+from scheduler import set_current_owner
+from deadline import current_deadline
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))  # Background claimers per web worker process
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 1.0))
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 600))  # A running job is retried after this long
+JOB_RENEW_SECONDS = JOB_LEASE_SECONDS / 3.0  # The running instance extends the lease this often
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 2))
+JOB_WAIT_TIMEOUT = int(os.environ.get("JOB_WAIT_TIMEOUT", 280))  # Below gunicorn's 300 s timeout
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))  # Finished jobs are kept this long
+SWEEP_SECONDS = 300
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+class JobTimeout(Exception):
+    """Raised when a job doesn't finish within the wait timeout"""
+
+
+class Job(db.Model):
+    """A unit of work any instance can claim"""
+
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    key = db.Column(db.String(160), nullable=False, index=True)  # Identical work shares one job
+    owner = db.Column(db.String(64))  # Session that asked first, for fair scheduling
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_by = db.Column(db.String(128))
+    lease_until = db.Column(db.DateTime(timezone=True))
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=_utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=_utcnow, onupdate=_utcnow)
+
+    __table_args__ = (
+        db.Index("ix_jobs_status_id", "status", "id"),
+        # At most one queued or running job per key, so concurrent submits can't both insert
+        db.Index(
+            "uq_jobs_active_key", "key", unique=True,
+            sqlite_where=db.text("status IN ('queued', 'running')"),
+            postgresql_where=db.text("status IN ('queued', 'running')"),
+        ),
+    )
+
+
+class JobQueue(object):
+    """
+    Database job queue shared by every instance.
+
+    Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED on Postgres, so
+    claimers on any number of instances never block on each other or take the
+    same job; adding instances adds throughput. SQLite (the local stand-in)
+    has no row locks, so the claim is also a conditional UPDATE on the status.
+    A request submits its job and tries to claim it itself, so work normally
+    runs where it was requested (with its progress reports); identical work
+    requested elsewhere waits on the same job, and jobs whose instance died
+    are retried once their lease runs out.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers = {}
+        self._workers = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.app is not None
+
+    def init_app(self, app):
+        self.app = app
+
+    def create_indexes(self):
+        """
+        Add indexes that create_all() skips on an existing jobs table (call inside an app context)
+        """
+        for index in Job.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    def register(self, kind, handler):
+        """
+        Set the function that runs jobs of this kind
+
+        Args:
+            kind (str): Job kind, e.g. "youtube"
+            handler (function): Takes the payload dict, returns a JSON-serializable result
+        """
+        self._handlers[kind] = handler
+
+    def submit(self, kind, key, payload, owner=None):
+        """
+        Queue a job, or join the queued or running job for the same key
+
+        The partial unique index on active keys settles concurrent submits: the
+        loser's insert fails and it joins the winner's job instead.
+
+        Returns:
+            int: Job ID
+        """
+        with self.app.app_context():
+            for attempt in range(3):
+                existing = Job.query.filter(Job.key == key, Job.status.in_((QUEUED, RUNNING))).order_by(Job.id).first()
+                if existing is not None:
+                    metrics.increment("jobs.joined")
+                    return existing.id
+                job = Job(kind=kind, key=key, owner=owner, payload=json.dumps(payload), status=QUEUED)
+                db.session.add(job)
+                try:
+                    db.session.commit()
+                except IntegrityError:
+                    # Another instance queued the same key in between; join it (or retry if it already finished)
+                    db.session.rollback()
+                    if attempt == 2:
+                        raise
+                    continue
+                metrics.increment("jobs.submitted")
+                return job.id
+
+    def claim(self, job_id=None):
+        """
+        Claim the oldest queued job (or a specific one) for this instance
+
+        Args:
+            job_id (int, optional): Only claim this job
+
+        Returns:
+            tuple: (job ID, kind, payload dict, owner, lease holder), or None if there was nothing to claim
+        """
+        with self.app.app_context():
+            query = Job.query.filter(Job.status == QUEUED, Job.kind.in_(list(self._handlers)))
+            if job_id is not None:
+                query = query.filter(Job.id == job_id)
+            job = query.order_by(Job.id).with_for_update(skip_locked=True).first()
+            if job is None:
+                db.session.rollback()
+                return None
+            holder = f"{self.worker_id}:{threading.get_ident()}"
+            claimed_job = (job.id, job.kind, json.loads(job.payload), job.owner, holder)
+            claimed = Job.query.filter(Job.id == job.id, Job.status == QUEUED).update({
+                Job.status: RUNNING,
+                Job.locked_by: holder,
+                Job.lease_until: _utcnow() + timedelta(seconds=JOB_LEASE_SECONDS),
+                Job.attempts: Job.attempts + 1,
+            }, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                return None
+            metrics.increment("jobs.claimed")
+            return claimed_job
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self.app.app_context():
+            Job.query.filter(Job.id == job_id).update({
+                Job.status: status,
+                Job.result: None if result is None else json.dumps(result),
+                Job.error: error,
+                Job.lease_until: None,
+            }, synchronize_session=False)
+            db.session.commit()
+        metrics.increment(f"jobs.{status}")
+
+    def renew_lease(self, job_id, holder):
+        """
+        Extend a running job's lease so requeue_expired() doesn't hand it to another instance
+
+        Returns:
+            bool: False if the job is no longer running under this holder
+        """
+        with self.app.app_context():
+            renewed = Job.query.filter(Job.id == job_id, Job.status == RUNNING, Job.locked_by == holder).update({
+                Job.lease_until: _utcnow() + timedelta(seconds=JOB_LEASE_SECONDS),
+            }, synchronize_session=False)
+            db.session.commit()
+        return bool(renewed)
+
+    def _keep_leased(self, job_id, holder, done):
+        while not done.wait(JOB_RENEW_SECONDS):
+            try:
+                if not self.renew_lease(job_id, holder):
+                    logger.warning(f"Job {job_id} lost its lease while running")
+                    return
+            except Exception as e:
+                logger.error(f"Could not renew the lease of job {job_id}: {str(e)}")
+
+    def execute(self, job_id, kind, payload, owner=None, holder=None):
+        """
+        Run a claimed job and record its result
+
+        While the handler runs, the lease is renewed every JOB_RENEW_SECONDS,
+        so a long job isn't mistaken for one whose instance died.
+
+        Returns:
+            The handler's result
+
+        Raises:
+            Exception: Whatever the handler raised, after the job is marked failed
+        """
+        started = time.time()
+        if owner:
+            set_current_owner(owner)
+        done = threading.Event()
+        if holder is not None:
+            threading.Thread(
+                target=self._keep_leased, args=(job_id, holder, done), name=f"job-lease-{job_id}", daemon=True,
+            ).start()
+        try:
+            result = self._handlers[kind](payload)
+        except Exception as e:
+            logger.error(f"Job {job_id} ({kind}) failed: {str(e)}")
+            self._finish(job_id, FAILED, error=str(e))
+            raise
+        finally:
+            done.set()
+        self._finish(job_id, DONE, result=result)
+        metrics.observe(f"jobs.{kind}.seconds", time.time() - started)
+        return result
+
+    def wait(self, job_id, timeout=JOB_WAIT_TIMEOUT):
+        """
+        Wait for a job claimed elsewhere to finish
+
+        Returns:
+            The job's result
+
+        Raises:
+            RuntimeError: If the job failed
+            JobTimeout: If it didn't finish in time
+            RequestCancelled: If the waiting request is cancelled first
+        """
+        deadline = time.time() + timeout
+        request_deadline = current_deadline()
+        while time.time() < deadline:
+            request_deadline.check("job_wait")
+            with self.app.app_context():
+                job = db.session.get(Job, job_id)
+                status, result, error = (job.status, job.result, job.error) if job else (FAILED, None, "Job vanished")
+            if status == DONE:
+                return json.loads(result) if result is not None else None
+            if status == FAILED:
+                raise RuntimeError(error or "Job failed")
+            time.sleep(JOB_POLL_SECONDS)
+        metrics.increment("jobs.wait_timeouts")
+        raise JobTimeout(f"Job {job_id} did not finish within {timeout} seconds")
+
+    def run(self, kind, key, payload, owner=None):
+        """
+        Submit a job and run it here if nobody else has it, otherwise wait for it
+
+        Returns:
+            The job's result
+        """
+        job_id = self.submit(kind, key, payload, owner=owner)
+        claimed = self.claim(job_id)
+        if claimed is not None:
+            return self.execute(*claimed)
+        return self.wait(job_id)
+
+    def requeue_expired(self):
+        """Return running jobs whose lease ran out (their instance died) to the queue"""
+        with self.app.app_context():
+            now = _utcnow()
+            expired = Job.query.filter(Job.status == RUNNING, Job.lease_until < now)
+            failed = expired.filter(Job.attempts >= JOB_MAX_ATTEMPTS).update({
+                Job.status: FAILED, Job.error: "Gave up after the job's instance stopped responding",
+                Job.lease_until: None,
+            }, synchronize_session=False)
+            requeued = Job.query.filter(Job.status == RUNNING, Job.lease_until < now).update({
+                Job.status: QUEUED, Job.locked_by: None, Job.lease_until: None,
+            }, synchronize_session=False)
+            removed = Job.query.filter(
+                Job.status.in_((DONE, FAILED)),
+                Job.updated_at < now - timedelta(seconds=JOB_RETENTION_SECONDS),
+            ).delete(synchronize_session=False)
+            db.session.commit()
+        if failed or requeued:
+            logger.warning(f"Requeued {requeued} expired jobs, gave up on {failed}")
+        if removed:
+            logger.info(f"Removed {removed} finished jobs")
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Number of jobs per status
+        """
+        with self.app.app_context():
+            rows = db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all()
+        return {status: count for status, count in rows}
+
+    def _worker_loop(self, sweep):
+        last_sweep = 0.0
+        while True:
+            try:
+                if time.time() - last_sweep > SWEEP_SECONDS:
+                    last_sweep = time.time()
+                    self.requeue_expired()
+                    if sweep is not None:
+                        sweep()
+                claimed = self.claim()
+                if claimed is None:
+                    time.sleep(JOB_POLL_SECONDS)
+                    continue
+                try:
+                    self.execute(*claimed)
+                except Exception:
+                    pass  # Logged and recorded on the job by execute()
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}")
+                time.sleep(JOB_POLL_SECONDS)
+
+    def start_workers(self, count=JOB_WORKERS, sweep=None):
+        """
+        Start background threads that claim queued jobs (call once per process)
+
+        Args:
+            count (int): Number of worker threads
+            sweep (function, optional): Also run periodically, e.g. to expire cached entries
+        """
+        with self._lock:
+            if self._workers:
+                return
+            for index in range(count):
+                worker = threading.Thread(
+                    target=self._worker_loop, args=(sweep if index == 0 else None,),
+                    name=f"job-worker-{index}", daemon=True,
+                )
+                worker.start()
+                self._workers.append(worker)
+        logger.info(f"Started {count} job workers as {self.worker_id}")
+
+
+job_queue = JobQueue()
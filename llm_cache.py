@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", "./cache/completions")
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))  # 7 days
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 200 * 1024 * 1024))  # 200 MB
+
+
+def make_cache_key(text, prompt_version, model, params):
+    """
+    Build the cache key for a completion
+
+    Args:
+        text (str): The prompt input (transcript or section), whitespace-normalized
+        prompt_version (str): Version of the prompt template, bumped on every prompt change
+        model (str): Model name
+        params (dict): Sampling parameters (temperature, top_p, max_tokens, ...)
+
+    Returns:
+        str: Hex digest identifying the completion
+    """
+    payload = json.dumps(
+        {
+            "text": " ".join(text.split()),
+            "prompt_version": prompt_version,
+            "model": model,
+            "params": params,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache(object):
+    """
+    Disk-backed cache of LLM completions with a TTL and a total size bound.
+
+    Entries are one JSON file each, so the cache is shared between gunicorn
+    workers and survives restarts. A file's mtime is refreshed on every hit and
+    the least recently used files are evicted once the size bound is exceeded.
+    """
+
+    def __init__(self, cache_dir=LLM_CACHE_DIR, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Set to a SharedCache to share completions with other instances; disk stays the first level
+        self.shared = None
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        Look up a completion
+
+        Args:
+            key (str): Cache key from make_cache_key
+
+        Returns:
+            str: The cached completion, or None on a miss or expired entry
+        """
+        completion = self._get_local(key)
+        if completion is None and self.shared is not None:
+            completion = self.shared.get(f"completion:{key}")
+            if completion is not None:
+                self._set_local(key, completion)
+        return completion
+
+    def _get_local(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if time.time() - entry.get("created", 0) > self.ttl:
+                os.remove(path)
+                return None
+            # Mark as recently used for eviction
+            os.utime(path, None)
+            return entry["completion"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set(self, key, completion):
+        """
+        Store a completion and evict old entries if the cache grew too large
+
+        Args:
+            key (str): Cache key from make_cache_key
+            completion (str): The completion text
+        """
+        self._set_local(key, completion)
+        if self.shared is not None:
+            self.shared.set(f"completion:{key}", completion, ttl=self.ttl)
+
+    def _set_local(self, key, completion):
+        path = self._path(key)
+        # Write atomically so a concurrent reader never sees a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "completion": completion}, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not persist completion {key}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            if self._approx_bytes is not None:
+                self._approx_bytes += os.path.getsize(path)
+            if self._approx_bytes is None or self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove expired entries, then the least recently used ones until under the size bound"""
+        now = time.time()
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    total -= size
+            logger.info(f"Evicted completion cache entries, size now {total} bytes")
+
+        self._approx_bytes = total
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+completion_cache = CompletionCache()
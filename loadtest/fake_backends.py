@@ -0,0 +1,202 @@
+"""
+Local stand-ins for the Groq API, the YouTube caption source and the media
+source that yt-dlp downloads from, for load testing without real upstreams.
+
+Start it, then point the app at it:
+
+    python loadtest/fake_backends.py --port 9000 --latency 0.5 --rpm 120 --error-rate 0.05
+
+    GROQ_BASE_URL=http://127.0.0.1:9000 \\
+    CAPTIONS_BACKEND_URL=http://127.0.0.1:9000 \\
+    YTDLP_BACKEND_URL=http://127.0.0.1:9000 \\
+    GROQ_API_KEY=fake gunicorn -c gunicorn.conf.py main:app
+
+Video IDs starting with "nocap" have no captions, so those requests fall
+through to the download + Whisper tier.
+"""
+import io
+import math
+import time
+import wave
+import random
+import struct
+import logging
+import argparse
+import threading
+from flask import Flask, request, jsonify, Response
+
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+# Behaviour knobs, overridden from the command line
+config = {
+    "latency": 0.5,  # Base seconds per Groq call
+    "latency_jitter": 0.2,  # Uniform +/- fraction of the base latency
+    "audio_seconds_per_mb": 0.5,  # Extra Whisper latency per MB uploaded
+    "chat_tokens_per_second": 500.0,  # Simulated generation speed
+    "rpm": 0,  # Requests per minute per endpoint before 429s (0 = unlimited)
+    "error_rate": 0.0,  # Fraction of Groq calls that get an injected 429
+    "caption_latency": 0.2,
+    "media_seconds": 120,  # Length of the generated audio served to yt-dlp
+}
+
+WORDS = (
+    "the lecture covers gradient descent loss functions regularization and "
+    "evaluation metrics with several worked examples and a short recap"
+).split()
+
+
+class RateLimiter(object):
+    """Token bucket refilled at config['rpm'] per minute"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._updated = time.time()
+
+    def allow(self):
+        rpm = config["rpm"]
+        if not rpm:
+            return True
+        with self._lock:
+            now = time.time()
+            if self._tokens is None:
+                self._tokens = float(rpm)
+            self._tokens = min(float(rpm), self._tokens + (now - self._updated) * rpm / 60.0)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+limiters = {"audio": RateLimiter(), "chat": RateLimiter()}
+
+
+def _sleep(base):
+    jitter = config["latency_jitter"]
+    time.sleep(max(0.0, base * random.uniform(1 - jitter, 1 + jitter)))
+
+
+def _rate_limited(kind):
+    if not limiters[kind].allow() or random.random() < config["error_rate"]:
+        body = jsonify({"error": {"message": "Rate limit reached (simulated)", "type": "rate_limit_error"}})
+        return body, 429, {"retry-after": "1"}
+    return None
+
+
+def _fake_text(words):
+    return " ".join(random.choice(WORDS) for _ in range(words)) + "."
+
+
+@app.route("/openai/v1/audio/transcriptions", methods=["POST"])
+def audio_transcriptions():
+    limited = _rate_limited("audio")
+    if limited:
+        return limited
+
+    upload = request.files.get("file")
+    size = len(upload.read()) if upload else 0
+    _sleep(config["latency"] + config["audio_seconds_per_mb"] * size / (1024 * 1024))
+
+    # Roughly 150 spoken words per minute of 16 kHz mono audio
+    words = max(5, int(size / (32000 * 60) * 150))
+    text = _fake_text(words)
+    if request.form.get("response_format") == "text":
+        return Response(text, mimetype="text/plain")
+    return jsonify({"text": text})
+
+
+@app.route("/openai/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    limited = _rate_limited("chat")
+    if limited:
+        return limited
+
+    body = request.get_json(force=True)
+    prompt = " ".join(message.get("content", "") for message in body.get("messages", []))
+    completion_tokens = min(int(body.get("max_tokens") or 1024), max(64, len(prompt) // 5))
+    _sleep(config["latency"] + completion_tokens / config["chat_tokens_per_second"])
+
+    content = "## Simulated notes\n\n" + "\n".join(
+        f"- {_fake_text(12)}" for _ in range(max(1, completion_tokens // 20))
+    )
+    return jsonify({
+        "id": f"chatcmpl-{random.getrandbits(48):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": completion_tokens,
+            "total_tokens": len(prompt) // 4 + completion_tokens,
+        },
+    })
+
+
+@app.route("/captions/<video_id>")
+def captions(video_id):
+    _sleep(config["caption_latency"])
+    if video_id.startswith("nocap"):
+        return jsonify({"error": "No transcript found"}), 404
+    segments = []
+    start = 0.0
+    for _ in range(int(config["media_seconds"] / 4)):
+        segments.append({"text": _fake_text(8), "start": start, "duration": 4.0})
+        start += 4.0
+    return jsonify(segments)
+
+
+_media_cache = {}
+
+
+def _sine_wav(seconds, rate=16000):
+    if seconds not in _media_cache:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(rate)
+            frames = b"".join(
+                struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / rate))) for i in range(rate)
+            )
+            for _ in range(int(seconds)):
+                wav_file.writeframes(frames)
+        _media_cache[seconds] = buffer.getvalue()
+    return _media_cache[seconds]
+
+
+@app.route("/media/<name>")
+def media(name):
+    data = _sine_wav(config["media_seconds"])
+    return Response(data, mimetype="audio/wav", headers={"Content-Length": str(len(data))})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Groq, caption and media backends")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=config["latency"], help="Base seconds per Groq call")
+    parser.add_argument("--rpm", type=int, default=config["rpm"], help="Requests per minute per endpoint (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"], help="Fraction of injected 429s")
+    parser.add_argument("--caption-latency", type=float, default=config["caption_latency"])
+    parser.add_argument("--media-seconds", type=int, default=config["media_seconds"])
+    args = parser.parse_args()
+
+    config.update(
+        latency=args.latency,
+        rpm=args.rpm,
+        error_rate=args.error_rate,
+        caption_latency=args.caption_latency,
+        media_seconds=args.media_seconds,
+    )
+    logging.basicConfig(level=logging.INFO)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Replay a realistic request mix against a running instance of the app at
+increasing concurrency and report throughput, latency percentiles and error
+rates per endpoint.
+
+    python loadtest/loadgen.py --base-url http://127.0.0.1:5000 \\
+        --concurrency 1,4,16,32 --duration 60
+
+Each virtual user keeps its own cookie session and picks its next request from
+the weighted mix. /download-pdf needs notes in the session, so a user without
+notes generates them first (and that request is counted under /generate-notes).
+Run against loadtest/fake_backends.py to measure the app itself rather than
+the real upstreams.
+"""
+import io
+import sys
+import json
+import math
+import time
+import wave
+import random
+import struct
+import argparse
+import threading
+from collections import defaultdict
+import requests
+
+
+# Default mix, as relative weights
+DEFAULT_MIX = {
+    "transcribe-audio-file": 2,
+    "transcribe-youtube": 4,
+    "generate-notes": 3,
+    "download-pdf": 1,
+}
+
+# A small pool makes repeated videos (and coalescing/caching) realistic;
+# "nocap" IDs have no captions on the fake backend
+VIDEO_IDS = ["lecture0001", "lecture0002", "lecture0003", "podcast0001", "nocap00001", "nocap00002"]
+
+
+def make_wav(seconds, rate=16000):
+    """
+    Build an in-memory 16 kHz mono WAV fixture
+
+    Args:
+        seconds (int): Duration
+        rate (int): Sample rate
+
+    Returns:
+        bytes: WAV file contents
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        one_second = b"".join(struct.pack("<h", int(6000 * math.sin(2 * math.pi * 220 * i / rate))) for i in range(rate))
+        for _ in range(seconds):
+            wav_file.writeframes(one_second)
+    return buffer.getvalue()
+
+
+def make_transcript(words):
+    vocabulary = "today we discuss caching queues latency budgets and how to measure throughput under load".split()
+    sentences = []
+    for _ in range(max(1, words // 12)):
+        sentences.append(" ".join(random.choice(vocabulary) for _ in range(12)).capitalize() + ".")
+    return " ".join(sentences)
+
+
+class Recorder(object):
+    """Thread-safe collection of (endpoint, latency, ok) samples"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, latency, status):
+        ok = 200 <= status < 400
+        with self._lock:
+            self.samples[endpoint].append((latency, ok))
+            if not ok:
+                self.errors[endpoint][status] += 1
+
+
+class VirtualUser(object):
+    def __init__(self, base_url, mix, recorder, fixtures, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.mix = mix
+        self.recorder = recorder
+        self.fixtures = fixtures
+        self.timeout = timeout
+        self.has_notes = False
+
+    def _call(self, endpoint, method="POST", **kwargs):
+        started = time.time()
+        try:
+            response = self.session.request(method, f"{self.base_url}/{endpoint}", timeout=self.timeout, **kwargs)
+            status = response.status_code
+            # Read the full body so streamed responses are timed to completion
+            _ = response.content
+        except requests.RequestException:
+            status = 599
+        self.recorder.record(endpoint, time.time() - started, status)
+        return status
+
+    def step(self):
+        endpoints = list(self.mix)
+        endpoint = random.choices(endpoints, weights=[self.mix[e] for e in endpoints])[0]
+
+        if endpoint == "transcribe-audio-file":
+            name, data = random.choice(self.fixtures["audio"])
+            self._call(endpoint, files={"audio_file": (name, data, "audio/wav")})
+        elif endpoint == "transcribe-youtube":
+            video_id = random.choice(VIDEO_IDS)
+            self._call(endpoint, json={"youtube_url": f"https://www.youtube.com/watch?v={video_id}"})
+        elif endpoint == "generate-notes":
+            self._generate_notes()
+        elif endpoint == "download-pdf":
+            if not self.has_notes:
+                self._generate_notes()
+            self._call(endpoint)
+
+    def _generate_notes(self):
+        transcript = random.choice(self.fixtures["transcripts"])
+        status = self._call("generate-notes", json={"transcript": transcript})
+        self.has_notes = self.has_notes or status == 200
+
+
+def run_step(base_url, mix, concurrency, duration, fixtures, timeout):
+    """
+    Run one concurrency level for a fixed duration
+
+    Returns:
+        tuple: (Recorder, elapsed seconds)
+    """
+    recorder = Recorder()
+    deadline = time.time() + duration
+    started = time.time()
+
+    def worker():
+        user = VirtualUser(base_url, mix, recorder, fixtures, timeout)
+        while time.time() < deadline:
+            user.step()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.time() - started
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed):
+    summary = {}
+    for endpoint, samples in sorted(recorder.samples.items()):
+        latencies = sorted(latency for latency, _ in samples)
+        failures = sum(1 for _, ok in samples if not ok)
+        summary[endpoint] = {
+            "requests": len(samples),
+            "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "error_rate": failures / len(samples) if samples else 0.0,
+            "errors_by_status": dict(recorder.errors[endpoint]),
+        }
+    return summary
+
+
+def print_table(concurrency, summary):
+    print(f"\n=== concurrency {concurrency} ===")
+    print(f"{'endpoint':<24}{'reqs':>7}{'rps':>8}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'errors':>9}")
+    for endpoint, row in summary.items():
+        print(
+            f"{endpoint:<24}{row['requests']:>7}{row['throughput_rps']:>8.2f}"
+            f"{row['p50']:>9.2f}{row['p95']:>9.2f}{row['p99']:>9.2f}{row['error_rate']:>8.1%}"
+        )
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        endpoint, weight = part.split("=")
+        mix[endpoint.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the speech-to-notes app")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=int, default=30, help="Seconds per concurrency level")
+    parser.add_argument("--mix", help="Endpoint weights, e.g. transcribe-youtube=4,generate-notes=3")
+    parser.add_argument("--timeout", type=int, default=330, help="Per-request timeout (gunicorn's is 300 s)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    fixtures = {
+        # Mostly short memos with the occasional long recording
+        "audio": [("memo.wav", make_wav(20)), ("memo2.wav", make_wav(45)), ("lecture.wav", make_wav(600))],
+        "transcripts": [make_transcript(300), make_transcript(1500), make_transcript(6000)],
+    }
+
+    results = {}
+    for level in [int(value) for value in args.concurrency.split(",")]:
+        recorder, elapsed = run_step(args.base_url, mix, level, args.duration, fixtures, args.timeout)
+        summary = summarize(recorder, elapsed)
+        results[level] = summary
+        print_table(level, summary)
+        sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
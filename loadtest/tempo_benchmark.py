@@ -0,0 +1,221 @@
+"""
+Measure what tempo compression (TEMPO_FACTOR) buys and costs: for each factor,
+the compressed audio's size and compression time, Whisper's latency on it,
+word error rate against a reference, and how far timestamps mapped back to the
+original timeline drift from those of the uncompressed audio.
+
+    GROQ_API_KEY=... python loadtest/tempo_benchmark.py --audio lecture.wav \\
+        --reference lecture.txt --factors 1.0,1.25,1.3,1.4,1.5 --repeat 3
+
+The fixture must be 16-bit PCM mono WAV, as upload conversion produces. Without
+--reference, the 1.0x transcript is the reference. Without --audio, a synthetic
+voiced fixture is used: fine for size, timing, pitch and drift numbers (and
+against loadtest/fake_backends.py via --base-url), meaningless for WER.
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import wave
+import argparse
+import tempfile
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tempo import compress_wav, restore_timestamps  # noqa: E402
+
+
+def make_voiced_wav(path, seconds, rate=16000):
+    """
+    Write a speech-like fixture: a 140 Hz harmonic voice with a wandering pitch,
+    switched on and off in syllable-length bursts
+
+    Args:
+        path (str): Where to write it
+        seconds (int): Duration
+        rate (int): Sample rate
+    """
+    rng = np.random.default_rng(7)
+    t = np.arange(seconds * rate) / float(rate)
+    pitch = 140 * (1 + 0.08 * np.sin(2 * np.pi * 0.7 * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = np.repeat(rng.random(int(seconds * 5) + 1) > 0.3, rate // 5)[:len(t)]
+    envelope = np.convolve(syllables.astype(float), np.hanning(800) / 400.0, mode="same")
+    samples = (0.25 * voice * envelope * 32767).astype("<i2")
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(samples.tobytes())
+
+
+def read_samples(path):
+    with wave.open(path, "rb") as wav_file:
+        rate = wav_file.getframerate()
+        samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2")
+    return samples.astype(np.float32) / 32768.0, rate
+
+
+def dominant_frequency(samples, rate, seconds=5.0):
+    """Strongest frequency in the loudest few seconds, to check the pitch survived"""
+    window = int(seconds * rate)
+    if len(samples) > window:
+        energy = np.convolve(samples * samples, np.ones(rate // 10), mode="valid")
+        start = min(max(0, int(np.argmax(energy)) - window // 2), len(samples) - window)
+        samples = samples[start:start + window]
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    spectrum[:int(50 * len(samples) / rate)] = 0  # Ignore rumble
+    return float(np.argmax(spectrum) * rate / len(samples))
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance over the reference length, ignoring case and punctuation"""
+    ref = re.findall(r"[\w']+", reference.lower())
+    hyp = re.findall(r"[\w']+", hypothesis.lower())
+    if not ref:
+        return float("nan")
+    previous = list(range(len(hyp) + 1))
+    for i, word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, other in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (word != other))
+        previous = current
+    return previous[-1] / float(len(ref))
+
+
+def timestamp_drift(reference_segments, segments):
+    """
+    Mean and worst distance from each segment's start to the nearest reference
+    segment start, in seconds; None if either side has no timestamps
+    """
+    starts = np.array([s["start"] for s in reference_segments if s.get("start") is not None])
+    if not len(starts) or not segments:
+        return None
+    gaps = [float(np.min(np.abs(starts - s["start"]))) for s in segments if s.get("start") is not None]
+    return {"mean": float(np.mean(gaps)), "max": float(np.max(gaps))} if gaps else None
+
+
+def transcribe(base_url, api_key, model, path, timeout):
+    """
+    One Whisper call with verbose_json, so segments carry timestamps
+
+    Returns:
+        tuple: (seconds taken, text, segments)
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    started = time.time()
+    response = requests.post(
+        f"{base_url.rstrip('/')}/openai/v1/audio/transcriptions",
+        headers={"Authorization": f"Bearer {api_key}"},
+        files={"file": (os.path.basename(path), io.BytesIO(data), "audio/wav")},
+        data={"model": model, "response_format": "verbose_json", "temperature": "0"},
+        timeout=timeout,
+    )
+    elapsed = time.time() - started
+    response.raise_for_status()
+    body = response.json()
+    return elapsed, body.get("text", ""), body.get("segments") or []
+
+
+def benchmark(audio_path, factors, base_url, api_key, model, repeat, reference, timeout, workdir):
+    original, rate = read_samples(audio_path)
+    original_pitch = dominant_frequency(original, rate)
+    results = {}
+    baseline = None
+    for factor in factors:
+        path = audio_path
+        tempo_map = None
+        compress_seconds = 0.0
+        if factor > 1.0:
+            path = os.path.join(workdir, f"tempo_{factor:g}.wav")
+            started = time.process_time()
+            tempo_map = compress_wav(audio_path, path, factor)
+            compress_seconds = time.process_time() - started
+        samples, _ = read_samples(path)
+
+        row = {
+            "audio_seconds": len(samples) / float(rate),
+            "bytes": os.path.getsize(path),
+            "compress_cpu_seconds": compress_seconds,
+            "pitch_hz": dominant_frequency(samples, rate),
+            "original_pitch_hz": original_pitch,
+        }
+        if api_key:
+            latencies = []
+            for _ in range(repeat):
+                latency, text, segments = transcribe(base_url, api_key, model, path, timeout)
+                latencies.append(latency)
+            segments = restore_timestamps(segments, tempo_map)
+            if baseline is None:
+                baseline = (text, segments)
+            row["latency_seconds"] = float(np.median(latencies))
+            row["total_seconds"] = row["latency_seconds"] + compress_seconds
+            row["wer"] = word_error_rate(reference or baseline[0], text)
+            row["drift_seconds"] = timestamp_drift(baseline[1], segments)
+        results[f"{factor:g}"] = row
+    return results
+
+
+def print_table(results):
+    base = next(iter(results.values()))
+    print(f"{'factor':>7}{'audio s':>9}{'MB':>8}{'size':>7}{'cpu s':>8}{'pitch':>8}"
+          f"{'groq s':>8}{'speedup':>9}{'WER':>7}{'drift':>8}")
+    for factor, row in results.items():
+        line = (
+            f"{factor:>7}{row['audio_seconds']:>9.1f}{row['bytes'] / 1e6:>8.2f}"
+            f"{row['bytes'] / float(base['bytes']):>7.0%}{row['compress_cpu_seconds']:>8.2f}{row['pitch_hz']:>8.0f}"
+        )
+        if "latency_seconds" in row:
+            drift = row["drift_seconds"]
+            line += (
+                f"{row['latency_seconds']:>8.2f}{base['total_seconds'] / row['total_seconds']:>8.2f}x"
+                f"{row['wer']:>7.1%}{(drift['mean'] if drift else float('nan')):>8.2f}"
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speed and accuracy of tempo-compressed transcription")
+    parser.add_argument("--audio", help="16-bit PCM mono WAV fixture (default: synthesized)")
+    parser.add_argument("--seconds", type=int, default=120, help="Length of the synthesized fixture")
+    parser.add_argument("--reference", help="File with the fixture's correct transcript")
+    parser.add_argument("--factors", default="1.0,1.25,1.3,1.4,1.5", help="Comma-separated tempo factors")
+    parser.add_argument("--base-url", default=os.environ.get("GROQ_BASE_URL", "https://api.groq.com"))
+    parser.add_argument("--model", default="whisper-large-v3-turbo")
+    parser.add_argument("--repeat", type=int, default=3, help="Whisper calls per factor; the median latency is kept")
+    parser.add_argument("--timeout", type=int, default=120)
+    parser.add_argument("--no-transcribe", action="store_true", help="Only measure the compression itself")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    factors = sorted(set([1.0] + [float(value) for value in args.factors.split(",")]))
+    api_key = None if args.no_transcribe else os.environ.get("GROQ_API_KEY")
+    if not api_key and not args.no_transcribe:
+        print("GROQ_API_KEY is not set; measuring the compression only", file=sys.stderr)
+    reference = None
+    if args.reference:
+        with open(args.reference) as f:
+            reference = f.read()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        audio_path = args.audio
+        if not audio_path:
+            audio_path = os.path.join(workdir, "fixture.wav")
+            make_voiced_wav(audio_path, args.seconds)
+        results = benchmark(
+            audio_path, factors, args.base_url, api_key, args.model, args.repeat, reference, args.timeout, workdir
+        )
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
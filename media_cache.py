@@ -0,0 +1,149 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from metrics import metrics
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+CAPTIONS_CACHE_TTL = int(os.environ.get("CAPTIONS_CACHE_TTL", 3600))
+METADATA_CACHE_TTL = int(os.environ.get("METADATA_CACHE_TTL", 1800))  # Below the life of yt-dlp's stream URLs
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 3600))
+NEGATIVE_CACHE_TTL = 300  # "No captions" and other permanent answers are remembered this long
+LOAD_WAIT_SECONDS = 60  # A caller waits this long for someone else's load of the same key
+
+
+class _Load(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache(object):
+    """
+    In-process cache of upstream lookups (captions, video metadata, page text)
+    with a TTL and an LRU size bound.
+
+    Concurrent lookups of the same key share one load, so a transcription
+    arriving while a prefetch is still fetching waits for that fetch instead of
+    starting another. Errors the remember_error predicate accepts (an upstream
+    saying there are no captions) are cached for NEGATIVE_CACHE_TTL; others
+    are not cached at all.
+    """
+
+    def __init__(self, name, ttl, max_entries=512, remember_error=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.remember_error = remember_error
+        # Set to a SharedCache to share JSON values with other instances
+        self.shared = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires at, value, error)
+        self._loads = {}
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, error, ttl):
+        self._entries[key] = (time.time() + ttl, value, error)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def peek(self, key):
+        """
+        Whether a fresh value (or remembered error) is cached for key, without loading it
+        """
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def get_or_load(self, key, loader):
+        """
+        Get the cached value for key, or load it (once, however many callers ask)
+
+        Args:
+            key (str): e.g. the video ID
+            loader (function): Takes no arguments and returns the value, or raises
+
+        Returns:
+            The value
+
+        Raises:
+            Exception: The loader's error, possibly remembered from an earlier load
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            load = self._loads.get(key) if entry is None else None
+            leader = entry is None and load is None
+            if leader:
+                load = self._loads[key] = _Load()
+
+        if entry is not None:
+            metrics.increment(f"cache.{self.name}.hits")
+            if entry[2] is not None:
+                raise entry[2]
+            return entry[1]
+
+        if not leader:
+            metrics.increment(f"cache.{self.name}.joined")
+            if not load.done.wait(LOAD_WAIT_SECONDS):
+                raise TimeoutError(f"Timed out waiting for {self.name} of {key}")
+            if load.error is not None:
+                raise load.error
+            return load.value
+
+        metrics.increment(f"cache.{self.name}.misses")
+        try:
+            value = self.shared.get(f"{self.name}:{key}") if self.shared is not None else None
+            if value is None:
+                value = loader()
+                if self.shared is not None:
+                    self.shared.set(f"{self.name}:{key}", value, ttl=self.ttl)
+            with self._lock:
+                self._store(key, value, None, self.ttl)
+            load.value = value
+            return value
+        except Exception as e:
+            if self.remember_error is not None and self.remember_error(e):
+                with self._lock:
+                    self._store(key, None, e, min(self.ttl, NEGATIVE_CACHE_TTL))
+            load.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loads.pop(key, None)
+            load.done.set()
+
+    def forget(self, key):
+        """Drop a cached value, e.g. one that turned out to be stale"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def _no_captions(error):
+    message = str(error).lower()
+    return "no transcript" in message or "disabled" in message
+
+
+# Caption segments by video ID; "no captions" is remembered so the captions tier fails fast
+caption_cache = TTLCache("captions", CAPTIONS_CACHE_TTL, remember_error=_no_captions)
+# yt-dlp metadata (extract_info without downloading) by video ID; large, so kept in-process only
+metadata_cache = TTLCache("metadata", METADATA_CACHE_TTL, max_entries=128)
+# Text of the video page, the page-context tier's input
+page_cache = TTLCache("page", PAGE_CACHE_TTL)
@@ -0,0 +1,289 @@
+import os
+import time
+import logging
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from metrics import metrics
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+MEMORY_BUDGET_MB = int(os.environ.get("MEMORY_BUDGET_MB", 1024))  # Per request; 0 disables the budget
+MEMORY_SAMPLE_INTERVAL = float(os.environ.get("MEMORY_SAMPLE_INTERVAL", 0.05))  # Seconds between RSS samples
+MEMORY_TRACEMALLOC = os.environ.get("MEMORY_TRACEMALLOC", "").lower() in ("1", "true", "yes", "on")  # Opt-in: slows allocation
+
+# Request estimate: conversion streams to disk, so what grows is the audio
+# segments read whole for upload to Whisper and the fingerprint's peaks and hashes
+REQUEST_OVERHEAD_BYTES = 64 * 1024 * 1024  # Upload buffers, HTTP clients, the transcript
+ANALYSIS_BYTES = 48 * 1024 * 1024  # Fingerprint and tempo blocks; bounded whatever the length
+PCM_BYTES_PER_SECOND = 16000 * 2  # Converted audio is 16 kHz mono 16-bit
+HELD_COPIES = 2  # A segment's bytes and the multipart body built from them
+INDEX_BYTES_PER_SECOND = 2048  # Spectral peaks and hashes, kept for the whole recording
+
+MB = 1024 * 1024
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+if MEMORY_TRACEMALLOC:
+    tracemalloc.start()
+
+_local = threading.local()
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised before processing a recording that would take a request past its memory budget"""
+
+    def __init__(self, estimate_bytes, budget_bytes):
+        super(MemoryBudgetExceeded, self).__init__(
+            f"Processing would need about {estimate_bytes // MB} MB, over the {budget_bytes // MB} MB budget"
+        )
+        self.estimate_bytes = estimate_bytes
+        self.budget_bytes = budget_bytes
+
+
+def current_rss():
+    """
+    Resident set size of this process
+
+    Returns:
+        int: Bytes
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # Not Linux: the lifetime peak is the best available figure (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if peak > 1 << 32 else peak * 1024
+
+
+class _Sampler(object):
+    """
+    Background thread sampling RSS while any stage is being measured,
+    so short-lived peaks between a stage's start and end are seen
+    """
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}  # id -> stage record
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+
+    def add(self, record):
+        with self._lock:
+            self._active[id(record)] = record
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="memory-sampler", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def remove(self, record):
+        with self._lock:
+            self._active.pop(id(record), None)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wake.wait()
+                active = list(self._active.values())
+            rss = current_rss()
+            for record in active:
+                if rss > record["rss_peak"]:
+                    record["rss_peak"] = rss
+            time.sleep(self.interval)
+
+
+_sampler = _Sampler()
+
+
+def _new_record(stage):
+    rss = current_rss()
+    return {"stage": stage, "rss_start": rss, "rss_peak": rss, "rss_end": None, "traced_peak": None}
+
+
+def measure(fn, *args, **kwargs):
+    """
+    Run fn while sampling this process's RSS; usable in pool processes too
+
+    Returns:
+        tuple: (fn's result, dict with rss_start, rss_peak and rss_end in bytes)
+    """
+    record = _new_record("measure")
+    _sampler.add(record)
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        _sampler.remove(record)
+        record["rss_end"] = current_rss()
+        record["rss_peak"] = max(record["rss_peak"], record["rss_end"])
+    return result, {key: record[key] for key in ("rss_start", "rss_peak", "rss_end")}
+
+
+class RequestMemory(object):
+    """
+    Memory used by one request, stage by stage.
+
+    RSS is per process, so with several requests in flight a stage's peak
+    includes whatever the others allocated at the same time; the figures are
+    most useful in aggregate (p95 per stage) and for the request that was
+    running when a worker was OOM-killed. tracemalloc peaks (MEMORY_TRACEMALLOC)
+    are also process-wide.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.stages = []
+        self.rss_start = current_rss()
+
+    @contextmanager
+    def stage(self, name):
+        """Measure a pipeline stage (e.g. "save", "convert", "transcribe")"""
+        record = _new_record(name)
+        if MEMORY_TRACEMALLOC:
+            tracemalloc.reset_peak()
+        _sampler.add(record)
+        try:
+            yield record
+        finally:
+            _sampler.remove(record)
+            record["rss_end"] = current_rss()
+            record["rss_peak"] = max(record["rss_peak"], record["rss_end"])
+            if MEMORY_TRACEMALLOC:
+                record["traced_peak"] = tracemalloc.get_traced_memory()[1]
+            self._add(record)
+
+    def add_external(self, name, measured):
+        """Record a stage measured in another process (see measure())"""
+        record = dict(measured, stage=name, traced_peak=None)
+        self._add(record)
+
+    def _add(self, record):
+        self.stages.append(record)
+        growth = record["rss_peak"] - record["rss_start"]
+        metrics.observe(f"memory.{self.kind}.{record['stage']}.rss_growth_mb", growth / float(MB))
+        metrics.observe(f"memory.{self.kind}.{record['stage']}.rss_peak_mb", record["rss_peak"] / float(MB))
+        if record["traced_peak"] is not None:
+            metrics.observe(f"memory.{self.kind}.{record['stage']}.traced_peak_mb", record["traced_peak"] / float(MB))
+
+    def summary(self):
+        """
+        Returns:
+            dict: Peak RSS and per-stage growth in MB
+        """
+        peak = max([record["rss_peak"] for record in self.stages] + [self.rss_start])
+        return {
+            "kind": self.kind,
+            "rss_start_mb": round(self.rss_start / float(MB), 1),
+            "rss_peak_mb": round(peak / float(MB), 1),
+            "stages": {
+                record["stage"]: {
+                    "rss_growth_mb": round((record["rss_peak"] - record["rss_start"]) / float(MB), 1),
+                    "rss_peak_mb": round(record["rss_peak"] / float(MB), 1),
+                    "traced_peak_mb": (
+                        round(record["traced_peak"] / float(MB), 1) if record["traced_peak"] is not None else None
+                    ),
+                }
+                for record in self.stages
+            },
+        }
+
+
+@contextmanager
+def track_request(kind):
+    """
+    Account for this thread's pipeline memory, stage by stage; logs a summary when done
+
+    Args:
+        kind (str): "upload", "youtube" or "pdf"
+
+    Yields:
+        RequestMemory: The request's accounting
+    """
+    tracker = RequestMemory(kind)
+    previous = getattr(_local, "tracker", None)
+    _local.tracker = tracker
+    try:
+        yield tracker
+    finally:
+        _local.tracker = previous
+        summary = tracker.summary()
+        metrics.observe(f"memory.{kind}.rss_peak_mb", summary["rss_peak_mb"])
+        metrics.set_gauge("memory.rss_mb", round(current_rss() / float(MB), 1))
+        logger.info(f"Memory for {kind} request: {summary}")
+
+
+@contextmanager
+def memory_stage(name):
+    """Measure a stage of the current request, if it is being tracked"""
+    tracker = getattr(_local, "tracker", None)
+    if tracker is None:
+        yield None
+        return
+    with tracker.stage(name) as record:
+        yield record
+
+
+def record_external_stage(name, measured):
+    """Add a stage measured in a pool process to the current request, if it is being tracked"""
+    tracker = getattr(_local, "tracker", None)
+    if tracker is not None and measured:
+        tracker.add_external(name, measured)
+
+
+def estimate_request_bytes(duration, held_seconds):
+    """
+    Memory a request processing a recording is expected to need at its peak
+
+    Args:
+        duration (float): Seconds of audio being transcribed
+        held_seconds (float): Seconds of converted audio held in memory at once
+            (the segments being uploaded to Whisper concurrently)
+
+    Returns:
+        int: Bytes
+    """
+    duration = max(0.0, duration or 0.0)
+    held = min(duration, max(0.0, held_seconds)) * PCM_BYTES_PER_SECOND * HELD_COPIES
+    return int(REQUEST_OVERHEAD_BYTES + ANALYSIS_BYTES + held + duration * INDEX_BYTES_PER_SECOND)
+
+
+def check_budget(estimate_bytes, budget_mb=None):
+    """
+    Refuse work expected to need more than the per-request budget
+
+    Args:
+        estimate_bytes (int): From estimate_request_bytes
+        budget_mb (int, optional): MEMORY_BUDGET_MB by default; 0 disables the check
+
+    Raises:
+        MemoryBudgetExceeded: If the estimate is over the budget
+    """
+    budget_mb = MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+    if budget_mb > 0 and estimate_bytes > budget_mb * MB:
+        metrics.increment("memory.rejected")
+        raise MemoryBudgetExceeded(estimate_bytes, budget_mb * MB)
+
+
+def snapshot():
+    """
+    Returns:
+        dict: Current RSS, the budget and tracemalloc totals for /metrics
+    """
+    result = {
+        "rss_mb": round(current_rss() / float(MB), 1),
+        "budget_mb": MEMORY_BUDGET_MB,
+        "tracemalloc": MEMORY_TRACEMALLOC,
+    }
+    if MEMORY_TRACEMALLOC:
+        traced, peak = tracemalloc.get_traced_memory()
+        result["traced_mb"] = round(traced / float(MB), 1)
+        result["traced_peak_mb"] = round(peak / float(MB), 1)
+    return result
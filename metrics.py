@@ -0,0 +1,82 @@
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+MAX_SAMPLES = 1000  # Recent observations kept per metric for percentiles
+MAX_EVENTS = 200  # Recent events kept per event name
+
+
+class Metrics(object):
+    """
+    Minimal in-process metrics registry: counters, gauges, observed values
+    (count/sum/percentiles over recent samples) and recent structured events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._observations = defaultdict(lambda: {"count": 0, "sum": 0.0, "samples": deque(maxlen=MAX_SAMPLES)})
+        self._events = defaultdict(lambda: deque(maxlen=MAX_EVENTS))
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            observation = self._observations[name]
+            observation["count"] += 1
+            observation["sum"] += value
+            observation["samples"].append(value)
+
+    def record_event(self, name, **fields):
+        fields["time"] = time.time()
+        with self._lock:
+            self._events[name].append(fields)
+        logger.info(f"{name}: {fields}")
+
+    def snapshot(self):
+        """
+        Get a JSON-serializable copy of all metrics
+
+        Returns:
+            dict: counters, gauges, observations and recent events
+        """
+        with self._lock:
+            observations = {}
+            for name, observation in self._observations.items():
+                samples = sorted(observation["samples"])
+                observations[name] = {
+                    "count": observation["count"],
+                    "sum": observation["sum"],
+                    "p50": _percentile(samples, 0.50),
+                    "p95": _percentile(samples, 0.95),
+                    "p99": _percentile(samples, 0.99),
+                }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "observations": observations,
+                "events": {name: list(events) for name, events in self._events.items()},
+            }
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+
+metrics = Metrics()
@@ -0,0 +1,107 @@
+import os
+import struct
+import logging
+
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+OPUS_GRANULE_RATE = 48000  # Ogg Opus granule positions always count 48 kHz samples
+TAIL_SCAN_BYTES = 65536  # The last page header is always within this many bytes of the end
+
+
+class OpusHead(object):
+    def __init__(self, channels, pre_skip, input_sample_rate):
+        self.channels = channels
+        self.pre_skip = pre_skip
+        self.input_sample_rate = input_sample_rate
+
+
+def read_opus_head(path):
+    """
+    Read the identification header of an Ogg Opus file
+
+    Args:
+        path (str): Path to the .ogg/.opus file
+
+    Returns:
+        OpusHead: Channel count, pre-skip and original sample rate
+
+    Raises:
+        ValueError: If the file isn't Ogg Opus
+    """
+    with open(path, "rb") as f:
+        packet = read_first_packet(f, 19)
+
+    if len(packet) < 19 or packet[0:8] != b"OpusHead":
+        raise ValueError("Ogg file does not contain Opus")
+    channels = packet[9]
+    pre_skip, input_sample_rate = struct.unpack("<HI", packet[10:16])
+    return OpusHead(channels, pre_skip, input_sample_rate)
+
+
+def read_first_packet(f, length):
+    """
+    Read the start of the first packet of an Ogg file (the codec identification header)
+
+    Args:
+        f: The open file, or anything file-like with read and seek
+        length (int): Bytes of the packet to read
+
+    Returns:
+        bytes: Up to length bytes of the packet
+
+    Raises:
+        ValueError: If the file isn't an Ogg file
+    """
+    f.seek(0)
+    header = f.read(27)
+    if len(header) < 27 or header[0:4] != b"OggS":
+        raise ValueError("Not an Ogg file")
+    segment_count = header[26]
+    f.seek(segment_count, os.SEEK_CUR)
+    return f.read(length)
+
+
+def last_granule_position(tail):
+    """
+    Granule position of the last Ogg page in the final bytes of a file
+
+    Args:
+        tail (bytes): The last TAIL_SCAN_BYTES (or fewer) bytes of the file
+
+    Returns:
+        int: The granule position, or None if no page header was found
+    """
+    # Skip "OggS" byte sequences that happen to occur inside packet data
+    position = tail.rfind(b"OggS")
+    while position >= 0 and (position + 27 > len(tail) or tail[position + 4] != 0):
+        position = tail.rfind(b"OggS", 0, position)
+    if position < 0:
+        return None
+    granule = struct.unpack("<q", tail[position + 6:position + 14])[0]
+    return granule if granule >= 0 else None
+
+
+def ogg_opus_duration(path):
+    """
+    Duration of an Ogg Opus file from the granule position of its last page
+
+    Returns:
+        float: Duration in seconds, or None if it can't be determined
+    """
+    try:
+        head = read_opus_head(path)
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            f.seek(max(0, size - TAIL_SCAN_BYTES))
+            tail = f.read()
+    except (OSError, ValueError) as e:
+        logger.debug(f"Could not read Ogg Opus duration of {path}: {str(e)}")
+        return None
+
+    granule = last_granule_position(tail)
+    if granule is None:
+        return None
+    return max(0, granule - head.pre_skip) / float(OPUS_GRANULE_RATE)
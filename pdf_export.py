@@ -0,0 +1,509 @@
+import io
+import os
+import re
+import time
+import zlib
+import logging
+import tempfile
+from collections import deque
+from xml.sax.saxutils import escape
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import Paragraph, Spacer, Frame, LayoutError
+from metrics import metrics
+from deadline import current_deadline
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+PDF_SPOOL_BYTES = int(os.environ.get("PDF_SPOOL_BYTES", 4 * 1024 * 1024))  # Larger PDFs spill from memory to a temp file
+PDF_CHUNK_BYTES = 64 * 1024  # Size of each chunk of a streamed PDF
+TEXT_CHUNK_CHARS = 16 * 1024  # Text is read this much at a time
+TRANSCRIPT_PARAGRAPH_CHARS = 1200  # Raw transcripts are broken into paragraphs at a sentence end past this length
+PAGE_MARGIN = 72
+
+BLANK_LINE = re.compile(r"\n[ \t]*\n")
+# Markdown emphasis; only a marker with a partner becomes a tag, and italics
+# never cross a tag, so the markup Paragraph gets is always balanced
+BOLD = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__")
+ITALIC = re.compile(r"(?<![\w*])\*(?=\S)([^<>]+?)(?<=\S)\*(?![\w*])|(?<![\w_])_(?=\S)([^<>]+?)(?<=\S)_(?![\w_])")
+
+NOTES = "notes"
+TRANSCRIPT = "transcript"
+
+
+def _build_styles():
+    styles = getSampleStyleSheet()
+    normal_style = ParagraphStyle(
+        'Normal',
+        parent=styles['Normal'],
+        fontSize=10,
+        leading=14,
+        spaceBefore=6,
+        spaceAfter=6,
+        allowWidows=0
+    )
+    return {
+        'title': ParagraphStyle(
+            'Title',
+            parent=styles['Heading1'],
+            fontSize=18,
+            spaceAfter=16,
+            textColor=colors.HexColor('#2c3e50'),
+            alignment=1  # Center alignment
+        ),
+        'h1': ParagraphStyle(
+            'Heading1',
+            parent=styles['Heading1'],
+            fontSize=16,
+            spaceBefore=16,
+            spaceAfter=8,
+            textColor=colors.HexColor('#3498db'),
+            borderWidth=0,
+            borderColor=colors.HexColor('#3498db'),
+            borderPadding=5,
+            borderRadius=None,
+            allowWidows=0
+        ),
+        'h2': ParagraphStyle(
+            'Heading2',
+            parent=styles['Heading2'],
+            fontSize=14,
+            spaceBefore=12,
+            spaceAfter=6,
+            textColor=colors.HexColor('#2980b9'),
+            allowWidows=0
+        ),
+        'h3': ParagraphStyle(
+            'Heading3',
+            parent=styles['Heading3'],
+            fontSize=12,
+            spaceBefore=10,
+            spaceAfter=4,
+            textColor=colors.HexColor('#0d6efd'),
+            allowWidows=0
+        ),
+        'normal': normal_style,
+        'bullet': ParagraphStyle(
+            'Bullet',
+            parent=normal_style,
+            leftIndent=20,
+            firstLineIndent=-15,
+            spaceBefore=4,
+            spaceAfter=4
+        ),
+        'blockquote': ParagraphStyle(
+            'Blockquote',
+            parent=normal_style,
+            leftIndent=30,
+            rightIndent=30,
+            fontStyle='italic',
+            textColor=colors.HexColor('#6c757d'),
+            spaceBefore=8,
+            spaceAfter=8,
+            borderWidth=1,
+            borderColor=colors.HexColor('#dee2e6'),
+            borderPadding=8,
+            borderRadius=6
+        ),
+    }
+
+
+STYLES = _build_styles()
+
+
+def iter_text(text, chunk_chars=TEXT_CHUNK_CHARS):
+    """
+    Yield a string in slices, so it can be fed to the paragraph iterators
+    like any other text stream
+
+    Args:
+        text (str): The text
+        chunk_chars (int): Characters per slice
+
+    Yields:
+        str: Consecutive slices of text
+    """
+    for start in range(0, len(text), chunk_chars):
+        yield text[start:start + chunk_chars]
+
+
+def iter_lines(chunks):
+    """
+    Split a stream of text into lines without holding more than one chunk and
+    one line at a time
+
+    Args:
+        chunks (iterable): Strings, e.g. from iter_text
+
+    Yields:
+        str: Lines, without their newlines
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def _paragraph_break(text):
+    """Index just after the first sentence end at or beyond TRANSCRIPT_PARAGRAPH_CHARS, or -1"""
+    best = -1
+    for mark in (". ", "? ", "! "):
+        index = text.find(mark, TRANSCRIPT_PARAGRAPH_CHARS)
+        if index >= 0 and (best < 0 or index < best):
+            best = index
+    return best + 1 if best >= 0 else -1
+
+
+def iter_transcript_paragraphs(chunks):
+    """
+    Break a transcript stream into paragraphs: at blank lines where it has
+    them, otherwise at the first sentence end past TRANSCRIPT_PARAGRAPH_CHARS
+    (Whisper output is one long line)
+
+    Args:
+        chunks (iterable): Strings, e.g. from iter_text
+
+    Yields:
+        str: Paragraphs, with whitespace collapsed
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        while True:
+            cut = _paragraph_break(pending)
+            if cut < 0 and len(pending) >= 4 * TRANSCRIPT_PARAGRAPH_CHARS:
+                # No sentence ends; don't let a runaway paragraph grow without bound
+                cut = pending.rfind(" ", 0, 2 * TRANSCRIPT_PARAGRAPH_CHARS) + 1 or 2 * TRANSCRIPT_PARAGRAPH_CHARS
+            blank = BLANK_LINE.search(pending)
+            if blank is not None and (cut < 0 or blank.start() < cut):
+                paragraph, pending = pending[:blank.start()], pending[blank.end():]
+            elif cut >= 0:
+                paragraph, pending = pending[:cut], pending[cut:]
+            else:
+                break
+            paragraph = " ".join(paragraph.split())
+            if paragraph:
+                yield paragraph
+    paragraph = " ".join(pending.split())
+    if paragraph:
+        yield paragraph
+
+
+def _inline_markup(line):
+    """
+    Paragraph markup for a line of notes: the text escaped, then paired ** / __
+    made bold and * / _ italic. A lone marker ("5 * 3 = 15", snake_case) stays
+    as it is.
+    """
+    markup = escape(line)
+    markup = BOLD.sub(lambda match: f"<b>{match.group(1) or match.group(2)}</b>", markup)
+    return ITALIC.sub(lambda match: f"<i>{match.group(1) or match.group(2)}</i>", markup)
+
+
+def notes_flowables(chunks):
+    """
+    Lay out markdown notes, one flowable at a time
+
+    Args:
+        chunks (iterable): The notes' text, e.g. from iter_text
+
+    Yields:
+        Flowable: Title, headings, quotes, list items and paragraphs in order
+    """
+    yield Paragraph("Structured Notes", STYLES['title'])
+    yield Spacer(1, 20)
+
+    for line in iter_lines(chunks):
+        line = line.strip()
+
+        # Skip empty lines
+        if not line:
+            continue
+
+        # Process headings
+        if line.startswith('# '):
+            yield Paragraph(_inline_markup(line[2:]), STYLES['h1'])
+        elif line.startswith('## '):
+            yield Paragraph(_inline_markup(line[3:]), STYLES['h2'])
+        elif line.startswith('### '):
+            yield Paragraph(_inline_markup(line[4:]), STYLES['h3'])
+
+        # Process blockquotes
+        elif line.startswith('> '):
+            yield Paragraph(_inline_markup(line[2:]), STYLES['blockquote'])
+
+        # Process bullet points
+        elif line.startswith('- ') or line.startswith('* '):
+            yield Paragraph(f"• {_inline_markup(line[2:])}", STYLES['bullet'])
+
+        # Process numbered lists
+        elif line[0].isdigit() and '. ' in line:
+            num, text = line.split('. ', 1)
+            yield Paragraph(f"{escape(num)}. {_inline_markup(text)}", STYLES['bullet'])
+
+        # Process regular paragraphs
+        else:
+            yield Paragraph(_inline_markup(line), STYLES['normal'])
+
+
+def transcript_flowables(chunks):
+    """
+    Lay out a raw transcript, one paragraph at a time
+
+    Args:
+        chunks (iterable): The transcript's text, e.g. from iter_text
+
+    Yields:
+        Flowable: Title and paragraphs in order
+    """
+    yield Paragraph("Transcript", STYLES['title'])
+    yield Spacer(1, 20)
+    for paragraph in iter_transcript_paragraphs(chunks):
+        # Transcripts are plain text; "<" or "&" must not be read as markup
+        yield Paragraph(escape(paragraph), STYLES['normal'])
+
+
+class PDFPageWriter(object):
+    """
+    Writes a PDF a page at a time. Each page's content stream is compressed and
+    written as soon as the page is finished; the fonts, page tree and
+    cross-reference table, which depend on every page, follow at the end
+    (PDF allows the forward references). Only object offsets are kept, so
+    memory doesn't grow with the document.
+    """
+
+    CATALOG, PAGES, RESOURCES, INFO = 1, 2, 3, 4
+
+    def __init__(self, output, title):
+        self.output = output
+        self.title = title
+        self.position = 0
+        self.offsets = {}
+        self.page_ids = []
+        self._next_id = self.INFO + 1
+        # The binary comment marks the file as binary for transfer tools
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.output.write(data)
+        self.position += len(data)
+
+    def _allocate(self):
+        number = self._next_id
+        self._next_id += 1
+        return number
+
+    def _object(self, number, body):
+        self.offsets[number] = self.position
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+    def add_page(self, stream, pagesize):
+        """
+        Args:
+            stream (bytes): The page's content stream, uncompressed
+            pagesize (tuple): Width and height in points
+        """
+        content = zlib.compress(stream)
+        contents_id = self._allocate()
+        self._object(
+            contents_id,
+            b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(content), content)
+        )
+        page_id = self._allocate()
+        self._object(page_id, (
+            f"<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {pagesize[0]:g} {pagesize[1]:g}] "
+            f"/Contents {contents_id} 0 R /Resources {self.RESOURCES} 0 R >>"
+        ).encode("ascii"))
+        self.page_ids.append(page_id)
+
+    def close(self, fonts):
+        """
+        Write everything that refers to all the pages, and the trailer
+
+        Args:
+            fonts (dict): Font dictionaries (bytes) by the internal names the
+                pages use, e.g. "F1"
+        """
+        font_refs = []
+        for name, body in sorted(fonts.items()):
+            font_id = self._allocate()
+            self._object(font_id, body)
+            font_refs.append(f"/{name} {font_id} 0 R")
+        self._object(self.RESOURCES, (
+            f"<< /Font << {' '.join(font_refs)} >> /ProcSet [/PDF /Text] >>"
+        ).encode("ascii"))
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._object(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode("ascii"))
+        title = self.title.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        self._object(self.INFO, f"<< /Title ({title}) /Producer (Speechscribe) >>".encode("latin-1", "replace"))
+        self._object(self.CATALOG, f"<< /Type /Catalog /Pages {self.PAGES} 0 R >>".encode("ascii"))
+
+        xref_at = self.position
+        count = self._next_id
+        entries = [b"0000000000 65535 f \n"] + [b"%010d 00000 n \n" % self.offsets[n] for n in range(1, count)]
+        self._write(b"xref\n0 %d\n%s" % (count, b"".join(entries)))
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+            count, self.CATALOG, self.INFO, xref_at
+        ))
+
+
+class _PageStreamCanvas(canvas.Canvas):
+    """
+    A canvas that hands each finished page to a PDFPageWriter instead of
+    keeping every page until save(), as reportlab's Canvas does
+    """
+
+    def __init__(self, writer, pagesize):
+        canvas.Canvas.__init__(self, io.BytesIO(), pagesize=pagesize)
+        self._writer = writer
+
+    def showPage(self):
+        code = self._psCommandsBeforePage + [self._preamble] + self._code + [" "] + self._psCommandsAfterPage
+        self._writer.add_page(("\n".join(code) + "\n").encode("utf-8"), self._pagesize)
+        self._startPage()
+
+    def fonts(self):
+        """Dictionaries of the fonts the pages have used, by internal name"""
+        return {
+            internal[1:]: self._doc.idToObject[internal[1:]].format(self._doc)
+            for internal in self._doc.fontMapping.values()
+        }
+
+
+def _new_frame(pagesize):
+    width, height = pagesize
+    return Frame(PAGE_MARGIN, PAGE_MARGIN, width - 2 * PAGE_MARGIN, height - 2 * PAGE_MARGIN)
+
+
+def render_pages(flowables, output, title, pagesize=letter):
+    """
+    Lay flowables out onto pages as they are produced, writing each page to
+    output as soon as it is full
+
+    Unlike SimpleDocTemplate.build, which takes the whole list of flowables
+    and formats the whole document when it saves, this pulls flowables from an
+    iterator and lets go of each page once it is written. A flowable that
+    doesn't fit is split across pages.
+
+    Args:
+        flowables (iterable): e.g. from notes_flowables or transcript_flowables
+        output: Writable binary file object
+        title (str): Document title
+        pagesize (tuple): Page size in points
+
+    Yields:
+        int: The number of pages written so far, after each page
+
+    Raises:
+        RequestCancelled: If the request's deadline passes mid-render
+        LayoutError: If a flowable doesn't fit even on an empty page
+    """
+    deadline = current_deadline()
+    writer = PDFPageWriter(output, title)
+    pdf = _PageStreamCanvas(writer, pagesize)
+    frame = _new_frame(pagesize)
+    source = iter(flowables)
+    pending = deque()  # Remainders of split flowables, placed before anything new
+    page_used = False
+
+    while True:
+        flowable = pending.popleft() if pending else next(source, None)
+        if flowable is None:
+            break
+        if frame.add(flowable, pdf):
+            page_used = True
+            continue
+
+        parts = frame.split(flowable, pdf)
+        if parts and frame.add(parts[0], pdf):
+            pending.extendleft(reversed(parts[1:]))
+        elif page_used:
+            pending.appendleft(flowable)
+        else:
+            # An empty frame that can't take it or a piece of it never will; leaving
+            # it out would quietly lose part of the document
+            raise LayoutError(f"A {type(flowable).__name__} doesn't fit on an empty page")
+
+        # The page is full
+        deadline.check("pdf")
+        pdf.showPage()
+        frame = _new_frame(pagesize)
+        page_used = False
+        yield len(writer.page_ids)
+
+    pdf.showPage()
+    writer.close(pdf.fonts())
+    yield len(writer.page_ids)
+
+
+def stream_pdf(text, kind=NOTES, on_complete=None, chunk_bytes=PDF_CHUNK_BYTES):
+    """
+    Render notes or a transcript to PDF, yielding its bytes as pages are
+    finished (the first page as soon as it is ready, then in chunks)
+
+    The PDF is also written to a spooled temporary file, in memory up to
+    PDF_SPOOL_BYTES and on disk beyond that, so it can be kept once complete.
+
+    Args:
+        text (str): Markdown notes or a raw transcript
+        kind (str): NOTES or TRANSCRIPT
+        on_complete (function, optional): Called with the spooled file,
+            positioned at its start, once the whole PDF has been rendered
+            (e.g. to cache it); not called if rendering stops early
+        chunk_bytes (int): Bytes to gather before yielding after the first page
+
+    Yields:
+        bytes: The PDF, in order
+
+    Raises:
+        RequestCancelled: If the request's deadline passes mid-render
+        LayoutError: If part of the text can't be laid out on a page
+    """
+    if kind == TRANSCRIPT:
+        flowables, title = transcript_flowables(iter_text(text)), "Transcript"
+    else:
+        flowables, title = notes_flowables(iter_text(text)), "Structured Notes"
+
+    started = time.time()
+    spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES, suffix=".pdf")
+    sent = 0
+    pages = 0
+    try:
+        for pages in render_pages(flowables, spool, title):
+            if sent and spool.tell() - sent < chunk_bytes:
+                continue
+            if not sent:
+                metrics.observe("pdf.first_byte_seconds", time.time() - started)
+            spool.seek(sent)
+            chunk = spool.read()
+            spool.seek(0, os.SEEK_END)
+            sent += len(chunk)
+            yield chunk
+
+        size = spool.tell()
+        if size > sent:
+            spool.seek(sent)
+            yield spool.read()
+        metrics.increment(f"pdf.rendered.{kind}")
+        metrics.observe("pdf.pages", pages)
+        metrics.observe("pdf.bytes", size)
+        logger.info(f"Rendered {kind} PDF: {pages} pages, {size} bytes in {time.time() - started:.1f}s")
+
+        if on_complete is not None:
+            spool.seek(0)
+            on_complete(spool)
+    finally:
+        spool.close()
@@ -0,0 +1,110 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+from youtube import extract_video_id, fetch_transcript_segments
+from download import video_info
+from call_llm import fetch_page_context
+from media_cache import caption_cache, metadata_cache, page_cache
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+PREFETCH = os.environ.get("PREFETCH", "1").lower() in ("1", "true", "yes", "on")
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", 4))
+PREFETCH_MAX_PENDING = int(os.environ.get("PREFETCH_MAX_PENDING", 32))  # Lookups queued or running; more are dropped
+
+CAPTIONS = "captions"
+METADATA = "metadata"
+PAGE = "page"
+
+
+class Prefetcher(object):
+    """
+    Warm the caption, metadata and page caches for a YouTube video while the
+    user is still looking at the form, so /transcribe-youtube finds them ready.
+
+    Captions and metadata are fetched concurrently; the page (only the
+    page-context tier's input) is fetched when the video turns out to have no
+    captions. Each lookup runs at most once per video at a time, and a
+    transcription that arrives mid-lookup joins it through the cache. Work
+    beyond PREFETCH_MAX_PENDING is dropped rather than queued: it's only a
+    head start.
+    """
+
+    def __init__(self, enabled=PREFETCH, workers=PREFETCH_WORKERS, max_pending=PREFETCH_MAX_PENDING):
+        self.enabled = enabled
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = set()  # (kind, video ID)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    def prefetch(self, youtube_url, skip=()):
+        """
+        Start warming the caches for a video in the background
+
+        Args:
+            youtube_url (str): A validated YouTube URL
+            skip (iterable): Kinds not to fetch (CAPTIONS, METADATA, PAGE), e.g.
+                because that tier's circuit is open
+
+        Returns:
+            list: The kinds that were queued
+        """
+        video_id = extract_video_id(youtube_url)
+        if not self.enabled or not video_id:
+            return []
+
+        queued = []
+        for kind, cache in ((CAPTIONS, caption_cache), (METADATA, metadata_cache)):
+            if kind in skip:
+                continue
+            if cache.peek(video_id):
+                metrics.increment(f"prefetch.{kind}.cached")
+                continue
+            if self._submit(kind, video_id, youtube_url, PAGE not in skip):
+                queued.append(kind)
+        return queued
+
+    def _submit(self, kind, video_id, youtube_url, page_fallback=False):
+        with self._lock:
+            if (kind, video_id) in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                metrics.increment("prefetch.dropped")
+                return False
+            self._pending.add((kind, video_id))
+        metrics.increment(f"prefetch.{kind}.queued")
+        self._executor.submit(self._run, kind, video_id, youtube_url, page_fallback)
+        return True
+
+    def _run(self, kind, video_id, youtube_url, page_fallback):
+        started = time.time()
+        try:
+            if kind == CAPTIONS:
+                fetch_transcript_segments(video_id)
+            elif kind == METADATA:
+                video_info(youtube_url)
+            else:
+                fetch_page_context(youtube_url)
+            metrics.increment(f"prefetch.{kind}.completed")
+            metrics.observe(f"prefetch.{kind}.seconds", time.time() - started)
+        except Exception as e:
+            metrics.increment(f"prefetch.{kind}.failed")
+            logger.info(f"Prefetch of {kind} for {video_id} failed: {str(e)}")
+            # Without captions the page-context tier may be needed
+            if kind == CAPTIONS and page_fallback and not page_cache.peek(video_id):
+                self._submit(PAGE, video_id, youtube_url)
+        finally:
+            with self._lock:
+                self._pending.discard((kind, video_id))
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,527 @@
+import os
+import struct
+import logging
+from wavstream import parse_wav_header
+from oggopus import read_first_packet, last_granule_position, OPUS_GRANULE_RATE, TAIL_SCAN_BYTES
+from conversion import FFMPEG_AVAILABLE
+from timerange import range_duration
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+MAX_MEDIA_SECONDS = int(os.environ.get("MAX_MEDIA_SECONDS", 4 * 3600))  # Longer recordings (or ranges) are rejected up front
+
+# Bytes of an upload the probe reads: the client sends this much of the start
+# and, for formats whose duration is at the end (Ogg, some MP4), of the end
+PROBE_HEAD_BYTES = 65536
+PROBE_TAIL_BYTES = TAIL_SCAN_BYTES
+
+# Rough throughput figures for the processing-time estimate
+TRANSCRIBE_SPEED = float(os.environ.get("PROBE_TRANSCRIBE_SPEED", 60))  # Seconds of audio transcribed per second
+CONVERT_SPEED = float(os.environ.get("PROBE_CONVERT_SPEED", 200))  # Seconds of audio converted per second
+DOWNLOAD_BYTES_PER_SECOND = float(os.environ.get("PROBE_DOWNLOAD_BYTES_PER_SECOND", 2 * 1024 * 1024))
+CAPTIONS_SECONDS = 2.0  # Fetching and cleaning captions
+REQUEST_OVERHEAD_SECONDS = 2.0  # Saving the upload, API round trips, storing the transcript
+
+FALLBACK_BITRATE = 128000  # Assumed when only the size is known (YouTube audio is converted to 128 kbps MP3)
+TRANSCODED_BYTES_PER_SECOND = 16000 * 2  # Uploads are converted to 16 kHz mono 16-bit PCM
+DOWNLOAD_MP3_BYTES_PER_SECOND = FALLBACK_BITRATE // 8
+
+# MPEG audio layer III tables
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2 and 2.5
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+MP3_SCAN_BYTES = 4096  # Enough for the first two frames at any bitrate, and the Xing/VBRI header
+
+_MP4_AUDIO_CODECS = {b"mp4a": "aac", b"alac": "alac", b"Opus": "opus", b"fLaC": "flac", b".mp3": "mp3", b"ac-3": "ac3"}
+
+
+class PartialFile(object):
+    """
+    The first and last bytes of a file, read as if they were the whole file.
+    Reading anything in between raises ValueError, which the probe treats as
+    "this detail isn't in the probed bytes".
+    """
+
+    def __init__(self, head, size, tail=b""):
+        self.head = head
+        self.tail = tail or b""
+        self.size = size
+        self.tail_start = size - len(self.tail)
+        self.position = 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, length=-1):
+        start = min(self.position, self.size)
+        end = self.size if length is None or length < 0 else min(self.size, start + length)
+        if end <= len(self.head):
+            data = self.head[start:end]
+        elif self.tail and start >= self.tail_start:
+            data = self.tail[start - self.tail_start:end - self.tail_start]
+        elif self.tail and self.tail_start <= len(self.head):
+            # Head and tail overlap, so together they are the whole file
+            data = (self.head[:self.tail_start] + self.tail)[start:end]
+        elif start == end:
+            data = b""
+        else:
+            raise ValueError("The header extends past the probed bytes")
+        self.position = end
+        return data
+
+
+def _media(container, codec=None, duration=None, sample_rate=None, channels=None, bitrate=None, prenormalized=False):
+    return {
+        "container": container,
+        "codec": codec,
+        "duration": duration,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "bitrate": bitrate,
+        "prenormalized": prenormalized,
+    }
+
+
+def _probe_wav(f, size):
+    fmt = parse_wav_header(f, size)
+    codec = f"pcm_{'f' if fmt.audio_format == 3 else 's'}{fmt.bits_per_sample}le"
+    return _media(
+        "wav", codec, fmt.duration, fmt.sample_rate, fmt.channels,
+        fmt.sample_rate * fmt.block_align * 8, fmt.is_normalized(),
+    )
+
+
+def _ogg_duration(f, size, rate, pre_skip=0):
+    f.seek(max(0, size - TAIL_SCAN_BYTES))
+    granule = last_granule_position(f.read())
+    if granule is None:
+        return None
+    return max(0, granule - pre_skip) / float(rate)
+
+
+def _probe_ogg(f, size):
+    packet = read_first_packet(f, 28)
+    if packet[0:8] == b"OpusHead" and len(packet) >= 19:
+        channels = packet[9]
+        pre_skip, input_sample_rate = struct.unpack("<HI", packet[10:16])
+        media = _media(
+            "ogg", "opus", None, input_sample_rate or None, channels,
+            prenormalized=channels == 1 and 0 < input_sample_rate <= 16000,
+        )
+        rate, skip = OPUS_GRANULE_RATE, pre_skip
+    elif packet[0:7] == b"\x01vorbis" and len(packet) >= 28:
+        channels = packet[11]
+        sample_rate, _, nominal_bitrate = struct.unpack("<Iii", packet[12:24])
+        media = _media("ogg", "vorbis", None, sample_rate, channels, nominal_bitrate if nominal_bitrate > 0 else None)
+        rate, skip = sample_rate, 0
+    else:
+        return _media("ogg")
+    try:
+        media["duration"] = _ogg_duration(f, size, rate, skip)
+    except ValueError:
+        pass  # The client didn't send the end of the file
+    return media
+
+
+def _probe_flac(f, size):
+    f.seek(4)
+    block = f.read(4 + 34)
+    if len(block) < 38 or block[0] & 0x7F != 0:
+        raise ValueError("FLAC file doesn't start with STREAMINFO")
+    fields = int.from_bytes(block[14:22], "big")
+    sample_rate = fields >> 44
+    channels = ((fields >> 41) & 0x7) + 1
+    total_samples = fields & ((1 << 36) - 1)
+    duration = total_samples / float(sample_rate) if sample_rate and total_samples else None
+    return _media("flac", "flac", duration, sample_rate or None, channels, int(size * 8 / duration) if duration else None)
+
+
+def _mp3_frame(header):
+    """Parse a layer III frame header; returns (version, sample rate, bitrate, channels, frame length) or None"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x3  # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5
+    layer = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    channels = 1 if header[3] >> 6 == 3 else 2
+    padding = (header[2] >> 1) & 0x1
+    frame_length = (144 if version == 3 else 72) * bitrate // sample_rate + padding
+    return version, sample_rate, bitrate, channels, frame_length
+
+
+def _probe_mp3(f, size):
+    f.seek(0)
+    start = 0
+    id3 = f.read(10)
+    if id3[0:3] == b"ID3" and len(id3) == 10:
+        # Tag size is a 28-bit "syncsafe" integer; a footer adds another 10 bytes
+        start = 10 + ((id3[6] << 21) | (id3[7] << 14) | (id3[8] << 7) | id3[9]) + (10 if id3[5] & 0x10 else 0)
+    f.seek(start)
+    data = f.read(MP3_SCAN_BYTES)
+
+    # The first frame whose successor is also where its length says it is
+    for offset in range(max(0, len(data) - 4)):
+        frame = _mp3_frame(data[offset:offset + 4])
+        if frame is None:
+            continue
+        following = offset + frame[4]
+        if following + 4 <= len(data) and _mp3_frame(data[following:following + 4]) is None:
+            continue
+        break
+    else:
+        raise ValueError("No MPEG audio frame found")
+
+    version, sample_rate, bitrate, channels, _ = frame
+    samples_per_frame = 1152 if version == 3 else 576
+    audio_start = start + offset
+    duration = None
+
+    # VBR files carry their frame count in a Xing/Info or VBRI header in the first frame
+    side_info = (17 if channels == 1 else 32) if version == 3 else (9 if channels == 1 else 17)
+    xing = data[offset + 4 + side_info:offset + 4 + side_info + 12]
+    vbri = data[offset + 36:offset + 36 + 18]
+    if xing[0:4] in (b"Xing", b"Info") and len(xing) == 12 and struct.unpack(">I", xing[4:8])[0] & 0x1:
+        duration = struct.unpack(">I", xing[8:12])[0] * samples_per_frame / float(sample_rate)
+    elif vbri[0:4] == b"VBRI" and len(vbri) == 18:
+        duration = struct.unpack(">I", vbri[14:18])[0] * samples_per_frame / float(sample_rate)
+    if duration:
+        bitrate = int((size - audio_start) * 8 / duration)
+    else:
+        duration = (size - audio_start) * 8.0 / bitrate
+    return _media("mp3", "mp3", duration, sample_rate, channels, bitrate)
+
+
+def _mp4_boxes(f, start, end):
+    """Yield (type, body start, box end) for the boxes between start and end"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            raise ValueError("Corrupt MP4 box")
+        yield kind, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def _mp4_child(f, start, end, kind):
+    for child, body, child_end in _mp4_boxes(f, start, end):
+        if child == kind:
+            return body, child_end
+    return None
+
+
+def _probe_mp4(f, size):
+    media = _media("mp4")
+    moov = _mp4_child(f, 0, size, b"moov")
+    if moov is None:
+        return media
+
+    mvhd = _mp4_child(f, moov[0], moov[1], b"mvhd")
+    if mvhd is not None:
+        f.seek(mvhd[0])
+        version = f.read(4)[0]
+        if version == 1:
+            f.seek(16, os.SEEK_CUR)
+            timescale, duration = struct.unpack(">IQ", f.read(12))
+        else:
+            f.seek(8, os.SEEK_CUR)
+            timescale, duration = struct.unpack(">II", f.read(8))
+        if timescale:
+            media["duration"] = duration / float(timescale)
+            media["bitrate"] = int(size * 8 / media["duration"]) if duration else None
+
+    # The first audio track's sample description names the codec
+    for kind, body, end in _mp4_boxes(f, moov[0], moov[1]):
+        if kind != b"trak":
+            continue
+        stsd = None
+        box = (body, end)
+        for child in (b"mdia", b"minf", b"stbl", b"stsd"):
+            box = _mp4_child(f, box[0], box[1], child)
+            if box is None:
+                break
+        else:
+            stsd = box
+        if stsd is None:
+            continue
+        f.seek(stsd[0] + 8)
+        entry = f.read(36)
+        codec = _MP4_AUDIO_CODECS.get(entry[4:8])
+        if codec is None:
+            continue
+        media["codec"] = codec
+        channels, _, _, _, rate = struct.unpack(">HHHHI", entry[24:36])
+        media["channels"] = channels or None
+        media["sample_rate"] = (rate >> 16) or None
+        break
+    return media
+
+
+def probe_file(f, size):
+    """
+    Identify an audio file from its header and read its duration and format
+    without decoding anything (a few KB at the start, and the end of Ogg files)
+
+    Args:
+        f: The open file, or a PartialFile of the bytes a client sent
+        size (int): Size of the whole file in bytes
+
+    Returns:
+        dict: container, codec, duration (seconds, None if unknown), sample_rate,
+            channels, bitrate and prenormalized (16 kHz mono that needs no conversion)
+
+    Raises:
+        ValueError: If it isn't an audio format the app accepts
+    """
+    f.seek(0)
+    magic = f.read(12)
+    if magic[0:4] == b"RIFF" and magic[8:12] == b"WAVE":
+        container, parse = "wav", _probe_wav
+    elif magic[0:4] == b"OggS":
+        container, parse = "ogg", _probe_ogg
+    elif magic[0:4] == b"fLaC":
+        container, parse = "flac", _probe_flac
+    elif magic[4:8] == b"ftyp":
+        container, parse = "mp4", _probe_mp4
+    elif magic[0:3] == b"ID3" or _mp3_frame(magic[0:4]) is not None:
+        container, parse = "mp3", _probe_mp3
+    else:
+        # MP3 files sometimes start with padding or junk before the first frame
+        try:
+            return _probe_mp3(f, size)
+        except (ValueError, struct.error, IndexError):
+            raise ValueError("Not a recognized audio file")
+
+    try:
+        return parse(f, size)
+    except (ValueError, struct.error, IndexError) as e:
+        # Recognized, but the details aren't in the probed bytes (or the header is damaged)
+        logger.debug(f"Partial probe of {container} file: {str(e)}")
+        return _media(container)
+
+
+def probe_path(path):
+    """
+    Probe a saved audio file (see probe_file)
+
+    Returns:
+        dict: The probe, or None if the file isn't a recognized audio format
+    """
+    try:
+        with open(path, "rb") as f:
+            return probe_file(f, os.path.getsize(path))
+    except (OSError, ValueError) as e:
+        logger.debug(f"Could not probe {path}: {str(e)}")
+        return None
+
+
+def probe_stream(stream, size):
+    """
+    Probe an upload before it is saved, leaving the stream at the start
+
+    Args:
+        stream: The uploaded file's seekable stream
+        size (int): Size of the upload in bytes
+
+    Returns:
+        dict: The probe (see probe_file)
+
+    Raises:
+        ValueError: If it isn't a recognized audio format
+    """
+    try:
+        return probe_file(stream, size)
+    finally:
+        stream.seek(0)
+
+
+def conversion_path(file_extension, prenormalized=False, time_range=None):
+    """
+    How an upload will be converted for transcription
+
+    Args:
+        file_extension (str): Extension of the upload, lowercase with the dot
+        prenormalized (bool): The file is already 16 kHz mono
+        time_range (tuple, optional): (start, end or None) seconds
+
+    Returns:
+        str: "as_is", "wav_chunked" or "ffmpeg", or None if it needs ffmpeg and
+            ffmpeg isn't installed
+    """
+    if prenormalized and time_range is None:
+        return "as_is"
+    if file_extension == ".wav":
+        return "wav_chunked"
+    return "ffmpeg" if FFMPEG_AVAILABLE else None
+
+
+def _clock(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def too_long_message(duration):
+    """
+    Error for a recording (or range) over MAX_MEDIA_SECONDS
+
+    Returns:
+        str: The message, or None if it's within the limit or its length is unknown
+    """
+    if duration is None or MAX_MEDIA_SECONDS <= 0 or duration <= MAX_MEDIA_SECONDS:
+        return None
+    return (
+        f"The recording is too long ({_clock(duration)}; the limit is {_clock(MAX_MEDIA_SECONDS)}). "
+        "Choose a shorter time range or a shorter recording."
+    )
+
+
+def estimate_seconds(duration, convert=True, download_bytes=0):
+    """
+    Rough wall-clock time to transcribe a recording
+
+    Args:
+        duration (float): Seconds of audio to transcribe
+        convert (bool): Whether the audio needs converting first
+        download_bytes (int): Bytes to download first
+
+    Returns:
+        float: Seconds
+    """
+    seconds = REQUEST_OVERHEAD_SECONDS + (download_bytes or 0) / DOWNLOAD_BYTES_PER_SECOND
+    if convert:
+        seconds += duration / CONVERT_SPEED
+    return round(seconds + duration / TRANSCRIBE_SPEED, 1)
+
+
+def describe_upload(media, size, file_extension, time_range=None):
+    """
+    Pre-flight summary of an upload for the client and the pipeline
+
+    Args:
+        media (dict): The upload's probe (see probe_file)
+        size (int): Size of the upload in bytes
+        file_extension (str): Extension of the upload, lowercase with the dot
+        time_range (tuple, optional): (start, end or None) seconds to transcribe
+
+    Returns:
+        dict: The probe plus duration_estimated, range_duration, transcoded_bytes,
+            path, estimated_seconds, and error and reason ("too_long", "range" or
+            "unsupported") if it would be rejected
+    """
+    summary = dict(media, source="upload", size=size, captions=False)
+    duration = media["duration"]
+    summary["duration_estimated"] = duration is None
+    if duration is None:
+        duration = size * 8.0 / (media["bitrate"] or FALLBACK_BITRATE)
+    selected = range_duration(time_range, duration)
+    summary["range_duration"] = round(selected, 3)
+
+    path = conversion_path(file_extension, media["prenormalized"], time_range)
+    summary["path"] = path
+    summary["transcoded_bytes"] = size if path == "as_is" else int(selected * TRANSCODED_BYTES_PER_SECOND)
+    summary["estimated_seconds"] = estimate_seconds(selected, convert=path != "as_is")
+    summary["error"], summary["reason"] = too_long_message(selected), "too_long"
+    if time_range is not None and selected <= 0:
+        summary["error"], summary["reason"] = "The requested time range is outside the recording.", "range"
+    elif summary["error"] is None and path is None:
+        summary["error"] = "This server can't convert this format. Please upload a WAV file instead."
+        summary["reason"] = "unsupported"
+    if summary["error"] is None:
+        summary["reason"] = None
+    return summary
+
+
+def describe_video(info, time_range=None, max_download_bytes=None):
+    """
+    Pre-flight summary of a video from its yt-dlp metadata (nothing is downloaded)
+
+    Args:
+        info (dict): yt-dlp's extract_info(..., download=False) result
+        time_range (tuple, optional): (start, end or None) seconds to transcribe
+        max_download_bytes (int, optional): Reject downloads estimated to be larger
+
+    Returns:
+        dict: duration, codec, download_bytes, transcoded_bytes, captions, path,
+            estimated_seconds, download_error (why downloading it would be refused)
+            and error (why it would be rejected altogether), each None if it's fine
+    """
+    duration = info.get("duration")
+    selected = range_duration(time_range, float(duration) if duration else None)
+    bitrate = info.get("abr") or info.get("tbr")
+
+    # yt-dlp often has no exact size; fall back to its approximation, then to duration x bitrate
+    download_bytes = info.get("filesize") or info.get("filesize_approx")
+    if not download_bytes and duration and bitrate:
+        download_bytes = int(float(duration) * bitrate * 1000 / 8)
+    if download_bytes and time_range is not None and duration and selected is not None:
+        # Only the section's bytes are fetched
+        download_bytes = int(download_bytes * selected / float(duration))
+
+    captions = bool(info.get("subtitles") or info.get("automatic_captions"))
+    summary = {
+        "source": "youtube",
+        "title": info.get("title"),
+        "container": info.get("ext"),
+        "codec": info.get("acodec") if info.get("acodec") not in (None, "none") else None,
+        "duration": float(duration) if duration else None,
+        "range_duration": round(selected, 3) if selected is not None else None,
+        "bitrate": int(bitrate * 1000) if bitrate else None,
+        "download_bytes": download_bytes or None,
+        "transcoded_bytes": int(selected * DOWNLOAD_MP3_BYTES_PER_SECOND) if selected else None,
+        "captions": captions,
+        "path": "captions" if captions else "download",
+        "live": bool(info.get("is_live")),
+    }
+    if captions:
+        summary["estimated_seconds"] = CAPTIONS_SECONDS
+    elif selected:
+        summary["estimated_seconds"] = estimate_seconds(selected, download_bytes=download_bytes or 0)
+    else:
+        summary["estimated_seconds"] = None
+
+    # Captions cost the same however long the video is; the limits are for downloading it
+    download_error = too_long_message(selected)
+    if download_error is None and max_download_bytes and (download_bytes or 0) > max_download_bytes:
+        download_error = (
+            f"The audio is too large to download (about {download_bytes // (1024 * 1024)} MB). "
+            "Choose a shorter time range or a shorter video."
+        )
+    if time_range is not None and selected is not None and selected <= 0:
+        download_error = "The requested time range is outside the video."
+    if summary["live"]:
+        download_error = "Live streams can't be transcribed until they have ended."
+    summary["download_error"] = download_error
+    summary["error"] = None if captions and not summary["live"] else download_error
+    return summary
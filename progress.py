@@ -0,0 +1,61 @@
+import logging
+import threading
+
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def set_progress_sink(sink):
+    """
+    Send this thread's progress reports to sink (or nowhere, with None)
+
+    Args:
+        sink (function): Called with each progress event dict
+    """
+    _local.sink = sink
+
+
+def current_sink():
+    return getattr(_local, "sink", None)
+
+
+def report(stage, **fields):
+    """
+    Report pipeline progress to whoever is streaming this request, if anyone
+
+    Args:
+        stage (str): e.g. "downloading", "converting", "transcribing", "partial"
+        **fields: Stage details such as percent, segment and segments, or text
+    """
+    sink = current_sink()
+    if sink is None:
+        return
+    try:
+        sink(dict(fields, stage=stage))
+    except Exception as e:
+        # Progress is best-effort and must never break the pipeline
+        logger.debug(f"Dropped progress event: {str(e)}")
+
+
+def bind(fn):
+    """
+    Wrap fn so it reports to the calling thread's sink when run on another thread
+    (e.g. in a ThreadPoolExecutor)
+
+    Returns:
+        function: The wrapped function
+    """
+    sink = current_sink()
+
+    def bound(*args, **kwargs):
+        previous = current_sink()
+        set_progress_sink(sink)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            set_progress_sink(previous)
+
+    return bound
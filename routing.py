@@ -0,0 +1,199 @@
+import os
+import logging
+import threading
+from collections import namedtuple
+from metrics import metrics
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Routing policy: "quality" always uses the large models, "fast" always the
+# light ones, "balanced" picks by input size
+ROUTING_POLICY = os.environ.get("ROUTING_POLICY", "balanced").lower()
+
+# Model tiers
+WHISPER_LARGE_MODEL = os.environ.get("WHISPER_LARGE_MODEL", "whisper-large-v3")
+WHISPER_TURBO_MODEL = os.environ.get("WHISPER_TURBO_MODEL", "whisper-large-v3-turbo")
+CHAT_LARGE_MODEL = os.environ.get("CHAT_LARGE_MODEL", "llama3-70b-8192")
+CHAT_SMALL_MODEL = os.environ.get("CHAT_SMALL_MODEL", "llama-3.1-8b-instant")
+
+# Context windows in tokens, used to keep prompt + completion within limits
+MODEL_CONTEXT_TOKENS = {
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# Balanced-policy thresholds
+TURBO_MAX_AUDIO_SECONDS = int(os.environ.get("TURBO_MAX_AUDIO_SECONDS", 10 * 60))  # Short clips use turbo
+SMALL_CHAT_MAX_TOKENS = int(os.environ.get("SMALL_CHAT_MAX_TOKENS", 1500))  # Short transcripts use the small model
+
+# Completion sizing
+CHARS_PER_TOKEN = 4
+MIN_COMPLETION_TOKENS = 512
+MAX_COMPLETION_TOKENS = 4096
+PROMPT_OVERHEAD_TOKENS = 600  # Instructions wrapped around the transcript
+
+RouteDecision = namedtuple("RouteDecision", ["model", "tier", "reason"])
+
+
+class ContextTooLarge(ValueError):
+    """The input leaves no room for a useful completion in the model's context window"""
+
+# Latest decisions made on this thread, so callers can record which model produced a result
+_last = threading.local()
+
+
+def last_model(kind):
+    """
+    Get the model most recently routed to on this thread
+
+    Args:
+        kind (str): "transcription" or "chat"
+
+    Returns:
+        str: Model name, or None if nothing was routed since the last reset
+    """
+    return getattr(_last, kind, None)
+
+
+def remember_model(kind, model):
+    """Record the model behind a result reused instead of routed (e.g. a matched transcript)"""
+    setattr(_last, kind, model)
+
+
+def reset_last_models():
+    """Forget this thread's previous routing decisions"""
+    _last.transcription = None
+    _last.chat = None
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate for English text
+
+    Args:
+        text (str): Input text
+
+    Returns:
+        int: Approximate number of tokens
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def route_transcription(duration_seconds, source):
+    """
+    Pick the Whisper model for an audio file
+
+    Args:
+        duration_seconds (float): Audio duration, or None if unknown
+        source (str): Where the audio came from ("upload", "youtube", "recording")
+
+    Returns:
+        RouteDecision: The chosen model and why
+    """
+    if ROUTING_POLICY == "quality":
+        decision = RouteDecision(WHISPER_LARGE_MODEL, "large", "quality policy")
+    elif ROUTING_POLICY == "fast":
+        decision = RouteDecision(WHISPER_TURBO_MODEL, "turbo", "fast policy")
+    elif duration_seconds is None:
+        decision = RouteDecision(WHISPER_LARGE_MODEL, "large", "unknown duration")
+    elif duration_seconds <= TURBO_MAX_AUDIO_SECONDS:
+        decision = RouteDecision(WHISPER_TURBO_MODEL, "turbo", f"short audio ({duration_seconds:.0f}s)")
+    else:
+        decision = RouteDecision(WHISPER_LARGE_MODEL, "large", f"long audio ({duration_seconds:.0f}s)")
+
+    _last.transcription = decision.model
+    metrics.increment(f"routing.transcription.{decision.tier}")
+    metrics.record_event(
+        "routing.transcription",
+        source=source,
+        duration_seconds=duration_seconds,
+        policy=ROUTING_POLICY,
+        model=decision.model,
+        reason=decision.reason,
+    )
+    return decision
+
+
+def route_chat(input_tokens, purpose):
+    """
+    Pick the chat model for a notes or transcript request
+
+    Args:
+        input_tokens (int): Estimated tokens of the variable input (transcript, page text)
+        purpose (str): What the completion is for ("notes", "youtube_transcript")
+
+    Returns:
+        RouteDecision: The chosen model and why
+    """
+    if ROUTING_POLICY == "quality":
+        decision = RouteDecision(CHAT_LARGE_MODEL, "large", "quality policy")
+    elif ROUTING_POLICY == "fast":
+        decision = RouteDecision(CHAT_SMALL_MODEL, "small", "fast policy")
+    elif input_tokens <= SMALL_CHAT_MAX_TOKENS:
+        decision = RouteDecision(CHAT_SMALL_MODEL, "small", f"short input ({input_tokens} tokens)")
+    else:
+        decision = RouteDecision(CHAT_LARGE_MODEL, "large", f"long input ({input_tokens} tokens)")
+
+    # A policy can pick a model whose context the input doesn't fit; fall
+    # back to the other tier when that one has room
+    if not _fits(decision.model, input_tokens):
+        other = RouteDecision(CHAT_SMALL_MODEL, "small", "") if decision.tier == "large" else RouteDecision(CHAT_LARGE_MODEL, "large", "")
+        if _fits(other.model, input_tokens):
+            decision = other._replace(reason=f"input ({input_tokens} tokens) exceeds {decision.model}'s context")
+
+    _last.chat = decision.model
+    metrics.increment(f"routing.chat.{decision.tier}")
+    metrics.record_event(
+        "routing.chat",
+        purpose=purpose,
+        input_tokens=input_tokens,
+        policy=ROUTING_POLICY,
+        model=decision.model,
+        reason=decision.reason,
+    )
+    return decision
+
+
+def _available_tokens(model, input_tokens):
+    """Completion tokens left in the model's context after the input and the prompt around it"""
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return context - input_tokens - PROMPT_OVERHEAD_TOKENS
+
+
+def _fits(model, input_tokens):
+    return _available_tokens(model, input_tokens) >= MIN_COMPLETION_TOKENS
+
+
+def completion_budget(model, input_tokens, expected_output_tokens=None):
+    """
+    Size max_tokens to the input: structured notes are roughly as long as the
+    text they summarize, and prompt plus completion must fit the model context.
+
+    Args:
+        model (str): Chat model name
+        input_tokens (int): Estimated tokens of the variable input
+        expected_output_tokens (int, optional): Override the output estimate
+            when it doesn't scale with the input
+
+    Returns:
+        int: max_tokens to request
+
+    Raises:
+        ContextTooLarge: If fewer than MIN_COMPLETION_TOKENS fit next to the input
+    """
+    if expected_output_tokens is None:
+        expected_output_tokens = int(input_tokens * 1.2) + 256
+    wanted = max(MIN_COMPLETION_TOKENS, expected_output_tokens)
+    available = _available_tokens(model, input_tokens)
+    if available < MIN_COMPLETION_TOKENS:
+        metrics.increment("routing.context_too_large")
+        raise ContextTooLarge(f"Input of about {input_tokens} tokens is too long for {model}")
+    return min(wanted, MAX_COMPLETION_TOKENS, available)
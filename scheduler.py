@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+import threading
+import itertools
+from contextlib import contextmanager
+from metrics import metrics
+from deadline import current_deadline
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+GROQ_AUDIO_CONCURRENCY = int(os.environ.get("GROQ_AUDIO_CONCURRENCY", 2))
+GROQ_CHAT_CONCURRENCY = int(os.environ.get("GROQ_CHAT_CONCURRENCY", 4))
+# Most slots one session may hold while other sessions are waiting
+SESSION_MAX_SLOTS = int(os.environ.get("SESSION_MAX_SLOTS", 1))
+# How much a session's already-running work counts against its next job
+FAIR_SHARE_WEIGHT = 1.0
+# Cost units forgiven per second of waiting, so long jobs can't starve
+AGING_RATE = float(os.environ.get("SCHEDULER_AGING_RATE", 10.0))
+
+ANONYMOUS_OWNER = "anonymous"
+
+_local = threading.local()
+
+
+def set_current_owner(owner):
+    """
+    Set the session that jobs started from this thread belong to
+
+    Args:
+        owner (str): Session identifier
+    """
+    _local.owner = owner
+
+
+def current_owner():
+    """
+    Get the session that jobs started from this thread belong to
+
+    Returns:
+        str: Session identifier
+    """
+    return getattr(_local, "owner", ANONYMOUS_OWNER)
+
+
+class _Job(object):
+    def __init__(self, sequence, cost, owner):
+        self.sequence = sequence
+        self.cost = cost
+        self.owner = owner
+        self.enqueued = time.time()
+        self.granted = False
+
+
+class FairScheduler(object):
+    """
+    Admit work to a fixed number of slots, shortest job first, with fair sharing
+    between sessions.
+
+    A waiting job's priority is its estimated cost, plus the cost of the work its
+    session is already running, minus a credit that grows while it waits. Short
+    jobs therefore overtake long ones, one session can't monopolize the slots,
+    and a long job still runs eventually.
+    """
+
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._running = {}  # owner -> [job count, total cost]
+        self._running_count = 0
+        self._sequence = itertools.count()
+
+    def _priority(self, job, now):
+        running_cost = self._running.get(job.owner, [0, 0.0])[1]
+        return job.cost + FAIR_SHARE_WEIGHT * running_cost - AGING_RATE * (now - job.enqueued)
+
+    def _eligible(self, job):
+        running_jobs = self._running.get(job.owner, [0, 0.0])[0]
+        if running_jobs < SESSION_MAX_SLOTS:
+            return True
+        # Over quota: only deferred to other sessions' jobs that could run instead
+        return not any(
+            other.owner != job.owner and self._running.get(other.owner, [0, 0.0])[0] < SESSION_MAX_SLOTS
+            for other in self._waiting
+        )
+
+    def _dispatch(self):
+        now = time.time()
+        while self._running_count < self.slots and self._waiting:
+            candidates = [job for job in self._waiting if self._eligible(job)]
+            if not candidates:
+                break
+            job = min(candidates, key=lambda j: (self._priority(j, now), j.sequence))
+            self._waiting.remove(job)
+            job.granted = True
+            self._running_count += 1
+            usage = self._running.setdefault(job.owner, [0, 0.0])
+            usage[0] += 1
+            usage[1] += job.cost
+        self._publish()
+        self._condition.notify_all()
+
+    def _publish(self):
+        metrics.set_gauge(f"scheduler.{self.name}.queue_depth", len(self._waiting))
+        metrics.set_gauge(f"scheduler.{self.name}.running", self._running_count)
+
+    @contextmanager
+    def slot(self, cost, owner=None):
+        """
+        Wait for a slot, run the body, then release the slot
+
+        Args:
+            cost (float): Estimated cost of the job (audio seconds or tokens)
+            owner (str, optional): Session the job belongs to; defaults to the current thread's
+
+        Yields:
+            float: Seconds spent waiting for the slot
+
+        Raises:
+            RequestCancelled: If the request is cancelled while waiting; it never gets a slot
+        """
+        job = _Job(next(self._sequence), max(0.0, float(cost or 0)), owner or current_owner())
+        deadline = current_deadline()
+
+        with self._condition:
+            self._waiting.append(job)
+            self._dispatch()
+            while not job.granted:
+                # Re-evaluate periodically so aging credit takes effect
+                self._condition.wait(timeout=1.0)
+                if not job.granted and deadline.expired():
+                    self._waiting.remove(job)
+                    self._dispatch()
+                    deadline.check(f"scheduler.{self.name}")
+                if not job.granted:
+                    self._dispatch()
+
+        waited = time.time() - job.enqueued
+        metrics.observe(f"scheduler.{self.name}.wait_seconds", waited)
+        if waited > 1:
+            logger.info(f"{self.name} job (cost {job.cost:.0f}) waited {waited:.1f}s for a slot")
+
+        try:
+            yield waited
+        finally:
+            with self._condition:
+                self._running_count -= 1
+                usage = self._running[job.owner]
+                usage[0] -= 1
+                usage[1] -= job.cost
+                if usage[0] == 0:
+                    del self._running[job.owner]
+                self._dispatch()
+
+
+audio_scheduler = FairScheduler("audio", GROQ_AUDIO_CONCURRENCY)
+chat_scheduler = FairScheduler("chat", GROQ_CHAT_CONCURRENCY)
@@ -0,0 +1,91 @@
+import re
+import zlib
+import hashlib
+
+# Constants
+SECTION_MIN_CHARS = 3000  # Never cut a section shorter than this
+SECTION_MAX_CHARS = 8000  # Always cut once a section grows this large
+SENTENCE_BOUNDARY_DIVISOR = 20  # ~1 in 20 sentence ends is a cut point
+WORD_BOUNDARY_DIVISOR = 300  # Used for unpunctuated text such as auto-captions
+BOUNDARY_WINDOW = 3  # Number of trailing words that decide a cut point
+
+_SENTENCE_END = re.compile(r'[.!?]["\')\]]*$')
+
+
+def normalize_text(text):
+    """
+    Collapse whitespace so that formatting-only edits don't change a section's hash
+
+    Args:
+        text (str): Raw text
+
+    Returns:
+        str: Normalized text
+    """
+    return " ".join(text.split())
+
+
+def section_hash(text):
+    """
+    Compute the stable content hash of a section
+
+    Args:
+        text (str): Section text
+
+    Returns:
+        str: Hex digest identifying the section content
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def split_into_sections(transcript):
+    """
+    Split a transcript into content-defined sections.
+
+    Cut points are chosen from the words around them rather than from their
+    position in the text, so editing a few words only changes the section
+    containing the edit (and at most its neighbour); every other section keeps
+    the same text and therefore the same hash.
+
+    Args:
+        transcript (str): The full transcript
+
+    Returns:
+        list: Section texts, in order
+    """
+    words = normalize_text(transcript).split(" ")
+    if not words or words == [""]:
+        return []
+
+    # Prefer cutting at sentence ends when the text has punctuation at all
+    sentence_mode = any(_SENTENCE_END.search(word) for word in words)
+    divisor = SENTENCE_BOUNDARY_DIVISOR if sentence_mode else WORD_BOUNDARY_DIVISOR
+
+    sections = []
+    current = []
+    current_chars = 0
+
+    for i, word in enumerate(words):
+        current.append(word)
+        current_chars += len(word) + 1
+
+        if current_chars < SECTION_MIN_CHARS:
+            continue
+
+        if current_chars >= SECTION_MAX_CHARS:
+            cut = True
+        elif sentence_mode and not _SENTENCE_END.search(word):
+            cut = False
+        else:
+            window = " ".join(words[max(0, i - BOUNDARY_WINDOW + 1):i + 1]).lower()
+            cut = zlib.crc32(window.encode("utf-8")) % divisor == 0
+
+        if cut:
+            sections.append(" ".join(current))
+            current = []
+            current_chars = 0
+
+    if current:
+        sections.append(" ".join(current))
+
+    return sections
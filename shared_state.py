@@ -0,0 +1,236 @@
+import os
+import json
+import uuid
+import logging
+from datetime import datetime, timedelta, timezone
+from flask.sessions import SessionInterface, SessionMixin, SecureCookieSessionInterface
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+from history import db
+from llm_cache import completion_cache
+from media_cache import caption_cache, page_cache
+from metrics import metrics
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+# Keep sessions, transcript caches and the job queue in the database (Postgres via
+# DATABASE_URL, SQLite locally) so several instances can run behind a load balancer
+SHARED_STATE = os.environ.get("SHARED_STATE", "").lower() in ("1", "true", "yes", "on")
+SHARED_CACHE_TTL = int(os.environ.get("SHARED_CACHE_TTL", 7 * 24 * 3600))  # 7 days
+SESSION_REFRESH_SECONDS = 24 * 3600  # A session's expiry is pushed back at most once a day
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _aware(moment):
+    # SQLite hands back naive datetimes even for timezone-aware columns
+    return moment if moment is None or moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+class SharedCacheEntry(db.Model):
+    """A cached value shared by every instance"""
+
+    __tablename__ = "shared_cache"
+
+    key = db.Column(db.String(160), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+
+class SessionRecord(db.Model):
+    """Server-side session data; the cookie only carries the signed session key"""
+
+    __tablename__ = "sessions"
+
+    key = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+
+class SharedCache(object):
+    """
+    Database-backed key/value cache for results every instance should reuse
+    (transcripts, completions). Each call runs in its own app context, so it's
+    safe from any thread; failures are logged and treated as misses.
+    """
+
+    def __init__(self):
+        self.app = None
+
+    @property
+    def enabled(self):
+        return self.app is not None
+
+    def init_app(self, app):
+        self.app = app
+
+    def get(self, key):
+        """
+        Look up a value
+
+        Args:
+            key (str): Cache key, e.g. "transcript:youtube:<video id>"
+
+        Returns:
+            The cached JSON value, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        try:
+            with self.app.app_context():
+                entry = db.session.get(SharedCacheEntry, key)
+                if entry is None or _aware(entry.expires_at) < _utcnow():
+                    metrics.increment("shared_cache.misses")
+                    return None
+                value = json.loads(entry.value)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed for {key}: {str(e)}")
+            return None
+        metrics.increment("shared_cache.hits")
+        return value
+
+    def set(self, key, value, ttl=SHARED_CACHE_TTL):
+        """
+        Store a JSON-serializable value for ttl seconds
+        """
+        if not self.enabled:
+            return
+        try:
+            with self.app.app_context():
+                db.session.merge(SharedCacheEntry(
+                    key=key, value=json.dumps(value), expires_at=_utcnow() + timedelta(seconds=ttl)
+                ))
+                db.session.commit()
+        except Exception as e:
+            # Usually another instance stored the same key at the same moment
+            logger.warning(f"Shared cache write failed for {key}: {str(e)}")
+
+    def sweep(self):
+        """Delete expired cache entries and sessions"""
+        if not self.enabled:
+            return
+        with self.app.app_context():
+            now = _utcnow()
+            removed = SharedCacheEntry.query.filter(SharedCacheEntry.expires_at < now).delete()
+            removed_sessions = SessionRecord.query.filter(SessionRecord.expires_at < now).delete()
+            db.session.commit()
+        if removed or removed_sessions:
+            logger.info(f"Removed {removed} expired cache entries and {removed_sessions} expired sessions")
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session whose data lives in the sessions table"""
+
+    def __init__(self, initial=None, key=None, new=False, stored_json=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.key = key
+        self.new = new
+        self.modified = False
+        self.stored_json = stored_json
+        self.expires_at = expires_at
+
+
+class DatabaseSessionInterface(SessionInterface):
+    """
+    Keep session data in the database instead of the cookie, so any instance
+    can serve any request and large transcripts don't overflow the cookie.
+    Sessions from before shared state was enabled are carried over, keeping
+    their history.
+    """
+
+    salt = "speechscribe-session"
+
+    def __init__(self):
+        self.legacy = SecureCookieSessionInterface()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                key = self._signer(app).unsign(cookie).decode("utf-8")
+            except BadSignature:
+                key = None
+
+            if key is not None:
+                record = db.session.get(SessionRecord, key)
+                if record is not None and _aware(record.expires_at) > _utcnow():
+                    return ServerSession(
+                        json.loads(record.data), key=key, stored_json=record.data, expires_at=_aware(record.expires_at)
+                    )
+            else:
+                legacy = self.legacy.open_session(app, request)
+                if legacy:
+                    metrics.increment("sessions.migrated")
+                    return ServerSession(dict(legacy), key=uuid.uuid4().hex, new=True)
+        return ServerSession(key=uuid.uuid4().hex, new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                SessionRecord.query.filter_by(key=session.key).delete()
+                db.session.commit()
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        response.vary.add("Cookie")
+        expires = self.get_expiration_time(app, session) or _utcnow() + app.permanent_session_lifetime
+        data = json.dumps(dict(session), sort_keys=True)
+        # Setting session.permanent on every request marks it modified, so compare the data instead
+        refresh_due = session.expires_at is None or \
+            expires - session.expires_at > timedelta(seconds=SESSION_REFRESH_SECONDS)
+        if data != session.stored_json or refresh_due:
+            try:
+                db.session.merge(SessionRecord(key=session.key, data=data, expires_at=expires))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not save session: {str(e)}")
+                return
+
+        if session.new or refresh_due or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.key).decode("utf-8"),
+                expires=expires,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+shared_cache = SharedCache()
+
+
+def init_shared_state(app):
+    """
+    Move sessions and shared caches into the database (call before the tables are created)
+
+    Args:
+        app (Flask): The application
+    """
+    shared_cache.init_app(app)
+    completion_cache.shared = shared_cache
+    caption_cache.shared = shared_cache
+    page_cache.shared = shared_cache
+    app.session_interface = DatabaseSessionInterface()
+    logger.info(f"Shared state enabled on {app.config.get('SQLALCHEMY_DATABASE_URI', '').split('://')[0]}")
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from metrics import metrics
+from deadline import current_deadline, POLL_SECONDS
+from workspace import manage_directory, add_sweeper
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+SINGLE_FLIGHT_DIR = os.environ.get("SINGLE_FLIGHT_DIR", "./cache/singleflight")
+# How long a finished result is handed to late arrivals from other worker processes
+SINGLE_FLIGHT_RESULT_TTL = int(os.environ.get("SINGLE_FLIGHT_RESULT_TTL", 120))
+
+
+class _Call(object):
+    def __init__(self, deadline):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.deadline = deadline  # The leader's, which joiners keep alive
+
+
+class SingleFlight(object):
+    """
+    Coalesce identical in-flight work so only one pipeline runs per key.
+
+    Within a process, concurrent callers with the same key wait on the first
+    caller and share its result. Across gunicorn worker processes, the leader
+    of each process takes an exclusive file lock for the key; whoever gets it
+    first does the work and publishes the result to a file that the other
+    processes read once the lock is released.
+    """
+
+    def __init__(self, lock_dir=SINGLE_FLIGHT_DIR, result_ttl=SINGLE_FLIGHT_RESULT_TTL):
+        self.lock_dir = lock_dir
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._calls = {}
+        os.makedirs(self.lock_dir, exist_ok=True)
+        # Result files only matter while work is in flight. Lock files are
+        # never swept by age: one could be unlinked just as another process
+        # opens it to flock, so they are removed here, under their own lock
+        self.lock_max_age = max(3600, self.result_ttl)
+        manage_directory(self.lock_dir, max_age=self.lock_max_age, keep_suffixes=(".lock",))
+        add_sweeper(self.remove_stale_locks)
+
+    def do(self, key, fn, shareable=None):
+        """
+        Run fn once for all concurrent callers with the same key
+
+        Args:
+            key (str): Identity of the work, e.g. "youtube:<video id>"
+            fn (function): Zero-argument function doing the work; its result must be JSON-serializable
+            shareable (function, optional): Decides whether a result may be handed to
+                other processes (e.g. not for errors, so they can retry)
+
+        Returns:
+            The result of fn, possibly computed by another caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call(current_deadline())
+                self._calls[key] = call
+
+        if not leader:
+            logger.info(f"Joining in-flight work for {key}")
+            metrics.increment("singleflight.joined")
+            # The leader's client leaving doesn't cancel the work while this caller
+            # still wants it; this caller leaving releases it
+            call.deadline.attach()
+            try:
+                current_deadline().wait_for(call.event, "singleflight")
+            except Exception:
+                if not call.event.is_set():
+                    call.deadline.abandon()
+                raise
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_across_processes(key, fn, shareable)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _run_across_processes(self, key, fn, shareable):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        lock_path = os.path.join(self.lock_dir, f"{name}.lock")
+        result_path = os.path.join(self.lock_dir, f"{name}.json")
+
+        with self._locked(lock_path):
+            # Keep the lock file young so remove_stale_locks leaves it alone
+            os.utime(lock_path, None)
+
+            found, result = self._read_result(result_path)
+            if found:
+                logger.info(f"Reusing result of {key} from another worker")
+                metrics.increment("singleflight.joined_remote")
+                return result
+
+            metrics.increment("singleflight.leader")
+            result = fn()
+            if shareable is None or shareable(result):
+                self._write_result(result_path, result)
+            return result
+
+    @contextmanager
+    def _locked(self, lock_path):
+        """
+        Hold the exclusive lock of lock_path
+
+        The file may have been unlinked by remove_stale_locks between opening
+        and flocking it, in which case the lock protects nothing and is taken
+        again on the file now at lock_path. The lock is polled rather than
+        waited on, so a request waiting for another worker's run still stops
+        at its deadline.
+
+        Raises:
+            RequestCancelled: If the request is cancelled while waiting
+        """
+        deadline = current_deadline()
+        while True:
+            lock_file = open(lock_path, "a")
+            try:
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        deadline.wait(POLL_SECONDS, "single_flight")
+                try:
+                    current = os.stat(lock_path)
+                except FileNotFoundError:
+                    current = None
+                held = os.fstat(lock_file.fileno())
+                if current is not None and (current.st_dev, current.st_ino) == (held.st_dev, held.st_ino):
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    return
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            finally:
+                lock_file.close()
+
+    def remove_stale_locks(self):
+        """
+        Unlink lock files unused for lock_max_age, each while holding it, so a
+        process about to flock it either finds it gone or sees it replaced
+
+        Returns:
+            int: Number of lock files removed
+        """
+        removed = 0
+        now = time.time()
+        try:
+            names = os.listdir(self.lock_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if not name.endswith(".lock"):
+                continue
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if now - os.path.getmtime(path) <= self.lock_max_age:
+                    continue
+                # Opened without O_CREAT, so a lock removed meanwhile isn't recreated
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                held = os.fstat(fd)
+                current = os.stat(path)
+                if (current.st_dev, current.st_ino) == (held.st_dev, held.st_ino) and now - current.st_mtime > self.lock_max_age:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                # Locked by a running flight, or already replaced
+                continue
+            finally:
+                os.close(fd)
+        return removed
+
+    def _read_result(self, result_path):
+        try:
+            with open(result_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False, None
+        if time.time() - entry.get("created", 0) > self.result_ttl:
+            return False, None
+        return True, entry.get("result")
+
+    def _write_result(self, result_path, result):
+        temp_path = f"{result_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "result": result}, f)
+            os.replace(temp_path, result_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not publish single-flight result: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def file_sha256(stream, chunk_size=1024 * 1024):
+    """
+    Hash a seekable stream's content and rewind it
+
+    Args:
+        stream: Binary file-like object, e.g. an uploaded file's stream
+        chunk_size (int): Bytes read per iteration
+
+    Returns:
+        str: Hex digest of the content
+    """
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+single_flight = SingleFlight()
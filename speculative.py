@@ -0,0 +1,203 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from metrics import metrics
+from history import content_hash
+from scheduler import set_current_owner
+from call_llm import generate_structured_notes
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+SPECULATIVE_NOTES = os.environ.get("SPECULATIVE_NOTES", "").lower() in ("1", "true", "yes", "on")  # Opt-in
+SPECULATIVE_WORKERS = int(os.environ.get("SPECULATIVE_WORKERS", 2))
+SPECULATIVE_EDIT_DELAY = float(os.environ.get("SPECULATIVE_EDIT_DELAY", 5))  # Seconds of quiet after an edit before starting
+SPECULATIVE_ABANDON_SECONDS = int(os.environ.get("SPECULATIVE_ABANDON_SECONDS", 300))  # No requests for this long = abandoned
+SPECULATIVE_ATTACH_TIMEOUT = int(os.environ.get("SPECULATIVE_ATTACH_TIMEOUT", 240))  # Below gunicorn's 300 s timeout
+
+
+class NotesCancelled(Exception):
+    """Raised inside a speculative job once it has been cancelled"""
+
+
+class _Job(object):
+    def __init__(self, owner, transcript_hash):
+        self.owner = owner
+        self.transcript_hash = transcript_hash
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.started = time.time()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class SpeculativeNotes(object):
+    """
+    Start generating notes in the background as soon as a transcript is stored,
+    so /generate-notes can return the result (or wait on the running job)
+    instead of starting from scratch.
+
+    Each session has at most one job. It is cancelled when the transcript is
+    edited (and restarted for the new text after a quiet period), when the
+    page is closed, or when the session makes no requests for
+    SPECULATIVE_ABANDON_SECONDS. Completed section notes land in the
+    completion cache, so cancelled work that finished isn't lost.
+    """
+
+    def __init__(self, generate, enabled=SPECULATIVE_NOTES, workers=SPECULATIVE_WORKERS):
+        self.generate = generate
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._jobs = {}  # owner -> _Job
+        self._last_seen = {}  # owner -> time of the last request
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculative-notes")
+
+    def touch(self, owner):
+        """Note that the session is still active"""
+        if self.enabled:
+            with self._lock:
+                self._last_seen[owner] = time.time()
+
+    def start(self, owner, transcript, delay=0.0):
+        """
+        Start (or keep) the background notes job for this session's transcript
+
+        Args:
+            owner (str): Session ID
+            transcript (str): The transcript that was just stored
+            delay (float): Seconds to wait before calling the model; another
+                edit within that time cancels the job before it costs anything
+        """
+        if not self.enabled or not transcript.strip():
+            return
+        self.sweep()
+
+        transcript_hash = content_hash(transcript)
+        with self._lock:
+            current = self._jobs.get(owner)
+            if current is not None and current.transcript_hash == transcript_hash and not current.cancelled():
+                return
+            if current is not None:
+                self._cancel(current, "transcript changed")
+
+            job = _Job(owner, transcript_hash)
+            self._jobs[owner] = job
+            self._last_seen[owner] = time.time()
+            job.future = self._executor.submit(self._run, job, transcript, delay)
+        metrics.increment("speculative.started")
+
+    def _run(self, job, transcript, delay):
+        if delay and job.cancel_event.wait(delay):
+            raise NotesCancelled("Cancelled before starting")
+
+        set_current_owner(job.owner)
+        notes = self.generate(transcript, cancelled=lambda: self._should_stop(job))
+        if job.cancelled():
+            raise NotesCancelled("Cancelled")
+        if notes.startswith("Error"):
+            metrics.increment("speculative.failed")
+        else:
+            metrics.increment("speculative.completed")
+            metrics.observe("speculative.seconds", time.time() - job.started)
+        return notes
+
+    def _should_stop(self, job):
+        if job.cancelled():
+            return True
+        with self._lock:
+            last_seen = self._last_seen.get(job.owner, job.started)
+        if time.time() - last_seen > SPECULATIVE_ABANDON_SECONDS:
+            self.cancel(job.owner, "session abandoned")
+            return True
+        return False
+
+    def _cancel(self, job, reason):
+        # Caller holds self._lock
+        if not job.cancelled():
+            job.cancel_event.set()
+            metrics.increment("speculative.cancelled")
+            logger.info(f"Cancelled speculative notes for session {job.owner[:8]}: {reason}")
+        if self._jobs.get(job.owner) is job:
+            del self._jobs[job.owner]
+
+    def cancel(self, owner, reason="cancelled"):
+        """
+        Cancel the session's background job, if any
+
+        Args:
+            owner (str): Session ID
+            reason (str): Logged with the cancellation
+        """
+        with self._lock:
+            job = self._jobs.get(owner)
+            if job is not None:
+                self._cancel(job, reason)
+
+    def abandon(self, owner):
+        """The user closed the page: cancel the job and forget the session"""
+        self.cancel(owner, "page closed")
+        with self._lock:
+            self._last_seen.pop(owner, None)
+
+    def result(self, owner, transcript):
+        """
+        Get the speculative notes for this transcript, waiting for the job if it's still running
+
+        Args:
+            owner (str): Session ID
+            transcript (str): The transcript notes are being requested for
+
+        Returns:
+            str: The notes, or None if there's no usable job (the caller generates them itself)
+        """
+        if not self.enabled:
+            return None
+
+        transcript_hash = content_hash(transcript)
+        with self._lock:
+            job = self._jobs.get(owner)
+        if job is None or job.transcript_hash != transcript_hash or job.cancelled():
+            metrics.increment("speculative.misses")
+            return None
+
+        # The user is here and waiting, so the job is no longer speculative
+        attached = not job.future.done()
+        try:
+            notes = job.future.result(timeout=SPECULATIVE_ATTACH_TIMEOUT)
+        except (NotesCancelled, FutureTimeoutError):
+            metrics.increment("speculative.misses")
+            return None
+        except Exception as e:
+            logger.warning(f"Speculative notes job failed: {str(e)}")
+            metrics.increment("speculative.misses")
+            return None
+
+        with self._lock:
+            if self._jobs.get(owner) is job:
+                del self._jobs[owner]
+        if notes.startswith("Error"):
+            return None
+        metrics.increment("speculative.attached" if attached else "speculative.hits")
+        return notes
+
+    def sweep(self):
+        """Forget sessions that have gone quiet and cancel their jobs"""
+        cutoff = time.time() - SPECULATIVE_ABANDON_SECONDS
+        with self._lock:
+            for owner, last_seen in list(self._last_seen.items()):
+                if last_seen < cutoff:
+                    job = self._jobs.get(owner)
+                    if job is not None:
+                        self._cancel(job, "session abandoned")
+                    del self._last_seen[owner]
+
+
+speculative_notes = SpeculativeNotes(generate_structured_notes)
@@ -6,12 +6,15 @@ document.addEventListener('DOMContentLoaded', function() {
     const transcriptElement = document.getElementById('transcript');
     const generateNotesBtn = document.getElementById('generateNotes');
     const downloadPDFBtn = document.getElementById('downloadPDF');
+    const downloadTranscriptPDFBtn = document.getElementById('downloadTranscriptPDF');
     const structuredNotesElement = document.getElementById('structured-notes');
     const notesLoadingElement = document.getElementById('notes-loading');
     const recordingStatus = document.getElementById('status-text');
     const recordingIndicator = document.getElementById('recording-indicator');
     const transcribeYoutubeBtn = document.getElementById('transcribe-youtube');
     const youtubeUrlInput = document.getElementById('youtube-url');
+    const youtubeStartInput = document.getElementById('youtube-start');
+    const youtubeEndInput = document.getElementById('youtube-end');
     const useManualTranscriptBtn = document.getElementById('use-manual-transcript');
     const manualTranscriptInput = document.getElementById('manual-transcript');
     
@@ -24,6 +27,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const transcribeAudioFileBtn = document.getElementById('transcribe-audio-file');
     const uploadProgress = document.getElementById('upload-progress');
     const audioUploadForm = document.getElementById('audio-upload-form');
+    const uploadStartInput = document.getElementById('upload-start');
+    const uploadEndInput = document.getElementById('upload-end');
+    const uploadProbeInfo = document.getElementById('upload-probe');
     
     // Add tab switching logic - refresh page when switching to upload tab from youtube tab
     if (uploadTabButton) {
@@ -36,6 +42,13 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Let the server stop any background notes generation for this page
+    window.addEventListener('pagehide', function() {
+        if (navigator.sendBeacon) {
+            navigator.sendBeacon('/page-closed');
+        }
+    });
+    
     // Global variables
     let recognition = null;
     let finalTranscript = '';
@@ -45,6 +58,35 @@ document.addEventListener('DOMContentLoaded', function() {
     // Check browser support for Speech Recognition
     const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
     
+    // Seconds from "90", "1:30" or "1:02:03"; null if empty, NaN if invalid
+    function parseTimeInput(input) {
+        const text = input ? input.value.trim() : '';
+        if (!text) {
+            return null;
+        }
+        const parts = text.split(':');
+        if (parts.length > 3 || parts.some(part => part === '' || isNaN(Number(part)))) {
+            return NaN;
+        }
+        return parts.reduce((total, part) => total * 60 + Number(part), 0);
+    }
+    
+    // {start, end} from a pair of time inputs; null for the whole recording
+    function readTimeRange(startInput, endInput) {
+        const start = parseTimeInput(startInput);
+        const end = parseTimeInput(endInput);
+        if (Number.isNaN(start) || Number.isNaN(end)) {
+            throw new Error('Please enter times as seconds or h:mm:ss.');
+        }
+        if (!start && end === null) {
+            return null;
+        }
+        if (end !== null && end <= (start || 0)) {
+            throw new Error('The end time must be after the start time.');
+        }
+        return { start: start || 0, end: end };
+    }
+    
     // Show error modal
     function showError(message) {
         const errorModal = new bootstrap.Modal(document.getElementById('errorModal'));
@@ -162,13 +204,18 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Function to save transcript to server
-    function saveTranscriptToServer(transcript) {
+    // transcriptId links the session to the history record a streamed transcription created
+    function saveTranscriptToServer(transcript, transcriptId) {
+        const payload = { transcript: transcript };
+        if (transcriptId !== undefined && transcriptId !== null) {
+            payload.transcript_id = transcriptId;
+        }
         fetch('/save-transcript', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ transcript: transcript })
+            body: JSON.stringify(payload)
         })
         .then(response => {
             if (!response.ok) {
@@ -184,6 +231,113 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Human-readable label for a transcription progress event, or null to keep the current one
+    function describeProgress(event) {
+        switch (event.stage) {
+            case 'tier':
+                return {
+                    captions: 'Fetching captions...',
+                    download: 'Downloading audio...',
+                    page_context: 'Reading the video page...'
+                }[event.tier] || 'Processing...';
+            case 'downloading':
+                return `Downloading ${event.percent}%...`;
+            case 'converting':
+                return 'Converting audio...';
+            case 'splitting':
+                return 'Splitting audio...';
+            case 'compressing':
+                return 'Speeding up audio...';
+            case 'transcribing':
+            case 'partial':
+                return event.segments > 1
+                    ? `Transcribing segment ${event.segment} of ${event.segments}...`
+                    : 'Transcribing...';
+            default:
+                return null;
+        }
+    }
+    
+    // Returns a handler that shows progress events on a button (and optional progress bar)
+    // and appends partial transcript text as each segment completes
+    function createProgressRenderer(button, progressBar) {
+        let partialText = '';
+        return function(event) {
+            const label = describeProgress(event);
+            if (label) {
+                button.innerHTML = `<i class="fas fa-spinner fa-spin me-1"></i> ${label}`;
+            }
+            if (progressBar) {
+                let percent = null;
+                if (event.stage === 'downloading') {
+                    percent = event.percent;
+                } else if (event.stage === 'partial' && event.segments) {
+                    percent = Math.round((event.segment / event.segments) * 100);
+                } else if (event.stage === 'converting' || event.stage === 'splitting') {
+                    percent = 0;
+                }
+                if (percent !== null) {
+                    progressBar.style.width = percent + '%';
+                    progressBar.textContent = label || '';
+                }
+            }
+            if (event.stage === 'partial' && event.text && transcriptElement) {
+                partialText = partialText ? partialText + ' ' + event.text : event.text;
+                transcriptElement.textContent = partialText;
+            }
+        };
+    }
+    
+    // Feed complete NDJSON lines from text (starting at offset) to onEvent;
+    // returns the offset just past the last complete line
+    function consumeProgressLines(text, offset, onEvent) {
+        let newline = text.indexOf('\n', offset);
+        while (newline !== -1) {
+            const line = text.substring(offset, newline).trim();
+            if (line) {
+                try {
+                    onEvent(JSON.parse(line));
+                } catch (e) {
+                    console.error('Bad progress line:', line);
+                }
+            }
+            offset = newline + 1;
+            newline = text.indexOf('\n', offset);
+        }
+        return offset;
+    }
+    
+    // Read a streamed (application/x-ndjson) transcription response, passing progress
+    // events to onEvent; resolves with the final "done" or "error" event
+    function readProgressStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let finalEvent = null;
+        const handle = function(event) {
+            if (event.stage === 'done' || event.stage === 'error') {
+                finalEvent = event;
+            } else {
+                onEvent(event);
+            }
+        };
+        function pump() {
+            return reader.read().then(({ done, value }) => {
+                buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+                buffer = buffer.substring(consumeProgressLines(buffer, 0, handle));
+                if (done) {
+                    return finalEvent;
+                }
+                return pump();
+            });
+        }
+        return pump();
+    }
+    
+    function isProgressStream(contentType) {
+        return (contentType || '').indexOf('application/x-ndjson') !== -1;
+    }
+    
     // Start recording
     function startRecording() {
         if (recognition) {
@@ -249,16 +403,33 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        let timeRange;
+        try {
+            timeRange = readTimeRange(youtubeStartInput, youtubeEndInput);
+        } catch (e) {
+            showError(e.message);
+            return;
+        }
+        
         // Disable button and show loading
         transcribeYoutubeBtn.disabled = true;
         transcribeYoutubeBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Processing...';
         
+        // Ask for live progress; partial text is shown as each segment is transcribed
+        const renderProgress = createProgressRenderer(transcribeYoutubeBtn, null);
+        let streamed = false;
+        
         fetch('/transcribe-youtube', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'application/x-ndjson, application/json',
             },
-            body: JSON.stringify({ youtube_url: youtubeUrl })
+            body: JSON.stringify({
+                youtube_url: youtubeUrl,
+                start: timeRange ? timeRange.start : null,
+                end: timeRange ? timeRange.end : null
+            })
         })
         .then(response => {
             if (!response.ok) {
@@ -266,6 +437,18 @@ document.addEventListener('DOMContentLoaded', function() {
                     throw new Error(data.error || 'Failed to get transcript from YouTube video');
                 });
             }
+            if (isProgressStream(response.headers.get('Content-Type')) && response.body) {
+                streamed = true;
+                return readProgressStream(response, renderProgress).then(result => {
+                    if (!result) {
+                        throw new Error('The connection closed before the transcript was ready. Please try again.');
+                    }
+                    if (result.stage === 'error') {
+                        throw new Error(result.error || 'Failed to get transcript from YouTube video');
+                    }
+                    return result;
+                });
+            }
             return response.json();
         })
         .then(data => {
@@ -277,6 +460,11 @@ document.addEventListener('DOMContentLoaded', function() {
                     transcriptElement.textContent = finalTranscript;
                 }
                 
+                // A streamed response couldn't update the session, so store it now
+                if (streamed) {
+                    saveTranscriptToServer(finalTranscript, data.transcript_id);
+                }
+                
                 // Enable generate notes button
                 if (generateNotesBtn) {
                     generateNotesBtn.disabled = false;
@@ -458,17 +646,29 @@ document.addEventListener('DOMContentLoaded', function() {
             showError('No structured notes to download. Please generate notes first.');
             return;
         }
-        
+        fetchPDF('/download-pdf', 'structured_notes.pdf', downloadPDFBtn, 'Download PDF');
+    }
+    
+    // Download PDF of the raw transcript (rendered page by page on the server, so any length works)
+    function downloadTranscriptPDF() {
+        const text = transcriptElement ? transcriptElement.textContent.trim() : '';
+        if (!text || text === 'Your transcript will appear here...') {
+            showError('No transcript to download. Please transcribe something first.');
+            return;
+        }
+        fetchPDF('/download-pdf?content=transcript', 'transcript.pdf', downloadTranscriptPDFBtn, 'Transcript PDF');
+    }
+    
+    function fetchPDF(url, filename, button, label) {
         // Show loading state
-        if (downloadPDFBtn) {
-            downloadPDFBtn.disabled = true;
-            downloadPDFBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Generating PDF...';
+        if (button) {
+            button.disabled = true;
+            button.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Generating PDF...';
         }
         
         // Fetch the PDF using AJAX
-        fetch('/download-pdf', {
-            method: 'POST'
-        })
+        // GET so the browser can revalidate its copy with If-None-Match instead of downloading it again
+        fetch(url)
         .then(response => {
             if (!response.ok) {
                 throw new Error('Failed to generate PDF');
@@ -477,13 +677,13 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .then(blob => {
             // Create a download link for the blob
-            const url = window.URL.createObjectURL(blob);
+            const blobUrl = window.URL.createObjectURL(blob);
             const a = document.createElement('a');
-            a.href = url;
-            a.download = 'structured_notes.pdf';
+            a.href = blobUrl;
+            a.download = filename;
             document.body.appendChild(a);
             a.click();
-            window.URL.revokeObjectURL(url);
+            window.URL.revokeObjectURL(blobUrl);
             a.remove();
         })
         .catch(error => {
@@ -492,11 +692,401 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .finally(() => {
             // Reset button state
-            if (downloadPDFBtn) {
-                downloadPDFBtn.disabled = false;
-                downloadPDFBtn.innerHTML = '<i class="fas fa-file-pdf me-1"></i> Download PDF';
+            if (button) {
+                button.disabled = false;
+                button.innerHTML = `<i class="fas fa-file-pdf me-1"></i> ${label}`;
+            }
+        });
+    }
+    
+    // Client-side audio normalization: decode, resample to 16 kHz mono and
+    // encode to Opus (or 16-bit WAV without WebCodecs) before uploading, so a
+    // large recording is uploaded at a fraction of its size. The server
+    // recognizes these files and skips its own conversion.
+    const TARGET_SAMPLE_RATE = 16000;
+    const OPUS_BITRATE = 32000;
+    const OPUS_DEFAULT_PRE_SKIP = 312; // libopus encoder delay, in 48 kHz samples
+    const CLIENT_NORMALIZE_MAX_BYTES = 200 * 1024 * 1024; // Decoding anything bigger needs too much memory
+    
+    async function normalizeAudioForUpload(file, timeRange) {
+        const OfflineContext = window.OfflineAudioContext || window.webkitOfflineAudioContext;
+        if (!OfflineContext || file.size > CLIENT_NORMALIZE_MAX_BYTES) {
+            return null;
+        }
+        
+        try {
+            const encoded = await file.arrayBuffer();
+            // decodeAudioData resamples to the context's sample rate
+            const context = new OfflineContext(1, 1, TARGET_SAMPLE_RATE);
+            const decoded = await context.decodeAudioData(encoded);
+            let samples = downmixToMono(decoded);
+            if (timeRange) {
+                // Only the requested part is encoded and uploaded
+                const from = Math.min(samples.length, Math.floor(timeRange.start * TARGET_SAMPLE_RATE));
+                const to = timeRange.end === null ? samples.length : Math.ceil(timeRange.end * TARGET_SAMPLE_RATE);
+                samples = samples.subarray(from, Math.min(samples.length, to));
+                if (samples.length === 0) {
+                    return null;  // Let the server report the range as outside the recording
+                }
+            }
+            const baseName = file.name.substring(0, file.name.lastIndexOf('.')) || 'audio';
+            
+            let normalized;
+            if (await opusEncodingSupported()) {
+                normalized = { blob: await encodeOggOpus(samples), name: baseName + '.ogg', format: 'opus' };
+            } else {
+                normalized = { blob: encodeWav16(samples), name: baseName + '.wav', format: 'wav' };
+            }
+            
+            console.log(`Normalized ${file.name} in the browser: ${file.size} -> ${normalized.blob.size} bytes (${normalized.format})`);
+            // Already-compact files (e.g. low-bitrate MP3) can come out bigger as WAV;
+            // a cut file is used regardless, so the range isn't applied twice
+            return (timeRange || normalized.blob.size < file.size) ? normalized : null;
+        } catch (e) {
+            console.warn("Client-side audio normalization failed, uploading the original file:", e);
+            return null;
+        }
+    }
+    
+    function downmixToMono(buffer) {
+        const mono = new Float32Array(buffer.length);
+        for (let c = 0; c < buffer.numberOfChannels; c++) {
+            const channel = buffer.getChannelData(c);
+            for (let i = 0; i < channel.length; i++) {
+                mono[i] += channel[i] / buffer.numberOfChannels;
+            }
+        }
+        return mono;
+    }
+    
+    function opusConfig() {
+        return { codec: 'opus', sampleRate: TARGET_SAMPLE_RATE, numberOfChannels: 1, bitrate: OPUS_BITRATE };
+    }
+    
+    async function opusEncodingSupported() {
+        if (typeof AudioEncoder === 'undefined' || typeof AudioData === 'undefined') {
+            return false;
+        }
+        try {
+            const support = await AudioEncoder.isConfigSupported(opusConfig());
+            return support.supported;
+        } catch (e) {
+            return false;
+        }
+    }
+    
+    async function encodeOggOpus(samples) {
+        const packets = [];
+        let preSkip = OPUS_DEFAULT_PRE_SKIP;
+        let encoderError = null;
+        
+        const encoder = new AudioEncoder({
+            output: function(chunk, metadata) {
+                const data = new Uint8Array(chunk.byteLength);
+                chunk.copyTo(data);
+                packets.push({ data: data, duration: chunk.duration || 20000 });
+                // Some encoders hand back their OpusHead, which has the real pre-skip
+                const description = metadata && metadata.decoderConfig && metadata.decoderConfig.description;
+                if (description) {
+                    const head = description instanceof ArrayBuffer
+                        ? new Uint8Array(description)
+                        : new Uint8Array(description.buffer, description.byteOffset, description.byteLength);
+                    if (head.length >= 12) {
+                        preSkip = head[10] | (head[11] << 8);
+                    }
+                }
+            },
+            error: function(e) {
+                encoderError = e;
             }
         });
+        encoder.configure(opusConfig());
+        
+        // Feed the encoder one second at a time
+        for (let offset = 0; offset < samples.length; offset += TARGET_SAMPLE_RATE) {
+            const frame = samples.subarray(offset, Math.min(offset + TARGET_SAMPLE_RATE, samples.length));
+            const audioData = new AudioData({
+                format: 'f32',
+                sampleRate: TARGET_SAMPLE_RATE,
+                numberOfFrames: frame.length,
+                numberOfChannels: 1,
+                timestamp: Math.round(offset * 1e6 / TARGET_SAMPLE_RATE),
+                data: frame
+            });
+            encoder.encode(audioData);
+            audioData.close();
+        }
+        await encoder.flush();
+        encoder.close();
+        
+        if (encoderError) {
+            throw encoderError;
+        }
+        if (!packets.length) {
+            throw new Error('Opus encoder produced no output');
+        }
+        return buildOggOpus(packets, preSkip, samples.length);
+    }
+    
+    // Ogg container for the raw Opus packets (RFC 7845)
+    const OGG_CRC_TABLE = (function() {
+        const table = new Uint32Array(256);
+        for (let i = 0; i < 256; i++) {
+            let r = i << 24;
+            for (let j = 0; j < 8; j++) {
+                r = (r & 0x80000000) ? ((r << 1) ^ 0x04c11db7) : (r << 1);
+            }
+            table[i] = r >>> 0;
+        }
+        return table;
+    })();
+    
+    function oggCrc(bytes) {
+        let crc = 0;
+        for (let i = 0; i < bytes.length; i++) {
+            crc = ((crc << 8) ^ OGG_CRC_TABLE[((crc >>> 24) ^ bytes[i]) & 0xff]) >>> 0;
+        }
+        return crc;
+    }
+    
+    function oggPage(packets, granule, serial, sequence, headerType) {
+        const lacing = [];
+        let bodyLength = 0;
+        packets.forEach(function(packet) {
+            let remaining = packet.length;
+            while (remaining >= 255) {
+                lacing.push(255);
+                remaining -= 255;
+            }
+            lacing.push(remaining);
+            bodyLength += packet.length;
+        });
+        
+        const page = new Uint8Array(27 + lacing.length + bodyLength);
+        const view = new DataView(page.buffer);
+        page.set([0x4f, 0x67, 0x67, 0x53], 0); // "OggS"
+        page[5] = headerType;
+        view.setUint32(6, granule % 0x100000000, true);
+        view.setUint32(10, Math.floor(granule / 0x100000000), true);
+        view.setUint32(14, serial, true);
+        view.setUint32(18, sequence, true);
+        page[26] = lacing.length;
+        page.set(lacing, 27);
+        let offset = 27 + lacing.length;
+        packets.forEach(function(packet) {
+            page.set(packet, offset);
+            offset += packet.length;
+        });
+        // The checksum is computed with its own field set to zero
+        view.setUint32(22, oggCrc(page), true);
+        return page;
+    }
+    
+    function opusHeadPacket(preSkip) {
+        const head = new Uint8Array(19);
+        const view = new DataView(head.buffer);
+        head.set(new TextEncoder().encode('OpusHead'), 0);
+        head[8] = 1; // Version
+        head[9] = 1; // Channels
+        view.setUint16(10, preSkip, true);
+        view.setUint32(12, TARGET_SAMPLE_RATE, true); // Original sample rate, used by the server to recognize the file
+        return head;
+    }
+    
+    function opusTagsPacket() {
+        const vendor = new TextEncoder().encode('speechscribe-web');
+        const tags = new Uint8Array(8 + 4 + vendor.length + 4);
+        const view = new DataView(tags.buffer);
+        tags.set(new TextEncoder().encode('OpusTags'), 0);
+        view.setUint32(8, vendor.length, true);
+        tags.set(vendor, 12);
+        return tags;
+    }
+    
+    function buildOggOpus(packets, preSkip, totalSamples) {
+        const serial = Math.floor(Math.random() * 0xffffffff) >>> 0;
+        const pages = [
+            oggPage([opusHeadPacket(preSkip)], 0, serial, 0, 0x02),
+            oggPage([opusTagsPacket()], 0, serial, 1, 0)
+        ];
+        
+        // Granule positions count 48 kHz samples including the pre-skip; the
+        // last page's granule trims the encoder's padding at the end
+        const endGranule = preSkip + Math.round(totalSamples * 48000 / TARGET_SAMPLE_RATE);
+        let granule = 0;
+        let sequence = 2;
+        let group = [];
+        let segments = 0;
+        let groupDuration = 0;
+        
+        packets.forEach(function(packet) {
+            const packetSegments = Math.floor(packet.data.length / 255) + 1;
+            // About one second of audio per page, and never more than 255 lacing values
+            if (group.length && (segments + packetSegments > 255 || groupDuration >= 1e6)) {
+                pages.push(oggPage(group, Math.min(granule, endGranule), serial, sequence++, 0));
+                group = [];
+                segments = 0;
+                groupDuration = 0;
+            }
+            group.push(packet.data);
+            segments += packetSegments;
+            groupDuration += packet.duration;
+            granule += Math.round(packet.duration * 48000 / 1e6);
+        });
+        pages.push(oggPage(group, endGranule, serial, sequence, 0x04));
+        
+        return new Blob(pages, { type: 'audio/ogg' });
+    }
+    
+    function encodeWav16(samples) {
+        const buffer = new ArrayBuffer(44 + samples.length * 2);
+        const view = new DataView(buffer);
+        const writeAscii = function(offset, text) {
+            for (let i = 0; i < text.length; i++) {
+                view.setUint8(offset + i, text.charCodeAt(i));
+            }
+        };
+        
+        writeAscii(0, 'RIFF');
+        view.setUint32(4, 36 + samples.length * 2, true);
+        writeAscii(8, 'WAVE');
+        writeAscii(12, 'fmt ');
+        view.setUint32(16, 16, true);
+        view.setUint16(20, 1, true); // PCM
+        view.setUint16(22, 1, true); // Mono
+        view.setUint32(24, TARGET_SAMPLE_RATE, true);
+        view.setUint32(28, TARGET_SAMPLE_RATE * 2, true);
+        view.setUint16(32, 2, true);
+        view.setUint16(34, 16, true);
+        writeAscii(36, 'data');
+        view.setUint32(40, samples.length * 2, true);
+        for (let i = 0; i < samples.length; i++) {
+            const s = Math.max(-1, Math.min(1, samples[i]));
+            view.setInt16(44 + i * 2, s < 0 ? s * 0x8000 : s * 0x7fff, true);
+        }
+        return new Blob([buffer], { type: 'audio/wav' });
+    }
+    
+    // Bytes of a file sent to /probe instead of the whole file (the server's PROBE_HEAD_BYTES and PROBE_TAIL_BYTES)
+    const PROBE_HEAD_BYTES = 65536;
+    const PROBE_TAIL_BYTES = 65536;
+    let uploadProbe = null;  // {file, rangeKey, result} of the latest probe
+    
+    // "1:02:03" or "4:05" for a number of seconds
+    function formatDuration(seconds) {
+        const total = Math.round(seconds);
+        const hours = Math.floor(total / 3600);
+        const minutes = Math.floor((total % 3600) / 60);
+        const secs = String(total % 60).padStart(2, '0');
+        return hours ? `${hours}:${String(minutes).padStart(2, '0')}:${secs}` : `${minutes}:${secs}`;
+    }
+    
+    // One-line summary of a /probe result
+    function describeProbe(result) {
+        const parts = [];
+        const duration = result.range_duration != null ? result.range_duration : result.duration;
+        if (duration != null) {
+            parts.push((result.duration_estimated ? 'about ' : '') + formatDuration(duration));
+        }
+        if (result.codec) {
+            parts.push(result.codec.toUpperCase());
+        }
+        if (result.estimated_seconds != null) {
+            parts.push(result.estimated_seconds < 60
+                ? 'should take under a minute'
+                : `should take about ${Math.round(result.estimated_seconds / 60)} min`);
+        }
+        return parts.join(' · ');
+    }
+    
+    // Ask the server about a file from its first and last bytes, before uploading any of it
+    function probeUpload(file, timeRange) {
+        const formData = new FormData();
+        formData.append('head', file.slice(0, PROBE_HEAD_BYTES), 'head');
+        if (file.size > PROBE_HEAD_BYTES) {
+            formData.append('tail', file.slice(Math.max(0, file.size - PROBE_TAIL_BYTES)), 'tail');
+        }
+        formData.append('size', file.size);
+        formData.append('filename', file.name);
+        if (timeRange) {
+            formData.append('start', timeRange.start);
+            formData.append('end', timeRange.end === null ? '' : timeRange.end);
+        }
+        return fetch('/probe', { method: 'POST', body: formData }).then(response => response.json());
+    }
+    
+    // Probe the selected file and show what it is, or why it would be rejected
+    function refreshUploadProbe() {
+        if (!uploadProbeInfo) {
+            return;
+        }
+        const file = audioFileInput.files.length ? audioFileInput.files[0] : null;
+        let timeRange = null;
+        try {
+            timeRange = readTimeRange(uploadStartInput, uploadEndInput);
+        } catch (e) {
+            return;  // Reported when the user clicks transcribe
+        }
+        uploadProbeInfo.textContent = '';
+        uploadProbeInfo.classList.remove('text-danger');
+        if (!file) {
+            uploadProbe = null;
+            return;
+        }
+        const probe = { file: file, rangeKey: JSON.stringify(timeRange), result: null };
+        uploadProbe = probe;
+        probeUpload(file, timeRange).then(function(result) {
+            if (uploadProbe !== probe) {
+                return;  // A newer file or range was chosen meanwhile
+            }
+            probe.result = result;
+            uploadProbeInfo.textContent = result.error || describeProbe(result);
+            uploadProbeInfo.classList.toggle('text-danger', Boolean(result.error));
+        }).catch(function(error) {
+            console.warn('Could not probe the file:', error);
+        });
+    }
+    
+    if (audioFileInput) {
+        audioFileInput.addEventListener('change', refreshUploadProbe);
+        [uploadStartInput, uploadEndInput].forEach(function(input) {
+            if (input) input.addEventListener('change', refreshUploadProbe);
+        });
+    }
+    
+    // Warm the server's caption and metadata caches while the user is still on the form
+    const PREFETCH_DELAY_MS = 500;
+    let prefetchTimer = null;
+    let prefetchedVideoId = null;
+    
+    // The video ID of a youtube.com/watch or youtu.be URL, or null
+    function youtubeVideoId(url) {
+        const match = url.match(/^https:\/\/(?:(?:www\.)?youtube\.com\/watch\?(?:[^&]*&)*v=|youtu\.be\/)([\w-]{6,})/);
+        return match ? match[1] : null;
+    }
+    
+    function prefetchYoutube() {
+        const youtubeUrl = youtubeUrlInput.value.trim();
+        const videoId = youtubeVideoId(youtubeUrl);
+        if (!videoId || videoId === prefetchedVideoId) {
+            return;
+        }
+        prefetchedVideoId = videoId;
+        fetch('/prefetch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ youtube_url: youtubeUrl })
+        }).catch(function(error) {
+            console.warn('Could not prefetch the video:', error);
+        });
+    }
+    
+    if (youtubeUrlInput) {
+        // Debounced, so typing a URL character by character doesn't send each prefix
+        youtubeUrlInput.addEventListener('input', function() {
+            clearTimeout(prefetchTimer);
+            prefetchTimer = setTimeout(prefetchYoutube, PREFETCH_DELAY_MS);
+        });
     }
     
     // Add event listeners
@@ -505,6 +1095,7 @@ document.addEventListener('DOMContentLoaded', function() {
     if (clearTranscriptBtn) clearTranscriptBtn.addEventListener('click', clearTranscript);
     if (generateNotesBtn) generateNotesBtn.addEventListener('click', generateNotes);
     if (downloadPDFBtn) downloadPDFBtn.addEventListener('click', downloadPDF);
+    if (downloadTranscriptPDFBtn) downloadTranscriptPDFBtn.addEventListener('click', downloadTranscriptPDF);
     if (transcribeYoutubeBtn) transcribeYoutubeBtn.addEventListener('click', getYoutubeTranscript);
     if (useManualTranscriptBtn) useManualTranscriptBtn.addEventListener('click', useManualTranscript);
     
@@ -530,6 +1121,21 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
             
+            let timeRange;
+            try {
+                timeRange = readTimeRange(uploadStartInput, uploadEndInput);
+            } catch (e) {
+                showError(e.message);
+                return;
+            }
+            
+            // Don't upload a file the probe already found would be rejected
+            if (uploadProbe && uploadProbe.file === file && uploadProbe.rangeKey === JSON.stringify(timeRange)
+                    && uploadProbe.result && uploadProbe.result.error) {
+                showError(uploadProbe.result.error);
+                return;
+            }
+            
             // Show loading state
             transcribeAudioFileBtn.disabled = true;
             transcribeAudioFileBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Processing...';
@@ -543,121 +1149,167 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
             }
             
-            // Create form data
-            const formData = new FormData();
-            formData.append('audio_file', file);
+            // Downsample and compress in the browser first when it's supported
+            transcribeAudioFileBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Preparing audio...';
+            normalizeAudioForUpload(file, timeRange).then(function(normalized) {
+                transcribeAudioFileBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Processing...';
+                
+                // Create form data
+                const formData = new FormData();
+                if (normalized) {
+                    // Already cut to the time range in the browser
+                    formData.append('audio_file', normalized.blob, normalized.name);
+                    formData.append('client_normalized', normalized.format);
+                } else {
+                    formData.append('audio_file', file);
+                    if (timeRange) {
+                        // The server decodes only this part
+                        formData.append('start', timeRange.start);
+                        if (timeRange.end !== null) {
+                            formData.append('end', timeRange.end);
+                        }
+                    }
+                }
             
-            // Debug: Log form data (can't see the actual file content but we can see if it's attached)
-            console.log("FormData created with file:", file.name);
+                // Debug: Log form data (can't see the actual file content but we can see if it's attached)
+                console.log("FormData created with file:", normalized ? normalized.name : file.name);
             
-            // Send to server
-            const xhr = new XMLHttpRequest();
+                // Send to server
+                const xhr = new XMLHttpRequest();
+                const progressBar = uploadProgress ? uploadProgress.querySelector('.progress-bar') : null;
+                const renderProgress = createProgressRenderer(transcribeAudioFileBtn, progressBar);
+                let streamOffset = 0;
+                let streamResult = null;
+                const handleStreamEvent = function(event) {
+                    if (event.stage === 'done' || event.stage === 'error') {
+                        streamResult = event;
+                    } else {
+                        renderProgress(event);
+                    }
+                };
             
-            // Track upload progress
-            xhr.upload.addEventListener('progress', function(e) {
-                if (e.lengthComputable && uploadProgress) {
-                    const percentComplete = Math.round((e.loaded / e.total) * 100);
-                    console.log(`Upload progress: ${percentComplete}%`);
-                    const progressBar = uploadProgress.querySelector('.progress-bar');
-                    if (progressBar) {
-                        progressBar.style.width = percentComplete + '%';
-                        progressBar.textContent = percentComplete + '%';
+                // Show server-side progress as it's streamed back
+                xhr.addEventListener('progress', function() {
+                    if (isProgressStream(xhr.getResponseHeader('Content-Type'))) {
+                        streamOffset = consumeProgressLines(xhr.responseText, streamOffset, handleStreamEvent);
                     }
-                }
-            });
+                });
             
-            xhr.addEventListener('load', function() {
-                console.log("XHR load event, status:", xhr.status);
-                if (xhr.status === 200) {
-                    // Parse the response
-                    const response = JSON.parse(xhr.responseText);
-                    console.log("Response:", response);
+                // Track upload progress
+                xhr.upload.addEventListener('progress', function(e) {
+                    if (e.lengthComputable && uploadProgress) {
+                        const percentComplete = Math.round((e.loaded / e.total) * 100);
+                        console.log(`Upload progress: ${percentComplete}%`);
+                        const progressBar = uploadProgress.querySelector('.progress-bar');
+                        if (progressBar) {
+                            progressBar.style.width = percentComplete + '%';
+                            progressBar.textContent = percentComplete + '%';
+                        }
+                    }
+                });
+            
+                xhr.addEventListener('load', function() {
+                    console.log("XHR load event, status:", xhr.status);
+                    // A streamed response is always 200; its last event carries the real status
+                    let status = xhr.status;
+                    let streamedResponse = null;
+                    if (status === 200 && isProgressStream(xhr.getResponseHeader('Content-Type'))) {
+                        streamOffset = consumeProgressLines(xhr.responseText, streamOffset, handleStreamEvent);
+                        streamedResponse = streamResult || { error: 'The connection closed before the transcript was ready.' };
+                        status = streamResult ? streamResult.status : 500;
+                    }
+                    if (status === 200) {
+                        // Parse the response
+                        const response = streamedResponse || JSON.parse(xhr.responseText);
+                        console.log("Response:", response);
                     
-                    // Set the transcript
-                    if (response.transcript) {
-                        console.log("Setting transcript:", response.transcript);
-                        // No need to store in client-side session, the server already has it
-                        finalTranscript = response.transcript;
-                        if (transcriptElement) {
-                            transcriptElement.textContent = finalTranscript;
+                        // Set the transcript
+                        if (response.transcript) {
+                            console.log("Setting transcript:", response.transcript);
+                            // No need to store in client-side session, the server already has it
+                            finalTranscript = response.transcript;
+                            if (transcriptElement) {
+                                transcriptElement.textContent = finalTranscript;
                             
-                            // Make sure the tab with the transcript is active
-                            const transcriptTab = document.querySelector('button[data-bs-target="#transcript-tab"]');
-                            if (transcriptTab) {
-                                const tab = new bootstrap.Tab(transcriptTab);
-                                tab.show();
-                            }
+                                // Make sure the tab with the transcript is active
+                                const transcriptTab = document.querySelector('button[data-bs-target="#transcript-tab"]');
+                                if (transcriptTab) {
+                                    const tab = new bootstrap.Tab(transcriptTab);
+                                    tab.show();
+                                }
                             
-                            // Scroll to the transcript
-                            document.getElementById('transcript-container').scrollIntoView({ behavior: 'smooth' });
-                        }
+                                // Scroll to the transcript
+                                document.getElementById('transcript-container').scrollIntoView({ behavior: 'smooth' });
+                            }
                         
-                        // Store in session
-                        saveTranscriptToServer(finalTranscript);
+                            // Store in session
+                            saveTranscriptToServer(finalTranscript, response.transcript_id);
                         
-                        // Enable generate notes button
-                        if (generateNotesBtn) {
-                            generateNotesBtn.disabled = false;
-                        }
+                            // Enable generate notes button
+                            if (generateNotesBtn) {
+                                generateNotesBtn.disabled = false;
+                            }
                         
-                        // Reset form
-                        audioFileInput.value = '';
-                    }
-                } else {
-                    // Handle error
-                    console.error("Error response:", xhr.status, xhr.responseText);
-                    try {
-                        const response = JSON.parse(xhr.responseText);
-                        if (xhr.status === 503) {
-                            // Special handling for service unavailable
-                            const errorModal = new bootstrap.Modal(document.getElementById('errorModal'));
-                            const errorElement = document.getElementById('error-message');
-                            errorElement.innerHTML = `
-                                <div class="alert alert-warning">
-                                    <h5><i class="fas fa-exclamation-triangle me-2"></i>Service Limitation</h5>
-                                    <p>${response.error || 'Online speech recognition is currently unavailable.'}</p>
-                                    <hr>
-                                    <p class="mb-0">Suggestions:</p>
-                                    <ul>
-                                        <li>Try the YouTube transcription tab instead</li>
-                                        <li>Use the manual text input if you have a transcript</li>
-                                    </ul>
-                                </div>
-                            `;
-                            errorModal.show();
-                        } else {
-                            showError(`Error: ${response.error || 'Failed to transcribe audio file'}`);
+                            // Reset form
+                            audioFileInput.value = '';
+                        }
+                    } else {
+                        // Handle error
+                        console.error("Error response:", status, xhr.responseText);
+                        try {
+                            const response = streamedResponse || JSON.parse(xhr.responseText);
+                            if (status === 503) {
+                                // Special handling for service unavailable
+                                const errorModal = new bootstrap.Modal(document.getElementById('errorModal'));
+                                const errorElement = document.getElementById('error-message');
+                                errorElement.innerHTML = `
+                                    <div class="alert alert-warning">
+                                        <h5><i class="fas fa-exclamation-triangle me-2"></i>Service Limitation</h5>
+                                        <p>${response.error || 'Online speech recognition is currently unavailable.'}</p>
+                                        <hr>
+                                        <p class="mb-0">Suggestions:</p>
+                                        <ul>
+                                            <li>Try the YouTube transcription tab instead</li>
+                                            <li>Use the manual text input if you have a transcript</li>
+                                        </ul>
+                                    </div>
+                                `;
+                                errorModal.show();
+                            } else {
+                                showError(`Error: ${response.error || 'Failed to transcribe audio file'}`);
+                            }
+                        } catch (e) {
+                            showError('Error: Failed to transcribe audio file. Server returned an invalid response.');
                         }
-                    } catch (e) {
-                        showError('Error: Failed to transcribe audio file. Server returned an invalid response.');
                     }
-                }
                 
-                // Reset UI state
-                if (uploadProgress) {
-                    uploadProgress.classList.add('d-none');
-                }
-                transcribeAudioFileBtn.disabled = false;
-                transcribeAudioFileBtn.innerHTML = '<i class="fas fa-upload me-1"></i> Upload & Transcribe';
-            });
+                    // Reset UI state
+                    if (uploadProgress) {
+                        uploadProgress.classList.add('d-none');
+                    }
+                    transcribeAudioFileBtn.disabled = false;
+                    transcribeAudioFileBtn.innerHTML = '<i class="fas fa-upload me-1"></i> Upload & Transcribe';
+                });
             
-            xhr.addEventListener('error', function(e) {
-                console.error("XHR error event:", e);
-                showError('Error: Network error while uploading file. Please try again.');
+                xhr.addEventListener('error', function(e) {
+                    console.error("XHR error event:", e);
+                    showError('Error: Network error while uploading file. Please try again.');
                 
-                // Reset UI state
-                if (uploadProgress) {
-                    uploadProgress.classList.add('d-none');
-                }
-                transcribeAudioFileBtn.disabled = false;
-                transcribeAudioFileBtn.innerHTML = '<i class="fas fa-upload me-1"></i> Upload & Transcribe';
-            });
+                    // Reset UI state
+                    if (uploadProgress) {
+                        uploadProgress.classList.add('d-none');
+                    }
+                    transcribeAudioFileBtn.disabled = false;
+                    transcribeAudioFileBtn.innerHTML = '<i class="fas fa-upload me-1"></i> Upload & Transcribe';
+                });
             
-            // Open and send the request
-            console.log("Opening XHR request to /transcribe-audio-file");
-            xhr.open('POST', '/transcribe-audio-file', true);
-            xhr.send(formData);
-            console.log("XHR request sent with form data");
+                // Open and send the request
+                console.log("Opening XHR request to /transcribe-audio-file");
+                xhr.open('POST', '/transcribe-audio-file', true);
+                xhr.setRequestHeader('Accept', 'application/x-ndjson, application/json');
+                xhr.send(formData);
+                console.log("XHR request sent with form data");
+            });
         });
     }
 });
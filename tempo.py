@@ -0,0 +1,254 @@
+import os
+import mmap
+import time
+import wave
+import logging
+import numpy as np
+from metrics import metrics
+from wavstream import read_wav_header, WAVE_FORMAT_PCM
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings
+TEMPO_FACTOR = float(os.environ.get("TEMPO_FACTOR", 1.0))  # 1.3-1.5 speeds speech up with little loss; 1.0 disables
+MAX_TEMPO_FACTOR = 2.0  # Whisper's accuracy falls off quickly beyond this
+FRAME_SECONDS = 0.03  # WSOLA frame; a few pitch periods of speech
+TOLERANCE_SECONDS = 0.008  # How far a frame may move from its nominal position to stay in phase
+DECIMATION = 4  # The coarse similarity search runs at a quarter of the sample rate
+BLOCK_OUTPUT_FRAMES = 2048  # Frames overlap-added per block; bounds peak memory
+ANCHOR_EVERY = 16  # Frames between the time-map anchors kept for timestamps
+
+
+def tempo_factor(factor=None):
+    """
+    The configured speed-up, clamped to what Whisper handles
+
+    Returns:
+        float: 1.0 when tempo compression is off
+    """
+    factor = TEMPO_FACTOR if factor is None else factor
+    return min(max(1.0, factor), MAX_TEMPO_FACTOR)
+
+
+class TempoMap(object):
+    """
+    Maps times in tempo-compressed audio back to the original recording,
+    through anchors recorded while compressing
+    """
+
+    def __init__(self, compressed_times, original_times):
+        self.compressed_times = np.asarray(compressed_times, dtype=np.float64)
+        self.original_times = np.asarray(original_times, dtype=np.float64)
+
+    def to_original(self, seconds):
+        """
+        Args:
+            seconds (float or array): Time(s) in the compressed audio
+
+        Returns:
+            float or array: The same moment(s) in the original recording
+        """
+        mapped = np.interp(seconds, self.compressed_times, self.original_times)
+        return float(mapped) if np.ndim(mapped) == 0 else mapped
+
+
+def restore_timestamps(segments, tempo_map):
+    """
+    Move timestamped segments (e.g. Whisper's verbose_json segments or words)
+    from the compressed audio's timeline back to the original's
+
+    Args:
+        segments (list): Dicts with 'start' and 'end' in compressed seconds
+        tempo_map (TempoMap): From compress_wav, or None if nothing was compressed
+
+    Returns:
+        list: Copies of the segments with original-timeline 'start' and 'end'
+    """
+    if tempo_map is None:
+        return [dict(segment) for segment in segments]
+    restored = []
+    for segment in segments:
+        segment = dict(segment)
+        for key in ("start", "end"):
+            if segment.get(key) is not None:
+                segment[key] = round(tempo_map.to_original(segment[key]), 3)
+        restored.append(segment)
+    return restored
+
+
+def _decimate(samples):
+    usable = len(samples) - len(samples) % DECIMATION
+    return samples[:usable].reshape(-1, DECIMATION).mean(axis=1)
+
+
+def _best_offset(candidates, template):
+    """
+    Index into candidates where template fits best, by normalized cross-correlation
+
+    Args:
+        candidates (array): Samples covering every allowed frame position
+        template (array): The natural continuation of the previous frame
+    """
+    correlation = np.correlate(candidates, template, mode="valid")
+    energy = np.cumsum(np.concatenate(([0.0], candidates * candidates)))
+    window_energy = energy[len(template):] - energy[:-len(template)]
+    return int(np.argmax(correlation / np.sqrt(np.maximum(window_energy[:len(correlation)], 1e-9))))
+
+
+def _choose_positions(x, previous, first_frame, count, analysis_hop, frame, hop, tolerance):
+    """
+    WSOLA's sequential step: pick each frame's input position so its start
+    continues the previously chosen frame's waveform (searched coarsely on a
+    decimated copy, then refined at full rate)
+
+    Returns:
+        array: Input sample positions of frames first_frame .. first_frame + count - 1
+    """
+    last_start = len(x) - frame
+    nominal = np.minimum(np.round(np.arange(first_frame, first_frame + count) * analysis_hop).astype(np.int64), last_start)
+
+    # One decimated copy of the span the whole block searches
+    span_start = max(0, min(previous + hop, nominal[0] - tolerance))
+    span_start -= span_start % DECIMATION
+    span_end = min(len(x), max(nominal[-1], previous) + tolerance + hop + frame + DECIMATION)
+    coarse = _decimate(x[span_start:span_end].astype(np.float32))
+    coarse_frame = frame // DECIMATION
+
+    positions = np.empty(count, dtype=np.int64)
+    for index in range(count):
+        if first_frame + index == 0:
+            positions[index] = 0
+            previous = 0
+            continue
+        natural = min(previous + hop, last_start)
+        low = max(0, nominal[index] - tolerance)
+        high = min(last_start, nominal[index] + tolerance)
+
+        # Coarse search in the decimated copy
+        template_at = (natural - span_start) // DECIMATION
+        low_at = (low - span_start) // DECIMATION
+        high_at = (high - span_start) // DECIMATION
+        template = coarse[template_at:template_at + coarse_frame]
+        candidates = coarse[low_at:high_at + coarse_frame]
+        if len(template) == coarse_frame and len(candidates) > coarse_frame:
+            best = span_start + (low_at + _best_offset(candidates, template)) * DECIMATION
+        else:
+            best = nominal[index]
+
+        # Refine within one decimation step at the full rate
+        low = max(low, best - DECIMATION)
+        high = min(high, best + DECIMATION)
+        template = x[natural:natural + frame].astype(np.float32)
+        candidates = x[low:high + frame].astype(np.float32)
+        if len(template) == frame and len(candidates) > frame:
+            best = low + _best_offset(candidates, template)
+        positions[index] = previous = min(max(0, best), last_start)
+    return positions
+
+
+def compress_wav(input_path, output_path, factor=None, cancelled=None):
+    """
+    Speed up speech without changing its pitch (WSOLA time-scale modification)
+
+    The input is memory-mapped and processed in blocks of frames: each frame's
+    position is chosen sequentially, then the block's frames are gathered,
+    windowed and overlap-added as whole NumPy arrays. Peak memory depends on
+    BLOCK_OUTPUT_FRAMES, not on the length of the recording.
+
+    Args:
+        input_path (str): 16-bit PCM mono WAV (what conversion produces)
+        output_path (str): Where to write the compressed WAV, same format
+        factor (float, optional): Speed-up; TEMPO_FACTOR by default
+        cancelled (function, optional): Checked between blocks; returning True
+            stops the work (the conversion pool's cancel file)
+
+    Returns:
+        TempoMap: Maps compressed times back to the original, or None if the
+            factor is 1 and nothing was written
+
+    Raises:
+        ValueError: If the input isn't 16-bit PCM mono WAV
+        RuntimeError: If cancelled
+    """
+    factor = tempo_factor(factor)
+    if factor <= 1.0:
+        return None
+    fmt = read_wav_header(input_path)
+    if fmt.audio_format != WAVE_FORMAT_PCM or fmt.channels != 1 or fmt.bits_per_sample != 16:
+        raise ValueError("Tempo compression needs 16-bit PCM mono WAV")
+
+    started = time.time()
+    rate = fmt.sample_rate
+    frame = int(round(FRAME_SECONDS * rate / (2 * DECIMATION))) * 2 * DECIMATION  # Whole coarse samples per half frame
+    hop = frame // 2
+    analysis_hop = hop * factor
+    tolerance = int(round(TOLERANCE_SECONDS * rate))
+    # Periodic Hann: overlapping by half, consecutive windows sum to exactly 1
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)
+    offsets = np.arange(frame)
+
+    compressed_times, original_times = [], []
+    with open(input_path, "rb") as f, wave.open(output_path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+
+        if fmt.frames < frame:
+            # Too short to have anything to compress
+            f.seek(fmt.data_offset)
+            out.writeframes(f.read(fmt.frames * 2))
+            return TempoMap([0.0, fmt.duration], [0.0, fmt.duration])
+
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            x = np.frombuffer(mapped, dtype="<i2", count=fmt.frames, offset=fmt.data_offset)
+            total = int((fmt.frames - frame) / analysis_hop) + 1
+            previous = 0
+            carry = np.zeros(hop, dtype=np.float32)  # Second half of the last frame, still to be added
+
+            for first in range(0, total, BLOCK_OUTPUT_FRAMES):
+                if cancelled is not None and cancelled():
+                    raise RuntimeError("Tempo compression was cancelled")
+                count = min(BLOCK_OUTPUT_FRAMES, total - first)
+                positions = _choose_positions(x, previous, first, count, analysis_hop, frame, hop, tolerance)
+                previous = int(positions[-1])
+
+                # Gather, window and overlap-add the block's frames all at once
+                frames = x[positions[:, None] + offsets].astype(np.float32) * (window / 32768.0)
+                block = frames[:, :hop].copy()
+                block[0] += carry
+                block[1:] += frames[:-1, hop:]
+                carry = frames[-1, hop:]
+                out.writeframes(_to_pcm16(block.ravel()))
+                del frames, block
+
+                anchors = np.arange(first, first + count, ANCHOR_EVERY)
+                compressed_times.extend((anchors * hop / float(rate)).tolist())
+                original_times.extend((positions[anchors - first] / float(rate)).tolist())
+
+            out.writeframes(_to_pcm16(carry))
+        finally:
+            # The array is a view of the map, which can't close while it exists (e.g. after a cancel)
+            x = None
+            mapped.close()
+
+    compressed_duration = (total + 1) * hop / float(rate)
+    compressed_times.append(compressed_duration)
+    original_times.append(fmt.duration)
+
+    elapsed = time.time() - started
+    metrics.observe("tempo.seconds", elapsed)
+    metrics.observe("tempo.audio_seconds_saved", fmt.duration - compressed_duration)
+    logger.info(
+        f"Compressed {fmt.duration:.0f}s of audio to {compressed_duration:.0f}s ({factor:g}x) in {elapsed:.2f}s"
+    )
+    return TempoMap(compressed_times, original_times)
+
+
+def _to_pcm16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
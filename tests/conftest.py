@@ -0,0 +1,22 @@
+"""
+Test setup: the app's modules read their settings and create their cache
+directories at import time, so the environment and working directory are
+pointed at a scratch directory before anything from the repo is imported.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix="speechscribe-tests-")
+
+sys.path.insert(0, ROOT)
+os.chdir(SCRATCH)
+os.environ["GROQ_API_KEY"] = "test"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(SCRATCH, 'speechscribe.db')}"
+os.environ["WORKSPACE_ROOT"] = SCRATCH
+os.environ["LLM_CACHE_DIR"] = os.path.join(SCRATCH, "cache", "completions")
+os.environ["PDF_CACHE_DIR"] = os.path.join(SCRATCH, "cache", "pdf")
+os.environ["SINGLE_FLIGHT_DIR"] = os.path.join(SCRATCH, "cache", "singleflight")
+os.environ["PREFETCH"] = "0"
+os.environ.pop("SHARED_STATE", None)
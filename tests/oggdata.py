@@ -0,0 +1,26 @@
+"""Builders for minimal Ogg Opus streams, shared by the probe and conversion tests"""
+import struct
+
+
+def ogg_page(payload, granule=0, sequence=0, flags=0):
+    segments = []
+    remaining = len(payload)
+    while remaining >= 255:
+        segments.append(255)
+        remaining -= 255
+    segments.append(remaining)
+    header = b"OggS" + bytes([0, flags]) + struct.pack("<qII", granule, 1, sequence) + b"\0\0\0\0"
+    return header + bytes([len(segments)]) + bytes(segments) + payload
+
+
+def opus_head(channels=1, pre_skip=312, input_rate=16000):
+    return b"OpusHead" + bytes([1, channels]) + struct.pack("<HIhB", pre_skip, input_rate, 0, 0)
+
+
+def ogg_opus(seconds, channels=1, input_rate=16000, pre_skip=312):
+    """Identification page, a comment page and one audio page ending at the given duration"""
+    return (
+        ogg_page(opus_head(channels, pre_skip, input_rate), flags=2)
+        + ogg_page(b"OpusTags" + b"\0" * 8, sequence=1)
+        + ogg_page(b"\xfc" * 300 + b"OggS inside packet data", granule=int(seconds * 48000) + pre_skip, sequence=2, flags=4)
+    )
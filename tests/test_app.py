@@ -0,0 +1,99 @@
+import io
+import functools
+import json
+import wave
+
+import pytest
+
+import app as app_module
+import deadline
+import memory
+from progress import report
+
+
+@pytest.fixture
+def client():
+    app_module.app.config["TESTING"] = True
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def test_metrics_is_loopback_only_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", None)
+
+    assert client.get("/metrics").status_code == 200
+    assert client.get("/metrics", environ_base={"REMOTE_ADDR": "203.0.113.5"}).status_code == 403
+    assert client.get("/metrics", headers={"X-Forwarded-For": "203.0.113.5"}).status_code == 403
+
+
+def test_metrics_requires_the_token_when_configured(client, monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", "secret")
+
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"}, environ_base={"REMOTE_ADDR": "203.0.113.5"})
+    assert response.status_code == 200
+    assert "counters" in response.get_json()
+
+
+def wav_bytes(seconds=1.0, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(b"\0\0" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def test_upload_streams_progress_and_partial_transcripts(client, monkeypatch):
+    def fake_process(upload, time_range=None):
+        report("transcribing", segment=1, segments=2)
+        report("partial", text="first half")
+        report("transcribing", segment=2, segments=2)
+        return "first half second half"
+
+    monkeypatch.setattr(app_module, "process_uploaded_audio", fake_process)
+    response = client.post(
+        "/transcribe-audio-file",
+        data={"audio_file": (io.BytesIO(wav_bytes()), "progress-test.wav")},
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert response.mimetype == "application/x-ndjson"
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    stages = [event["stage"] for event in events]
+    assert stages[0] == "started" and stages[-1] == "done"
+    assert {"stage": "partial", "text": "first half"} in events
+    assert events[-1]["transcript"] == "first half second half"
+    assert events[-1]["status"] == 200
+
+
+def test_invalid_time_range_is_a_bad_request(client):
+    response = client.post("/transcribe-youtube", json={
+        "youtube_url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ", "start": "5:00", "end": "1:00",
+    })
+    assert response.status_code == 400
+    assert "end time" in response.get_json()["error"]
+
+
+def test_upload_over_the_memory_budget_is_refused(client, monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_BUDGET_MB", 100)  # Below even a short recording's estimate
+    response = client.post(
+        "/transcribe-audio-file", data={"audio_file": (io.BytesIO(wav_bytes(seconds=2.0)), "budget-test.wav")},
+    )
+    assert response.status_code == 413
+    assert "too long" in response.get_json()["error"]
+
+
+def test_recording_is_transcribed_within_the_request_deadline(client, monkeypatch):
+    def slow_transcribe(audio_path, source=None):
+        deadline.current_deadline().wait(60, "transcribing")
+        return "too late"
+
+    monkeypatch.setattr(app_module, "request_deadline", functools.partial(deadline.request_deadline, seconds=0.2))
+    monkeypatch.setattr(app_module, "transcribe_audio", slow_transcribe)
+    response = client.post("/transcribe", data={"audio": (io.BytesIO(wav_bytes()), "recording.wav")})
+
+    assert response.status_code == 504
+    assert "longer than the server allows" in response.get_json()["error"]
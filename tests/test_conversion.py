@@ -0,0 +1,112 @@
+import os
+import time
+import wave
+import threading
+
+import numpy as np
+import pytest
+
+import conversion
+from conversion import ConversionPool, ConversionQueueFull, convert_audio, _run_cancellable
+from deadline import RequestCancelled, request_deadline
+
+
+def write_wav(path, rate, seconds=1.0, channels=1):
+    samples = (0.3 * np.sin(2 * np.pi * 220 * np.arange(int(rate * seconds) * channels) / rate) * 32767).astype("<i2")
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(samples.tobytes())
+
+
+def test_non_wav_always_goes_through_the_cancellable_ffmpeg_cli(tmp_path, monkeypatch):
+    commands = []
+    monkeypatch.setattr(conversion, "FFMPEG_AVAILABLE", True)
+    monkeypatch.setattr(conversion, "_run_cancellable", lambda command, cancel_path=None: commands.append((command, cancel_path)))
+
+    assert convert_audio("in.mp3", "out.wav", ".mp3", time_range=(30, 90), cancel_path="out.wav.cancel")
+    command, cancel_path = commands[0]
+    assert command[0] == "ffmpeg" and cancel_path == "out.wav.cancel"
+    assert command[command.index("-ss") + 1] == "30" and command[command.index("-t") + 1] == "60"
+    assert command[command.index("-ac") + 1] == "1" and command[command.index("-ar") + 1] == "16000"
+
+
+def test_non_wav_without_ffmpeg_fails_clearly(monkeypatch):
+    monkeypatch.setattr(conversion, "FFMPEG_AVAILABLE", False)
+
+    with pytest.raises(RuntimeError, match="ffmpeg is required"):
+        convert_audio("in.m4a", "out.wav", ".m4a")
+
+
+def test_cancel_file_stops_the_wav_fast_path(tmp_path):
+    write_wav(tmp_path / "in.wav", 44100)
+    cancel_path = tmp_path / "out.wav.cancel"
+    cancel_path.touch()
+
+    with pytest.raises(RuntimeError, match="cancelled"):
+        convert_audio(str(tmp_path / "in.wav"), str(tmp_path / "out.wav"), ".wav", cancel_path=str(cancel_path))
+
+
+def test_cancel_file_kills_the_process(tmp_path):
+    cancel_path = tmp_path / "job.cancel"
+    threading.Timer(0.3, cancel_path.touch).start()
+    started = time.time()
+
+    with pytest.raises(RuntimeError, match="cancelled"):
+        _run_cancellable(["sleep", "30"], cancel_path=str(cancel_path))
+    assert time.time() - started < 5
+
+
+def test_timeout_kills_the_process():
+    with pytest.raises(RuntimeError, match="longer than"):
+        _run_cancellable(["sleep", "30"], timeout=0.3)
+
+
+def test_pool_converts_wav_and_frees_its_slot(tmp_path):
+    write_wav(tmp_path / "in.wav", 44100, channels=2)
+    pool = ConversionPool(workers=1, queue_size=0)
+    try:
+        assert pool.convert(str(tmp_path / "in.wav"), str(tmp_path / "out.wav"), ".wav")
+        with wave.open(str(tmp_path / "out.wav"), "rb") as out:
+            assert (out.getnchannels(), out.getframerate()) == (1, 16000)
+        deadline = time.time() + 5
+        while pool.snapshot()["running"] and time.time() < deadline:
+            time.sleep(0.05)
+        assert pool.snapshot()["running"] == 0
+    finally:
+        if pool._executor is not None:
+            pool._executor.shutdown()
+
+
+def stops_when_cancelled(output_path, cancel_path):
+    # Runs in the pool process: works until the cancel file appears, then takes a while to stop
+    while not os.path.exists(cancel_path):
+        time.sleep(0.05)
+    time.sleep(0.5)
+    with open(output_path + ".stopped", "w"):
+        pass
+    raise RuntimeError("cancelled")
+
+
+def test_cancelled_job_has_stopped_before_the_request_gives_up(tmp_path):
+    output_path = str(tmp_path / "out.wav")
+    pool = ConversionPool(workers=1, queue_size=0)
+    try:
+        with request_deadline(1.0):
+            with pytest.raises(RequestCancelled):
+                pool._run("convert", stops_when_cancelled, output_path, output_path)
+        assert os.path.exists(output_path + ".stopped")
+        assert not os.path.exists(output_path + ".cancel")
+    finally:
+        if pool._executor is not None:
+            pool._executor.shutdown()
+
+
+def test_full_pool_rejects_with_retry_after():
+    pool = ConversionPool(workers=1, queue_size=0)
+    pool._admit()
+
+    with pytest.raises(ConversionQueueFull) as rejected:
+        pool._admit()
+    assert rejected.value.retry_after >= 1
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "loadtest"))
+import fake_backends  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(fake_backends.config, "latency", 0.0)
+    monkeypatch.setitem(fake_backends.config, "caption_latency", 0.0)
+    monkeypatch.setitem(fake_backends.config, "chat_tokens_per_second", 1e9)
+    monkeypatch.setitem(fake_backends.config, "media_seconds", 8)
+    monkeypatch.setattr(fake_backends, "limiters", {"audio": fake_backends.RateLimiter(), "chat": fake_backends.RateLimiter()})
+    return fake_backends.app.test_client()
+
+
+def test_chat_completion_has_the_openai_shape(client):
+    response = client.post("/openai/v1/chat/completions", json={
+        "model": "m", "max_tokens": 100, "messages": [{"role": "user", "content": "x" * 2000}],
+    })
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["choices"][0]["message"]["content"].startswith("## Simulated notes")
+    assert body["usage"]["completion_tokens"] == 100
+
+
+def test_rate_limit_returns_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setitem(fake_backends.config, "rpm", 2)
+
+    statuses = [client.post("/openai/v1/chat/completions", json={"messages": []}).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    limited = client.post("/openai/v1/chat/completions", json={"messages": []})
+    assert limited.headers["retry-after"] == "1"
+
+
+def test_captions_and_media(client):
+    assert client.get("/captions/nocap123").status_code == 404
+    assert len(client.get("/captions/abc").get_json()) == 2
+    media = client.get("/media/video.wav")
+    assert media.data[:4] == b"RIFF"
+    assert len(media.data) == 44 + 8 * 16000 * 2
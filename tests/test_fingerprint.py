@@ -0,0 +1,140 @@
+import subprocess
+import sys
+import wave
+
+import numpy as np
+import pytest
+from flask import Flask
+
+import fingerprint
+from fingerprint import FingerprintIndex, FingerprintRecording, fingerprint_wav, ANALYSIS_RATE
+from history import db
+
+RATE = 16000
+
+
+def write_tones(path, seed, seconds=30.0, trim=0.0, gain=1.0):
+    """Random 0.1-0.4 s tones between 300 Hz and 3.5 kHz, like a busy spectrogram"""
+    rng = np.random.default_rng(seed)
+    pieces = []
+    while sum(len(piece) for piece in pieces) < (seconds + trim) * RATE:
+        length = int(rng.uniform(0.1, 0.4) * RATE)
+        t = np.arange(length) / float(RATE)
+        tone = sum(np.sin(2 * np.pi * rng.uniform(300, 3500) * t) for _ in range(3)) / 3.0
+        pieces.append(tone * np.hanning(length))
+    samples = np.concatenate(pieces)[int(trim * RATE):int((seconds + trim) * RATE)] * 0.5 * gain
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(RATE)
+        wav_file.writeframes((samples * 32767).astype("<i2").tobytes())
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'fingerprints.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    fingerprint_index = FingerprintIndex()
+    fingerprint_index.init_app(app)
+    return fingerprint_index
+
+
+def test_trimmed_quieter_copy_matches_at_an_offset(index, tmp_path):
+    original = fingerprint_wav(write_tones(tmp_path / "original.wav", seed=1))
+    index.add(original, "the original transcript", "whisper-large-v3", owner="alice")
+
+    # Half a second cut from the start, and 6 dB quieter
+    copy = fingerprint_wav(write_tones(tmp_path / "copy.wav", seed=1, seconds=29.5, trim=0.5, gain=0.5))
+    match = index.match(copy, owner="alice")
+    assert match is not None
+    assert match.transcript == "the original transcript"
+    assert match.model == "whisper-large-v3"
+    assert match.confidence >= fingerprint.MIN_CONFIDENCE
+
+
+def test_unrelated_audio_misses(index, tmp_path):
+    index.add(fingerprint_wav(write_tones(tmp_path / "one.wav", seed=1)), "one", owner="alice")
+    other = fingerprint_wav(write_tones(tmp_path / "two.wav", seed=2))
+    assert index.match(other, owner="alice") is None
+
+
+def test_recordings_are_only_matched_for_their_owner(index, tmp_path, monkeypatch):
+    private = fingerprint_wav(write_tones(tmp_path / "private.wav", seed=3))
+    index.add(private, "alice's meeting", owner="alice")
+
+    assert index.match(private, owner="alice").transcript == "alice's meeting"
+    assert index.match(private, owner="bob") is None
+    assert index.match(private) is None
+
+    monkeypatch.setattr(fingerprint, "FINGERPRINT_SHARED", True)
+    assert index.match(private, owner="bob").transcript == "alice's meeting"
+
+
+def test_old_table_gains_an_owner_column(index):
+    with index.app.app_context():
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("DROP TABLE fingerprint_hashes")
+            connection.exec_driver_sql("DROP TABLE fingerprint_recordings")
+            connection.exec_driver_sql(
+                "CREATE TABLE fingerprint_recordings (id INTEGER PRIMARY KEY, duration FLOAT NOT NULL, "
+                "hash_count INTEGER NOT NULL, transcript TEXT NOT NULL, model VARCHAR(64), created_at DATETIME NOT NULL)"
+            )
+        index.upgrade_schema()
+        index.upgrade_schema()  # Nothing left to do the second time
+        columns = [column["name"] for column in db.inspect(db.engine).get_columns(FingerprintRecording.__tablename__)]
+    assert "owner" in columns
+
+
+def pcm_at_analysis_rate(wav_path, raw_path):
+    """What ffmpeg's decode pipe would write for this WAV: mono 16-bit PCM at ANALYSIS_RATE"""
+    with wave.open(wav_path, "rb") as wav_file:
+        samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2")
+    raw_path.write_bytes(samples[::RATE // ANALYSIS_RATE].tobytes())
+    return str(raw_path)
+
+
+def test_prenormalized_opus_upload_is_fingerprinted_through_the_decoder(index, tmp_path, monkeypatch):
+    wav_path = write_tones(tmp_path / "original.wav", seed=5)
+    index.add(fingerprint_wav(wav_path), "transcript of the recording", owner="alice")
+
+    # The browser's 16 kHz mono Opus upload is used as-is, so it is never a WAV
+    upload = tmp_path / "input.ogg"
+    upload.write_bytes(b"OggS")
+    raw = pcm_at_analysis_rate(wav_path, tmp_path / "decoded.raw")
+    commands = []
+
+    def decode_command(path):
+        commands.append(path)
+        return [sys.executable, "-c", f"import sys; sys.stdout.buffer.write(open({raw!r}, 'rb').read())"]
+
+    monkeypatch.setattr(fingerprint, "FFMPEG_AVAILABLE", True)
+    monkeypatch.setattr(fingerprint, "_decode_command", decode_command)
+    decoded = index.fingerprint(str(upload))
+    assert commands == [str(upload)]
+    assert decoded is not None and decoded.duration == pytest.approx(30.0, abs=0.1)
+    assert index.match(decoded, owner="alice").transcript == "transcript of the recording"
+
+
+def test_undecodable_upload_has_no_fingerprint(index, tmp_path, monkeypatch):
+    monkeypatch.setattr(fingerprint, "FFMPEG_AVAILABLE", True)
+    monkeypatch.setattr(fingerprint, "_decode_command", lambda path: [sys.executable, "-c", "raise SystemExit(1)"])
+    assert index.fingerprint(str(tmp_path / "input.ogg")) is None
+
+    monkeypatch.setattr(fingerprint, "FFMPEG_AVAILABLE", False)
+    assert index.fingerprint(str(tmp_path / "input.ogg")) is None
+
+
+@pytest.mark.skipif(not fingerprint.FFMPEG_AVAILABLE, reason="needs ffmpeg")
+def test_opus_encoding_matches_the_wav(index, tmp_path):
+    wav_path = write_tones(tmp_path / "original.wav", seed=6)
+    index.add(fingerprint_wav(wav_path), "the original", owner="alice")
+    opus_path = str(tmp_path / "input.ogg")
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", wav_path, "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "24k", opus_path],
+        check=True,
+    )
+    assert index.match(index.fingerprint(opus_path), owner="alice").transcript == "the original"
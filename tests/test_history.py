@@ -0,0 +1,82 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+import history
+from history import db
+
+
+@pytest.fixture
+def app_context(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'history.db'}"
+    db.init_app(app)
+    with app.app_context():
+        history.init_history()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+OWNER = "a" * 32
+OTHER = "b" * 32
+
+
+def test_search_only_sees_the_owners_records(app_context):
+    history.save_transcript(OWNER, "Gradient descent minimizes the loss.", "upload")
+    other_id = history.save_transcript(OTHER, "Gradient descent for everyone else.", "upload")
+
+    results = history.search_transcripts(OWNER, "gradient")
+    assert len(results) == 1 and results[0]["id"] != other_id
+    assert history.search_transcripts(OWNER, "everyone") == []
+
+
+def test_owner_is_part_of_the_match_itself(app_context):
+    history.save_transcript(OWNER, "Gradient descent minimizes the loss.", "upload")
+    match = history._fts5_query("gradient", OWNER)
+
+    with db.engine.connect() as connection:
+        rows = connection.execute(text("SELECT rowid FROM transcripts_fts WHERE transcripts_fts MATCH :m"), {"m": match}).all()
+        assert len(rows) == 1
+        assert connection.execute(
+            text("SELECT rowid FROM transcripts_fts WHERE transcripts_fts MATCH :m"),
+            {"m": history._fts5_query("gradient", OTHER)},
+        ).all() == []
+
+
+def test_owner_id_is_not_searchable_as_text(app_context):
+    history.save_transcript(OWNER, "Nothing about sessions here.", "upload")
+
+    assert history.search_transcripts(OWNER, OWNER) == []
+
+
+def test_snippets_are_escaped_before_highlighting(app_context):
+    history.save_transcript(OWNER, 'Compare <script>alert("x")</script> with a & b in gradient terms.', "upload")
+
+    snippet = history.search_transcripts(OWNER, "gradient")[0]["snippet"]
+    assert "<script>" not in snippet
+    assert "&lt;script&gt;" in snippet and "&amp;" in snippet
+    assert "<mark>gradient</mark>" in snippet
+
+
+def test_edits_and_notes_are_indexed(app_context):
+    record_id = history.save_transcript(OWNER, "First draft about rivers.", "upload")
+    history.update_transcript(OWNER, record_id, "Second draft about mountains.")
+    history.save_notes(OWNER, record_id, "Second draft about mountains.", "# Glaciers")
+
+    assert history.search_transcripts(OWNER, "rivers") == []
+    assert [r["id"] for r in history.search_transcripts(OWNER, "mountains")] == [record_id]
+    assert [r["id"] for r in history.search_transcripts(OWNER, "glaciers")] == [record_id]
+
+
+def test_old_index_without_owner_is_rebuilt(app_context):
+    history.save_transcript(OWNER, "Gradient descent minimizes the loss.", "upload")
+    with db.engine.begin() as connection:
+        for statement in history._SQLITE_FTS_DROP:
+            connection.execute(text(statement))
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE transcripts_fts USING fts5(transcript, notes, content='transcripts', content_rowid='id')"
+        ))
+
+    history.init_history()
+    assert len(history.search_transcripts(OWNER, "gradient")) == 1
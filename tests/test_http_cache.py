@@ -0,0 +1,77 @@
+import gzip
+import io
+
+import pytest
+from flask import Flask, jsonify
+
+import http_cache
+from http_cache import init_http_cache, pdf_etag, store_pdf, pdf_cache_path
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__, static_folder=http_cache.__file__.rsplit("/", 1)[0] + "/static")
+    init_http_cache(app)
+
+    @app.route("/data")
+    def data():
+        return jsonify({"words": ["transcript"] * 500})
+
+    @app.route("/tiny")
+    def tiny():
+        return jsonify({"ok": True})
+
+    return app.test_client()
+
+
+def test_json_is_compressed_with_an_encoding_specific_etag(client):
+    response = client.get("/data", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"].endswith('-gzip"')
+    assert b"transcript" in gzip.decompress(response.data)
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_matching_etag_gets_304(client):
+    etag = client.get("/data", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+
+    response = client.get("/data", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_small_bodies_are_not_compressed(client):
+    assert "Content-Encoding" not in client.get("/tiny", headers={"Accept-Encoding": "gzip"}).headers
+
+
+def test_versioned_static_urls_are_immutable(client):
+    app = client.application
+    with app.test_request_context():
+        from flask import url_for
+        url = url_for("static", filename="css/style.css")
+    assert "?v=" in url
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_pdf_etag_depends_on_text_kind_and_render_version(monkeypatch):
+    etag = pdf_etag("notes", "notes")
+
+    assert etag != pdf_etag("notes", "transcript")
+    assert etag != pdf_etag("other", "notes")
+    monkeypatch.setattr(http_cache, "PDF_RENDER_VERSION", "pdf-next")
+    assert etag != pdf_etag("notes", "notes")
+
+
+def test_store_pdf_copies_from_the_current_position(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_cache, "PDF_CACHE_DIR", str(tmp_path))
+    source = io.BytesIO(b"skip%PDF-1.4 body")
+    source.seek(4)
+
+    path = store_pdf("abc", source)
+    assert path == pdf_cache_path("abc")
+    assert open(path, "rb").read() == b"%PDF-1.4 body"
+    assert source.tell() == 4
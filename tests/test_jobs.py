@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+import jobs
+from history import db
+from jobs import Job, JobQueue, QUEUED, RUNNING, DONE
+
+
+@pytest.fixture
+def queue(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'jobs.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    job_queue = JobQueue()
+    job_queue.init_app(app)
+    return job_queue
+
+
+def test_only_one_active_job_per_key(queue):
+    first = queue.submit("youtube", "youtube:abc", {"n": 1})
+    assert queue.submit("youtube", "youtube:abc", {"n": 2}) == first
+
+    # A second insert that slipped past the lookup is refused by the index
+    with queue.app.app_context():
+        db.session.add(Job(kind="youtube", key="youtube:abc", payload="{}", status=QUEUED))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_losing_submit_joins_the_winners_job(queue, monkeypatch):
+    add = db.session.add
+    winner = []
+
+    def add_after_another_instance(job):
+        # Another instance queues the same key between this submit's lookup and its insert
+        if not winner:
+            with db.engine.begin() as connection:
+                result = connection.execute(Job.__table__.insert().values(
+                    kind="youtube", key=job.key, payload="{}", status=QUEUED, attempts=0,
+                    created_at=jobs._utcnow(), updated_at=jobs._utcnow(),
+                ))
+                winner.append(result.inserted_primary_key[0])
+        add(job)
+
+    monkeypatch.setattr(db.session, "add", add_after_another_instance)
+    assert queue.submit("youtube", "youtube:race", {}) == winner[0]
+    monkeypatch.undo()
+
+    with queue.app.app_context():
+        assert Job.query.filter(Job.key == "youtube:race").count() == 1
+        assert db.session.get(Job, winner[0]).status == QUEUED
+
+
+def test_finished_key_can_be_submitted_again(queue):
+    queue.register("youtube", lambda payload: "ok")
+    first = queue.submit("youtube", "youtube:again", {})
+    assert queue.execute(*queue.claim(first)) == "ok"
+    assert queue.submit("youtube", "youtube:again", {}) != first
+
+
+def test_running_job_renews_its_lease(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RENEW_SECONDS", 0.05)
+    leases = []
+
+    def handler(payload):
+        with queue.app.app_context():
+            Job.query.filter(Job.id == job_id).update({Job.lease_until: jobs._utcnow() - timedelta(seconds=1)})
+            db.session.commit()
+        for _ in range(50):
+            with queue.app.app_context():
+                lease = db.session.get(Job, job_id).lease_until
+            if lease.tzinfo is None:
+                lease = lease.replace(tzinfo=jobs.timezone.utc)
+            if lease > jobs._utcnow():
+                leases.append(lease)
+                break
+            jobs.time.sleep(0.02)
+        # A sweep now must leave the job alone
+        queue.requeue_expired()
+        with queue.app.app_context():
+            return db.session.get(Job, job_id).status
+
+    queue.register("youtube", handler)
+    job_id = queue.submit("youtube", "youtube:long", {})
+    assert queue.execute(*queue.claim(job_id)) == RUNNING
+    assert leases
+
+    with queue.app.app_context():
+        job = db.session.get(Job, job_id)
+        assert job.status == DONE and job.lease_until is None
+
+
+def test_lease_is_not_renewed_for_another_holder(queue):
+    queue.register("youtube", lambda payload: None)
+    job_id = queue.submit("youtube", "youtube:stolen", {})
+    claimed = queue.claim(job_id)
+    assert queue.renew_lease(job_id, claimed[-1])
+    assert not queue.renew_lease(job_id, "other-host:1:2")
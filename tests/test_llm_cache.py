@@ -0,0 +1,39 @@
+import os
+import time
+
+from llm_cache import CompletionCache, make_cache_key
+
+
+def test_key_ignores_whitespace_but_not_prompt_version_or_params():
+    key = make_cache_key("a  b\nc", "notes-1", "model", {"temperature": 0.1})
+
+    assert key == make_cache_key("a b c", "notes-1", "model", {"temperature": 0.1})
+    assert key != make_cache_key("a b c", "notes-2", "model", {"temperature": 0.1})
+    assert key != make_cache_key("a b c", "notes-1", "model", {"temperature": 0.2})
+
+
+def test_round_trip_and_expiry(tmp_path):
+    cache = CompletionCache(cache_dir=str(tmp_path), ttl=60)
+    cache.set("k", "notes")
+    assert cache.get("k") == "notes"
+
+    old = time.time() - 120
+    os.utime(tmp_path / "k.json", (old, old))
+    assert cache.get("k") is None
+    assert not (tmp_path / "k.json").exists()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = CompletionCache(cache_dir=str(tmp_path))
+    for index in range(4):
+        cache.set(f"k{index}", "x" * 60)
+        old = time.time() - 100 + index
+        os.utime(tmp_path / f"k{index}.json", (old, old))
+    cache.get("k0")
+    # Room for two entries
+    cache.max_bytes = 2 * os.path.getsize(tmp_path / "k0.json") + 10
+    cache.set("k4", "x" * 60)
+
+    assert cache.get("k0") == "x" * 60
+    assert cache.get("k4") == "x" * 60
+    assert cache.get("k1") is None
@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+import pytest
+
+import memory
+import audio
+from memory import (
+    track_request, memory_stage, record_external_stage, measure, current_rss, MB,
+    estimate_request_bytes, check_budget, MemoryBudgetExceeded,
+)
+
+
+def test_stages_are_recorded_and_peaks_seen():
+    with track_request("upload") as tracker:
+        with memory_stage("convert"):
+            block = np.ones(64 * MB, dtype=np.uint8)
+            time.sleep(3 * memory.MEMORY_SAMPLE_INTERVAL)
+            del block
+        with memory_stage("transcribe"):
+            pass
+        record_external_stage("convert_pool", {"rss_start": 10 * MB, "rss_peak": 30 * MB, "rss_end": 12 * MB})
+
+    summary = tracker.summary()
+    assert list(summary["stages"]) == ["convert", "transcribe", "convert_pool"]
+    # The allocation was freed before the stage ended; only the sampler could see it
+    assert summary["stages"]["convert"]["rss_growth_mb"] >= 48
+    assert summary["stages"]["convert_pool"]["rss_growth_mb"] == 20.0
+
+
+def test_stages_outside_a_tracked_request_are_ignored():
+    with memory_stage("convert") as record:
+        assert record is None
+    record_external_stage("convert_pool", {"rss_start": 0, "rss_peak": 1, "rss_end": 0})
+
+
+def test_measure_returns_the_result_and_its_rss():
+    result, measured = measure(lambda x: x * 2, 21)
+
+    assert result == 42
+    assert measured["rss_peak"] >= measured["rss_start"] > 0
+    assert current_rss() > 0
+
+
+def test_estimate_grows_with_the_recording_and_the_held_audio():
+    short = estimate_request_bytes(60, 60)
+    long_whole = estimate_request_bytes(3600, 3600)
+    long_segmented = estimate_request_bytes(3600, 1200)
+    assert short < long_segmented < long_whole
+    assert long_whole - long_segmented == 2400 * memory.PCM_BYTES_PER_SECOND * memory.HELD_COPIES
+
+
+def test_budget_refuses_only_what_is_over_it(monkeypatch):
+    check_budget(500 * MB, budget_mb=512)
+    check_budget(10 ** 12, budget_mb=0)  # Disabled
+    with pytest.raises(MemoryBudgetExceeded) as over:
+        check_budget(600 * MB, budget_mb=512)
+    assert over.value.budget_bytes == 512 * MB
+
+
+def test_uploads_are_judged_on_the_requested_range(monkeypatch):
+    monkeypatch.setattr(audio, "get_audio_duration", lambda path: 4 * 3600.0)
+    budget = estimate_request_bytes(600, 600) // MB + 1
+    monkeypatch.setattr(memory, "MEMORY_BUDGET_MB", budget)
+    with pytest.raises(MemoryBudgetExceeded):
+        audio.check_memory_budget("long.wav")
+    audio.check_memory_budget("long.wav", time_range=(60.0, 600.0))
@@ -0,0 +1,85 @@
+import re
+
+import pytest
+
+import call_llm
+from llm_cache import completion_cache
+from tests.test_sections import make_transcript
+
+
+@pytest.fixture
+def fake_completions(monkeypatch, tmp_path):
+    prompts = []
+
+    def complete(client, prompt, model, params, owner, cancelled=None):
+        prompts.append((prompt, model))
+        if "Here is the outline:" in prompt:
+            return "# Whole Lecture\n\n## Summary\nAn overview."
+        return f"# Part Title\n## Topic {len(prompts)}\n- detail"
+
+    monkeypatch.setattr(call_llm, "_complete_notes", complete)
+    monkeypatch.setattr(completion_cache, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(completion_cache, "shared", None)
+    return prompts
+
+
+def test_sections_are_merged_under_one_title_and_summary(fake_completions):
+    notes = call_llm.generate_structured_notes(make_transcript())
+
+    assert not notes.startswith("Error")
+    assert notes.startswith("# Whole Lecture\n\n## Summary")
+    assert len(re.findall(r"^# ", notes, re.M)) == 1
+    section_prompts = [prompt for prompt, _ in fake_completions if "Here is the outline:" not in prompt]
+    assert len(section_prompts) > 3
+    assert not any(re.search(r"part \d+ of \d+", prompt) for prompt in section_prompts)
+
+
+def test_edit_resends_only_changed_sections(fake_completions):
+    transcript = make_transcript(seed=2)
+    call_llm.generate_structured_notes(transcript)
+    first_calls = len(fake_completions)
+
+    middle = len(transcript) // 2
+    edited = transcript[:middle] + " an inserted remark about something else entirely." + transcript[middle:]
+    fake_completions.clear()
+    call_llm.generate_structured_notes(edited)
+
+    resent = [prompt for prompt, _ in fake_completions if "Here is the outline:" not in prompt]
+    assert 1 <= len(resent) <= 2 < first_calls
+
+
+def test_each_section_is_routed_on_its_own_size(fake_completions):
+    call_llm.generate_structured_notes(make_transcript(seed=3))
+
+    section_models = {model for prompt, model in fake_completions if "Here is the outline:" not in prompt}
+    # Sections are at most SECTION_MAX_CHARS, which the small model always takes
+    assert section_models == {call_llm.route_chat(1, "notes").model}
+
+
+def test_failed_or_cancelled_merge_is_not_cached(monkeypatch, tmp_path):
+    monkeypatch.setattr(completion_cache, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(completion_cache, "shared", None)
+    merge = {"fail": True}
+    stop = {"now": False}
+
+    def complete(client, prompt, model, params, owner, cancelled=None):
+        if "Here is the outline:" in prompt:
+            if cancelled is not None and cancelled():
+                raise RuntimeError("Notes generation was cancelled")
+            if merge["fail"]:
+                raise RuntimeError("upstream error")
+            return "# Whole Lecture\n\n## Summary\nAn overview."
+        return "# Part Title\n- detail"
+
+    monkeypatch.setattr(call_llm, "_complete_notes", complete)
+    transcript = make_transcript(seed=4)
+
+    degraded = call_llm.generate_structured_notes(transcript)
+    assert not degraded.startswith("Error") and "## Summary" not in degraded
+
+    stop["now"] = True
+    merge["fail"] = False
+    cancelled = call_llm.generate_structured_notes(transcript, cancelled=lambda: stop["now"])
+    assert cancelled.startswith("Error") and "cancelled" in cancelled
+
+    assert call_llm.generate_structured_notes(transcript).startswith("# Whole Lecture\n\n## Summary")
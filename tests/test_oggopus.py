@@ -0,0 +1,45 @@
+import pytest
+
+from oggopus import read_opus_head, ogg_opus_duration, last_granule_position
+from conversion import is_prenormalized
+from tests.oggdata import ogg_opus, ogg_page
+
+
+def test_head_and_duration(tmp_path):
+    path = tmp_path / "clip.ogg"
+    path.write_bytes(ogg_opus(12.5, channels=1, input_rate=16000))
+
+    head = read_opus_head(str(path))
+    assert (head.channels, head.pre_skip, head.input_sample_rate) == (1, 312, 16000)
+    assert ogg_opus_duration(str(path)) == pytest.approx(12.5)
+
+
+def test_browser_prepared_opus_skips_conversion(tmp_path):
+    mono = tmp_path / "mono.opus"
+    mono.write_bytes(ogg_opus(3, channels=1, input_rate=16000))
+    stereo = tmp_path / "stereo.ogg"
+    stereo.write_bytes(ogg_opus(3, channels=2, input_rate=48000))
+    vorbis = tmp_path / "vorbis.ogg"
+    vorbis.write_bytes(ogg_page(b"\x01vorbis" + b"\0" * 23))
+
+    assert is_prenormalized(str(mono), ".opus")
+    assert not is_prenormalized(str(stereo), ".ogg")
+    assert not is_prenormalized(str(vorbis), ".ogg")
+
+
+def test_oggs_inside_packet_data_is_not_a_page():
+    tail = ogg_page(b"x" * 10, granule=96000) + b"\x00" * 20 + b"OggS\x07junk"
+
+    assert last_granule_position(tail) == 96000
+
+
+def test_truncated_or_foreign_files_are_rejected(tmp_path):
+    path = tmp_path / "bad.ogg"
+    path.write_bytes(b"OggS\0")
+    with pytest.raises(ValueError):
+        read_opus_head(str(path))
+    assert ogg_opus_duration(str(path)) is None
+
+    path.write_bytes(b"ID3" + b"\0" * 64)
+    with pytest.raises(ValueError):
+        read_opus_head(str(path))
@@ -0,0 +1,108 @@
+import io
+import re
+import zlib
+
+import pytest
+from reportlab.platypus import LayoutError, Spacer
+
+import app as app_module
+from pdf_export import (
+    _inline_markup, iter_text, notes_flowables, render_pages, stream_pdf, transcript_flowables, NOTES, TRANSCRIPT,
+)
+from tests.test_sections import make_transcript
+
+
+def check_structure(pdf):
+    """Check the cross-reference table against the objects; returns the page count"""
+    assert pdf.startswith(b"%PDF-1.4") and pdf.rstrip().endswith(b"%%EOF")
+    xref_at = int(re.search(rb"startxref\n(\d+)\n%%EOF\s*$", pdf).group(1))
+    assert pdf[xref_at:xref_at + 5] == b"xref\n"
+    first, count = map(int, re.match(rb"xref\n(\d+) (\d+)\n", pdf[xref_at:]).groups())
+    table = pdf[xref_at:].split(b"\n", 2)[2]
+    entries = [table[index * 20:index * 20 + 20] for index in range(count)]
+    assert first == 0 and entries[0] == b"0000000000 65535 f \n"
+    for number, entry in enumerate(entries[1:], 1):
+        assert entry.endswith(b" 00000 n \n")
+        offset = int(entry[:10])
+        assert pdf[offset:].startswith(b"%d 0 obj\n" % number)
+    assert int(re.search(rb"/Size (\d+)", pdf).group(1)) == count
+
+    pages = len(re.findall(rb"/Type /Page ", pdf))
+    assert int(re.search(rb"/Type /Pages /Kids \[[^\]]*\] /Count (\d+)", pdf).group(1)) == pages
+    return pages
+
+
+def page_text(pdf):
+    streams = re.findall(rb"/FlateDecode >>\nstream\n(.*?)\nendstream", pdf, re.S)
+    return b"".join(zlib.decompress(stream) for stream in streams)
+
+
+def test_long_transcript_has_a_valid_xref_and_every_page():
+    output = io.BytesIO()
+    progress = list(render_pages(transcript_flowables(iter_text(make_transcript(600))), output, "Transcript"))
+    pdf = output.getvalue()
+    pages = check_structure(pdf)
+    assert pages > 3
+    assert progress[-1] == pages and progress == sorted(progress)
+
+
+def test_streamed_chunks_make_the_whole_pdf():
+    completed = []
+    chunks = list(stream_pdf(make_transcript(300), TRANSCRIPT, on_complete=lambda f: completed.append(f.read()),
+                             chunk_bytes=4096))
+    pdf = b"".join(chunks)
+    assert len(chunks) > 1
+    assert check_structure(pdf) >= 2
+    assert completed == [pdf]
+
+
+def test_lone_emphasis_markers_and_markup_characters_render():
+    notes = "# Notes <draft>\n\n5 * 3 = 15\n\nuse snake_case & **bold *and* more**\n\n- a < b\n\n1. x_y * 2\n"
+    pdf = b"".join(stream_pdf(notes, NOTES))
+    assert check_structure(pdf) == 1
+    text = page_text(pdf)
+    assert b"5 * 3 = 15" in text and b"snake_case" in text and b"a < b" in text
+
+
+def test_inline_markup_is_balanced():
+    assert _inline_markup("5 * 3 = 15") == "5 * 3 = 15"
+    assert _inline_markup("**bold** and *it*") == "<b>bold</b> and <i>it</i>"
+    assert _inline_markup("a_b_c and a <tag>") == "a_b_c and a &lt;tag&gt;"
+    for line in ("***x***", "**a *b* c**", "* x ** y _ z __", "_a **b_ c**"):
+        markup = _inline_markup(line)
+        for tag in ("b", "i"):
+            assert markup.count(f"<{tag}>") == markup.count(f"</{tag}>")
+    list(notes_flowables(iter_text("***x***\n_a **b_ c**\n")))  # Paragraph accepts them
+
+
+def test_flowable_too_big_for_a_page_is_an_error():
+    with pytest.raises(LayoutError):
+        list(render_pages([Spacer(1, 5000)], io.BytesIO(), "Too big"))
+
+
+@pytest.fixture
+def client():
+    app_module.app.config["TESTING"] = True
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def test_download_streams_a_valid_pdf(client):
+    with client.session_transaction() as session:
+        session["structured_notes"] = "# Title\n\n5 * 3 = 15, still *fine*"
+    response = client.get("/download-pdf")
+    assert response.status_code == 200
+    assert check_structure(response.get_data()) == 1
+
+
+def test_first_page_failure_is_an_error_response(client, monkeypatch):
+    def broken(*args, **kwargs):
+        raise LayoutError("doesn't fit")
+        yield b""
+
+    monkeypatch.setattr(app_module, "stream_pdf", broken)
+    with client.session_transaction() as session:
+        session["structured_notes"] = "# Unrenderable"
+    response = client.get("/download-pdf")
+    assert response.status_code == 500
+    assert "doesn't fit" in response.get_json()["error"]
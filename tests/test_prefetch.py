@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+import media_cache
+import prefetch
+from media_cache import TTLCache
+from prefetch import Prefetcher, CAPTIONS, METADATA, PAGE
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+def test_concurrent_lookups_share_one_load():
+    cache = TTLCache("test", ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        started.set()
+        release.wait(5)
+        return ["segment"]
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_load("v", loader)))
+    leader.start()
+    started.wait(5)
+    joiners = [threading.Thread(target=lambda: results.append(cache.get_or_load("v", loader))) for _ in range(3)]
+    for joiner in joiners:
+        joiner.start()
+    release.set()
+    for thread in [leader] + joiners:
+        thread.join(5)
+
+    assert loads == [1]
+    assert results == [["segment"]] * 4
+    assert cache.get_or_load("v", lambda: ["reloaded"]) == ["segment"]
+
+
+def test_entries_expire_and_the_oldest_are_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(media_cache.time, "time", lambda: now[0])
+    cache = TTLCache("test", ttl=10, max_entries=2)
+    for key in ("a", "b"):
+        cache.get_or_load(key, lambda key=key: key)
+    cache.get_or_load("a", lambda: "unused")  # "a" is now the most recent
+    cache.get_or_load("c", lambda: "c")
+    assert cache.peek("a") and cache.peek("c") and not cache.peek("b")
+
+    now[0] += 11
+    assert not cache.peek("a")
+    assert cache.get_or_load("a", lambda: "fresh") == "fresh"
+
+
+def test_only_remembered_errors_are_cached():
+    cache = TTLCache("captions", ttl=3600, remember_error=media_cache._no_captions)
+    calls = []
+
+    def no_captions():
+        calls.append(1)
+        raise Exception("No transcript found for this video")
+
+    for _ in range(2):
+        with pytest.raises(Exception, match="No transcript"):
+            cache.get_or_load("quiet", no_captions)
+    assert len(calls) == 1
+
+    def flaky():
+        calls.append(1)
+        raise ConnectionError("reset by peer")
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            cache.get_or_load("flaky", flaky)
+    assert len(calls) == 3
+
+    cache.forget("quiet")
+    assert cache.get_or_load("quiet", lambda: "captions now") == "captions now"
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    calls = []
+    monkeypatch.setattr(prefetch, "fetch_transcript_segments", lambda video_id: calls.append((CAPTIONS, video_id)))
+    monkeypatch.setattr(prefetch, "video_info", lambda url: calls.append((METADATA, url)))
+    monkeypatch.setattr(prefetch, "fetch_page_context", lambda url: calls.append((PAGE, url)))
+    for cache in (media_cache.caption_cache, media_cache.metadata_cache, media_cache.page_cache):
+        cache.forget(VIDEO_ID)
+    return calls
+
+
+def drain(prefetcher):
+    for _ in range(200):
+        if not prefetcher._pending:
+            return
+        time.sleep(0.01)
+
+
+def test_captions_and_metadata_are_prefetched(fetches):
+    prefetcher = Prefetcher(enabled=True)
+    assert sorted(prefetcher.prefetch(URL)) == [CAPTIONS, METADATA]
+    drain(prefetcher)
+    assert sorted(fetches) == [(CAPTIONS, VIDEO_ID), (METADATA, URL)]
+
+    assert prefetcher.prefetch(URL, skip=(CAPTIONS, METADATA)) == []
+    assert Prefetcher(enabled=False).prefetch(URL) == []
+    assert Prefetcher(enabled=True).prefetch("https://www.youtube.com/") == []
+
+
+def test_page_is_fetched_only_when_captions_fail(fetches, monkeypatch):
+    def no_captions(video_id):
+        fetches.append((CAPTIONS, video_id))
+        raise Exception("Transcripts are disabled for this video")
+
+    monkeypatch.setattr(prefetch, "fetch_transcript_segments", no_captions)
+    prefetcher = Prefetcher(enabled=True)
+    prefetcher.prefetch(URL, skip=(METADATA,))
+    drain(prefetcher)
+    assert fetches == [(CAPTIONS, VIDEO_ID), (PAGE, URL)]
+
+    fetches.clear()
+    prefetcher.prefetch(URL, skip=(METADATA, PAGE))
+    drain(prefetcher)
+    assert fetches == [(CAPTIONS, VIDEO_ID)]
+
+
+def test_duplicate_and_excess_work_is_dropped(fetches, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(prefetch, "fetch_transcript_segments", lambda video_id: release.wait(5))
+    monkeypatch.setattr(prefetch, "video_info", lambda url: release.wait(5))
+    prefetcher = Prefetcher(enabled=True, max_pending=2)
+    assert prefetcher.prefetch(URL) == [CAPTIONS, METADATA]
+    assert prefetcher.prefetch(URL) == []  # Already pending
+    assert prefetcher.prefetch("https://youtu.be/aaaaaaaaaaa") == []  # Over the limit
+    release.set()
+    drain(prefetcher)
+    assert not prefetcher._pending
@@ -0,0 +1,119 @@
+import io
+import struct
+import wave
+
+import pytest
+
+from probe import PartialFile, probe_file, PROBE_HEAD_BYTES
+from tests.oggdata import ogg_opus
+
+
+def wav_data(seconds=2, rate=16000, channels=1):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(b"\0\0" * channels * rate * seconds)
+    return buffer.getvalue()
+
+
+def flac_data(seconds=3, rate=44100, channels=2):
+    fields = (rate << 44) | ((channels - 1) << 41) | (15 << 36) | (seconds * rate)
+    streaminfo = struct.pack(">HH", 4096, 4096) + b"\0" * 6 + fields.to_bytes(8, "big") + b"\0" * 16
+    return b"fLaC" + bytes([0x80, 0, 0, 34]) + streaminfo + b"\0" * 2000
+
+
+def mp3_data(frames=200):
+    # MPEG-1 layer III, 128 kbps, 44.1 kHz, mono: 417-byte frames
+    return b"ID3\x03\0\0\0\0\0\x0a" + b"\0" * 10 + (b"\xff\xfb\x90\xc0" + b"\0" * 413) * frames
+
+
+def box(kind, body):
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+
+def mp4_data(seconds=10, rate=48000, channels=2, moov_first=True):
+    mvhd = box(b"mvhd", b"\0" * 12 + struct.pack(">II", 1000, seconds * 1000) + b"\0" * 80)
+    entry = b"\0" * 6 + b"\0\x01" + b"\0" * 8 + struct.pack(">HHHHI", channels, 16, 0, 0, rate << 16)
+    stsd = box(b"stsd", b"\0" * 4 + struct.pack(">I", 1) + struct.pack(">I4s", 8 + len(entry), b"mp4a") + entry)
+    trak = box(b"trak", box(b"mdia", box(b"minf", box(b"stbl", stsd))))
+    moov = box(b"moov", mvhd + trak)
+    ftyp = box(b"ftyp", b"M4A \0\0\0\0")
+    mdat = box(b"mdat", b"\0" * 200000)
+    return ftyp + (moov + mdat if moov_first else mdat + moov)
+
+
+def probe_bytes(data):
+    return probe_file(io.BytesIO(data), len(data))
+
+
+def test_complete_headers():
+    wav = probe_bytes(wav_data(rate=16000))
+    assert (wav["container"], wav["codec"], wav["duration"], wav["prenormalized"]) == ("wav", "pcm_s16le", 2.0, True)
+
+    flac = probe_bytes(flac_data())
+    assert (flac["codec"], flac["sample_rate"], flac["channels"], flac["duration"]) == ("flac", 44100, 2, 3.0)
+
+    mp3 = probe_bytes(mp3_data())
+    assert (mp3["codec"], mp3["sample_rate"], mp3["channels"], mp3["bitrate"]) == ("mp3", 44100, 1, 128000)
+    assert mp3["duration"] == pytest.approx(200 * 417 * 8 / 128000.0)
+
+    mp4 = probe_bytes(mp4_data())
+    assert (mp4["codec"], mp4["sample_rate"], mp4["channels"], mp4["duration"]) == ("aac", 48000, 2, 10.0)
+
+    ogg = probe_bytes(ogg_opus(5.0))
+    assert (ogg["codec"], ogg["channels"], ogg["prenormalized"]) == ("opus", 1, True)
+    assert ogg["duration"] == pytest.approx(5.0)
+
+
+@pytest.mark.parametrize("data, container", [
+    (wav_data(), "wav"),
+    (flac_data(), "flac"),
+    (mp4_data(), "mp4"),
+    (ogg_opus(5.0), "ogg"),
+])
+def test_truncated_headers_are_recognized_without_details(data, container):
+    # Every cut inside the header still names the container and never raises
+    for cut in range(12, 120):
+        media = probe_bytes(data[:cut])
+        assert media["container"] == container
+
+
+def test_truncated_mp3_falls_back_to_a_bitrate_estimate():
+    data = mp3_data()[:20 + 417 * 3]
+    media = probe_bytes(data)
+    assert media["bitrate"] == 128000
+    assert media["duration"] == pytest.approx((len(data) - 20) * 8 / 128000.0)
+
+    # An ID3 tag longer than the bytes sent leaves only the container
+    assert probe_file(PartialFile(b"ID3\x03\0\0\0\x7f\x7f\x7f" + b"\0" * 100, 10 ** 7), 10 ** 7)["container"] == "mp3"
+
+
+def test_partial_uploads_use_the_head_and_tail():
+    data = mp4_data(moov_first=False)
+    head, tail = data[:PROBE_HEAD_BYTES], data[-PROBE_HEAD_BYTES:]
+    assert probe_file(PartialFile(head, len(data)), len(data))["duration"] is None
+    assert probe_file(PartialFile(head, len(data), tail), len(data))["duration"] == 10.0
+
+    ogg = ogg_opus(120.0)
+    padded = ogg[:-1000] + b"\0" * 500000 + ogg[-1000:]  # Not valid pages, but only the ends are read
+    media = probe_file(PartialFile(ogg[:200], len(padded)), len(padded))
+    assert media["codec"] == "opus" and media["duration"] is None
+
+
+def test_partial_file_refuses_bytes_it_doesnt_have():
+    f = PartialFile(b"abcd", 100, tail=b"wxyz")
+    assert f.read(2) == b"ab"
+    f.seek(-4, 2)
+    assert f.read() == b"wxyz"
+    f.seek(10)
+    with pytest.raises(ValueError):
+        f.read(4)
+
+
+def test_unknown_files_are_rejected():
+    with pytest.raises(ValueError):
+        probe_bytes(b"%PDF-1.4 definitely not audio" * 10)
+    with pytest.raises(ValueError):
+        probe_bytes(b"")
@@ -0,0 +1,28 @@
+import pytest
+
+import routing
+from routing import route_chat, completion_budget, ContextTooLarge, MIN_COMPLETION_TOKENS
+
+
+def test_short_input_goes_to_the_small_model():
+    assert route_chat(100, "notes").tier == "small"
+    assert route_chat(routing.SMALL_CHAT_MAX_TOKENS + 1, "notes").tier == "large"
+
+
+def test_input_too_long_for_the_large_context_moves_to_the_wider_model():
+    decision = route_chat(20000, "notes")
+
+    assert decision.model == routing.CHAT_SMALL_MODEL
+    assert "exceeds" in decision.reason
+    assert completion_budget(decision.model, 20000) >= MIN_COMPLETION_TOKENS
+
+
+def test_budget_stays_inside_the_context():
+    budget = completion_budget("llama3-70b-8192", 6000)
+
+    assert budget + 6000 + routing.PROMPT_OVERHEAD_TOKENS <= 8192
+
+
+def test_budget_raises_when_no_completion_fits():
+    with pytest.raises(ContextTooLarge):
+        completion_budget("llama3-70b-8192", 7500)
@@ -0,0 +1,99 @@
+import time
+import threading
+
+import scheduler as scheduler_module
+from scheduler import FairScheduler
+
+
+def run_jobs(scheduler, jobs):
+    """Hold the only slot, queue the jobs, then release and record the order they ran in"""
+    order = []
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with scheduler.slot(1, "holder"):
+            holding.set()
+            release.wait(5)
+
+    def job(name, cost, owner):
+        with scheduler.slot(cost, owner):
+            order.append(name)
+
+    threads = [threading.Thread(target=hold)]
+    threads[0].start()
+    holding.wait(5)
+    for name, cost, owner in jobs:
+        thread = threading.Thread(target=job, args=(name, cost, owner))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_shortest_job_runs_first():
+    order = run_jobs(FairScheduler("test", 1), [("long", 600, "a"), ("short", 10, "b"), ("medium", 100, "c")])
+
+    assert order == ["short", "medium", "long"]
+
+
+def test_slots_are_never_oversubscribed():
+    scheduler = FairScheduler("test", 2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def job(index):
+        with scheduler.slot(index, f"owner{index}"):
+            with lock:
+                running.append(index)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(index)
+
+    threads = [threading.Thread(target=job, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert max(peak) == 2
+    assert len(peak) == 8
+
+
+def test_capped_sessions_dont_leave_a_free_slot_idle(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "SESSION_MAX_SLOTS", 1)
+    scheduler = FairScheduler("test", 3)
+    release = {name: threading.Event() for name in ("A", "B", "C")}
+    started = []
+
+    def job(name):
+        with scheduler.slot(10, name[0]):
+            started.append(name)
+            release[name[0]].wait(5)
+
+    def start(*names):
+        for name in names:
+            thread = threading.Thread(target=job, args=(name,))
+            thread.start()
+            threads.append(thread)
+        time.sleep(0.2)
+
+    threads = []
+    start("A1", "B1", "C1")
+    start("A2", "B2")  # Both sessions are at their cap, and no slot is free
+    assert len(started) == 3
+
+    # A slot frees up: one of the capped sessions' jobs takes it rather than it staying idle
+    release["C"].set()
+    time.sleep(0.2)
+    assert len(started) == 4
+    release["A"].set()
+    release["B"].set()
+    for thread in threads:
+        thread.join(5)
+    assert sorted(started) == ["A1", "A2", "B1", "B2", "C1"]
@@ -0,0 +1,42 @@
+import random
+
+from sections import split_into_sections, section_hash, SECTION_MIN_CHARS, SECTION_MAX_CHARS
+
+
+def make_transcript(sentences=600, seed=1):
+    rng = random.Random(seed)
+    words = ["speech", "model", "audio", "notes", "lecture", "topic", "data", "signal", "result", "method",
+             "question", "answer", "system", "student", "example", "problem", "value", "time"]
+    return " ".join(
+        " ".join(rng.choice(words) for _ in range(rng.randint(6, 18))).capitalize() + "."
+        for _ in range(sentences)
+    )
+
+
+def test_sections_cover_the_text_within_bounds():
+    transcript = make_transcript()
+    sections = split_into_sections(transcript)
+
+    assert len(sections) > 3
+    assert " ".join(sections).split() == transcript.split()
+    for section in sections[:-1]:
+        assert SECTION_MIN_CHARS <= len(section) <= SECTION_MAX_CHARS + 200
+
+
+def test_local_edit_only_changes_nearby_sections():
+    transcript = make_transcript()
+    before = split_into_sections(transcript)
+    middle = len(transcript) // 2
+    edited = transcript[:middle] + " an inserted remark about something else entirely." + transcript[middle:]
+    after = split_into_sections(edited)
+
+    before_hashes = [section_hash(section) for section in before]
+    after_hashes = [section_hash(section) for section in after]
+    changed = [h for h in after_hashes if h not in before_hashes]
+    assert 1 <= len(changed) <= 2
+    assert after_hashes[:2] == before_hashes[:2]
+    assert after_hashes[-2:] == before_hashes[-2:]
+
+
+def test_empty_transcript_has_no_sections():
+    assert split_into_sections("   ") == []
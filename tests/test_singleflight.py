@@ -0,0 +1,76 @@
+import time
+import threading
+
+import pytest
+
+from deadline import RequestCancelled, request_deadline
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_run(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def work():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+        return {"transcript": "hello"}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("youtube:abc", work)))
+    leader.start()
+    started.wait(5)
+    joiners = [threading.Thread(target=lambda: results.append(flight.do("youtube:abc", work))) for _ in range(3)]
+    for joiner in joiners:
+        joiner.start()
+    release.set()
+    for thread in [leader] + joiners:
+        thread.join(5)
+
+    assert len(runs) == 1
+    assert results == [{"transcript": "hello"}] * 4
+
+
+def test_published_result_is_reused_by_another_process(tmp_path):
+    first = SingleFlight(lock_dir=str(tmp_path))
+    second = SingleFlight(lock_dir=str(tmp_path))  # Stands in for another worker process
+
+    assert first.do("upload:1", lambda: "text") == "text"
+    assert second.do("upload:1", lambda: "recomputed") == "text"
+
+
+def test_unshareable_results_are_not_published(tmp_path):
+    first = SingleFlight(lock_dir=str(tmp_path))
+    second = SingleFlight(lock_dir=str(tmp_path))
+    not_error = lambda result: not result.startswith("Error")
+
+    first.do("upload:2", lambda: "Error: quota", shareable=not_error)
+    assert second.do("upload:2", lambda: "text", shareable=not_error) == "text"
+
+
+def test_waiting_on_another_process_honours_the_deadline(tmp_path):
+    first = SingleFlight(lock_dir=str(tmp_path))
+    second = SingleFlight(lock_dir=str(tmp_path))  # Stands in for another worker process
+    started = threading.Event()
+    release = threading.Event()
+
+    def work():
+        started.set()
+        release.wait(5)
+        return "text"
+
+    leader = threading.Thread(target=lambda: first.do("youtube:slow", work))
+    leader.start()
+    started.wait(5)
+    begun = time.monotonic()
+    try:
+        with pytest.raises(RequestCancelled):
+            with request_deadline(seconds=0.3):
+                second.do("youtube:slow", lambda: "recomputed")
+        assert time.monotonic() - begun < 2
+    finally:
+        release.set()
+        leader.join(5)
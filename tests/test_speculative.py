@@ -0,0 +1,66 @@
+import threading
+
+from speculative import SpeculativeNotes
+
+
+def make(generate):
+    return SpeculativeNotes(generate, enabled=True, workers=1)
+
+
+def test_result_is_served_from_the_background_job():
+    calls = []
+    notes = make(lambda transcript, cancelled: calls.append(transcript) or f"# Notes on {transcript}")
+
+    notes.start("owner", "the transcript")
+    assert notes.result("owner", "the transcript") == "# Notes on the transcript"
+    assert calls == ["the transcript"]
+    # Consumed: a second request generates its own
+    assert notes.result("owner", "the transcript") is None
+
+
+def test_edit_cancels_the_running_job_and_starts_over():
+    started = threading.Event()
+    seen_cancel = threading.Event()
+
+    def generate(transcript, cancelled):
+        if transcript == "first":
+            started.set()
+            while not cancelled():
+                threading.Event().wait(0.01)
+            seen_cancel.set()
+            return "stale"
+        return f"# {transcript}"
+
+    notes = make(generate)
+    notes.start("owner", "first")
+    started.wait(5)
+    notes.start("owner", "second")
+
+    assert seen_cancel.wait(5)
+    assert notes.result("owner", "first") is None
+    assert notes.result("owner", "second") == "# second"
+
+
+def test_delayed_job_cancelled_before_it_calls_the_model():
+    calls = []
+    notes = make(lambda transcript, cancelled: calls.append(transcript) or "# notes")
+
+    notes.start("owner", "draft", delay=5)
+    notes.abandon("owner")
+
+    assert notes.result("owner", "draft") is None
+    assert calls == []
+
+
+def test_errors_are_not_served():
+    notes = make(lambda transcript, cancelled: "Error generating structured notes: quota")
+
+    notes.start("owner", "text")
+    assert notes.result("owner", "text") is None
+
+
+def test_disabled_does_nothing():
+    notes = SpeculativeNotes(lambda transcript, cancelled: "# notes", enabled=False)
+
+    notes.start("owner", "text")
+    assert notes.result("owner", "text") is None
@@ -0,0 +1,98 @@
+import wave
+
+import numpy as np
+import pytest
+
+import tempo
+from tempo import TempoMap, compress_wav, restore_timestamps, tempo_factor
+
+RATE = 16000
+
+
+def write_wav(path, samples, channels=1):
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(RATE)
+        wav_file.writeframes((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+    return str(path)
+
+
+def read_wav(path):
+    with wave.open(str(path), "rb") as wav_file:
+        return np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2").astype(np.float32) / 32768
+
+
+def voice(seconds, pitch=200.0):
+    t = np.arange(int(seconds * RATE)) / float(RATE)
+    return 0.3 * sum(np.sin(2 * np.pi * k * pitch * t) / k for k in range(1, 5))
+
+
+def dominant_frequency(samples):
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    return np.argmax(spectrum) * RATE / float(len(samples))
+
+
+@pytest.mark.parametrize("factor", [1.25, 1.5, 2.0])
+def test_output_is_shorter_by_the_factor_at_the_same_pitch(tmp_path, factor):
+    source = write_wav(tmp_path / "in.wav", voice(10.0))
+    tempo_map = compress_wav(source, str(tmp_path / "out.wav"), factor)
+    output = read_wav(tmp_path / "out.wav")
+
+    assert len(output) / float(RATE) == pytest.approx(10.0 / factor, rel=0.01)
+    assert dominant_frequency(output) == pytest.approx(200.0, abs=2.0)
+    assert tempo_map.to_original(len(output) / float(RATE)) == pytest.approx(10.0, abs=0.05)
+
+
+def test_time_map_finds_a_sound_where_it_was(tmp_path):
+    samples = np.zeros(12 * RATE)
+    burst = voice(0.5)
+    samples[6 * RATE:6 * RATE + len(burst)] = burst  # A word at 6 s, silence around it
+    source = write_wav(tmp_path / "in.wav", samples)
+    tempo_map = compress_wav(source, str(tmp_path / "out.wav"), 1.5)
+
+    output = read_wav(tmp_path / "out.wav")
+    onset = np.argmax(np.abs(output) > 0.05) / float(RATE)
+    assert onset == pytest.approx(4.0, abs=0.1)
+    assert tempo_map.to_original(onset) == pytest.approx(6.0, abs=0.05)
+
+    times = tempo_map.to_original(np.linspace(0, len(output) / float(RATE), 50))
+    assert np.all(np.diff(times) > 0)
+    assert tempo_map.to_original(0.0) == pytest.approx(0.0, abs=0.01)
+
+
+def test_blocks_join_seamlessly(tmp_path, monkeypatch):
+    source = write_wav(tmp_path / "in.wav", voice(6.0, pitch=170.0))
+    compress_wav(source, str(tmp_path / "whole.wav"), 1.4)
+    monkeypatch.setattr(tempo, "BLOCK_OUTPUT_FRAMES", 7)
+    compress_wav(source, str(tmp_path / "blocks.wav"), 1.4)
+    assert np.array_equal(read_wav(tmp_path / "whole.wav"), read_wav(tmp_path / "blocks.wav"))
+
+
+def test_restore_timestamps():
+    tempo_map = TempoMap([0.0, 10.0], [0.0, 15.0])
+    segments = [{"start": 2.0, "end": 4.0, "text": "a"}, {"start": None, "end": 10.0, "text": "b"}]
+    restored = restore_timestamps(segments, tempo_map)
+    assert restored == [{"start": 3.0, "end": 6.0, "text": "a"}, {"start": None, "end": 15.0, "text": "b"}]
+    assert segments[0]["start"] == 2.0  # The input is left alone
+
+    unchanged = restore_timestamps(segments, None)
+    assert unchanged == segments and unchanged[0] is not segments[0]
+
+
+def test_factor_is_clamped_and_one_means_off(tmp_path):
+    assert tempo_factor(0.5) == 1.0
+    assert tempo_factor(5.0) == tempo.MAX_TEMPO_FACTOR
+    source = write_wav(tmp_path / "in.wav", voice(1.0))
+    assert compress_wav(source, str(tmp_path / "out.wav"), 1.0) is None
+    assert not (tmp_path / "out.wav").exists()
+
+
+def test_wrong_format_and_cancellation(tmp_path):
+    stereo = write_wav(tmp_path / "stereo.wav", np.repeat(voice(1.0), 2), channels=2)
+    with pytest.raises(ValueError):
+        compress_wav(stereo, str(tmp_path / "out.wav"), 1.5)
+
+    source = write_wav(tmp_path / "in.wav", voice(2.0))
+    with pytest.raises(RuntimeError, match="cancelled"):
+        compress_wav(source, str(tmp_path / "out.wav"), 1.5, cancelled=lambda: True)
@@ -0,0 +1,100 @@
+import urllib.error
+
+import pytest
+
+import tiers
+from deadline import current_deadline, request_deadline
+from tiers import classify_error, http_status, CircuitBreaker, TierChain, FATAL, UNSUPPORTED, BLOCKED, TRANSIENT
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("ERROR: [youtube] abc: Video unavailable", FATAL),
+    ("No transcript found for this video", UNSUPPORTED),
+    ("ERROR: unable to download video data: HTTP Error 403: Forbidden", BLOCKED),
+    ("429 Client Error: Too Many Requests for url", BLOCKED),
+    ("Sign in to confirm you're not a bot", BLOCKED),
+    ("Server returned status code: 429", BLOCKED),
+    ("Read timed out after 4290 ms", TRANSIENT),
+    ("Downloaded 403 of 1200 fragments before the connection reset", TRANSIENT),
+    ("Segment 429 failed to decode", TRANSIENT),
+])
+def test_classify_error(message, expected):
+    assert classify_error(message) == expected
+
+
+def test_status_from_exceptions_is_used_over_the_text():
+    error = urllib.error.HTTPError("https://example.com", 429, "Slow down", {}, None)
+    wrapped = RuntimeError("download failed")
+    wrapped.__cause__ = error
+
+    assert http_status(wrapped) == 429
+    assert classify_error(str(wrapped), http_status(wrapped)) == BLOCKED
+    assert classify_error("Video unavailable", 403) == FATAL
+
+
+def open_breaker(monkeypatch):
+    breaker = CircuitBreaker("test", 1.0)
+    for _ in range(tiers.FAILURE_THRESHOLD):
+        breaker.record_failure(TRANSIENT, 1.0)
+    assert not breaker.allow()
+    # Let the cooldown pass
+    monkeypatch.setattr(breaker, "_opened_at", 0.0)
+    assert breaker.allow()
+    return breaker
+
+
+def test_half_open_trial_ending_unsupported_closes_and_resets(monkeypatch):
+    breaker = open_breaker(monkeypatch)
+    breaker.record_failure(UNSUPPORTED, 1.0)
+
+    snapshot = breaker.snapshot()
+    assert snapshot["state"] == CircuitBreaker.CLOSED
+    assert snapshot["consecutive_failures"] == 0
+    assert snapshot["cooldown"] == tiers.BASE_COOLDOWN
+    # A single new failure must not re-open the circuit
+    breaker.record_failure(TRANSIENT, 1.0)
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_with_a_longer_cooldown(monkeypatch):
+    breaker = open_breaker(monkeypatch)
+    breaker.record_failure(BLOCKED, 1.0)
+
+    assert breaker.snapshot()["state"] == CircuitBreaker.OPEN
+    assert breaker.snapshot()["cooldown"] == min(2 * tiers.BASE_COOLDOWN, tiers.MAX_COOLDOWN)
+
+
+def test_chain_falls_through_to_the_next_tier():
+    chain = TierChain()
+    chain.add("captions", lambda url: "Error: No transcript found", 1.0)
+    chain.add("download", lambda url: "the transcript", 5.0)
+
+    assert chain.run("https://youtu.be/x") == ("the transcript", None, "download")
+
+
+def test_chain_stops_on_fatal_errors():
+    calls = []
+    chain = TierChain()
+    chain.add("captions", lambda url: "Error: Video unavailable", 1.0)
+    chain.add("download", lambda url: calls.append(url) or "text", 5.0)
+
+    result, error_class, tier = chain.run("https://youtu.be/x")
+    assert (error_class, tier, calls) == (FATAL, "captions", [])
+
+
+def test_running_out_of_a_time_slice_does_not_open_the_circuit():
+    def slow(url):
+        current_deadline().wait(5, "captions")
+        return "too late"
+
+    chain = TierChain()
+    chain.add("captions", slow, 0.05)
+    chain.add("download", lambda url: "the transcript", 0.9)
+
+    for _ in range(tiers.FAILURE_THRESHOLD + 1):
+        with request_deadline(seconds=1.0):
+            assert chain.run("https://youtu.be/x") == ("the transcript", None, "download")
+
+    breaker = chain.snapshot()
+    assert breaker["captions"]["state"] == CircuitBreaker.CLOSED
+    assert breaker["captions"]["consecutive_failures"] == 0
@@ -0,0 +1,70 @@
+import pytest
+
+import youtube
+from timerange import in_range, parse_time_range, parse_timestamp, range_duration, range_key
+
+
+def test_timestamps_accept_seconds_and_clock_times():
+    assert parse_timestamp(90) == 90.0
+    assert parse_timestamp("90.5") == 90.5
+    assert parse_timestamp("12:30") == 750.0
+    assert parse_timestamp("1:02:03") == 3723.0
+    assert parse_timestamp("  ") is None
+    assert parse_timestamp(None) is None
+
+
+@pytest.mark.parametrize("value", ["abc", "1:99:xx", "-5"])
+def test_invalid_timestamps_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+
+def test_time_ranges():
+    assert parse_time_range("", "") is None
+    assert parse_time_range("0", None) is None  # The whole recording
+    assert parse_time_range("1:00", "5:00") == (60.0, 300.0)
+    assert parse_time_range(None, "30") == (0.0, 30.0)
+    assert parse_time_range("45", "") == (45.0, None)
+    with pytest.raises(ValueError):
+        parse_time_range("5:00", "1:00")
+
+
+def test_range_keys_differ_per_range():
+    assert range_key(None) == ""
+    assert range_key((60.0, 300.0)) == "@60-300"
+    assert range_key((45.0, None)) == "@45-"
+    assert range_key((1.5, 2.0)) != range_key((1.5, 2.5))
+
+
+def test_range_duration_is_clipped_to_the_recording():
+    assert range_duration(None, 120.0) == 120.0
+    assert range_duration((30.0, 90.0), 120.0) == 60.0
+    assert range_duration((30.0, None), 120.0) == 90.0
+    assert range_duration((30.0, 500.0), 120.0) == 90.0
+    assert range_duration((200.0, 300.0), 120.0) == 0.0
+    assert range_duration((30.0, None), None) is None
+
+
+def test_segments_overlapping_the_range_are_kept():
+    time_range = (10.0, 20.0)
+    assert in_range(8.0, 3.0, time_range)  # Runs into the range
+    assert in_range(19.0, 5.0, time_range)
+    assert not in_range(5.0, 5.0, time_range)  # Ends exactly at the start
+    assert not in_range(20.0, 1.0, time_range)
+    assert in_range(500.0, None, (10.0, None))
+    assert in_range(0.0, None, None)
+
+
+def test_captions_are_filtered_to_the_range(monkeypatch):
+    segments = [
+        {"text": "intro words here", "start": 0.0, "duration": 5.0},
+        {"text": "the middle part", "start": 60.0, "duration": 5.0},
+        {"text": "closing remarks now", "start": 120.0, "duration": 5.0},
+    ]
+    monkeypatch.setattr(youtube, "fetch_transcript_segments", lambda video_id: segments)
+    url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+    transcript = youtube.get_youtube_transcript(url, time_range=(50.0, 100.0))
+    assert "middle" in transcript
+    assert "intro" not in transcript and "closing" not in transcript
+    assert youtube.get_youtube_transcript(url, time_range=(300.0, None)).startswith("Error:")
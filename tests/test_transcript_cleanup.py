@@ -0,0 +1,46 @@
+import pytest
+
+import youtube
+from transcript_cleanup import clean_transcript, merge_caption_segments, strip_non_speech
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("I think, um. We should go.", "I think. We should go."),
+    ("So, um, we should go.", "So, we should go."),
+    ("Um, hello there.", "hello there."),
+    ("It was, uh, erm, fine. Hmm! Right.", "It was, fine. Right."),
+    ("The album was umbrella-themed.", "The album was umbrella-themed."),
+    ("I I I think we're going to going to win.", "I think we're going to win."),
+    ("[Music] Welcome back (laughter) everyone ♪", "Welcome back everyone"),
+    ("Wait... what?", "Wait... what?"),
+])
+def test_clean_transcript(text, expected):
+    assert clean_transcript(text)[0] == expected
+
+
+def test_report_counts_the_savings():
+    _, report = clean_transcript("um uh um uh the point is this")
+
+    assert report["tokens_saved"] > 0
+    assert report["chars_after"] == len("the point is this")
+
+
+def test_rolling_caption_overlap_is_dropped():
+    merged = merge_caption_segments(["we will look at", "look at gradient descent", "[Music]", "gradient descent today"])
+
+    assert merged == "we will look at gradient descent today"
+
+
+def test_bracketed_numbers_are_not_tags():
+    assert strip_non_speech("see [1] and [Applause]").split() == ["see", "[1]", "and"]
+
+
+def test_youtube_transcript_keeps_what_was_said(monkeypatch):
+    monkeypatch.setattr(youtube, "fetch_transcript_segments", lambda video_id: [
+        {"text": "So, um, this is", "start": 0.0, "duration": 2.0},
+        {"text": "this is the lecture, uh, on sorting.", "start": 2.0, "duration": 3.0},
+    ])
+
+    transcript = youtube.get_youtube_transcript("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+    # Rolling overlap is merged, but fillers are only removed from the notes prompt
+    assert transcript == "So, um, this is the lecture, uh, on sorting."
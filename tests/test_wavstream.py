@@ -0,0 +1,103 @@
+import wave
+
+import numpy as np
+import pytest
+
+import wavstream
+from wavstream import convert_wav, read_wav_header
+
+
+def write_wav(path, samples, rate, channels=1):
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(pcm.tobytes())
+
+
+def read_wav(path):
+    with wave.open(str(path), "rb") as wav_file:
+        params = wav_file.getparams()
+        samples = np.frombuffer(wav_file.readframes(params.nframes), dtype="<i2").astype(np.float32) / 32768
+    return params, samples
+
+
+def dominant_frequency(samples, rate):
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    return np.argmax(spectrum) * rate / len(samples)
+
+
+def tone(frequency, seconds, rate):
+    t = np.arange(int(seconds * rate)) / rate
+    return 0.5 * np.sin(2 * np.pi * frequency * t)
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # Several blocks per file, so seams between blocks are exercised
+    monkeypatch.setattr(wavstream, "BLOCK_FRAMES", 4096)
+
+
+def test_stereo_44k_becomes_16k_mono_with_the_same_pitch(tmp_path, small_blocks):
+    rate = 44100
+    left = tone(440, 2.0, rate)
+    stereo = np.stack((left, left), axis=1).reshape(-1)
+    write_wav(tmp_path / "in.wav", stereo, rate, channels=2)
+
+    assert convert_wav(str(tmp_path / "in.wav"), str(tmp_path / "out.wav"))
+    params, samples = read_wav(tmp_path / "out.wav")
+
+    assert (params.nchannels, params.sampwidth, params.framerate) == (1, 2, 16000)
+    assert abs(params.nframes - 32000) <= 2
+    assert abs(dominant_frequency(samples, 16000) - 440) < 2
+    # Amplitude survives the filter and there are no clicks at block seams
+    assert 0.45 < np.max(np.abs(samples)) < 0.55
+    assert np.max(np.abs(np.diff(samples[100:-100]))) < 0.1
+
+
+def test_frequencies_above_the_new_nyquist_are_filtered(tmp_path, small_blocks):
+    rate = 48000
+    write_wav(tmp_path / "in.wav", tone(12000, 1.0, rate), rate)
+
+    convert_wav(str(tmp_path / "in.wav"), str(tmp_path / "out.wav"))
+    _, samples = read_wav(tmp_path / "out.wav")
+
+    # 12 kHz would alias to 4 kHz without the low-pass
+    assert np.sqrt(np.mean(samples[200:-200] ** 2)) < 0.02
+
+
+def test_normalized_input_is_left_alone(tmp_path):
+    write_wav(tmp_path / "in.wav", tone(440, 0.5, 16000), 16000)
+
+    assert convert_wav(str(tmp_path / "in.wav"), str(tmp_path / "out.wav")) is False
+    assert read_wav_header(str(tmp_path / "in.wav")).is_normalized()
+
+
+def test_time_range_keeps_only_those_frames(tmp_path, small_blocks):
+    rate = 32000
+    write_wav(tmp_path / "in.wav", tone(300, 4.0, rate), rate)
+
+    convert_wav(str(tmp_path / "in.wav"), str(tmp_path / "out.wav"), time_range=(1.0, 2.5))
+    params, _ = read_wav(tmp_path / "out.wav")
+
+    assert abs(params.nframes - 24000) <= 2
+
+
+def test_errors_mid_conversion_are_not_masked(tmp_path, small_blocks, monkeypatch):
+    rate = 44100
+    write_wav(tmp_path / "in.wav", tone(440, 1.0, rate), rate)
+    pcm_to_float = wavstream.pcm_to_float
+    blocks = []
+
+    def failing(raw, fmt):
+        blocks.append(raw)
+        if len(blocks) > 1:
+            raise OSError("disk full")
+        return pcm_to_float(raw, fmt)
+
+    monkeypatch.setattr(wavstream, "pcm_to_float", failing)
+
+    # The block still referenced here and by the traceback mustn't turn this into a BufferError
+    with pytest.raises(OSError, match="disk full"):
+        convert_wav(str(tmp_path / "in.wav"), str(tmp_path / "out.wav"))
@@ -0,0 +1,67 @@
+import os
+import time
+import fcntl
+import threading
+
+from workspace import sweep_directory, run_janitor_once
+from singleflight import SingleFlight
+
+
+def age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_sweep_removes_old_entries_and_keeps_protected_suffixes(tmp_path):
+    for name in ("old.json", "old.lock", "new.json"):
+        (tmp_path / name).write_text("x")
+    age(tmp_path / "old.json", 7200)
+    age(tmp_path / "old.lock", 7200)
+
+    removed = sweep_directory(str(tmp_path), max_age=3600, keep_suffixes=(".lock",))
+
+    assert removed == 1
+    assert sorted(os.listdir(tmp_path)) == ["new.json", "old.lock"]
+
+
+def test_janitor_leaves_single_flight_locks_to_their_owner(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    assert flight.do("key", lambda: 1) == 1
+    lock_path = next(tmp_path.glob("*.lock"))
+    age(lock_path, 2 * flight.lock_max_age)
+
+    # Held by another flight: neither the janitor nor the owner may remove it
+    with open(lock_path, "a") as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        run_janitor_once()
+        assert lock_path.exists()
+    run_janitor_once()
+    assert not lock_path.exists()
+
+
+def test_flight_retakes_a_lock_unlinked_while_it_waited(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    flight.do("key", lambda: 1)
+    lock_path = next(tmp_path.glob("*.lock"))
+    age(lock_path, 2 * flight.lock_max_age)
+
+    holder = open(lock_path, "a")
+    fcntl.flock(holder, fcntl.LOCK_EX)
+    inodes = []
+
+    def run():
+        with flight._locked(str(lock_path)):
+            inodes.append(os.stat(lock_path).st_ino)
+
+    waiter = threading.Thread(target=run)
+    waiter.start()
+    time.sleep(0.2)
+    # The holder unlinks the file it holds, as remove_stale_locks does
+    os.remove(lock_path)
+    fcntl.flock(holder, fcntl.LOCK_UN)
+    holder.close()
+    waiter.join(5)
+
+    assert inodes and os.path.exists(lock_path)
+    # The lock was taken on the file now at the path, not the unlinked one
+    assert inodes[0] == os.stat(lock_path).st_ino
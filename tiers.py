@@ -0,0 +1,365 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+from metrics import metrics
+from progress import report
+from deadline import current_deadline, stage_deadline
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Error classes
+FATAL = "fatal"  # The video itself can't be processed; no other tier will help
+UNSUPPORTED = "unsupported"  # This tier can't handle this video (e.g. no captions); try the next one
+BLOCKED = "blocked"  # The upstream is refusing us (rate limits, bot checks); the tier is unhealthy
+TRANSIENT = "transient"  # Timeouts, connection errors, 5xx; worth retrying
+
+_FATAL_MARKERS = (
+    "video unavailable",
+    "the video is unavailable",
+    "private video",
+    "video is private",
+    "has been removed",
+    "account associated with this video has been terminated",
+    "could not extract video id",
+    "valid youtube url",
+    "unsupported url",
+    "is not a valid url",
+)
+_UNSUPPORTED_MARKERS = (
+    "no transcript",
+    "transcripts disabled",
+    "subtitles are disabled",
+    "subtitles format is not supported",
+    "too large",
+    "too long",
+    "live streams",
+    "confirm your age",
+    "members-only",
+    "join this channel",
+    "premieres in",
+    "live event will begin",
+)
+_BLOCKED_MARKERS = (
+    "too many requests",
+    "rate limit",
+    "blocking requests",
+    "ip has been blocked",
+    "ipblocked",
+    "requestblocked",
+    "sign in to confirm you",
+    "not a bot",
+    "forbidden",
+)
+# A bare "429" or "403" could be any number in a message; only count it as a status
+_BLOCKED_STATUS_PATTERN = re.compile(
+    r"\b(?:http error|status(?: code)?|error code|response code)[\s:=]*(?:429|403)\b"
+    r"|\b(?:429|403)[\s:]+(?:too many requests|forbidden|client error)"
+)
+_BLOCKED_STATUS_CODES = (403, 429)
+
+# Circuit breaker settings
+FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 3))  # Consecutive failures that open the circuit
+BASE_COOLDOWN = int(os.environ.get("CIRCUIT_BASE_COOLDOWN", 60))  # Seconds an open circuit stays open at first
+MAX_COOLDOWN = int(os.environ.get("CIRCUIT_MAX_COOLDOWN", 600))  # Upper bound after repeated re-opening
+HEALTH_WINDOW = 50  # Recent outcomes kept per tier
+
+
+def http_status(error):
+    """
+    HTTP status carried by an exception (requests, urllib, the Groq SDK, yt-dlp's wrapped errors)
+
+    Args:
+        error (Exception): The exception
+
+    Returns:
+        int: The status code, or None if it has none
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        for candidate in (getattr(error, "status_code", None), getattr(error, "code", None),
+                          getattr(getattr(error, "response", None), "status_code", None)):
+            if isinstance(candidate, int):
+                return candidate
+        # yt-dlp keeps the underlying HTTPError in exc_info
+        exc_info = getattr(error, "exc_info", None)
+        error = exc_info[1] if exc_info else (error.__cause__ or error.__context__)
+    return None
+
+
+def classify_error(message, status=None):
+    """
+    Classify a tier's error message
+
+    Args:
+        message (str): Error message or exception text
+        status (int, optional): HTTP status of the failed call, when known
+
+    Returns:
+        str: One of FATAL, UNSUPPORTED, BLOCKED or TRANSIENT
+    """
+    text = (message or "").lower()
+    if any(marker in text for marker in _FATAL_MARKERS):
+        return FATAL
+    if any(marker in text for marker in _UNSUPPORTED_MARKERS):
+        return UNSUPPORTED
+    if status in _BLOCKED_STATUS_CODES:
+        return BLOCKED
+    if any(marker in text for marker in _BLOCKED_MARKERS) or _BLOCKED_STATUS_PATTERN.search(text):
+        return BLOCKED
+    return TRANSIENT
+
+
+class CircuitBreaker(object):
+    """
+    Health tracking and circuit breaking for one tier.
+
+    After FAILURE_THRESHOLD consecutive BLOCKED/TRANSIENT failures the circuit
+    opens and the tier is skipped for a cooldown that doubles each time it
+    re-opens. Once the cooldown expires a single trial request is let through
+    (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, prior_latency):
+        self.name = name
+        self.prior_latency = prior_latency
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=HEALTH_WINDOW)  # (success, latency, error class)
+        self._consecutive_failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._cooldown = BASE_COOLDOWN
+        self._trial_in_flight = False
+
+    def allow(self):
+        """
+        Whether a request may use this tier now
+
+        Returns:
+            bool: False while the circuit is open
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.time() - self._opened_at >= self._cooldown:
+                self._set_state(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def is_open(self):
+        """
+        Whether the circuit is currently keeping requests away, without
+        claiming the half-open trial (for optional work such as prefetching)
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                return time.time() - self._opened_at < self._cooldown
+            return self._state == self.HALF_OPEN
+
+    def record_success(self, latency):
+        with self._lock:
+            self._outcomes.append((True, latency, None))
+            self._trial_in_flight = False
+            self._close()
+        metrics.observe(f"tiers.{self.name}.latency_seconds", latency)
+        metrics.increment(f"tiers.{self.name}.success")
+
+    def record_cancelled(self):
+        """The request was cancelled mid-tier; says nothing about the tier's health"""
+        metrics.increment(f"tiers.{self.name}.cancelled")
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, error_class, latency):
+        metrics.increment(f"tiers.{self.name}.failure.{error_class}")
+        with self._lock:
+            self._trial_in_flight = False
+            # FATAL and UNSUPPORTED errors are about the video, not the tier's health
+            if error_class in (FATAL, UNSUPPORTED):
+                if self._state == self.HALF_OPEN:
+                    # The trial reached the upstream, so the tier is healthy again
+                    self._close()
+                return
+
+            self._outcomes.append((False, latency, error_class))
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN:
+                self._cooldown = min(self._cooldown * 2, MAX_COOLDOWN)
+                self._open()
+            elif self._consecutive_failures >= FAILURE_THRESHOLD:
+                self._open()
+
+    def _close(self):
+        self._consecutive_failures = 0
+        if self._state != self.CLOSED:
+            self._cooldown = BASE_COOLDOWN
+            self._set_state(self.CLOSED)
+
+    def _open(self):
+        self._opened_at = time.time()
+        self._set_state(self.OPEN)
+        logger.warning(f"Circuit for tier '{self.name}' opened for {self._cooldown}s")
+
+    def _set_state(self, state):
+        self._state = state
+        metrics.set_gauge(f"tiers.{self.name}.state", state)
+
+    def expected_cost(self):
+        """
+        Expected seconds to get a transcript from this tier: mean successful
+        latency divided by the (smoothed) success rate
+
+        Returns:
+            float: Score used to order tiers, lower is better
+        """
+        with self._lock:
+            successes = [latency for ok, latency, _ in self._outcomes if ok]
+            attempts = len(self._outcomes)
+        latency = sum(successes) / len(successes) if successes else self.prior_latency
+        success_rate = (len(successes) + 1.0) / (attempts + 1.0)
+        return latency / success_rate
+
+    def snapshot(self):
+        with self._lock:
+            attempts = len(self._outcomes)
+            successes = sum(1 for ok, _, _ in self._outcomes if ok)
+            return {
+                "state": self._state,
+                "success_rate": successes / attempts if attempts else None,
+                "consecutive_failures": self._consecutive_failures,
+                "cooldown": self._cooldown,
+            }
+
+
+class TierChain(object):
+    """
+    Ordered fallback chain of tiers with per-tier circuit breakers.
+    Regular tiers are tried cheapest-expected-cost first; last-resort tiers
+    always come after them.
+    """
+
+    def __init__(self):
+        self._tiers = []
+
+    def add(self, name, fn, prior_latency, last_resort=False):
+        """
+        Register a tier
+
+        Args:
+            name (str): Tier name, used in logs and metrics
+            fn (function): Takes the request argument, returns a result string ("Error..." on failure)
+            prior_latency (float): Expected seconds per success before any data is in
+            last_resort (bool): Keep this tier at the end regardless of its score
+        """
+        self._tiers.append((name, fn, CircuitBreaker(name, prior_latency), last_resort))
+
+    def ordered(self):
+        regular = [tier for tier in self._tiers if not tier[3]]
+        fallback = [tier for tier in self._tiers if tier[3]]
+        regular.sort(key=lambda tier: tier[2].expected_cost())
+        return regular + fallback
+
+    def run(self, argument, **options):
+        """
+        Try the tiers in order until one succeeds
+
+        Each tier runs under a slice of the request's deadline that leaves the
+        later tiers their expected latency, so a slow tier times out (as a
+        TRANSIENT failure) instead of using up the whole request.
+
+        Args:
+            argument: Passed to each tier function (e.g. the YouTube URL)
+            **options: Passed to each tier function as keyword arguments (e.g. time_range)
+
+        Returns:
+            tuple: (result, error class or None, name of the tier that produced the result)
+
+        Raises:
+            RequestCancelled: If the request's deadline passes or its client goes away
+        """
+        started = time.time()
+        last_error = None
+        last_class = None
+        last_tier = None
+        request_deadline = current_deadline()
+
+        tiers = self.ordered()
+        for index, (name, fn, breaker, _) in enumerate(tiers):
+            request_deadline.check("tiers")
+            if not breaker.allow():
+                logger.info(f"Skipping tier '{name}': circuit open")
+                metrics.increment(f"tiers.{name}.skipped")
+                continue
+
+            tier_started = time.time()
+            report("tier", tier=name)
+            status = None
+            with stage_deadline(self._budget(request_deadline, tiers[index:])) as tier_deadline:
+                try:
+                    result = fn(argument, **options)
+                except Exception as e:
+                    result = f"Error: {str(e)}"
+                    status = http_status(e)
+            latency = time.time() - tier_started
+
+            if result and not result.startswith("Error"):
+                breaker.record_success(latency)
+                # Time lost to failing tiers before reaching one that works
+                metrics.observe("tiers.wasted_seconds", tier_started - started)
+                return result, None, name
+
+            if request_deadline.expired():
+                # The tier was cut short, which says nothing about its health
+                breaker.record_cancelled()
+                request_deadline.check("tiers")
+
+            error_class = classify_error(result, status)
+            if tier_deadline.expired():
+                # A slice of the request's time running out says as little about the
+                # tier's health as a cancellation, so it doesn't count as a failure
+                logger.info(f"Tier '{name}' ran out of its {latency:.0f}s share of the request's time")
+                metrics.increment(f"tiers.{name}.timeouts")
+                error_class = TRANSIENT
+                breaker.record_cancelled()
+            else:
+                breaker.record_failure(error_class, latency)
+            logger.info(f"Tier '{name}' failed ({error_class}) after {latency:.1f}s: {result}")
+            last_error, last_class, last_tier = result, error_class, name
+
+            if error_class == FATAL:
+                break
+
+        if last_error is None:
+            last_error = "Error: All transcription sources are temporarily unavailable. Please try again in a few minutes."
+            last_class = BLOCKED
+        return last_error, last_class, last_tier
+
+    @staticmethod
+    def _budget(request_deadline, remaining_tiers):
+        remaining = request_deadline.remaining()
+        if remaining is None:
+            return None
+        name, fn, breaker, _ = remaining_tiers[0]
+        reserve = sum(later[2].prior_latency for later in remaining_tiers[1:])
+        return max(breaker.prior_latency, remaining - reserve)
+
+    def is_open(self, name):
+        """Whether the named tier's circuit is open (see CircuitBreaker.is_open)"""
+        return any(breaker.is_open() for tier_name, _, breaker, _ in self._tiers if tier_name == name)
+
+    def snapshot(self):
+        return {name: dict(breaker.snapshot(), expected_cost=breaker.expected_cost()) for name, _, breaker, _ in self._tiers}
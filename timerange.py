@@ -0,0 +1,105 @@
+import re
+
+
+_CLOCK = re.compile(r"^(?:(\d+):)?(\d{1,2}):(\d{1,2}(?:\.\d+)?)$")
+
+
+def parse_timestamp(value):
+    """
+    Parse a position in a recording
+
+    Args:
+        value: Seconds (number or string) or a clock time such as "1:02:03" or "12:30"
+
+    Returns:
+        float: Seconds, or None if value is empty
+
+    Raises:
+        ValueError: If value isn't a valid position
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        text = str(value).strip()
+        if not text:
+            return None
+        match = _CLOCK.match(text)
+        if match:
+            hours, minutes, secs = match.groups()
+            seconds = int(hours or 0) * 3600 + int(minutes) * 60 + float(secs)
+        else:
+            try:
+                seconds = float(text)
+            except ValueError:
+                raise ValueError(f"'{text}' is not a valid time; use seconds or h:mm:ss")
+    if seconds < 0:
+        raise ValueError("Times can't be negative")
+    return seconds
+
+
+def parse_time_range(start, end):
+    """
+    Parse the optional start and end of the part of a recording to transcribe
+
+    Args:
+        start: Start position (see parse_timestamp), empty for the beginning
+        end: End position, empty for the end of the recording
+
+    Returns:
+        tuple: (start seconds, end seconds or None), or None for the whole recording
+
+    Raises:
+        ValueError: If either time is invalid or the range is empty
+    """
+    start = parse_timestamp(start)
+    end = parse_timestamp(end)
+    if not start and end is None:
+        return None
+    start = start or 0.0
+    if end is not None and end <= start:
+        raise ValueError("The end time must be after the start time")
+    return (start, end)
+
+
+def range_duration(time_range, total_duration):
+    """
+    Length of the requested part of a recording
+
+    Args:
+        time_range (tuple): (start, end or None), or None for the whole recording
+        total_duration (float): Length of the whole recording, or None if unknown
+
+    Returns:
+        float: Seconds, or None if it can't be known
+    """
+    if time_range is None:
+        return total_duration
+    start, end = time_range
+    if total_duration is not None:
+        end = total_duration if end is None else min(end, total_duration)
+    if end is None:
+        return None
+    return max(0.0, end - start)
+
+
+def in_range(start, duration, time_range):
+    """Whether a caption segment starting at start overlaps the requested range"""
+    if time_range is None:
+        return True
+    range_start, range_end = time_range
+    return start + (duration or 0.0) > range_start and (range_end is None or start < range_end)
+
+
+def range_key(time_range):
+    """
+    Suffix for cache and coalescing keys, so different ranges never share a result
+
+    Returns:
+        str: "" for the whole recording, otherwise e.g. "@60-300"
+    """
+    if time_range is None:
+        return ""
+    start, end = time_range
+    return f"@{start:g}-{'' if end is None else f'{end:g}'}"
@@ -0,0 +1,173 @@
+import re
+import logging
+from routing import estimate_tokens
+from metrics import metrics
+
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+CLEANUP_VERSION = "cleanup-2"  # Part of the notes cache key; bump when the rules change
+MAX_OVERLAP_WORDS = 30  # Longest caption overlap looked for between consecutive segments
+MAX_REPEAT_NGRAM = 6  # Longest phrase collapsed when it's immediately repeated ("going to going to")
+
+# Non-speech annotations from auto-captions and Whisper: [Music], [Applause], [BLANK_AUDIO], (laughter), ♪
+_BRACKET_TAG = re.compile(r"\[[^\]\d]{1,40}\]")
+_PAREN_TAG = re.compile(
+    r"\((?:[a-z ]{0,20})?(?:music|applause|laughter|laughs|laughing|cheering|cheers|inaudible|"
+    r"silence|noise|crosstalk|coughs|sighs|static)(?:[a-z ]{0,20})?\)",
+    re.IGNORECASE,
+)
+_MUSIC_NOTES = re.compile(r"[♪♫]+")
+
+# Only fillers that never carry meaning; "like" and "you know" often do. A comma
+# after one goes with it; a full stop ends the sentence and stays
+_FILLER_WORDS = r"(?:u+h+m*|u+m+|e+r+m+|hmm+|mm+|ah+)"
+_FILLERS = re.compile(rf"(?<![\w'-]){_FILLER_WORDS}(?![\w'-]),?", re.IGNORECASE)
+# A filler that is a sentence of its own ("Hmm!") goes with its punctuation
+_FILLER_SENTENCES = re.compile(rf"(^|[.!?])[ \t]*{_FILLER_WORDS}(?![\w'-])[,.!?]*", re.IGNORECASE | re.MULTILINE)
+
+_SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([,.!?;:])")
+_REPEATED_PUNCTUATION = re.compile(r"([,;:])(?:\s*[,;:])+")
+_PAUSE_BEFORE_SENTENCE_END = re.compile(r"[,;:]+([.!?])")  # "I think, um." -> "I think."
+_LEADING_PUNCTUATION = re.compile(r"^[\s,;:.]+")
+
+
+def _word_key(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def strip_non_speech(text):
+    """
+    Remove non-speech annotations such as [Music], (laughter) and ♪
+
+    Args:
+        text (str): Transcript or caption text
+
+    Returns:
+        str: Text without the annotations
+    """
+    text = _BRACKET_TAG.sub(" ", text)
+    text = _PAREN_TAG.sub(" ", text)
+    return _MUSIC_NOTES.sub(" ", text)
+
+
+def merge_caption_segments(texts):
+    """
+    Join caption segments, dropping the text that rolling auto-captions repeat
+    at the start of a segment from the end of the previous one
+
+    Args:
+        texts (list): Segment texts in order
+
+    Returns:
+        str: The joined text
+    """
+    words = []
+    keys = []
+    dropped = 0
+    for text in texts:
+        # Tags are dropped first so "[Music]" between two segments doesn't hide their overlap
+        segment_words = strip_non_speech(text).split()
+        if not segment_words:
+            continue
+        segment_keys = [_word_key(word) for word in segment_words]
+
+        # Longest suffix of what we have that is a prefix of the new segment
+        overlap = 0
+        limit = min(MAX_OVERLAP_WORDS, len(keys), len(segment_keys))
+        for size in range(limit, 0, -1):
+            if keys[-size:] == segment_keys[:size]:
+                overlap = size
+                break
+        # A single shared word is usually a coincidence ("the ... the")
+        if overlap == 1 and len(segment_keys) > 1:
+            overlap = 0
+
+        words.extend(segment_words[overlap:])
+        keys.extend(segment_keys[overlap:])
+        dropped += overlap
+
+    if dropped:
+        metrics.increment("cleanup.overlap_words_dropped", dropped)
+        logger.info(f"Dropped {dropped} words of repeated caption overlap")
+    return " ".join(words)
+
+
+def _collapse_repeats(words):
+    """Collapse immediately repeated words (3+ times) and phrases (2+ words)"""
+    keys = [_word_key(word) for word in words]
+
+    # Stutters: "I I I think" -> "I think"; a doubled word ("that that") can be legitimate
+    result_words, result_keys = [], []
+    i = 0
+    while i < len(keys):
+        run = 1
+        while keys[i] and i + run < len(keys) and keys[i + run] == keys[i]:
+            run += 1
+        kept = 1 if run >= 3 else run
+        result_words.extend(words[i:i + kept])
+        result_keys.extend(keys[i:i + kept])
+        i += run
+
+    # Repeated phrases: "going to going to" -> "going to"
+    for size in range(MAX_REPEAT_NGRAM, 1, -1):
+        i = 0
+        words_out, keys_out = [], []
+        while i < len(result_keys):
+            if i + 2 * size <= len(result_keys) and result_keys[i:i + size] == result_keys[i + size:i + 2 * size] \
+                    and all(result_keys[i:i + size]):
+                i += size
+                continue
+            words_out.append(result_words[i])
+            keys_out.append(result_keys[i])
+            i += 1
+        result_words, result_keys = words_out, keys_out
+    return result_words
+
+
+def clean_transcript(text):
+    """
+    Remove what the model doesn't need from a transcript: non-speech tags,
+    filler words, stutters and redundant whitespace
+
+    Args:
+        text (str): Transcript text
+
+    Returns:
+        tuple: (cleaned text, report dict with character and estimated token savings)
+    """
+    cleaned = _FILLER_SENTENCES.sub(r"\1 ", strip_non_speech(text))
+    cleaned = _FILLERS.sub(" ", cleaned)
+
+    lines = []
+    for line in cleaned.splitlines():
+        words = line.split()
+        if words:
+            line = " ".join(_collapse_repeats(words))
+            line = _SPACE_BEFORE_PUNCTUATION.sub(r"\1", line)
+            line = _REPEATED_PUNCTUATION.sub(r"\1", line)
+            line = _PAUSE_BEFORE_SENTENCE_END.sub(r"\1", line)
+            line = _LEADING_PUNCTUATION.sub("", line)
+        lines.append(line.strip())
+    # Keep paragraph breaks, drop runs of blank lines
+    cleaned = re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+    tokens_before = estimate_tokens(text)
+    tokens_after = estimate_tokens(cleaned)
+    report = {
+        "chars_before": len(text),
+        "chars_after": len(cleaned),
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "saved_ratio": (tokens_before - tokens_after) / float(tokens_before) if tokens_before else 0.0,
+    }
+    metrics.increment("cleanup.tokens_saved", report["tokens_saved"])
+    metrics.observe("cleanup.saved_ratio", report["saved_ratio"])
+    logger.info(
+        f"Transcript cleanup: {tokens_before} -> {tokens_after} estimated tokens "
+        f"({report['saved_ratio']:.1%} saved)"
+    )
+    return cleaned, report
@@ -0,0 +1,282 @@
+import os
+import mmap
+import time
+import wave
+import struct
+import logging
+import numpy as np
+from metrics import metrics
+
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+TARGET_RATE = 16000  # Whisper works on 16 kHz mono
+BLOCK_FRAMES = 65536  # Input frames converted per block; bounds peak memory
+FILTER_TAPS = 127  # Anti-aliasing low-pass length (odd, so it has a center tap)
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavFormat(object):
+    def __init__(self, audio_format, channels, sample_rate, bits_per_sample, block_align, data_offset, data_size):
+        self.audio_format = audio_format
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.bits_per_sample = bits_per_sample
+        self.block_align = block_align
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+    @property
+    def frames(self):
+        return self.data_size // self.block_align
+
+    @property
+    def duration(self):
+        return self.frames / float(self.sample_rate)
+
+    def is_normalized(self):
+        """Already 16-bit PCM mono at or below the target rate, so it can be sent as-is"""
+        return (
+            self.audio_format == WAVE_FORMAT_PCM
+            and self.channels == 1
+            and self.bits_per_sample == 16
+            and self.sample_rate <= TARGET_RATE
+        )
+
+
+def read_wav_header(path):
+    """
+    Parse a RIFF/WAVE header without reading the sample data
+
+    Args:
+        path (str): Path to the WAV file
+
+    Returns:
+        WavFormat: Format and location of the data chunk
+
+    Raises:
+        ValueError: If the file isn't a WAV file this module can convert
+    """
+    with open(path, "rb") as f:
+        return parse_wav_header(f, os.path.getsize(path))
+
+
+def parse_wav_header(f, file_size):
+    """
+    Parse a RIFF/WAVE header from an open file, or anything file-like with
+    read, seek and tell (e.g. the first bytes of an upload)
+
+    Args:
+        f: The file, positioned anywhere
+        file_size (int): Size of the whole file in bytes
+
+    Returns:
+        WavFormat: Format and location of the data chunk
+
+    Raises:
+        ValueError: If the file isn't a WAV file this module can convert
+    """
+    f.seek(0)
+    riff = f.read(12)
+    if len(riff) < 12 or riff[0:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("WAV file has no data chunk")
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+
+        if chunk_id == b"fmt ":
+            body = f.read(chunk_size)
+            if len(body) < 16:
+                raise ValueError("WAV fmt chunk is too short")
+            audio_format, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", body[:16])
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                # The real format is the first two bytes of the SubFormat GUID
+                audio_format = struct.unpack("<H", body[24:26])[0]
+            fmt = (audio_format, channels, sample_rate, bits, block_align)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk comes before the fmt chunk")
+            data_offset = f.tell()
+            # Recorders that stream to disk sometimes leave the size at 0 or 0xFFFFFFFF
+            available = file_size - data_offset
+            data_size = chunk_size if 0 < chunk_size <= available else available
+            audio_format, channels, sample_rate, bits, block_align = fmt
+            break
+        else:
+            f.seek(chunk_size, os.SEEK_CUR)
+
+        # Chunks are padded to an even size
+        if chunk_size % 2:
+            f.seek(1, os.SEEK_CUR)
+
+    if audio_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise ValueError(f"Unsupported WAV encoding 0x{audio_format:04x}")
+    if audio_format == WAVE_FORMAT_PCM and bits not in (8, 16, 24, 32):
+        raise ValueError(f"Unsupported PCM bit depth {bits}")
+    if audio_format == WAVE_FORMAT_IEEE_FLOAT and bits not in (32, 64):
+        raise ValueError(f"Unsupported float bit depth {bits}")
+    if channels < 1 or sample_rate < 1 or block_align != channels * bits // 8:
+        raise ValueError("Inconsistent WAV header")
+
+    return WavFormat(audio_format, channels, sample_rate, bits, block_align, data_offset, data_size)
+
+
+def pcm_to_float(raw, fmt):
+    """
+    Convert a block of raw interleaved bytes to float32 samples of shape (frames, channels)
+    """
+    bits = fmt.bits_per_sample
+    if fmt.audio_format == WAVE_FORMAT_IEEE_FLOAT:
+        samples = raw.view("<f4" if bits == 32 else "<f8").astype(np.float32)
+    elif bits == 8:
+        # 8-bit WAV is unsigned
+        samples = (raw.astype(np.float32) - 128.0) / 128.0
+    elif bits == 16:
+        samples = raw.view("<i2").astype(np.float32) / 32768.0
+    elif bits == 24:
+        triples = raw.reshape(-1, 3).astype(np.int32)
+        values = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+        values = np.where(values & 0x800000, values - 0x1000000, values)
+        samples = values.astype(np.float32) / 8388608.0
+    else:
+        samples = raw.view("<i4").astype(np.float32) / 2147483648.0
+    return samples.reshape(-1, fmt.channels)
+
+
+def _lowpass_kernel(cutoff):
+    """
+    Hamming-windowed sinc low-pass filter
+
+    Args:
+        cutoff (float): Cutoff as a fraction of the input sample rate (0 < cutoff < 0.5)
+    """
+    n = np.arange(FILTER_TAPS) - (FILTER_TAPS - 1) / 2.0
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(FILTER_TAPS)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def convert_wav(input_path, output_path, time_range=None, cancelled=None):
+    """
+    Downmix and resample a WAV file to 16 kHz mono 16-bit PCM in fixed-size blocks.
+
+    The input is memory-mapped and never loaded whole; each block is converted
+    and written out before the next one is read, so peak memory depends on
+    BLOCK_FRAMES rather than on the length of the recording.
+
+    Args:
+        input_path (str): Source WAV file
+        output_path (str): Where to write the converted WAV
+        time_range (tuple, optional): (start, end or None) seconds; only these
+            frames are read
+        cancelled (function, optional): Checked between blocks; returning True
+            stops the work (the conversion pool's cancel file)
+
+    Returns:
+        bool: True if a converted file was written, False if the input is
+            already normalized and can be used as-is
+
+    Raises:
+        ValueError: If the input isn't a WAV file this module can convert
+        RuntimeError: If cancelled
+    """
+    fmt = read_wav_header(input_path)
+    if fmt.is_normalized() and time_range is None:
+        return False
+
+    first_frame, frames = 0, fmt.frames
+    if time_range is not None:
+        start, end = time_range
+        first_frame = min(fmt.frames, int(start * fmt.sample_rate))
+        last_frame = fmt.frames if end is None else min(fmt.frames, int(np.ceil(end * fmt.sample_rate)))
+        frames = max(0, last_frame - first_frame)
+
+    started = time.time()
+    out_rate = min(fmt.sample_rate, TARGET_RATE)
+    step = fmt.sample_rate / float(out_rate)  # Input frames per output frame
+    resampling = fmt.sample_rate != out_rate
+    kernel = _lowpass_kernel(0.45 / step) if resampling else None
+    history = FILTER_TAPS - 1
+
+    with open(input_path, "rb") as f, wave.open(output_path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(out_rate)
+
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = fmt.data_offset + first_frame * fmt.block_align
+
+            tail = np.zeros(history, dtype=np.float32)  # Filter state carried between blocks
+            filtered_start = -(history // 2)  # Input frame index of the first filtered sample
+            next_output = 0  # Index of the next output frame to produce
+            pending = np.zeros(0, dtype=np.float32)  # Filtered samples not yet fully consumed
+
+            for block_start in range(0, frames, BLOCK_FRAMES):
+                if cancelled is not None and cancelled():
+                    raise RuntimeError("WAV conversion was cancelled")
+                block_end = min(block_start + BLOCK_FRAMES, frames)
+                # Slicing the map copies the block, so no view of it is left open to
+                # stop the map closing (e.g. one held by an exception's traceback)
+                raw = np.frombuffer(
+                    mapped[offset + block_start * fmt.block_align:offset + block_end * fmt.block_align], dtype=np.uint8
+                )
+                mono = pcm_to_float(raw, fmt).mean(axis=1, dtype=np.float32)
+                del raw
+
+                if not resampling:
+                    out.writeframes(_to_pcm16(mono))
+                    continue
+
+                # Filter with the previous block's tail so there are no seams
+                padded = np.concatenate((tail, mono))
+                tail = padded[-history:].copy()
+                filtered = np.convolve(padded, kernel, mode="valid").astype(np.float32)
+                del padded
+
+                # Interpolate the output frames that fall inside the filtered samples we have
+                pending = np.concatenate((pending, filtered))
+                available_end = filtered_start + len(pending) - 1
+                last_output = int(np.floor(available_end / step))
+                if last_output >= next_output:
+                    positions = np.arange(next_output, last_output + 1) * step - filtered_start
+                    out.writeframes(_to_pcm16(np.interp(positions, np.arange(len(pending)), pending)))
+                    next_output = last_output + 1
+
+                # Keep only what the next output frame still needs
+                keep_from = min(len(pending), max(0, int(np.floor(next_output * step)) - filtered_start))
+                pending = pending[keep_from:]
+                filtered_start += keep_from
+
+            if resampling:
+                # Flush the filter with silence so the last input frames come out too
+                flush = np.convolve(np.concatenate((tail, np.zeros(history // 2, dtype=np.float32))), kernel, mode="valid")
+                pending = np.concatenate((pending, flush.astype(np.float32)))
+                total_outputs = int(np.ceil(frames / step))
+                available_end = min(filtered_start + len(pending) - 1, frames - 1)
+                last_output = min(total_outputs - 1, int(np.floor(available_end / step)))
+                if last_output >= next_output:
+                    positions = np.arange(next_output, last_output + 1) * step - filtered_start
+                    out.writeframes(_to_pcm16(np.interp(positions, np.arange(len(pending)), pending)))
+        finally:
+            mapped.close()
+
+    elapsed = time.time() - started
+    metrics.observe("wav_fastpath.seconds", elapsed)
+    logger.info(
+        f"Converted WAV ({fmt.channels} ch, {fmt.sample_rate} Hz, {fmt.bits_per_sample}-bit, "
+        f"{frames / float(fmt.sample_rate):.0f}s) to {out_rate} Hz mono in {elapsed:.2f}s"
+    )
+    return True
+
+
+def _to_pcm16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
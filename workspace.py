@@ -0,0 +1,250 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from metrics import metrics
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Constants
+WORKSPACE_PREFIX = "speechscribe-"
+TMPFS_DIR = "/dev/shm"
+TMPFS_MIN_FREE_BYTES = 512 * 1024 * 1024  # Only use tmpfs if at least 512 MB is free
+
+JANITOR_INTERVAL = int(os.environ.get("JANITOR_INTERVAL", 60))  # Seconds between sweeps
+JANITOR_MAX_AGE = int(os.environ.get("JANITOR_MAX_AGE", 3600))  # Files older than this are removed
+JANITOR_GRACE = int(os.environ.get("JANITOR_GRACE", 600))  # Never evict anything newer (covers gunicorn's timeout)
+
+# Directories the janitor keeps bounded:
+# path -> (quota in bytes or None, max age in seconds, file suffixes it never removes)
+MANAGED_DIRS = {
+    "./uploads": (int(os.environ.get("UPLOADS_QUOTA_BYTES", 1024 * 1024 * 1024)), JANITOR_MAX_AGE, ()),  # 1 GB
+    "./downloads/audio": (int(os.environ.get("DOWNLOADS_QUOTA_BYTES", 2 * 1024 * 1024 * 1024)), JANITOR_MAX_AGE, ()),  # 2 GB
+}
+
+# Extra cleanup functions run on every sweep, for files only their owner can
+# safely remove (e.g. lock files, which must be held while they are unlinked)
+_SWEEPERS = []
+
+
+def _pick_scratch_root():
+    """
+    Choose where request workspaces live: tmpfs when it has room, otherwise the system temp dir
+    """
+    configured = os.environ.get("WORKSPACE_ROOT")
+    if configured:
+        return configured
+
+    try:
+        if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+            usage = shutil.disk_usage(TMPFS_DIR)
+            if usage.free >= TMPFS_MIN_FREE_BYTES:
+                return TMPFS_DIR
+    except OSError:
+        pass
+
+    return tempfile.gettempdir()
+
+
+SCRATCH_ROOT = _pick_scratch_root()
+
+
+@contextmanager
+def request_workspace(kind="request"):
+    """
+    Give a request its own scratch directory and remove it afterwards, whatever happens
+
+    Args:
+        kind (str): Short label used in the directory name (e.g. "upload", "youtube")
+
+    Yields:
+        str: Path to the empty workspace directory
+    """
+    path = tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{kind}-", dir=SCRATCH_ROOT)
+    metrics.increment("workspace.created")
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+        metrics.increment("workspace.removed")
+
+
+def scratch_file(suffix=""):
+    """
+    Create a uniquely named scratch file for callers that hand the path on.
+    The caller owns the file; the janitor removes it if it is left behind.
+
+    Args:
+        suffix (str): File suffix, e.g. ".wav"
+
+    Returns:
+        str: Path to the new, empty file
+    """
+    fd, path = tempfile.mkstemp(prefix=WORKSPACE_PREFIX, suffix=suffix, dir=SCRATCH_ROOT)
+    os.close(fd)
+    return path
+
+
+def manage_directory(directory, quota_bytes=None, max_age=JANITOR_MAX_AGE, keep_suffixes=()):
+    """
+    Put another directory under the janitor's age and size limits
+
+    Args:
+        directory (str): Directory to sweep
+        quota_bytes (int, optional): Maximum total size of the directory
+        max_age (int): Maximum entry age in seconds
+        keep_suffixes (tuple): Names ending in these are left to their owner
+    """
+    MANAGED_DIRS[directory] = (quota_bytes, max_age, tuple(keep_suffixes))
+
+
+def add_sweeper(sweeper):
+    """
+    Run a cleanup function on every janitor pass
+
+    Args:
+        sweeper (function): Called without arguments; returns the number of entries it removed
+    """
+    _SWEEPERS.append(sweeper)
+
+
+def _remove(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return True
+    except OSError as e:
+        logger.warning(f"Janitor could not remove {path}: {str(e)}")
+        return False
+
+
+def _entry_size(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+    return os.path.getsize(path)
+
+
+def sweep_directory(directory, quota_bytes=None, max_age=JANITOR_MAX_AGE, prefix=None, keep_suffixes=()):
+    """
+    Remove entries older than max_age, then the oldest entries until the directory fits its quota
+
+    Args:
+        directory (str): Directory to sweep
+        quota_bytes (int, optional): Maximum total size of the directory
+        max_age (int): Maximum entry age in seconds
+        prefix (str, optional): Only consider entries whose name starts with this
+        keep_suffixes (tuple): Never consider entries whose name ends in one of these
+
+    Returns:
+        int: Number of entries removed
+    """
+    if not os.path.isdir(directory):
+        return 0
+
+    now = time.time()
+    removed = 0
+    entries = []
+    total = 0
+
+    for name in os.listdir(directory):
+        if prefix and not name.startswith(prefix):
+            continue
+        if keep_suffixes and name.endswith(tuple(keep_suffixes)):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            mtime = os.path.getmtime(path)
+            size = _entry_size(path)
+        except OSError:
+            continue
+
+        if now - mtime > max_age:
+            if _remove(path):
+                removed += 1
+            continue
+
+        entries.append((mtime, size, path))
+        total += size
+
+    if quota_bytes is not None and total > quota_bytes:
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= quota_bytes:
+                break
+            # Entries this young may still be in use by a running request
+            if now - mtime < JANITOR_GRACE:
+                break
+            if _remove(path):
+                removed += 1
+                total -= size
+        metrics.set_gauge(f"janitor.bytes.{directory}", total)
+
+    return removed
+
+
+def run_janitor_once():
+    """
+    Sweep all managed directories and stale request workspaces once
+
+    Returns:
+        int: Number of entries removed
+    """
+    removed = 0
+    for directory, (quota, max_age, keep_suffixes) in list(MANAGED_DIRS.items()):
+        removed += sweep_directory(directory, quota_bytes=quota, max_age=max_age, keep_suffixes=keep_suffixes)
+    for sweeper in list(_SWEEPERS):
+        try:
+            removed += sweeper()
+        except Exception as e:
+            logger.error(f"Janitor sweeper {getattr(sweeper, '__name__', sweeper)} failed: {str(e)}")
+    # Workspaces are normally removed by their request; this only catches
+    # leftovers from killed workers
+    removed += sweep_directory(SCRATCH_ROOT, max_age=JANITOR_MAX_AGE, prefix=WORKSPACE_PREFIX)
+
+    if removed:
+        logger.info(f"Janitor removed {removed} stale entries")
+        metrics.increment("janitor.removed", removed)
+    return removed
+
+
+_janitor_thread = None
+_janitor_lock = threading.Lock()
+
+
+def _janitor_loop():
+    while True:
+        try:
+            run_janitor_once()
+        except Exception as e:
+            logger.error(f"Janitor sweep failed: {str(e)}")
+        time.sleep(JANITOR_INTERVAL)
+
+
+def start_janitor():
+    """
+    Start the background janitor thread (once per process)
+    """
+    global _janitor_thread
+    with _janitor_lock:
+        if _janitor_thread is not None and _janitor_thread.is_alive():
+            return
+        _janitor_thread = threading.Thread(target=_janitor_loop, name="disk-janitor", daemon=True)
+        _janitor_thread.start()
+        logger.info(f"Started disk janitor (scratch root: {SCRATCH_ROOT})")
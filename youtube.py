@@ -1,6 +1,12 @@
+import os
 import re
 import logging
+import requests
 from youtube_transcript_api import YouTubeTranscriptApi
+from transcript_cleanup import merge_caption_segments
+from timerange import in_range, range_key
+from media_cache import caption_cache
+from deadline import current_deadline
 from dotenv import load_dotenv
 
 
@@ -9,6 +15,9 @@ load_dotenv()
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Optional stand-in caption server (e.g. loadtest/fake_backends.py); unset in production
+CAPTIONS_BACKEND_URL = os.environ.get("CAPTIONS_BACKEND_URL")
+
 def extract_video_id(youtube_url):
     """
     Extract the video ID from a YouTube URL
@@ -61,12 +70,37 @@ def extract_video_id(youtube_url):
     
     return None
 
-def get_youtube_transcript(youtube_url):
+def fetch_transcript_segments(video_id):
+    """
+    Fetch the caption segments of a video
+    
+    Args:
+        video_id (str): The YouTube video ID
+        
+    Returns:
+        list: Segments as dicts with 'text', 'start' and 'duration'
+    """
+    # Usually already fetched by the prefetch when the URL was pasted
+    return caption_cache.get_or_load(video_id, lambda: _download_transcript_segments(video_id))
+
+def _download_transcript_segments(video_id):
+    if CAPTIONS_BACKEND_URL:
+        response = requests.get(f"{CAPTIONS_BACKEND_URL.rstrip('/')}/captions/{video_id}", timeout=current_deadline().timeout(30))
+        if response.status_code == 404:
+            raise Exception("No transcript found for this video")
+        response.raise_for_status()
+        return response.json()
+    
+    return YouTubeTranscriptApi.get_transcript(video_id)
+
+def get_youtube_transcript(youtube_url, time_range=None):
     """
     Get the transcript from a YouTube video
     
     Args:
         youtube_url (str): The YouTube video URL
+        time_range (tuple, optional): (start, end or None) seconds; only captions
+            overlapping it are kept
         
     Returns:
         str: The full transcript
@@ -82,14 +116,24 @@ def get_youtube_transcript(youtube_url):
     
     try:
         logger.info(f"Requesting transcript for video ID: {video_id}")
-        transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
+        transcript_list = fetch_transcript_segments(video_id)
         
         if not transcript_list:
             logger.warning("Received empty transcript list from YouTube API")
             return "Error: No transcript available for this video. The creator may not have enabled captions."
         
-        # Combine all text parts into a single transcript
-        transcript = " ".join([part['text'] for part in transcript_list])
+        if time_range is not None:
+            transcript_list = [
+                part for part in transcript_list if in_range(part.get('start', 0.0), part.get('duration'), time_range)
+            ]
+            logger.info(f"Kept {len(transcript_list)} caption segments in the range {range_key(time_range)}")
+            if not transcript_list:
+                return "Error: No transcript text in the requested time range."
+        
+        # Combine all text parts into a single transcript, without the text rolling
+        # auto-captions repeat between segments. Fillers stay in what the user
+        # sees; they are only dropped from the notes prompt
+        transcript = merge_caption_segments([part['text'] for part in transcript_list])
         
         # Log transcript length for debugging
         transcript_length = len(transcript)